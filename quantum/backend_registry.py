@@ -0,0 +1,290 @@
+# backend_registry.py
+#
+# Cached backend discovery for hardware runs. `service.least_busy()` lists and
+# configures every backend on each call; here the backend list (name, qubit
+# count, simulator flag, last known status) is cached on disk with a TTL, and
+# the backend objects themselves, with their lazily fetched target, are kept
+# for the life of the process. Selection filters the cached list and then
+# asks only the remaining candidates for their current queue length. A pinned
+# backend (`--backend`) skips discovery entirely. When a fleet_survey.py
+# snapshot is fresh, selection ranks its backends by expected fidelity and
+# queue length instead, with status calls for only the top few candidates.
+#
+# The service is passed in, so a persistent worker or the batch runner can
+# share one, and LocalService below stands in for IBM Quantum offline.
+#
+#   python backend_registry.py refresh --api_token TOKEN
+#   python backend_registry.py list --local
+
+import argparse
+import hashlib
+import json
+import os
+import sys
+import time
+
+import result_io
+
+REGISTRY_VERSION = 1
+DEFAULT_TTL_SEC = 3600
+
+_BACKENDS = {} # (account, name) -> (service, backend, fetched_at)
+stats = {"list_hits": 0, "list_refreshes": 0, "backend_hits": 0, "backend_fetches": 0}
+
+
+class NoCandidateBackends(RuntimeError):
+    """No backend is left to select (none large enough, operational and not excluded).
+       submission.classify treats it as permanent, so failover does not retry it."""
+
+
+# --- Helper Functions (Logging to stderr) ---
+def log_stderr(*args, **kwargs):
+    """Prints messages to stderr."""
+    print(*args, file=sys.stderr, **kwargs)
+
+
+def default_cache_dir():
+    from cnf_oracle import default_cache_dir as base_dir
+    return os.path.join(base_dir(), "backends")
+
+
+def account_key(token):
+    """Cache namespace per account; the token itself is never written to disk."""
+    return hashlib.sha256((token or "").encode("utf-8")).hexdigest()[:16]
+
+
+def _listing_path(cache_dir, account):
+    return os.path.join(cache_dir or default_cache_dir(), f"{account}.json")
+
+
+def _status(backend):
+    """(operational, pending_jobs, status_msg); backends without status() count as idle and online."""
+    try:
+        status = backend.status()
+        return bool(status.operational), int(status.pending_jobs), getattr(status, "status_msg", None)
+    except AttributeError:
+        return True, 0, None
+
+
+# --- Backend Objects ---
+def get_backend(service, name, account="default", ttl=DEFAULT_TTL_SEC):
+    """service.backend(name), reused within the process so its target is fetched once per TTL."""
+    entry = _BACKENDS.get((account, name))
+    if entry is not None and entry[0] is service and time.time() - entry[2] <= ttl:
+        stats["backend_hits"] += 1
+        return entry[1]
+    stats["backend_fetches"] += 1
+    backend = service.backend(name)
+    _BACKENDS[(account, name)] = (service, backend, time.time())
+    return backend
+
+
+# --- Backend List ---
+def refresh(service, account="default", cache_dir=None):
+    """Lists every hardware backend and writes the cache. Returns the listing."""
+    stats["list_refreshes"] += 1
+    now = time.time()
+    backends = []
+    for backend in service.backends(simulator=False):
+        operational, pending_jobs, status_msg = _status(backend)
+        backends.append({
+            "name": backend.name,
+            "num_qubits": backend.num_qubits,
+            "operational": operational,
+            "pending_jobs": pending_jobs,
+            "status_msg": status_msg,
+        })
+        _BACKENDS[(account, backend.name)] = (service, backend, now)
+    listing = {"version": REGISTRY_VERSION, "fetched_at": now, "backends": backends}
+    try:
+        write_listing(listing, account, cache_dir)
+    except Exception as e:
+        log_stderr(f"Warning: Could not write backend cache: {e}")
+    return listing
+
+
+def write_listing(listing, account="default", cache_dir=None):
+    path = _listing_path(cache_dir, account)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    result_io.write_json_atomic(path, listing, indent=2)
+
+
+def load_listing(account="default", cache_dir=None):
+    try:
+        with open(_listing_path(cache_dir, account), "r") as f:
+            listing = json.load(f)
+        return listing if listing.get("version") == REGISTRY_VERSION else None
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        log_stderr(f"Warning: Ignoring unreadable backend cache: {e}")
+        return None
+
+
+def get_listing(service, account="default", cache_dir=None, ttl=DEFAULT_TTL_SEC):
+    """Cached listing if younger than ttl, else a refresh (falling back to a stale cache on error)."""
+    listing = load_listing(account, cache_dir)
+    if listing is not None and time.time() - listing["fetched_at"] <= ttl:
+        stats["list_hits"] += 1
+        return listing
+    try:
+        return refresh(service, account, cache_dir)
+    except Exception as e:
+        if listing is None:
+            raise
+        log_stderr(f"Warning: Backend list refresh failed ({e}); using cache from "
+                   f"{time.time() - listing['fetched_at']:.0f}s ago.")
+        return listing
+
+
+# --- Selection ---
+def select_backend(service, min_num_qubits, pinned=None, account="default", cache_dir=None, ttl=DEFAULT_TTL_SEC,
+                   survey=True, exclude=()):
+    """Returns (backend, info). Pinned backends are used as-is if large enough and operational;
+       otherwise the best-ranked backend of a fresh fleet survey, else the least busy cached
+       candidate by current queue length. Backends named in `exclude` (failed over from) are
+       never chosen."""
+    if pinned:
+        backend = get_backend(service, pinned, account, ttl)
+        if backend.num_qubits < min_num_qubits:
+            raise RuntimeError(f"Pinned backend {pinned} has {backend.num_qubits} qubits; {min_num_qubits} required.")
+        operational, pending_jobs, status_msg = _status(backend)
+        if not operational:
+            raise RuntimeError(f"Pinned backend {pinned} is not operational ({status_msg}).")
+        return backend, {"pinned": True, "pending_jobs": pending_jobs, "candidates": 1}
+
+    if survey:
+        import fleet_survey
+        snapshot = fleet_survey.load_snapshot(account, cache_dir, ttl)
+        if snapshot is not None:
+            return fleet_survey.select_backend(service, snapshot, min_num_qubits, account, ttl, exclude=exclude)
+
+    listing = get_listing(service, account, cache_dir, ttl)
+    candidates = [b for b in listing["backends"]
+                  if b["num_qubits"] >= min_num_qubits and b["operational"] and b["name"] not in exclude]
+    if not candidates:
+        raise NoCandidateBackends(f"No cached hardware backend has {min_num_qubits}+ qubits and is operational "
+                           f"(backend list from {time.time() - listing['fetched_at']:.0f}s ago; refresh to update).")
+    best = None
+    for candidate in candidates:
+        try:
+            backend = get_backend(service, candidate["name"], account, ttl)
+            operational, pending_jobs, _ = _status(backend) # Current queue length, one call per candidate
+        except Exception as e:
+            log_stderr(f"Warning: Skipping backend {candidate['name']}: {e}")
+            continue
+        if operational and (best is None or pending_jobs < best[1]):
+            best = (backend, pending_jobs)
+    if best is None:
+        raise NoCandidateBackends(f"None of the {len(candidates)} candidate backend(s) is currently operational.")
+    return best[0], {"pinned": False, "ranked_by": "queue", "pending_jobs": best[1], "candidates": len(candidates),
+                     "listing_age_sec": round(time.time() - listing["fetched_at"], 1)}
+
+
+# --- Local Stand-in Service ---
+class _LocalStatus:
+    def __init__(self, name, operational, pending_jobs):
+        self.backend_name = name
+        self.operational = operational
+        self.pending_jobs = pending_jobs
+        self.status_msg = "active" if operational else "maintenance"
+
+
+# LocalService fault kinds -> the error raised (see submission.classify)
+LOCAL_FAULTS = {
+    "transient": lambda name: ConnectionError(f"{name}: connection reset by peer (injected)"),
+    "cancel": lambda name: RuntimeError(f"Job on {name} was cancelled by the device (injected)"),
+    "outage": lambda name: RuntimeError(f"{name} is offline for maintenance (injected)"),
+    "invalid": lambda name: ValueError(f"Circuit is invalid for {name} (injected)"),
+}
+
+
+class LocalService:
+    """Offline stand-in for QiskitRuntimeService: GenericBackendV2 devices with fixed queue lengths.
+
+    `devices` is a list of (name, num_qubits, pending_jobs, operational) tuples. `faults` maps a
+    device name to the LOCAL_FAULTS kinds its next job submissions fail with, in order ("outage"
+    also takes the device out of service); the key "service" fails backends() listings instead.
+    """
+
+    DEFAULT_DEVICES = (("local_small", 5, 3, True), ("local_medium", 16, 12, True),
+                       ("local_large", 27, 1, True), ("local_offline", 27, 0, False))
+
+    def __init__(self, devices=DEFAULT_DEVICES, seed=1234, faults=None):
+        self.devices = {name: (num_qubits, pending, operational) for name, num_qubits, pending, operational in devices}
+        self.seed = seed
+        self.faults = {name: list(kinds) for name, kinds in (faults or {}).items()}
+        self.calls = {"backends": 0, "backend": 0, "status": 0, "runs": 0, "faults": 0}
+
+    def _inject(self, name):
+        """Raises the next scheduled fault for `name`, if any."""
+        if not self.faults.get(name):
+            return
+        kind = self.faults[name].pop(0)
+        self.calls["faults"] += 1
+        if kind == "outage" and name in self.devices:
+            num_qubits, pending, _ = self.devices[name]
+            self.devices[name] = (num_qubits, pending, False)
+        raise LOCAL_FAULTS[kind](name)
+
+    def _make(self, name):
+        from qiskit.providers.fake_provider import GenericBackendV2
+        num_qubits, pending, operational = self.devices[name]
+        backend = GenericBackendV2(num_qubits=num_qubits, seed=self.seed)
+        backend.name = name
+
+        def status():
+            self.calls["status"] += 1
+            num_qubits, pending, operational = self.devices[name]
+            return _LocalStatus(name, operational, pending)
+        backend.status = status
+
+        run = backend.run # SamplerV2 in local mode submits through backend.run
+        def faulty_run(*args, **kwargs):
+            self.calls["runs"] += 1
+            self._inject(name)
+            return run(*args, **kwargs)
+        backend.run = faulty_run
+        return backend
+
+    def backends(self, simulator=None, **kwargs):
+        self.calls["backends"] += 1
+        self._inject("service")
+        return [self._make(name) for name in self.devices]
+
+    def backend(self, name, **kwargs):
+        self.calls["backend"] += 1
+        if name not in self.devices:
+            raise KeyError(f"No backend named {name}")
+        return self._make(name)
+
+
+# --- Command Line ---
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Refresh or inspect the cached IBM Quantum backend list.")
+    parser.add_argument('command', choices=['refresh', 'list'], help='"refresh" re-lists backends now; "list" shows the cache (refreshing it if expired)')
+    parser.add_argument('--api_token', type=str, default=None, help='IBM Quantum API token')
+    parser.add_argument('--local', action='store_true', help='Use the offline LocalService stand-in instead of IBM Quantum')
+    parser.add_argument('--cache_dir', type=str, default=None, help='Backend cache directory (default: shared temp cache)')
+    parser.add_argument('--ttl', type=float, default=DEFAULT_TTL_SEC, help=f'Seconds before the list is re-fetched (default: {DEFAULT_TTL_SEC})')
+    args = parser.parse_args(argv)
+
+    if args.local:
+        service, account = LocalService(), "local"
+    else:
+        if not args.api_token:
+            parser.error("--api_token is required unless --local is given.")
+        from qiskit_ibm_runtime import QiskitRuntimeService
+        service, account = QiskitRuntimeService(channel="ibm_quantum", token=args.api_token), account_key(args.api_token)
+
+    if args.command == 'refresh':
+        listing = refresh(service, account, args.cache_dir)
+    else:
+        listing = get_listing(service, account, args.cache_dir, args.ttl)
+    log_stderr(f"{len(listing['backends'])} backend(s), fetched {time.time() - listing['fetched_at']:.0f}s ago.")
+    print(json.dumps(listing, indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,332 @@
+# batch_runner.py
+#
+# Runs many Grover / Shor configurations from one manifest on a process pool,
+# instead of starting one interpreter per run. Each worker imports the scripts
+# once and calls their run() repeatedly, with a fixed Aer thread count and the
+# shared transpile / calibration caches from run_context.py.
+#
+# Manifest (JSON object, JSON list, or JSON lines). Run spec keys are the
+# scripts' CLI flag names without the leading dashes:
+#
+#   {
+#     "defaults": {"plot_theme": "dark", "shots": 4096},
+#     "runs": [
+#       {"script": "grover_search", "marked_states": "101,010"},
+#       {"id": "shor-hw", "script": "shor_n15", "run_on_hardware": true, "profile": ["cpu"]}
+#     ]
+#   }
+#
+# Completed runs are streamed as JSON lines to stdout and appended to
+# <output_dir>/results.jsonl; --resume skips runs already recorded there.
+#
+#   python batch_runner.py manifest.json --workers 8 --api_token ... [--resume]
+#
+# To spread a manifest over several machines, see cluster_runner.py.
+
+import argparse
+import concurrent.futures
+import contextlib
+import hashlib
+import importlib
+import json
+import multiprocessing
+import os
+import sys
+import threading
+import time
+import traceback
+
+SCRIPTS = {
+    "grover_search": "grover_search",
+    "grover": "grover_search",
+    "shor_n15": "shor_n15",
+    "shor": "shor_n15",
+}
+# Terminal statuses a resumed batch does not rerun (unless --retry_failed).
+# "error" (the worker raised or crashed) and "deferred" (no QPU budget left yet,
+# see qpu_budget.py) are always retried.
+DONE_STATUSES = ("success", "failure", "invalid", "rejected")
+RESULTS_FILE = "results.jsonl"
+
+
+# --- Helper Functions (Logging to stderr) ---
+def log_stderr(*args, **kwargs):
+    """Prints messages to stderr."""
+    print(*args, file=sys.stderr, **kwargs)
+
+
+# --- Manifest ---
+def load_manifest(path):
+    """Returns (defaults, runs) from a JSON object / list or a JSON-lines file."""
+    with open(path, "r") as f:
+        text = f.read()
+    try:
+        data = json.loads(text)
+    except json.JSONDecodeError:
+        data = [json.loads(line) for line in text.splitlines() if line.strip()]
+    if isinstance(data, list):
+        return {}, data
+    if not isinstance(data, dict) or not isinstance(data.get("runs"), list):
+        raise ValueError("Manifest must be a list of run specs or an object with a 'runs' list.")
+    return data.get("defaults", {}), data["runs"]
+
+
+def run_id_for(index, spec):
+    """Explicit "id", otherwise derived from the position and content of the spec."""
+    if spec.get("id"):
+        return str(spec["id"])
+    content = {k: v for k, v in spec.items() if k != "api_token"}
+    digest = hashlib.sha1(json.dumps(content, sort_keys=True, default=str).encode("utf-8")).hexdigest()[:8]
+    return f"{index:04d}-{SCRIPTS.get(spec.get('script'), 'run')}-{digest}"
+
+
+def spec_to_argv(spec):
+    """{"marked_states": "101", "run_on_hardware": true, "profile": ["cpu"]} -> CLI argv."""
+    argv = []
+    for key, value in spec.items():
+        if key in ("id", "script") or value is None or value is False:
+            continue
+        flag = "--" + key
+        if value is True:
+            argv.append(flag)
+        elif isinstance(value, (list, tuple)):
+            for item in value:
+                argv.extend([flag, str(item)])
+        else:
+            argv.extend([flag, str(value)])
+    return argv
+
+
+def plan_runs(defaults, runs, output_dir, api_token=None):
+    """Merges defaults into each spec and fills per-run output paths. Returns a list of plans."""
+    plans = []
+    for index, raw in enumerate(runs):
+        spec = dict(defaults)
+        spec.update(raw)
+        run_id = run_id_for(index, raw)
+        script = SCRIPTS.get(spec.get("script"))
+        if api_token and not spec.get("api_token"):
+            spec["api_token"] = api_token
+        spec.setdefault("output_json", os.path.join(output_dir, f"{run_id}.json"))
+        if spec.get("event_stream") == "stdout":
+            # Runner stdout carries run records; keep each run's events in its own file
+            spec["event_stream"] = os.path.join(output_dir, f"{run_id}.events.jsonl")
+        plans.append({
+            "run_id": run_id,
+            "index": index,
+            "script": script,
+            "requested_script": spec.get("script"),
+            "argv": spec_to_argv(spec),
+            "output_json": spec["output_json"],
+            "log_file": os.path.join(output_dir, f"{run_id}.log"),
+        })
+    return plans
+
+
+def completed_run_ids(results_path, retry_failed=False):
+    """Run ids already recorded in a results file (for --resume)."""
+    done = set()
+    if not os.path.exists(results_path):
+        return done
+    statuses = ("success",) if retry_failed else DONE_STATUSES
+    with open(results_path, "r") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue # Partially written last line of an interrupted batch
+            if record.get("event") != "run_complete" or record.get("status") not in statuses:
+                continue
+            if record.get("status") == "invalid" or os.path.exists(record.get("output_json") or ""):
+                done.add(record["run_id"])
+    return done
+
+
+# --- Worker ---
+def _init_worker(cache_dir, aer_threads, calibration_ttl_sec, metrics_queue=None):
+    import run_context
+    run_context.configure(cache_dir=cache_dir, aer_threads=aer_threads, calibration_ttl_sec=calibration_ttl_sec)
+    if metrics_queue is not None:
+        import worker_metrics
+        worker_metrics.forward_to(metrics_queue) # The parent serves / writes the metrics of the whole pool
+
+
+def execute_run(plan):
+    """Runs one plan inside a worker; the script's stderr goes to the run's log file."""
+    import run_context
+    record = {
+        "event": "run_complete",
+        "run_id": plan["run_id"],
+        "index": plan["index"],
+        "script": plan["script"],
+        "output_json": plan["output_json"],
+        "log_file": plan["log_file"],
+        "worker_pid": os.getpid(),
+        "status": "error",
+        "error_message": None,
+    }
+    stats_before = dict(run_context.stats)
+    start = time.perf_counter()
+    with open(plan["log_file"], "w") as log, contextlib.redirect_stderr(log):
+        try:
+            module = importlib.import_module(plan["script"])
+            try:
+                args = module.parse_args(plan["argv"])
+            except SystemExit:
+                # argparse already wrote the usage error to the log
+                record["status"] = "invalid"
+                record["error_message"] = "Invalid run spec; see log_file for the argument error."
+                return record
+            results = module.run(args)
+            record["status"] = results["status"]
+            record["error_message"] = results.get("error_message")
+            record["execution_time_sec"] = results.get("execution_time_sec")
+            record["backend_used"] = results.get("backend_used")
+            record["job_id"] = results.get("job_id")
+        except Exception as e:
+            record["error_message"] = f"Run raised: {e}"
+            log_stderr(traceback.format_exc())
+        finally:
+            record["wall_time_sec"] = round(time.perf_counter() - start, 3)
+            record["cache_stats"] = {k: v - stats_before.get(k, 0) for k, v in run_context.stats.items()}
+    return record
+
+
+# --- Main Execution ---
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run a manifest of Grover / Shor configurations on a process pool.")
+    parser.add_argument('manifest', type=str, help='Manifest file (JSON or JSON lines) of run specs')
+    parser.add_argument('--output_dir', type=str, default=None, help='Directory for per-run results, logs and results.jsonl (default: <manifest>_results)')
+    parser.add_argument('--api_token', type=str, default=None, help='IBM Quantum API Token for runs that do not set their own')
+    parser.add_argument('--workers', type=int, default=None, help='Worker processes (default: CPU count)')
+    parser.add_argument('--aer_threads', type=int, default=None, help='Aer threads per worker (default: CPU count / workers, at least 1)')
+    parser.add_argument('--cache_dir', type=str, default=None, help='Shared transpile / calibration cache directory (default: <output_dir>/.cache)')
+    parser.add_argument('--calibration_ttl', type=float, default=900, help='Seconds a cached backend calibration stays valid (default: 900)')
+    parser.add_argument('--resume', action='store_true', help='Skip runs already recorded in results.jsonl')
+    parser.add_argument('--metrics_port', type=int, default=None, help='Serve OpenMetrics / Prometheus metrics of the runs (phase latency, cache hits, active jobs, QPU seconds, shots, peak memory) on http://127.0.0.1:PORT/metrics while the batch runs')
+    parser.add_argument('--metrics_file', type=str, default=None, help='Keep the same metrics in a Prometheus textfile (e.g. for node_exporter\'s textfile collector), rewritten as runs progress')
+    parser.add_argument('--retry_failed', action='store_true', help='With --resume, rerun runs that finished with a failure status')
+    args = parser.parse_args(argv)
+
+    try:
+        defaults, runs = load_manifest(args.manifest)
+    except Exception as e:
+        log_stderr(f"ERROR: Could not read manifest {args.manifest}: {e}")
+        return 1
+    output_dir = args.output_dir or os.path.splitext(args.manifest)[0] + "_results"
+    os.makedirs(output_dir, exist_ok=True)
+    results_path = os.path.join(output_dir, RESULTS_FILE)
+    cpu_count = os.cpu_count() or 1
+    workers = max(1, args.workers or cpu_count)
+    aer_threads = args.aer_threads or max(1, cpu_count // workers)
+    cache_dir = args.cache_dir or os.path.join(output_dir, ".cache")
+
+    plans = plan_runs(defaults, runs, output_dir, args.api_token)
+    seen = set()
+    for plan in plans:
+        if plan["run_id"] in seen:
+            log_stderr(f"ERROR: Duplicate run id '{plan['run_id']}' in manifest.")
+            return 1
+        seen.add(plan["run_id"])
+
+    done = completed_run_ids(results_path, args.retry_failed) if args.resume else set()
+    pending = [p for p in plans if p["run_id"] not in done]
+    log_stderr(f"Batch: {len(plans)} run(s), {len(plans) - len(pending)} already complete, "
+               f"{len(pending)} to run on {workers} worker(s) x {aer_threads} Aer thread(s).")
+
+    skipped = len(plans) - len(pending)
+    counts = {}
+    start = time.perf_counter()
+    with open(results_path, "a", buffering=1) as results_file:
+        def emit(record):
+            line = json.dumps(record, separators=(",", ":"), default=str)
+            results_file.write(line + "\n")
+            print(line, flush=True)
+            counts[record["status"]] = counts.get(record["status"], 0) + 1
+
+        for plan in [p for p in pending if p["script"] is None]:
+            emit({"event": "run_complete", "run_id": plan["run_id"], "index": plan["index"], "script": None,
+                  "output_json": None, "status": "invalid",
+                  "error_message": f"Unknown script '{plan['requested_script']}'. Expected one of {sorted(SCRIPTS)}."})
+        pending = [p for p in pending if p["script"] is not None]
+
+        # --- Metrics (opt-in): workers forward their updates to this process ---
+        mp_context = multiprocessing.get_context("spawn")
+        metrics_queue, metrics_stop, metrics_thread = None, threading.Event(), None
+        if args.metrics_port is not None or args.metrics_file:
+            import worker_metrics
+            metrics_queue = mp_context.Queue()
+            if args.metrics_port is not None:
+                worker_metrics.serve(args.metrics_port)
+            write_metrics = (lambda: worker_metrics.write_textfile(args.metrics_file)) if args.metrics_file else None
+            if write_metrics is not None:
+                write_metrics()
+            metrics_thread = threading.Thread(target=worker_metrics.drain, name="metrics-drain", daemon=True,
+                                              args=(metrics_queue, worker_metrics.REGISTRY, write_metrics, metrics_stop))
+            metrics_thread.start()
+
+        def new_pool():
+            return concurrent.futures.ProcessPoolExecutor(
+                max_workers=workers, mp_context=mp_context,
+                initializer=_init_worker, initargs=(cache_dir, aer_threads, args.calibration_ttl, metrics_queue))
+
+        def error_record(plan, message):
+            return {"event": "run_complete", "run_id": plan["run_id"], "index": plan["index"],
+                    "script": plan["script"], "output_json": plan["output_json"],
+                    "log_file": plan["log_file"], "status": "error", "error_message": message}
+
+        executor = new_pool()
+        try:
+            to_run = pending
+            while to_run:
+                # execute_run creates the log file first thing, so after a pool breaks a
+                # missing log file means the run never started
+                for plan in to_run:
+                    with contextlib.suppress(FileNotFoundError):
+                        os.unlink(plan["log_file"])
+                futures = {executor.submit(execute_run, plan): plan for plan in to_run}
+                not_started, started = [], 0
+                for future in concurrent.futures.as_completed(futures):
+                    plan = futures[future]
+                    try:
+                        record = future.result()
+                    except concurrent.futures.process.BrokenProcessPool as e:
+                        # A worker died (e.g. out of memory, a crash in Aer) and took the pool with it
+                        if not os.path.exists(plan["log_file"]):
+                            not_started.append(plan)
+                            continue
+                        record = error_record(plan, f"Worker process died during the run: {e}")
+                    except Exception as e:
+                        # The result could not be returned
+                        record = error_record(plan, f"Worker failed: {e}")
+                    started += 1
+                    emit(record)
+                to_run = not_started
+                if to_run:
+                    executor.shutdown(wait=True)
+                    if not started:
+                        # The pool broke before any run began (e.g. workers fail at startup); don't loop
+                        for plan in to_run:
+                            emit(error_record(plan, "Worker pool failed before the run started."))
+                        break
+                    log_stderr(f"A worker process died; restarting the pool for {len(to_run)} run(s) that had not started.")
+                    executor = new_pool()
+        except KeyboardInterrupt:
+            log_stderr("Interrupted; cancelling pending runs. Use --resume to continue.")
+            executor.shutdown(wait=False, cancel_futures=True)
+            return 130
+        executor.shutdown()
+        if metrics_thread is not None:
+            # The workers have exited, so everything they sent is queued; apply it before returning
+            metrics_stop.set()
+            metrics_thread.join()
+
+    summary = {"event": "batch_end", "total": len(plans), "skipped": skipped,
+               "counts": counts, "wall_time_sec": round(time.perf_counter() - start, 3), "results_file": results_path}
+    print(json.dumps(summary, separators=(",", ":")), flush=True)
+    log_stderr(f"Batch finished in {summary['wall_time_sec']}s: {counts}")
+    return 0 if all(status == "success" for status in counts) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
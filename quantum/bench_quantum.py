@@ -0,0 +1,451 @@
+# bench_quantum.py
+#
+# Offline benchmark harness for the Python side of the quantum workloads.
+# Sweeps the Grover and Shor building blocks over parameter grids on local
+# backends (AerSimulator for execution, a seeded GenericBackendV2 for
+# hardware-like transpilation) and records wall time, peak memory, depth and
+# CX count per case. Results are compared against a committed baseline
+# (bench_baseline.json) with per-metric tolerances.
+#
+# Only depth, CX count and peak memory gate the exit status. Wall time depends
+# on the machine, so it is scaled by a calibration loop timed in the same
+# process (against the one recorded with the baseline) and only reported.
+#
+#   python bench_quantum.py                       # run, compare, exit 1 on regression
+#   python bench_quantum.py --filter grover.run   # only matching cases
+#   python bench_quantum.py --update_baseline     # rewrite the baseline from this run
+
+import argparse
+import contextlib
+import io
+import os
+import platform
+import statistics
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+import grover_search
+import shor_n15
+import result_io
+import sim_compile
+import exact_distribution
+
+BENCH_VERSION = 1
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bench_baseline.json")
+# Relative slack per metric before a case counts as a regression.
+DEFAULT_TOLERANCES = {
+    "wall_median_sec": 0.50,
+    "peak_mem_mb": 0.25,
+    "depth": 0.15,
+    "cx_count": 0.15,
+}
+# Values below these floors are dominated by noise and never flagged.
+NOISE_FLOORS = {
+    "wall_median_sec": 0.002,
+    "peak_mem_mb": 0.5,
+}
+# Reported but never fail the run
+ADVISORY_METRICS = ("wall_median_sec",)
+SEED = 1234
+
+
+# --- Helper Functions (Logging to stderr) ---
+def log_stderr(*args, **kwargs):
+    """Prints messages to stderr."""
+    print(*args, file=sys.stderr, **kwargs)
+
+
+@contextlib.contextmanager
+def quiet(enabled=True):
+    """Swallows the scripts' progress logging while a case is measured."""
+    if not enabled:
+        yield
+        return
+    with contextlib.redirect_stderr(io.StringIO()):
+        yield
+
+
+# --- Backends ---
+_BACKENDS = {}
+
+
+def aer_backend():
+    if "aer" not in _BACKENDS:
+        _BACKENDS["aer"] = grover_search.AerSimulator(seed_simulator=SEED)
+    return _BACKENDS["aer"]
+
+
+def generic_backend(num_qubits):
+    """Hardware-like target (heavy-hex-free generic coupling map) for transpile cases."""
+    key = ("generic", num_qubits)
+    if key not in _BACKENDS:
+        from qiskit.providers.fake_provider import GenericBackendV2
+        _BACKENDS[key] = GenericBackendV2(num_qubits=max(num_qubits, 5), seed=SEED)
+    return _BACKENDS[key]
+
+
+def marked_set(n, size):
+    """Deterministic, distinct marked states for an n-qubit search."""
+    rng = np.random.default_rng(SEED + n * 101 + size)
+    picks = rng.choice(2 ** n, size=min(size, 2 ** n - 1), replace=False)
+    return [format(int(p), f"0{n}b") for p in sorted(picks)]
+
+
+def circuit_metrics(qc):
+    ops = qc.count_ops()
+    return {"depth": qc.depth(), "cx_count": int(ops.get("cx", 0))}
+
+
+# --- Cases ---
+# Each case factory returns (setup_fn, run_fn): setup_fn builds untimed inputs,
+# run_fn(inputs) is the measured call and returns structural metrics (or {}).
+def case_grover_oracle(n, marked):
+    states = marked_set(n, marked)
+    return (lambda: states,
+            lambda s: circuit_metrics(grover_search.grover_oracle(s, n)))
+
+
+def case_build_grover_circuit(n, marked):
+    states = marked_set(n, marked)
+    return (lambda: states,
+            lambda s: circuit_metrics(grover_search.build_grover_circuit(s)[0]))
+
+
+def case_grover_optimize_circuit(n, marked):
+    def setup():
+        with quiet():
+            qc, _ = grover_search.build_grover_circuit(marked_set(n, marked))
+        return qc, generic_backend(n)
+    return setup, lambda inputs: circuit_metrics(grover_search.optimize_circuit(*inputs)[0])
+
+
+def case_grover_run_circuit(n, shots):
+    def setup():
+        with quiet():
+            qc, _ = grover_search.build_grover_circuit(marked_set(n, 1))
+            qc, _, _, _ = grover_search.optimize_circuit(qc, aer_backend())
+        return qc
+    def run(qc):
+        _, (outcomes, frequencies), _ = grover_search.run_circuit(qc, aer_backend(), shots)
+        return {"distinct_outcomes": int(outcomes.size)}
+    return setup, run
+
+
+def _grover_sim_circuit(n, marked):
+    states = marked_set(n, marked)
+    oracle = sim_compile.marked_states_oracle(states)
+    return sim_compile.grover_circuit(oracle, grover_search.optimal_grover_iterations(len(states), n))
+
+
+def case_grover_sim_compile(n, marked):
+    return (lambda: None,
+            lambda _: circuit_metrics(sim_compile.optimize(_grover_sim_circuit(n, marked), aer_backend())[0]))
+
+
+def case_grover_sim_run_circuit(n, shots):
+    def setup():
+        with quiet():
+            qc, _, _, _ = sim_compile.optimize(_grover_sim_circuit(n, 1), aer_backend())
+        return qc
+    def run(qc):
+        _, (outcomes, frequencies), _ = grover_search.run_circuit(qc, aer_backend(), shots)
+        return {"distinct_outcomes": int(outcomes.size)}
+    return setup, run
+
+
+def case_grover_exact(n):
+    # One simulation regardless of shots; compare with grover.sim_run_circuit
+    def setup():
+        with quiet():
+            qc, _, _, _ = sim_compile.optimize(_grover_sim_circuit(n, 1), aer_backend())
+        return qc
+    def run(qc):
+        with quiet():
+            outcomes, probabilities = exact_distribution.run(qc, aer_backend())
+        return {"support": int(outcomes.size), "top_probability": round(exact_distribution.top(outcomes, probabilities)[1], 6)}
+    return setup, run
+
+
+def case_build_shor_circuit(n_control):
+    return (lambda: None,
+            lambda _: circuit_metrics(shor_n15.build_shor_circuit_n15(n_control, 4, 7)))
+
+
+def case_shor_optimize_circuit(n_control):
+    def setup():
+        with quiet():
+            qc = shor_n15.build_shor_circuit_n15(n_control, 4, 7)
+        return qc, generic_backend(n_control + 4)
+    return setup, lambda inputs: circuit_metrics(shor_n15.optimize_circuit(*inputs)[0])
+
+
+def case_shor_run_circuit(n_control, shots):
+    def setup():
+        with quiet():
+            qc = shor_n15.build_shor_circuit_n15(n_control, 4, 7)
+            qc, _, _, _ = shor_n15.optimize_circuit(qc, aer_backend())
+        return qc
+    def run(qc):
+        _, (outcomes, frequencies), _ = shor_n15.run_circuit(qc, aer_backend(), shots)
+        return {"distinct_outcomes": int(outcomes.size)}
+    return setup, run
+
+
+def case_shor_sim_compile(n_control):
+    def setup():
+        with quiet():
+            return shor_n15.build_shor_circuit_n15(n_control, 4, 7)
+    return setup, lambda qc: circuit_metrics(sim_compile.optimize(qc, aer_backend())[0])
+
+
+def case_shor_sim_run_circuit(n_control, shots):
+    def setup():
+        with quiet():
+            qc = shor_n15.build_shor_circuit_n15(n_control, 4, 7)
+            qc, _, _, _ = sim_compile.optimize(qc, aer_backend())
+        return qc
+    def run(qc):
+        _, (outcomes, frequencies), _ = shor_n15.run_circuit(qc, aer_backend(), shots)
+        return {"distinct_outcomes": int(outcomes.size)}
+    return setup, run
+
+
+def case_shor_exact(n_control):
+    def setup():
+        with quiet():
+            qc = shor_n15.build_shor_circuit_n15(n_control, 4, 7)
+            qc, _, _, _ = sim_compile.optimize(qc, aer_backend())
+        return qc
+    def run(qc):
+        with quiet():
+            outcomes, _ = exact_distribution.run(qc, aer_backend())
+        return {"support": int(outcomes.size)}
+    return setup, run
+
+
+def case_process_measurement(n_control):
+    # Every possible control-register reading, as the factor loop would see them
+    bitstrings = [format(y, f"0{n_control}b") for y in range(2 ** n_control)]
+    def run(values):
+        found = sum(1 for b in values if shor_n15.process_measurement(b, n_control, 7, 15)[0])
+        return {"factoring_readings": found}
+    return lambda: bitstrings, run
+
+
+def benchmark_cases(quick=False):
+    """Yields (case_id, factory) over the parameter grids."""
+    grover_n = [3, 5, 7] if quick else [3, 5, 7, 9, 11]
+    for n in grover_n:
+        for marked in (1, 4):
+            if 2 * marked >= 2 ** n: # Grover gives no amplification at half the space
+                continue
+            yield f"grover.grover_oracle[n={n},marked={marked}]", lambda n=n, m=marked: case_grover_oracle(n, m)
+            yield f"grover.build_grover_circuit[n={n},marked={marked}]", lambda n=n, m=marked: case_build_grover_circuit(n, m)
+    for n in grover_n[:4]:
+        for marked in (1, 4):
+            if 2 * marked >= 2 ** n:
+                continue
+            yield f"grover.optimize_circuit[n={n},marked={marked}]", lambda n=n, m=marked: case_grover_optimize_circuit(n, m)
+            yield f"grover.sim_compile[n={n},marked={marked}]", lambda n=n, m=marked: case_grover_sim_compile(n, m)
+    for n in grover_n[:3]:
+        for shots in ((1024,) if quick else (1024, 16384)):
+            yield f"grover.run_circuit[n={n},shots={shots}]", lambda n=n, s=shots: case_grover_run_circuit(n, s)
+            yield f"grover.sim_run_circuit[n={n},shots={shots}]", lambda n=n, s=shots: case_grover_sim_run_circuit(n, s)
+        yield f"grover.exact[n={n}]", lambda n=n: case_grover_exact(n)
+    for n_control in ((4, 6) if quick else (4, 6, 8)):
+        yield f"shor.build_shor_circuit_n15[t={n_control}]", lambda t=n_control: case_build_shor_circuit(t)
+        yield f"shor.optimize_circuit[t={n_control}]", lambda t=n_control: case_shor_optimize_circuit(t)
+        yield f"shor.sim_compile[t={n_control}]", lambda t=n_control: case_shor_sim_compile(t)
+        yield f"shor.process_measurement[t={n_control}]", lambda t=n_control: case_process_measurement(t)
+        yield f"shor.exact[t={n_control}]", lambda t=n_control: case_shor_exact(t)
+        for shots in ((1024,) if quick else (1024, 16384)):
+            yield f"shor.run_circuit[t={n_control},shots={shots}]", lambda t=n_control, s=shots: case_shor_run_circuit(t, s)
+            yield f"shor.sim_run_circuit[t={n_control},shots={shots}]", lambda t=n_control, s=shots: case_shor_sim_run_circuit(t, s)
+
+
+# --- Measurement ---
+def measure(factory, repeat, warmup, verbose=False):
+    """Times run_fn `repeat` times after `warmup` calls, then one extra traced call for peak memory."""
+    setup, run = factory()
+    with quiet(not verbose):
+        inputs = setup()
+        for _ in range(warmup):
+            run(inputs)
+        times = []
+        extra = {}
+        for _ in range(repeat):
+            start = time.perf_counter()
+            extra = run(inputs) or {}
+            times.append(time.perf_counter() - start)
+
+        # tracemalloc slows execution, so memory is measured on a separate call
+        tracemalloc.start()
+        try:
+            run(inputs)
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+    record = {
+        "wall_median_sec": round(statistics.median(times), 6),
+        "wall_min_sec": round(min(times), 6),
+        "peak_mem_mb": round(peak / (1024 * 1024), 4),
+    }
+    record.update(extra)
+    return record
+
+
+def calibration_sec(repeat=5):
+    """Median time of a fixed Python + NumPy workload; the machine-speed reference for wall times."""
+    rng = np.random.default_rng(SEED)
+    matrix = rng.random((200, 200))
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        total = 0
+        for i in range(200000):
+            total += i * i % 7
+        for _ in range(20):
+            matrix = np.tanh(matrix @ matrix / 200.0)
+        times.append(time.perf_counter() - start)
+    return round(statistics.median(times), 6)
+
+
+def environment_info():
+    import qiskit
+    import qiskit_aer
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "numpy": np.__version__,
+        "qiskit": qiskit.__version__,
+        "qiskit_aer": qiskit_aer.__version__,
+        "calibration_sec": calibration_sec(),
+    }
+
+
+# --- Baseline Comparison ---
+def compare(cases, baseline, calibration=None):
+    """Returns a list of regression dicts for metrics above baseline * (1 + tolerance).
+
+    Wall times are scaled by the baseline's calibration_sec / calibration when both are known;
+    regressions in ADVISORY_METRICS are marked "advisory".
+    """
+    tolerances = dict(DEFAULT_TOLERANCES)
+    tolerances.update(baseline.get("tolerances", {}))
+    reference_calibration = baseline.get("environment", {}).get("calibration_sec")
+    speed = reference_calibration / calibration if reference_calibration and calibration else 1.0
+    regressions = []
+    for case_id, current in cases.items():
+        reference = baseline.get("cases", {}).get(case_id)
+        if reference is None:
+            continue
+        for metric, tolerance in tolerances.items():
+            if metric not in current or metric not in reference:
+                continue
+            old, new = reference[metric], current[metric]
+            if metric == "wall_median_sec":
+                new = round(new * speed, 6)
+            if new < NOISE_FLOORS.get(metric, 0):
+                continue
+            if new > old * (1 + tolerance) and new != old:
+                regressions.append({
+                    "case": case_id,
+                    "metric": metric,
+                    "baseline": old,
+                    "current": new,
+                    "ratio": round(new / old, 3) if old else None,
+                    "tolerance": tolerance,
+                    "advisory": metric in ADVISORY_METRICS,
+                })
+    return regressions
+
+
+def load_baseline(path):
+    import json
+    if not os.path.exists(path):
+        return None
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+# --- Main Execution ---
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the Grover / Shor building blocks offline.")
+    parser.add_argument('--filter', type=str, default=None, help='Only run cases whose id contains this substring')
+    parser.add_argument('--repeat', type=int, default=5, help='Timed repetitions per case (default: 5)')
+    parser.add_argument('--warmup', type=int, default=1, help='Untimed warm-up calls per case (default: 1)')
+    parser.add_argument('--quick', action='store_true', help='Smaller parameter grids')
+    parser.add_argument('--output_json', type=str, default=None, help='Write this run\'s results to a JSON file')
+    parser.add_argument('--baseline', type=str, default=DEFAULT_BASELINE, help='Baseline JSON to compare against')
+    parser.add_argument('--update_baseline', action='store_true', help='Merge this run into the baseline file instead of comparing')
+    parser.add_argument('--verbose', action='store_true', help='Keep the scripts\' own stderr logging')
+    args = parser.parse_args(argv)
+    if args.repeat < 1:
+        parser.error("--repeat must be >= 1")
+
+    cases = {}
+    for case_id, factory in benchmark_cases(args.quick):
+        if args.filter and args.filter not in case_id:
+            continue
+        try:
+            cases[case_id] = measure(factory, args.repeat, args.warmup, args.verbose)
+        except Exception as e:
+            cases[case_id] = {"error": str(e)}
+            log_stderr(f"{case_id:<48} ERROR: {e}")
+            continue
+        record = cases[case_id]
+        structural = f"depth={record['depth']:<6} cx={record['cx_count']:<6}" if "depth" in record else ""
+        log_stderr(f"{case_id:<48} {record['wall_median_sec'] * 1000:>10.2f} ms  "
+                   f"{record['peak_mem_mb']:>9.3f} MB  {structural}")
+
+    report = {"version": BENCH_VERSION, "environment": environment_info(), "cases": cases}
+    if args.output_json:
+        result_io.write_json_atomic(args.output_json, report, indent=2)
+        log_stderr(f"Results written to {args.output_json}")
+
+    errors = [c for c, r in cases.items() if "error" in r]
+    if args.update_baseline:
+        baseline = load_baseline(args.baseline) or {"version": BENCH_VERSION, "tolerances": DEFAULT_TOLERANCES, "cases": {}}
+        baseline["environment"] = report["environment"]
+        baseline["cases"].update({c: r for c, r in cases.items() if "error" not in r})
+        baseline["cases"] = dict(sorted(baseline["cases"].items()))
+        result_io.write_json_atomic(args.baseline, baseline, indent=2)
+        log_stderr(f"Baseline updated: {args.baseline} ({len(baseline['cases'])} cases)")
+        return 1 if errors else 0
+
+    baseline = load_baseline(args.baseline)
+    if baseline is None:
+        log_stderr(f"No baseline at {args.baseline}; run with --update_baseline to create one.")
+        return 1 if errors else 0
+    if baseline.get("environment", {}).get("machine") != report["environment"]["machine"]:
+        log_stderr("Warning: baseline was recorded on a different machine type; timings may not be comparable.")
+    calibration = report["environment"]["calibration_sec"]
+    reference_calibration = baseline.get("environment", {}).get("calibration_sec")
+    if reference_calibration:
+        log_stderr(f"Calibration {calibration * 1000:.1f} ms vs {reference_calibration * 1000:.1f} ms for the baseline; "
+                   f"wall times scaled by {reference_calibration / calibration:.2f}.")
+
+    regressions = compare(cases, baseline, calibration)
+    missing = [c for c in cases if c not in baseline.get("cases", {})]
+    if missing:
+        log_stderr(f"{len(missing)} case(s) have no baseline entry yet.")
+    for r in regressions:
+        log_stderr(f"{'SLOWER (advisory)' if r['advisory'] else 'REGRESSION'} {r['case']} {r['metric']}: "
+                   f"{r['baseline']} -> {r['current']} (x{r['ratio']}, tolerance +{r['tolerance'] * 100:.0f}%)")
+    if errors:
+        log_stderr(f"{len(errors)} case(s) failed: {', '.join(errors)}")
+    gating = [r for r in regressions if not r["advisory"]]
+    if gating or errors:
+        return 1
+    log_stderr(f"No regressions across {len(cases)} case(s)"
+               + (f" ({len(regressions)} advisory wall-time warning(s))." if regressions else "."))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
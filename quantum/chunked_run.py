@@ -0,0 +1,244 @@
+# chunked_run.py
+#
+# Chunked execution for very large shot counts (`--shot_chunk`). The shots are
+# split into fixed-size jobs; each job's counts are merged into a
+# result_io.CountsAccumulator, so memory stays constant as the total grows.
+# After every --checkpoint_every chunks the partial histogram is written to
+# <results>.checkpoint.npz; `--resume` continues an interrupted run from it.
+# Each chunk emits a "chunk_end" progress event with running statistics.
+#
+# Under `--deadline`, a chunked run stops (keeping its checkpoint) once the next
+# chunk is not expected to fit, and run_within_deadline sizes a single
+# simulation from a pilot job instead of overrunning the budget. The pilot is
+# skipped when a previous run of the same circuit in this process shows that
+# all shots fit. A split run samples with two seeds, so its counts differ from
+# a single job with the same seed and must not go into the result cache.
+
+import json
+import math
+import os
+import sys
+import time
+
+import numpy as np
+
+import deadline
+import result_io
+import run_context
+
+CHECKPOINT_VERSION = 1
+# run_within_deadline: the pilot job runs shots // PILOT_FRACTION shots, and the
+# sized job may use DEADLINE_SAFETY of the budget left after it
+PILOT_FRACTION = 8
+DEADLINE_SAFETY = 0.8
+
+_sec_per_shot = {} # (circuit hash, backend name) -> measured seconds per shot, for run_within_deadline
+
+
+# --- Helper Functions (Logging to stderr) ---
+def log_stderr(*args, **kwargs):
+    """Prints messages to stderr."""
+    print(*args, file=sys.stderr, **kwargs)
+
+
+def checkpoint_path(output_json):
+    """<results>.json -> <results>.checkpoint.npz"""
+    base, _ = os.path.splitext(output_json)
+    return base + ".checkpoint.npz"
+
+
+def running_stats(accumulator):
+    """Top outcome with its probability and standard error, plus histogram entropy."""
+    outcomes, frequencies = accumulator.arrays()
+    total = accumulator.total
+    if total == 0 or len(frequencies) == 0:
+        return {"distinct_outcomes": 0}
+    top, top_count = result_io.top_outcome(outcomes, frequencies)
+    p = top_count / total
+    probabilities = frequencies / total
+    return {
+        "distinct_outcomes": int(len(frequencies)),
+        "top_outcome": result_io.outcome_to_bitstring(top, accumulator.num_bits),
+        "top_probability": round(p, 6),
+        "top_stderr": round(math.sqrt(p * (1 - p) / total), 6),
+        "entropy_bits": round(float(-(probabilities * np.log2(probabilities)).sum()), 6),
+    }
+
+
+# --- Checkpoints ---
+def _run_key(qc, backend, shots, chunk_shots, seed):
+    return json.dumps([CHECKPOINT_VERSION, run_context.circuit_hash(qc), backend.name, shots, chunk_shots, seed])
+
+
+def save_checkpoint(path, key, accumulator, chunks_done, job_ids, qpu_time):
+    outcomes, frequencies = accumulator.arrays()
+    meta = {"key": key, "chunks_done": chunks_done, "shots_done": accumulator.total,
+            "job_ids": job_ids, "qpu_time_sec": qpu_time}
+    tmp_path = path + ".tmp.npz"
+    np.savez_compressed(tmp_path, outcomes=outcomes, counts=frequencies,
+                        num_bits=np.int64(accumulator.num_bits), meta=np.array(json.dumps(meta)))
+    os.replace(tmp_path, path)
+
+
+def load_checkpoint(path, key, accumulator):
+    """Restores a matching checkpoint into the accumulator. Returns its metadata or None."""
+    try:
+        with np.load(path, allow_pickle=False) as data:
+            meta = json.loads(str(data["meta"]))
+            if meta.get("key") != key or int(data["num_bits"]) != accumulator.num_bits:
+                log_stderr(f"Checkpoint {path} belongs to a different run configuration; starting over.")
+                return None
+            accumulator.add(data["outcomes"], data["counts"])
+        return meta
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        log_stderr(f"Warning: Ignoring unreadable checkpoint {path}: {e}")
+        return None
+
+
+# --- Chunked Execution ---
+def run_chunked(run_circuit, qc, backend, shots, chunk_shots, timer, checkpoint_file=None, resume=False,
+                seed=None, checkpoint_every=1):
+    """Runs `shots` as ceil(shots / chunk_shots) jobs via the script's run_circuit.
+
+    Returns (last_job_id, (outcomes, frequencies), qpu_time_sec, info) where info
+    describes the chunking for the results JSON. With timer.deadline set, the run
+    stops early once the average chunk no longer fits the remaining budget.
+    """
+    num_bits = qc.num_clbits
+    accumulator = result_io.CountsAccumulator(num_bits)
+    num_chunks = int(math.ceil(shots / chunk_shots))
+    key = _run_key(qc, backend, shots, chunk_shots, seed)
+    chunks_done, job_ids, qpu_time, resumed_from = 0, [], None, 0
+
+    if resume and checkpoint_file:
+        meta = load_checkpoint(checkpoint_file, key, accumulator)
+        if meta is not None:
+            chunks_done, job_ids, qpu_time = meta["chunks_done"], meta["job_ids"], meta["qpu_time_sec"]
+            resumed_from = accumulator.total
+            log_stderr(f"Resuming from checkpoint: {chunks_done}/{num_chunks} chunk(s), {resumed_from} shots done.")
+            timer.event("chunk_resume", chunks_done=chunks_done, shots_done=resumed_from)
+
+    log_stderr(f"Chunked execution: {shots} shots in {num_chunks} chunk(s) of up to {chunk_shots}.")
+    start = time.perf_counter()
+    stopped_early = False
+    for index in range(chunks_done, num_chunks):
+        session_chunks = index - chunks_done
+        if timer.deadline is not None and session_chunks:
+            chunk_sec = (time.perf_counter() - start) / session_chunks
+            if chunk_sec > timer.deadline.remaining():
+                if checkpoint_file:
+                    try:
+                        save_checkpoint(checkpoint_file, key, accumulator, index, job_ids, qpu_time)
+                    except Exception as e:
+                        log_stderr(f"Warning: Could not write checkpoint: {e}")
+                timer.deadline.degrade("execute", shots=accumulator.total, requested_shots=shots,
+                                       chunks=index, requested_chunks=num_chunks)
+                stopped_early = True
+                break
+        this_chunk = min(chunk_shots, shots - index * chunk_shots)
+        if seed is not None:
+            # Same seed for every job would repeat the same samples; derive one per chunk
+            try:
+                backend.set_options(seed_simulator=seed + index)
+            except Exception:
+                pass
+        job_id, (outcomes, frequencies), chunk_qpu_time = run_circuit(qc, backend, this_chunk, timer)
+        accumulator.add(outcomes, frequencies)
+        del outcomes, frequencies
+        job_ids.append(job_id)
+        if chunk_qpu_time is not None:
+            qpu_time = (qpu_time or 0) + chunk_qpu_time
+
+        done = index + 1
+        if checkpoint_file and (done % checkpoint_every == 0) and done < num_chunks:
+            try:
+                save_checkpoint(checkpoint_file, key, accumulator, done, job_ids, qpu_time)
+            except Exception as e:
+                log_stderr(f"Warning: Could not write checkpoint: {e}")
+
+        elapsed = time.perf_counter() - start
+        shots_this_session = accumulator.total - resumed_from
+        rate = shots_this_session / elapsed if elapsed > 0 else None
+        stats = running_stats(accumulator)
+        timer.event("chunk_end", chunk=done, chunks_total=num_chunks, shots_done=accumulator.total,
+                    shots_total=shots, shots_per_sec=round(rate, 1) if rate else None,
+                    eta_sec=round((shots - accumulator.total) / rate, 1) if rate else None, **stats)
+        log_stderr(f"Chunk {done}/{num_chunks}: {accumulator.total}/{shots} shots, "
+                   f"top {stats.get('top_outcome')} p={stats.get('top_probability')}")
+
+    if seed is not None:
+        try:
+            backend.set_options(seed_simulator=seed)
+        except Exception:
+            pass
+    if checkpoint_file and os.path.exists(checkpoint_file) and not stopped_early:
+        os.unlink(checkpoint_file) # Run completed; the results JSON / sidecar supersede it
+
+    info = {
+        "chunk_shots": chunk_shots,
+        "chunks": num_chunks,
+        "resumed_from_shots": resumed_from,
+        "shots_done": accumulator.total,
+        "stopped_early": stopped_early, # --deadline; --resume continues from the checkpoint
+        "job_ids": job_ids,
+    }
+    return (job_ids[-1] if job_ids else None), accumulator.arrays(), qpu_time, info
+
+
+# --- Deadline-Sized Execution ---
+def run_within_deadline(run_circuit, qc, backend, shots, timer, seed=None):
+    """Runs as many of `shots` as fit timer.deadline: a pilot job measures the cost per
+    shot, then one more job runs the remaining shots, cut down to what the budget allows.
+    If this circuit's cost per shot is already known and all shots fit, one job runs them.
+
+    Returns (last_job_id, (outcomes, frequencies), qpu_time_sec, shots_done, split);
+    split is True when the shots ran as pilot + sized job (different seeds).
+    """
+    budget = timer.deadline
+    pilot_shots = shots // PILOT_FRACTION
+    rate_key = (run_context.circuit_hash(qc), backend.name)
+    known_rate = _sec_per_shot.get(rate_key)
+    if (budget is None or pilot_shots == 0
+            or (known_rate is not None and shots * known_rate <= max(0.0, budget.remaining()) * DEADLINE_SAFETY)):
+        start = time.perf_counter()
+        job_id, counts, qpu_time = run_circuit(qc, backend, shots, timer)
+        _sec_per_shot[rate_key] = (time.perf_counter() - start) / max(1, shots)
+        return job_id, counts, qpu_time, shots, False
+
+    accumulator = result_io.CountsAccumulator(qc.num_clbits)
+    start = time.perf_counter()
+    job_id, (outcomes, frequencies), qpu_time = run_circuit(qc, backend, pilot_shots, timer)
+    accumulator.add(outcomes, frequencies)
+    # Linear in shots: the per-job overhead is charged to the pilot's shots, which errs on the safe side
+    sec_per_shot = (time.perf_counter() - start) / pilot_shots
+    _sec_per_shot[rate_key] = sec_per_shot
+    remaining_shots = shots - pilot_shots
+    fit = int(max(0.0, budget.remaining()) * DEADLINE_SAFETY / sec_per_shot) if sec_per_shot > 0 else remaining_shots
+    planned = min(remaining_shots, fit)
+    log_stderr(f"Deadline pilot: {pilot_shots} shots at {sec_per_shot * 1e3:.3f} ms/shot; "
+               f"running {planned} of the remaining {remaining_shots}.")
+
+    if planned > 0:
+        if seed is not None:
+            try:
+                backend.set_options(seed_simulator=seed + 1) # Don't repeat the pilot's samples
+            except Exception:
+                pass
+        try:
+            job_id, (outcomes, frequencies), job_qpu_time = run_circuit(qc, backend, planned, timer)
+            accumulator.add(outcomes, frequencies)
+            if job_qpu_time is not None:
+                qpu_time = (qpu_time or 0) + job_qpu_time
+        except deadline.DeadlineExceeded as e:
+            log_stderr(f"Warning: {e} Keeping the pilot's {pilot_shots} shots.")
+        finally:
+            if seed is not None:
+                try:
+                    backend.set_options(seed_simulator=seed)
+                except Exception:
+                    pass
+    if accumulator.total < shots:
+        budget.degrade("execute", shots=accumulator.total, requested_shots=shots)
+    return job_id, accumulator.arrays(), qpu_time, accumulator.total, True
@@ -0,0 +1,569 @@
+# cluster_runner.py
+#
+# Coordinator / worker mode for sweeps that outgrow one machine. Uses the
+# batch runner's manifest format, run plans and worker code (each worker
+# process imports the scripts once and calls run() repeatedly), over a plain
+# TCP protocol of newline-delimited JSON messages; no external queue service.
+#
+#   python cluster_runner.py coordinator manifest.json --host 0.0.0.0 --port 7781 --auth_key KEY
+#   python cluster_runner.py worker coordinator-host:7781 --slots 8 --auth_key KEY
+#   python cluster_runner.py coordinator manifest.json --local_workers 3   # test on localhost
+#
+# Workers register with their slot count and pull tasks by granting free-slot
+# credit. Each task goes to the least loaded worker with credit (running tasks
+# per slot, or reported load average per CPU when the machine is busier).
+# Finished runs push their record and artifacts (results JSON, counts
+# sidecar, log, events) back; the coordinator writes them under its output
+# directory and appends to results.jsonl exactly as batch_runner.py does, so
+# --resume and run_stats.py work unchanged. A worker that disconnects or
+# misses heartbeats, or whose run process dies, has its task requeued on
+# another worker (up to --max_attempts).
+#
+# Messages are not encrypted: keep the coordinator on a trusted network and
+# prefer giving each worker its own --api_token over putting it in the manifest.
+
+import argparse
+import base64
+import collections
+import concurrent.futures
+import hmac
+import json
+import multiprocessing
+import os
+import shutil
+import socket
+import socketserver
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import batch_runner
+
+PROTOCOL_VERSION = 1
+DEFAULT_PORT = 7781
+HEARTBEAT_SEC = 5.0
+HEARTBEAT_TIMEOUT_SEC = 30.0
+DEFAULT_MAX_ATTEMPTS = 3
+CONNECT_TIMEOUT_SEC = 30.0
+NO_WORKERS_TIMEOUT_SEC = 300.0 # Queued tasks fail after this long without any live worker
+
+
+# --- Helper Functions (Logging to stderr) ---
+def log_stderr(*args, **kwargs):
+    """Prints messages to stderr."""
+    print(*args, file=sys.stderr, **kwargs)
+
+
+# --- Protocol ---
+def send_message(stream, lock, message):
+    data = (json.dumps(message, separators=(",", ":"), default=str) + "\n").encode("utf-8")
+    with lock:
+        stream.write(data)
+        stream.flush()
+
+
+def read_message(stream):
+    """Next message, or None when the peer closed the connection."""
+    line = stream.readline()
+    return json.loads(line) if line else None
+
+
+def _under(path, directory):
+    try:
+        return os.path.isabs(path) and os.path.commonpath([os.path.abspath(path), directory]) == directory
+    except ValueError:
+        return False
+
+
+# --- Coordinator ---
+class _Worker:
+    def __init__(self, worker_id, hello, sock, stream):
+        self.id = worker_id
+        self.name = hello.get("name") or f"worker-{worker_id}"
+        self.slots = max(1, int(hello.get("slots", 1)))
+        self.cpus = max(1, int(hello.get("cpus", 1)))
+        self.loadavg = 0.0
+        self.credits = 0
+        self.running = {} # run_id -> plan
+        self.completed = 0
+        self.last_seen = time.monotonic()
+        self.alive = True
+        self.sock = sock
+        self.stream = stream
+        self.lock = threading.Lock()
+
+    def load(self):
+        return max(len(self.running) / self.slots, self.loadavg / self.cpus)
+
+
+class Coordinator:
+    """Task queue, worker registry and result sink shared by the connection threads."""
+
+    def __init__(self, plans, output_dir, emit, auth_key=None, max_attempts=DEFAULT_MAX_ATTEMPTS,
+                 heartbeat_timeout=HEARTBEAT_TIMEOUT_SEC, no_workers_timeout=NO_WORKERS_TIMEOUT_SEC):
+        self.output_dir = output_dir
+        self.emit = emit
+        self.auth_key = auth_key
+        self.max_attempts = max_attempts
+        self.heartbeat_timeout = heartbeat_timeout
+        self.no_workers_timeout = no_workers_timeout
+        self.cond = threading.Condition()
+        self.queue = collections.deque(plans)
+        self.plans = {plan["run_id"]: plan for plan in plans}
+        self.attempts = collections.Counter()
+        self.remaining = len(plans)
+        self.workers = {}
+        self._next_id = 1
+
+    # --- Worker lifecycle (connection threads) ---
+    def register(self, hello, sock, stream):
+        if hello.get("type") != "hello" or hello.get("version") != PROTOCOL_VERSION:
+            raise ValueError(f"Expected hello with protocol version {PROTOCOL_VERSION}.")
+        if self.auth_key and not hmac.compare_digest(str(hello.get("auth_key") or ""), self.auth_key):
+            raise ValueError("Authentication failed.")
+        with self.cond:
+            worker = _Worker(self._next_id, hello, sock, stream)
+            self._next_id += 1
+            self.workers[worker.id] = worker
+        log_stderr(f"Worker {worker.name} registered ({worker.slots} slot(s), {worker.cpus} CPU(s)).")
+        return worker
+
+    def handle(self, worker, message):
+        kind = message.get("type")
+        with self.cond:
+            worker.last_seen = time.monotonic()
+            if "loadavg" in message:
+                worker.loadavg = float(message["loadavg"] or 0.0)
+            if kind == "pull":
+                worker.credits += int(message.get("slots", 1))
+            elif kind == "result":
+                self._complete(worker, message)
+            elif kind == "requeue":
+                plan = worker.running.pop(message["run_id"], None)
+                if plan is not None:
+                    self._retry(plan, f"{message.get('reason')} on {worker.name}")
+            self.cond.notify_all()
+
+    def lost(self, worker, reason):
+        """Requeues a disconnected (or silent) worker's tasks."""
+        with self.cond:
+            if not worker.alive:
+                return
+            worker.alive = False
+            worker.credits = 0
+            if self.remaining <= 0 and not worker.running:
+                return # Normal disconnect after the shutdown message
+            log_stderr(f"Worker {worker.name} lost ({reason}); requeueing {len(worker.running)} task(s).")
+            for plan in reversed(list(worker.running.values())): # appendleft: keep their original order
+                self._retry(plan, f"worker {worker.name} lost: {reason}")
+            worker.running.clear()
+            self.cond.notify_all()
+        try:
+            worker.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+    # --- Results (called with the lock held) ---
+    def _complete(self, worker, message):
+        run_id = message["run_id"]
+        plan = worker.running.pop(run_id, None)
+        worker.completed += 1
+        if plan is None:
+            return # Already requeued after a heartbeat timeout and finished elsewhere, or a duplicate
+        try:
+            self._write_files(message.get("files") or {})
+        except Exception as e:
+            log_stderr(f"Warning: Could not write artifacts of {run_id}: {e}")
+        record = dict(message["record"], output_json=plan["output_json"], log_file=plan["log_file"],
+                      worker=worker.name, attempt=self.attempts[run_id] + 1)
+        self._finish(record)
+
+    def _retry(self, plan, reason):
+        run_id = plan["run_id"]
+        self.attempts[run_id] += 1
+        if self.attempts[run_id] >= self.max_attempts:
+            self._fail(plan, f"Gave up after {self.attempts[run_id]} attempt(s); last: {reason}")
+        else:
+            log_stderr(f"Requeueing {run_id} (attempt {self.attempts[run_id] + 1}): {reason}")
+            self.queue.appendleft(plan)
+
+    def _fail(self, plan, message):
+        self._finish({"event": "run_complete", "run_id": plan["run_id"], "index": plan["index"], "script": plan["script"],
+                      "output_json": plan["output_json"], "log_file": plan["log_file"], "status": "error",
+                      "error_message": message})
+
+    def _finish(self, record):
+        self.remaining -= 1
+        self.emit(record)
+
+    def _write_files(self, files):
+        for relative, encoded in files.items():
+            path = os.path.normpath(os.path.join(self.output_dir, relative))
+            if not _under(path, self.output_dir):
+                raise ValueError(f"Refusing artifact path outside the output directory: {relative}")
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = path + ".tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(base64.b64decode(encoded))
+            os.replace(tmp_path, path)
+
+    # --- Scheduling (dispatcher thread) ---
+    def _assign(self):
+        """Pops (worker, plan) pairs for the least loaded workers with credit. Lock held."""
+        assignments = []
+        while self.queue:
+            ready = [w for w in self.workers.values() if w.alive and w.credits > 0]
+            if not ready:
+                break
+            worker = min(ready, key=lambda w: (w.load(), len(w.running), w.id))
+            plan = self.queue.popleft()
+            worker.credits -= 1
+            worker.running[plan["run_id"]] = plan
+            assignments.append((worker, plan))
+        return assignments
+
+    def dispatch(self):
+        """Runs until every task has a final record. Queued tasks fail once no worker has
+           been alive for no_workers_timeout seconds (e.g. local workers that failed to start)."""
+        idle_since = time.monotonic()
+        while True:
+            with self.cond:
+                if self.remaining <= 0:
+                    break
+                now = time.monotonic()
+                if any(w.alive for w in self.workers.values()):
+                    idle_since = now
+                elif now - idle_since > self.no_workers_timeout:
+                    log_stderr(f"No live workers for {self.no_workers_timeout:.0f}s; failing {len(self.queue)} queued task(s).")
+                    while self.queue:
+                        self._fail(self.queue.popleft(), f"No live workers for {self.no_workers_timeout:.0f}s.")
+                    continue
+                silent = [w for w in self.workers.values()
+                          if w.alive and now - w.last_seen > self.heartbeat_timeout]
+                assignments = self._assign()
+                if not assignments and not silent:
+                    self.cond.wait(timeout=1.0)
+            for worker in silent:
+                self.lost(worker, f"no heartbeat for {self.heartbeat_timeout:.0f}s")
+            for worker, plan in assignments:
+                try:
+                    send_message(worker.stream, worker.lock, {"type": "task", "plan": plan})
+                except (OSError, ValueError) as e: # ValueError: stream closed by the worker's handler thread
+                    self.lost(worker, f"send failed: {e}")
+
+    def shutdown_workers(self):
+        with self.cond:
+            alive = [w for w in self.workers.values() if w.alive]
+        for worker in alive:
+            try:
+                send_message(worker.stream, worker.lock, {"type": "shutdown"})
+            except (OSError, ValueError): # Disconnected since; its handler thread may have closed the stream
+                pass
+
+    def summary(self):
+        return {w.name: {"slots": w.slots, "completed": w.completed, "alive": w.alive} for w in self.workers.values()}
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        coordinator = self.server.coordinator
+        try:
+            hello = read_message(self.rfile)
+            worker = coordinator.register(hello or {}, self.request, self.wfile)
+        except Exception as e:
+            try:
+                send_message(self.wfile, threading.Lock(), {"type": "error", "error_message": str(e)})
+            except OSError:
+                pass
+            log_stderr(f"Rejected connection from {self.client_address[0]}: {e}")
+            return
+        try:
+            send_message(self.wfile, worker.lock, {"type": "welcome", "worker_id": worker.id,
+                                                   "output_dir": coordinator.output_dir,
+                                                   "heartbeat_sec": HEARTBEAT_SEC})
+            while True:
+                message = read_message(self.rfile)
+                if message is None:
+                    break
+                coordinator.handle(worker, message)
+            reason = "disconnected"
+        except (OSError, ValueError) as e:
+            reason = str(e)
+        coordinator.lost(worker, reason)
+
+
+class _Server(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+def run_coordinator(args):
+    try:
+        defaults, runs = batch_runner.load_manifest(args.manifest)
+    except Exception as e:
+        log_stderr(f"ERROR: Could not read manifest {args.manifest}: {e}")
+        return 1
+    # Absolute, so workers can map every artifact path under it to their own work directory
+    output_dir = os.path.abspath(args.output_dir or os.path.splitext(args.manifest)[0] + "_results")
+    os.makedirs(output_dir, exist_ok=True)
+    results_path = os.path.join(output_dir, batch_runner.RESULTS_FILE)
+
+    plans = batch_runner.plan_runs(defaults, runs, output_dir, args.api_token)
+    if len({p["run_id"] for p in plans}) != len(plans):
+        log_stderr("ERROR: Duplicate run ids in manifest.")
+        return 1
+    done = batch_runner.completed_run_ids(results_path, args.retry_failed) if args.resume else set()
+    pending = [p for p in plans if p["run_id"] not in done]
+    skipped = len(plans) - len(pending)
+
+    counts = {}
+    start = time.perf_counter()
+    with open(results_path, "a", buffering=1) as results_file:
+        def emit(record):
+            line = json.dumps(record, separators=(",", ":"), default=str)
+            results_file.write(line + "\n")
+            print(line, flush=True)
+            counts[record["status"]] = counts.get(record["status"], 0) + 1
+
+        for plan in [p for p in pending if p["script"] is None]:
+            emit({"event": "run_complete", "run_id": plan["run_id"], "index": plan["index"], "script": None,
+                  "output_json": None, "status": "invalid",
+                  "error_message": f"Unknown script '{plan['requested_script']}'. Expected one of {sorted(batch_runner.SCRIPTS)}."})
+        pending = [p for p in pending if p["script"] is not None]
+
+        coordinator = Coordinator(pending, output_dir, emit, args.auth_key, args.max_attempts, args.heartbeat_timeout,
+                                  args.no_workers_timeout)
+        server = _Server((args.host, args.port), _Handler)
+        server.coordinator = coordinator
+        host, port = server.server_address[:2]
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        log_stderr(f"Coordinator on {host}:{port}: {len(plans)} run(s), {skipped} already complete, "
+                   f"{len(pending)} to dispatch.")
+
+        local_workers = []
+        for i in range(args.local_workers):
+            command = [sys.executable, os.path.abspath(__file__), "worker", f"127.0.0.1:{port}",
+                       "--name", f"local-{i + 1}", "--slots", str(args.local_slots)]
+            if args.auth_key:
+                command += ["--auth_key", args.auth_key]
+            local_workers.append(subprocess.Popen(command))
+
+        try:
+            coordinator.dispatch()
+        except KeyboardInterrupt:
+            log_stderr("Interrupted; stopping workers. Use --resume to continue.")
+            return 130
+        finally:
+            coordinator.shutdown_workers()
+            server.shutdown()
+            server.server_close()
+            for process in local_workers:
+                try:
+                    process.wait(timeout=HEARTBEAT_TIMEOUT_SEC)
+                except subprocess.TimeoutExpired:
+                    process.kill()
+
+    summary = {"event": "batch_end", "total": len(plans), "skipped": skipped, "counts": counts,
+               "wall_time_sec": round(time.perf_counter() - start, 3), "results_file": results_path,
+               "workers": coordinator.summary()}
+    print(json.dumps(summary, separators=(",", ":")), flush=True)
+    log_stderr(f"Sweep finished in {summary['wall_time_sec']}s: {counts}")
+    return 0 if all(status == "success" for status in counts) else 1
+
+
+# --- Worker ---
+def localize_plan(plan, output_dir, task_dir, api_token=None):
+    """Maps every path under the coordinator's output_dir to the task's local directory."""
+    def local(value):
+        if isinstance(value, str) and _under(value, output_dir):
+            return os.path.join(task_dir, os.path.relpath(value, output_dir))
+        return value
+    argv = [local(item) for item in plan["argv"]]
+    if api_token and "--api_token" not in argv:
+        argv += ["--api_token", api_token]
+    return dict(plan, argv=argv, output_json=local(plan["output_json"]), log_file=local(plan["log_file"]))
+
+
+def collect_artifacts(task_dir, output_dir):
+    """{path relative to output_dir: base64 bytes} for every file the run wrote, with task-local
+       paths inside JSON files pointed back at the coordinator's output directory."""
+    local_prefix, remote_prefix = json.dumps(task_dir)[1:-1], json.dumps(output_dir)[1:-1]
+    files = {}
+    for root, _, names in os.walk(task_dir):
+        for name in names:
+            path = os.path.join(root, name)
+            with open(path, "rb") as f:
+                data = f.read()
+            if name.endswith((".json", ".jsonl")):
+                data = data.replace(local_prefix.encode("utf-8"), remote_prefix.encode("utf-8"))
+            files[os.path.relpath(path, task_dir)] = base64.b64encode(data).decode("ascii")
+    return files
+
+
+def _loadavg():
+    try:
+        return os.getloadavg()[0]
+    except (AttributeError, OSError):
+        return 0.0
+
+
+def _connect(address, timeout=CONNECT_TIMEOUT_SEC):
+    host, _, port = address.rpartition(":")
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            return socket.create_connection((host or "127.0.0.1", int(port or DEFAULT_PORT)))
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.5)
+
+
+def run_worker(args):
+    cpus = os.cpu_count() or 1
+    slots = max(1, args.slots or cpus)
+    aer_threads = args.aer_threads or max(1, cpus // slots)
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix="cluster_worker_")
+    cache_dir = args.cache_dir or os.path.join(work_dir, ".cache")
+    name = args.name or f"{socket.gethostname()}-{os.getpid()}"
+
+    try:
+        sock = _connect(args.coordinator)
+    except OSError as e:
+        log_stderr(f"ERROR: Could not reach coordinator {args.coordinator}: {e}")
+        return 1
+    stream = sock.makefile("rwb")
+    lock = threading.Lock()
+    send_message(stream, lock, {"type": "hello", "version": PROTOCOL_VERSION, "name": name, "slots": slots,
+                                "cpus": cpus, "auth_key": args.auth_key})
+    welcome = read_message(stream)
+    if not welcome or welcome.get("type") != "welcome":
+        log_stderr(f"ERROR: Coordinator refused registration: {(welcome or {}).get('error_message')}")
+        return 1
+    output_dir = welcome["output_dir"]
+    log_stderr(f"Worker {name}: {slots} slot(s) x {aer_threads} Aer thread(s), work dir {work_dir}")
+
+    def new_pool():
+        return concurrent.futures.ProcessPoolExecutor(
+            max_workers=slots, mp_context=multiprocessing.get_context("spawn"),
+            initializer=batch_runner._init_worker, initargs=(cache_dir, aer_threads, args.calibration_ttl))
+
+    state = {"pool": new_pool(), "running": 0}
+    state_lock = threading.Lock()
+    stop = threading.Event()
+
+    def heartbeat():
+        while not stop.wait(welcome.get("heartbeat_sec", HEARTBEAT_SEC)):
+            try:
+                send_message(stream, lock, {"type": "heartbeat", "loadavg": _loadavg(), "running": state["running"]})
+            except OSError:
+                return
+
+    def finished(plan, task_dir, pool, future):
+        with state_lock:
+            state["running"] -= 1
+        try:
+            try:
+                record = future.result()
+            except concurrent.futures.process.BrokenProcessPool as e:
+                # A run process died (e.g. out of memory); replace the pool and let the coordinator retry
+                with state_lock:
+                    if state["pool"] is pool:
+                        state["pool"] = new_pool()
+                send_message(stream, lock, {"type": "requeue", "run_id": plan["run_id"], "reason": f"run process died: {e}"})
+            else:
+                send_message(stream, lock, {"type": "result", "run_id": plan["run_id"], "record": record,
+                                            "files": collect_artifacts(task_dir, output_dir), "loadavg": _loadavg()})
+            send_message(stream, lock, {"type": "pull", "slots": 1})
+        except OSError:
+            pass # Coordinator gone; the main loop exits on EOF
+        finally:
+            if not args.keep_files:
+                shutil.rmtree(task_dir, ignore_errors=True)
+
+    threading.Thread(target=heartbeat, daemon=True).start()
+    send_message(stream, lock, {"type": "pull", "slots": slots, "loadavg": _loadavg()})
+    try:
+        while True:
+            message = read_message(stream)
+            if message is None or message.get("type") == "shutdown":
+                break
+            if message.get("type") != "task":
+                continue
+            plan = message["plan"]
+            task_dir = os.path.join(work_dir, plan["run_id"])
+            os.makedirs(task_dir, exist_ok=True)
+            local_plan = localize_plan(plan, output_dir, task_dir, args.api_token)
+            for path in (local_plan["output_json"], local_plan["log_file"]):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+            with state_lock:
+                pool = state["pool"]
+                state["running"] += 1
+            try:
+                future = pool.submit(batch_runner.execute_run, local_plan)
+            except RuntimeError as e: # Pool broken or shut down between tasks
+                with state_lock:
+                    state["running"] -= 1
+                    if state["pool"] is pool:
+                        state["pool"] = new_pool()
+                send_message(stream, lock, {"type": "requeue", "run_id": plan["run_id"], "reason": str(e)})
+                send_message(stream, lock, {"type": "pull", "slots": 1})
+                continue
+            future.add_done_callback(lambda f, plan=plan, task_dir=task_dir, pool=pool: finished(plan, task_dir, pool, f))
+    except (OSError, ValueError) as e:
+        log_stderr(f"Connection to coordinator failed: {e}")
+    finally:
+        stop.set()
+        state["pool"].shutdown(wait=False, cancel_futures=True)
+        try:
+            sock.close()
+        except OSError:
+            pass
+        if not args.work_dir and not args.keep_files:
+            shutil.rmtree(work_dir, ignore_errors=True)
+    log_stderr(f"Worker {name} stopped.")
+    return 0
+
+
+# --- Command Line ---
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run a Grover / Shor sweep across several machines over TCP.")
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    coordinator = sub.add_parser('coordinator', help='Serve a manifest to workers and collect their results')
+    coordinator.add_argument('manifest', type=str, help='Manifest file (JSON or JSON lines) of run specs, as for batch_runner.py')
+    coordinator.add_argument('--host', type=str, default='127.0.0.1', help='Address to listen on (default: 127.0.0.1; use 0.0.0.0 for remote workers)')
+    coordinator.add_argument('--port', type=int, default=DEFAULT_PORT, help=f'TCP port (default: {DEFAULT_PORT}; 0 picks a free port)')
+    coordinator.add_argument('--output_dir', type=str, default=None, help='Directory for per-run results, logs and results.jsonl (default: <manifest>_results)')
+    coordinator.add_argument('--api_token', type=str, default=None, help='IBM Quantum API Token for runs that do not set their own (sent to workers in the clear)')
+    coordinator.add_argument('--auth_key', type=str, default=None, help='Shared key workers must present to register')
+    coordinator.add_argument('--max_attempts', type=int, default=DEFAULT_MAX_ATTEMPTS, help=f'Times a task is tried after lost workers or dead run processes (default: {DEFAULT_MAX_ATTEMPTS})')
+    coordinator.add_argument('--heartbeat_timeout', type=float, default=HEARTBEAT_TIMEOUT_SEC, help=f'Seconds without a heartbeat before a worker counts as lost (default: {HEARTBEAT_TIMEOUT_SEC:.0f})')
+    coordinator.add_argument('--no_workers_timeout', type=float, default=NO_WORKERS_TIMEOUT_SEC, help=f'Seconds without any live worker before the queued runs fail (default: {NO_WORKERS_TIMEOUT_SEC:.0f})')
+    coordinator.add_argument('--local_workers', type=int, default=0, help='Also start this many workers on localhost')
+    coordinator.add_argument('--local_slots', type=int, default=1, help='Slots per local worker (default: 1)')
+    coordinator.add_argument('--resume', action='store_true', help='Skip runs already recorded in results.jsonl')
+    coordinator.add_argument('--retry_failed', action='store_true', help='With --resume, rerun runs that finished with a failure status')
+
+    worker = sub.add_parser('worker', help='Pull runs from a coordinator and execute them locally')
+    worker.add_argument('coordinator', type=str, help='Coordinator address HOST:PORT')
+    worker.add_argument('--slots', type=int, default=None, help='Concurrent runs (default: CPU count)')
+    worker.add_argument('--aer_threads', type=int, default=None, help='Aer threads per run (default: CPU count / slots, at least 1)')
+    worker.add_argument('--name', type=str, default=None, help='Worker name in results (default: host-pid)')
+    worker.add_argument('--auth_key', type=str, default=None, help='Shared key expected by the coordinator')
+    worker.add_argument('--api_token', type=str, default=None, help='IBM Quantum API Token added to runs that do not carry one')
+    worker.add_argument('--work_dir', type=str, default=None, help='Local directory for run artifacts before upload (default: temporary)')
+    worker.add_argument('--cache_dir', type=str, default=None, help='Transpile / calibration cache directory (default: <work_dir>/.cache)')
+    worker.add_argument('--calibration_ttl', type=float, default=900, help='Seconds a cached backend calibration stays valid (default: 900)')
+    worker.add_argument('--keep_files', action='store_true', help='Keep local run artifacts after upload')
+    args = parser.parse_args(argv)
+
+    if args.command == 'coordinator':
+        return run_coordinator(args)
+    return run_worker(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,511 @@
+# cnf_oracle.py
+#
+# Compiles a CNF formula (DIMACS file) or a Boolean expression into a Grover
+# phase oracle. Internal AND/OR/XOR terms are computed into ancilla qubits,
+# the phase is applied to the root, and the ancillas are uncomputed so they
+# return to |0>. Compiled oracles are cached per formula hash.
+
+import hashlib
+import io
+import json
+import math
+import os
+import re
+import sys
+import tempfile
+import time
+
+import numpy as np
+from qiskit import QuantumCircuit, QuantumRegister, AncillaRegister, qpy
+from qiskit.circuit.library import MCMT, ZGate
+
+import run_context
+
+# Bump when the compilation scheme changes so stale cache entries are ignored.
+ORACLE_COMPILER_VERSION = 1
+
+# Above this many variables the solution count is sampled instead of enumerated.
+EXACT_COUNT_MAX_VARS = 22
+COUNT_CHUNK_SIZE = 1 << 20
+SAMPLED_COUNT_SIZE = 1 << 16
+# Maximum number of explicit solutions kept for plotting / reporting.
+SOLUTION_LIST_LIMIT = 64
+
+# In-process cache: formula hash -> (oracle circuit, stats)
+_ORACLE_CACHE = {}
+
+
+# --- Helper Functions (Logging to stderr) ---
+def log_stderr(*args, **kwargs):
+    """Prints messages to stderr."""
+    print(*args, file=sys.stderr, **kwargs)
+
+
+def default_cache_dir():
+    """Returns the on-disk cache root shared by the quantum scripts."""
+    return os.environ.get("KEYSTONE_QUANTUM_CACHE",
+                          os.path.join(tempfile.gettempdir(), "keystone_quantum_cache"))
+
+
+# --- Formula Parsing ---
+# Formulas are plain nested tuples:
+#   ("var", index) | ("not", node) | ("and", [nodes]) | ("or", [nodes]) | ("xor", [nodes])
+# simplify_formula folds constant sub-formulas away; only a whole formula can
+# simplify to TRUE / FALSE ("const" nodes), and those never reach the compiler.
+# Variable i is mapped to qubit i, so it is the i-th bit from the right of a
+# measured bit-string.
+
+TRUE = ("const", True)
+FALSE = ("const", False)
+
+
+def parse_dimacs(text):
+    """Parses DIMACS CNF text. Returns (num_vars, clauses) with signed-int literals."""
+    num_vars = None
+    declared_clauses = None
+    clauses = []
+    current = []
+    for line_no, raw_line in enumerate(text.splitlines(), start=1):
+        line = raw_line.strip()
+        if not line or line.startswith("c") or line.startswith("%"):
+            continue
+        if line.startswith("p"):
+            parts = line.split()
+            if len(parts) != 4 or parts[1] != "cnf":
+                raise ValueError(f"Invalid DIMACS problem line {line_no}: '{line}'")
+            num_vars, declared_clauses = int(parts[2]), int(parts[3])
+            continue
+        for token in line.split():
+            literal = int(token)
+            if literal == 0:
+                if current:
+                    clauses.append(current)
+                current = []
+            else:
+                current.append(literal)
+    if current:
+        clauses.append(current)
+
+    if num_vars is None:
+        raise ValueError("DIMACS input is missing the 'p cnf <vars> <clauses>' line.")
+    if declared_clauses is not None and declared_clauses != len(clauses):
+        log_stderr(f"  Warning: DIMACS header declares {declared_clauses} clauses, found {len(clauses)}.")
+    for clause in clauses:
+        for literal in clause:
+            if abs(literal) > num_vars:
+                raise ValueError(f"Literal {literal} exceeds declared variable count {num_vars}.")
+    return num_vars, clauses
+
+
+def load_dimacs(path):
+    """Reads a DIMACS CNF file from disk."""
+    with open(path, "r") as f:
+        return parse_dimacs(f.read())
+
+
+def cnf_to_formula(clauses):
+    """Converts signed-int clauses into a formula tree, dropping tautological clauses."""
+    terms = []
+    seen = set()
+    for clause in clauses:
+        literals = sorted(set(clause), key=lambda l: (abs(l), l))
+        if any(-l in literals for l in literals):
+            continue  # (x | ~x | ...) is always true
+        key = tuple(literals)
+        if key in seen:
+            continue
+        seen.add(key)
+        nodes = [("var", abs(l) - 1) if l > 0 else ("not", ("var", abs(l) - 1)) for l in literals]
+        terms.append(nodes[0] if len(nodes) == 1 else ("or", nodes))
+    if not terms:
+        raise ValueError("CNF formula has no non-tautological clauses; every assignment is a solution.")
+    return terms[0] if len(terms) == 1 else ("and", terms)
+
+
+_TOKEN_RE = re.compile(r"\s*(?:(\()|(\))|(~|!|¬)|(&&|&|∧)|(\|\||\||∨)|(\^|⊕)|([A-Za-z_][A-Za-z0-9_]*))")
+_KEYWORDS = {"and": "&", "or": "|", "not": "~", "xor": "^"}
+
+
+def _tokenize(expr):
+    tokens = []
+    pos = 0
+    expr = expr.rstrip()
+    while pos < len(expr):
+        match = _TOKEN_RE.match(expr, pos)
+        if not match:
+            raise ValueError(f"Unexpected character in expression at position {pos}: '{expr[pos:pos + 10]}'")
+        pos = match.end()
+        lparen, rparen, neg, conj, disj, xor, ident = match.groups()
+        if lparen:
+            tokens.append("(")
+        elif rparen:
+            tokens.append(")")
+        elif neg:
+            tokens.append("~")
+        elif conj:
+            tokens.append("&")
+        elif disj:
+            tokens.append("|")
+        elif xor:
+            tokens.append("^")
+        elif ident.lower() in _KEYWORDS:
+            tokens.append(_KEYWORDS[ident.lower()])
+        else:
+            tokens.append(("id", ident))
+    return tokens
+
+
+def _natural_key(name):
+    return [int(part) if part.isdigit() else part for part in re.split(r"(\d+)", name)]
+
+
+def parse_boolean_expression(expr):
+    """Parses an expression such as '(a | ~b) & (b ^ c)'.
+
+    Precedence (loosest first): |, ^, &, ~. Keywords and/or/not/xor are accepted.
+    Returns (variable_names, formula); variables are ordered naturally (x2 < x10).
+    """
+    tokens = _tokenize(expr)
+    if not tokens:
+        raise ValueError("Boolean expression is empty.")
+    names = sorted({t[1] for t in tokens if isinstance(t, tuple)}, key=_natural_key)
+    index = {name: i for i, name in enumerate(names)}
+    pos = 0
+
+    def peek():
+        return tokens[pos] if pos < len(tokens) else None
+
+    def parse_binary(op, kind, parse_operand):
+        nonlocal pos
+        operands = [parse_operand()]
+        while peek() == op:
+            pos += 1
+            operands.append(parse_operand())
+        return operands[0] if len(operands) == 1 else (kind, operands)
+
+    def parse_or():
+        return parse_binary("|", "or", parse_xor)
+
+    def parse_xor():
+        return parse_binary("^", "xor", parse_and)
+
+    def parse_and():
+        return parse_binary("&", "and", parse_unary)
+
+    def parse_unary():
+        nonlocal pos
+        token = peek()
+        if token == "~":
+            pos += 1
+            return ("not", parse_unary())
+        if token == "(":
+            pos += 1
+            node = parse_or()
+            if peek() != ")":
+                raise ValueError("Unbalanced parentheses in Boolean expression.")
+            pos += 1
+            return node
+        if isinstance(token, tuple):
+            pos += 1
+            return ("var", index[token[1]])
+        raise ValueError(f"Unexpected token in Boolean expression: {token!r}")
+
+    formula = parse_or()
+    if pos != len(tokens):
+        raise ValueError(f"Unexpected trailing tokens in Boolean expression: {tokens[pos:]}")
+    formula = simplify_formula(formula)
+    if formula == TRUE:
+        # Like a CNF file whose clauses are all tautological
+        raise ValueError("Boolean expression is always true; every assignment is a solution.")
+    return names, formula # FALSE: unsatisfiable, reported by the caller
+
+
+def simplify_formula(node):
+    """Flattens nested AND/OR/XOR, collapses double negation, deduplicates operands and
+       propagates constants: x & ~x and x ^ x are FALSE, x | ~x and x ^ ~x are TRUE."""
+    kind = node[0]
+    if kind in ("var", "const"):
+        return node
+    if kind == "not":
+        child = simplify_formula(node[1])
+        if child[0] == "const":
+            return ("const", not child[1])
+        return child[1] if child[0] == "not" else ("not", child)
+    children = []
+    for child in (simplify_formula(c) for c in node[1]):
+        if child[0] == kind:
+            children.extend(child[1])
+        else:
+            children.append(child)
+    if kind == "xor":
+        # ~y is y ^ TRUE: negations and TRUE operands flip the parity, FALSE ones drop out and
+        # equal operands cancel in pairs, so x ^ ~x folds to TRUE
+        negate = False
+        operands = []
+        pending = list(children)
+        while pending:
+            child = pending.pop(0)
+            if child[0] == "not":
+                negate = not negate
+                pending.insert(0, child[1])
+            elif child[0] == "const":
+                negate ^= child[1]
+            elif child[0] == "xor":
+                pending[0:0] = child[1]
+            elif child in operands:
+                operands.remove(child)
+            else:
+                operands.append(child)
+        if not operands:
+            return ("const", negate)
+        result = operands[0] if len(operands) == 1 else ("xor", operands)
+        return ("not", result) if negate else result
+    absorbing, neutral = (FALSE, TRUE) if kind == "and" else (TRUE, FALSE)
+    unique = []
+    for child in children:
+        if child == absorbing:
+            return absorbing
+        if child != neutral and child not in unique:
+            unique.append(child)
+    for child in unique:
+        complement = child[1] if child[0] == "not" else ("not", child)
+        if complement in unique:
+            return absorbing
+    if not unique:
+        return neutral
+    return unique[0] if len(unique) == 1 else (kind, unique)
+
+
+def formula_to_string(node, names=None):
+    """Canonical textual form, used for hashing and logging."""
+    kind = node[0]
+    if kind == "const":
+        return "1" if node[1] else "0"
+    if kind == "var":
+        return names[node[1]] if names else f"x{node[1]}"
+    if kind == "not":
+        return "~" + formula_to_string(node[1], names)
+    symbol = {"and": " & ", "or": " | ", "xor": " ^ "}[kind]
+    return "(" + symbol.join(formula_to_string(c, names) for c in node[1]) + ")"
+
+
+def formula_hash(num_vars, formula):
+    """Stable hash of a formula; identifies compiled oracles in the cache."""
+    canonical = f"v{ORACLE_COMPILER_VERSION}|n={num_vars}|{formula_to_string(formula)}"
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def count_clauses(formula):
+    """Number of top-level clauses (1 for anything that is not an AND)."""
+    return len(formula[1]) if formula[0] == "and" else 1
+
+
+# --- Classical Evaluation ---
+def evaluate_formula(formula, assignments):
+    """Vectorized evaluation over an int array of assignments (bit i = variable i)."""
+    kind = formula[0]
+    if kind == "const":
+        return np.full(np.shape(assignments), formula[1], dtype=bool)
+    if kind == "var":
+        return ((assignments >> formula[1]) & 1).astype(bool)
+    if kind == "not":
+        return ~evaluate_formula(formula[1], assignments)
+    values = [evaluate_formula(c, assignments) for c in formula[1]]
+    if kind == "and":
+        return np.logical_and.reduce(values)
+    if kind == "or":
+        return np.logical_or.reduce(values)
+    return np.logical_xor.reduce(values)
+
+
+def assignment_to_bitstring(assignment, num_vars):
+    return format(int(assignment), f"0{num_vars}b")
+
+
+def bitstring_satisfies(formula, bitstring):
+    """Checks one measured bit-string (qubit 0 rightmost) against the formula."""
+    return bool(evaluate_formula(formula, np.array([int(bitstring, 2)], dtype=np.int64))[0])
+
+
+def count_solutions(formula, num_vars, seed=None):
+    """Counts satisfying assignments.
+
+    Enumerates all 2^n assignments in chunks up to EXACT_COUNT_MAX_VARS variables,
+    otherwise estimates the count from a uniform sample. Returns a dict with
+    'count', 'method' ('exact' or 'sampled') and up to SOLUTION_LIST_LIMIT solutions.
+    """
+    solutions = []
+    total = 1 << num_vars
+    if num_vars <= EXACT_COUNT_MAX_VARS:
+        count = 0
+        for start in range(0, total, COUNT_CHUNK_SIZE):
+            chunk = np.arange(start, min(start + COUNT_CHUNK_SIZE, total), dtype=np.int64)
+            hits = chunk[evaluate_formula(formula, chunk)]
+            count += int(hits.size)
+            if len(solutions) < SOLUTION_LIST_LIMIT:
+                solutions.extend(int(h) for h in hits[:SOLUTION_LIST_LIMIT - len(solutions)])
+        method = "exact"
+    else:
+        rng = np.random.default_rng(seed)
+        sample = rng.integers(0, total, size=SAMPLED_COUNT_SIZE, dtype=np.int64)
+        hits = np.unique(sample[evaluate_formula(formula, sample)])
+        solutions = [int(h) for h in hits[:SOLUTION_LIST_LIMIT]]
+        count = int(round(total * np.count_nonzero(evaluate_formula(formula, sample)) / SAMPLED_COUNT_SIZE))
+        method = "sampled"
+    return {
+        "count": count,
+        "method": method,
+        "solutions": [assignment_to_bitstring(s, num_vars) for s in solutions],
+    }
+
+
+# --- Oracle Compilation ---
+def _count_ancillas(formula, is_root=True):
+    kind = formula[0]
+    if kind == "var":
+        return 0
+    if kind == "not":
+        return _count_ancillas(formula[1], False)
+    below = sum(_count_ancillas(c, False) for c in formula[1])
+    # The root AND is applied directly as a multi-controlled Z, so it needs no ancilla.
+    return below + (0 if (is_root and kind == "and") else 1)
+
+
+def _compile_node(node, qc, var_qubits, allocate):
+    """Computes a sub-formula. Returns (qubit, negated) describing where its value lives."""
+    kind = node[0]
+    if kind == "var":
+        return var_qubits[node[1]], False
+    if kind == "not":
+        qubit, negated = _compile_node(node[1], qc, var_qubits, allocate)
+        return qubit, not negated
+
+    children = [_compile_node(c, qc, var_qubits, allocate) for c in node[1]]
+    target = allocate()
+    controls = [q for q, _ in children]
+    if kind == "xor":
+        parity = False
+        for qubit, negated in children:
+            qc.cx(qubit, target)
+            parity ^= negated
+        return target, parity
+
+    # ctrl_state is little-endian: the rightmost character belongs to the first control.
+    if kind == "and":
+        ctrl_state = "".join("0" if neg else "1" for _, neg in reversed(children))
+        qc.mcx(controls, target, ctrl_state=ctrl_state)
+        return target, False
+    # OR(x1..xk) = NOT AND(~x1..~xk)
+    ctrl_state = "".join("1" if neg else "0" for _, neg in reversed(children))
+    qc.mcx(controls, target, ctrl_state=ctrl_state)
+    return target, True
+
+
+def _apply_phase(qc, literals):
+    """Flips the phase when every (qubit, negated) literal evaluates to true."""
+    flips = [q for q, neg in literals if neg]
+    qubits = [q for q, _ in literals]
+    if flips:
+        qc.x(flips)
+    if len(qubits) == 1:
+        qc.z(qubits[0])
+    else:
+        qc.compose(MCMT(ZGate(), len(qubits) - 1, 1), qubits=qubits, inplace=True)
+    if flips:
+        qc.x(flips)
+
+
+def compile_phase_oracle(num_vars, formula):
+    """Builds the compute / phase / uncompute oracle. Returns (circuit, stats)."""
+    start = time.perf_counter()
+    num_ancillas = _count_ancillas(formula)
+    var_reg = QuantumRegister(num_vars, name="v")
+    registers = [var_reg]
+    anc_reg = None
+    if num_ancillas:
+        anc_reg = AncillaRegister(num_ancillas, name="anc")
+        registers.append(anc_reg)
+
+    compute = QuantumCircuit(*registers)
+    next_ancilla = iter(range(num_ancillas))
+
+    def allocate():
+        return anc_reg[next(next_ancilla)]
+
+    var_qubits = list(var_reg)
+    if formula[0] == "and":
+        root_literals = [_compile_node(c, compute, var_qubits, allocate) for c in formula[1]]
+    else:
+        root_literals = [_compile_node(formula, compute, var_qubits, allocate)]
+
+    oracle = QuantumCircuit(*registers, name="Oracle")
+    oracle.compose(compute, inplace=True)
+    _apply_phase(oracle, root_literals)
+    oracle.compose(compute.inverse(), inplace=True)
+
+    stats = {
+        "num_variables": num_vars,
+        "num_clauses": count_clauses(formula),
+        "num_ancillas": num_ancillas,
+        "oracle_qubits": oracle.num_qubits,
+        "oracle_depth": oracle.depth(),
+        "oracle_size": oracle.size(),
+        "oracle_multi_controlled_gates": sum(1 for inst in oracle.data if inst.operation.num_qubits >= 3),
+        "compile_time_sec": round(time.perf_counter() - start, 6),
+    }
+    return oracle, stats
+
+
+def get_phase_oracle(num_vars, formula, cache_dir=None):
+    """Returns (oracle, stats), reusing a compiled oracle cached under the formula hash."""
+    key = formula_hash(num_vars, formula)
+    if key in _ORACLE_CACHE:
+        oracle, stats = _ORACLE_CACHE[key]
+        return oracle, dict(stats, formula_hash=key, cache_hit=True)
+
+    cache_path = None
+    if cache_dir is not False:
+        cache_path = os.path.join(cache_dir or os.path.join(default_cache_dir(), "oracles"), key)
+        try:
+            with open(cache_path + ".qpy", "rb") as f:
+                oracle = qpy.load(f)[0]
+            with open(cache_path + ".json", "r") as f:
+                stats = json.load(f)
+            _ORACLE_CACHE[key] = (oracle, stats)
+            log_stderr(f"  Loaded compiled oracle from cache ({key[:12]}).")
+            return oracle, dict(stats, formula_hash=key, cache_hit=True)
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            log_stderr(f"  Warning: Ignoring unreadable oracle cache entry {key[:12]}: {e}")
+
+    log_stderr(f"  Compiling phase oracle ({count_clauses(formula)} clause(s), {num_vars} variable(s))...")
+    oracle, stats = compile_phase_oracle(num_vars, formula)
+    log_stderr(f"  Oracle compiled in {stats['compile_time_sec']:.4f}s: "
+               f"{stats['num_ancillas']} ancilla(s), depth {stats['oracle_depth']}, size {stats['oracle_size']}")
+    _ORACLE_CACHE[key] = (oracle, stats)
+
+    if cache_path:
+        try:
+            # Atomic writes, so a concurrent run never loads a partially written entry
+            buffer = io.BytesIO()
+            qpy.dump(oracle, buffer)
+            run_context._write_atomic(cache_path + ".qpy", buffer.getvalue())
+            run_context._write_atomic(cache_path + ".json", json.dumps(stats).encode("utf-8"))
+        except Exception as e:
+            log_stderr(f"  Warning: Could not write oracle cache entry: {e}")
+    return oracle, dict(stats, formula_hash=key, cache_hit=False)
+
+
+# --- Exponential Search Schedule ---
+def exponential_search_iterations(num_vars, rng, max_rounds):
+    """Yields Grover iteration counts for the BBHT exponential search.
+
+    Used when the number of solutions is not known exactly: each round draws
+    k uniformly from [0, m) and grows m by 6/5, capped at sqrt(2^n).
+    """
+    m = 1.0
+    cap = math.sqrt(2 ** num_vars)
+    for _ in range(max_rounds):
+        yield int(rng.integers(0, max(1, int(math.ceil(m)))))
+        m = min(m * 6 / 5, cap)
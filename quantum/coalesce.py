@@ -0,0 +1,233 @@
+# coalesce.py
+#
+# In-flight coalescing of identical hardware jobs. Dashboard users and
+# scheduled runs often ask for the same configuration on the same backend at
+# about the same time; without this each of them transpiles, submits and pays
+# QPU time for its own copy of the job.
+#
+# Requests are keyed by (transpiled circuit hash, backend, account, sampler
+# options) and registered in a small on-disk registry shared by every process
+# on the machine. A request whose key is already in flight attaches to the
+# existing job(s) instead of submitting, and every requester reports the same
+# job IDs and counts. A request for more shots than are in flight tops up with
+# one extra job for the difference, which later requesters share as well.
+#
+# Entries are dropped once their jobs have finished and been collected, when a
+# job failed or can no longer be found, or after ENTRY_TTL_SEC. A requester
+# that stops early (--deadline, SIGTERM) only cancels a shared job when no
+# other requester is still waiting for it.
+
+import contextlib
+import hashlib
+import json
+import os
+import sys
+import time
+
+import result_io
+import run_context
+
+REGISTRY_VERSION = 1
+ENTRY_TTL_SEC = 24 * 3600 # Longest a job is expected to stay queued
+# The lock is held while a job is submitted; one older than STALE_LOCK_SEC was left by a crashed process
+STALE_LOCK_SEC = 120.0
+LOCK_TIMEOUT_SEC = 150.0
+FINAL_STATES = ("DONE", "ERROR", "CANCELLED")
+
+_JOBS = {} # job_id -> job object, for requesters in this process (local-mode jobs exist nowhere else)
+
+
+# --- Helper Functions (Logging to stderr) ---
+def log_stderr(*args, **kwargs):
+    """Prints messages to stderr."""
+    print(*args, file=sys.stderr, **kwargs)
+
+
+def default_cache_dir():
+    from cnf_oracle import default_cache_dir as base_dir
+    return os.path.join(base_dir(), "inflight")
+
+
+def job_key(qc, backend, account="default", options=None):
+    """Identity of a hardware request, without its shot count."""
+    payload = json.dumps([REGISTRY_VERSION, run_context.circuit_hash(qc), backend.name, account, options or {}],
+                         sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _status(job):
+    status = job.status()
+    return getattr(status, "name", str(status)).upper()
+
+
+# --- Registry ---
+@contextlib.contextmanager
+def _locked(path):
+    """Cross-process lock: exclusive creation of a lock file."""
+    give_up = time.monotonic() + LOCK_TIMEOUT_SEC
+    while True:
+        try:
+            os.close(os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+            break
+        except FileExistsError:
+            try:
+                if time.time() - os.path.getmtime(path) > STALE_LOCK_SEC:
+                    os.unlink(path)
+                    continue
+            except FileNotFoundError:
+                continue
+            if time.monotonic() > give_up:
+                raise TimeoutError(f"Timed out waiting for the in-flight registry lock {path}.")
+            time.sleep(0.01)
+    try:
+        yield
+    finally:
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+
+
+class Registry:
+    """The on-disk table of in-flight requests: one JSON entry per key."""
+
+    def __init__(self, directory=None):
+        self.directory = directory or default_cache_dir()
+        os.makedirs(self.directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:32] + ".json")
+
+    def lock(self, key):
+        return _locked(os.path.join(self.directory, key[:32] + ".lock"))
+
+    def load(self, key):
+        try:
+            with open(self._path(key), "r", encoding="utf-8") as f:
+                entry = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+        if entry.get("key") != key or time.time() - entry.get("updated_at", 0) > ENTRY_TTL_SEC:
+            return None
+        return entry
+
+    def save(self, key, entry):
+        entry["updated_at"] = time.time()
+        path = self._path(key)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(entry, f)
+        os.replace(tmp_path, path)
+
+    def drop(self, key):
+        try:
+            os.unlink(self._path(key))
+        except FileNotFoundError:
+            pass
+
+
+def _live_jobs(entry, get_job):
+    """The entry's job objects, or None if any of them failed or cannot be retrieved."""
+    jobs = []
+    for record in entry["jobs"]:
+        try:
+            job = _JOBS.get(record["job_id"]) or get_job(record["job_id"])
+            if _status(job) in ("ERROR", "CANCELLED"):
+                return None
+        except Exception as e:
+            log_stderr(f"Warning: In-flight job {record['job_id']} is unavailable ({e}); submitting a new job.")
+            return None
+        jobs.append(job)
+    return jobs
+
+
+# --- Coalesced Execution ---
+def acquire(registry, key, backend_name, shots, submit, get_job):
+    """Attaches to the key's in-flight jobs, topping up shots if needed, or submits a new job.
+
+    submit(shots) -> job. Returns (jobs, info); info is the results JSON's "coalesced" entry.
+    """
+    with registry.lock(key):
+        entry = registry.load(key)
+        jobs = _live_jobs(entry, get_job) if entry else None
+        if jobs is None:
+            entry, jobs = {"key": key, "backend": backend_name, "jobs": [], "requesters": 0,
+                           "created_at": time.time()}, []
+        in_flight = sum(record["shots"] for record in entry["jobs"])
+        submitted = []
+        if in_flight < shots:
+            # Submitting under the lock keeps a concurrent identical request from submitting too
+            job = submit(shots - in_flight)
+            _JOBS[job.job_id()] = job
+            entry["jobs"].append({"job_id": job.job_id(), "shots": shots - in_flight})
+            jobs.append(job)
+            submitted.append(job.job_id())
+        entry["requesters"] += 1
+        registry.save(key, entry)
+
+    role = "submitted" if not in_flight else ("topped_up" if submitted else "attached")
+    if role != "submitted":
+        log_stderr(f"Coalesced with {len(entry['jobs']) - len(submitted)} identical in-flight job(s) on "
+                   f"{backend_name} ({in_flight} shots)" + (f"; topped up with {shots - in_flight} shots." if submitted else "."))
+    info = {"key": key[:16], "role": role, "job_ids": [record["job_id"] for record in entry["jobs"]],
+            "submitted_job_ids": submitted, "submitted_shots": shots - in_flight if submitted else 0,
+            "requested_shots": shots,
+            "shots": sum(record["shots"] for record in entry["jobs"]), "requesters": entry["requesters"]}
+    return jobs, info
+
+
+def sole_requester(registry, key):
+    """True if no other requester is waiting for the key's jobs (so they may be cancelled)."""
+    entry = registry.load(key)
+    return entry is None or entry.get("requesters", 0) <= 1
+
+
+def release(registry, key, jobs):
+    """Drops this requester from the entry. The entry itself goes once all of its jobs are final;
+       a job still running stays attachable even if nobody waits for it any more."""
+    with registry.lock(key):
+        entry = registry.load(key)
+        if entry is None:
+            return
+        entry["requesters"] = max(0, entry["requesters"] - 1)
+        held = {job.job_id() for job in jobs}
+        try:
+            finished = (held >= {record["job_id"] for record in entry["jobs"]}
+                        and all(_status(job) in FINAL_STATES for job in jobs))
+        except Exception:
+            finished = False
+        if finished:
+            registry.drop(key)
+            for job_id in held:
+                _JOBS.pop(job_id, None)
+        else:
+            registry.save(key, entry)
+
+
+def run(qc, backend, shots, timer, submit_circuit, collect_job, get_job=None, account="default", directory=None,
+        options=None):
+    """The scripts' run_circuit, coalesced with identical in-flight requests.
+
+    submit_circuit(qc, backend, shots, timer) -> job and collect_job(job, qc, timer, cancel) ->
+    (job_id, (outcomes, frequencies), qpu_time) are the scripts' own. Returns (first job_id,
+    (outcomes, frequencies), qpu_time_sec, info); the counts and QPU time cover every shared job.
+    """
+    registry = Registry(directory)
+    key = job_key(qc, backend, account, options)
+    jobs, info = acquire(registry, key, backend.name, shots,
+                         lambda n: submit_circuit(qc, backend, n, timer), get_job or (lambda job_id: None))
+    try:
+        may_cancel = lambda: sole_requester(registry, key)
+        collected = [collect_job(job, qc, timer, may_cancel) for job in jobs]
+    finally:
+        release(registry, key, jobs)
+    if len(collected) == 1:
+        job_id, counts, qpu_time = collected[0]
+        return job_id, counts, qpu_time, info
+    accumulator = result_io.CountsAccumulator(qc.num_clbits)
+    qpu_times = []
+    for _, (outcomes, frequencies), qpu_time in collected:
+        accumulator.add(outcomes, frequencies)
+        if qpu_time is not None:
+            qpu_times.append(qpu_time)
+    return collected[0][0], accumulator.arrays(), (sum(qpu_times) if qpu_times else None), info
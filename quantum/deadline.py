@@ -0,0 +1,206 @@
+# deadline.py
+#
+# Run budgets (`--deadline`) and cooperative cancellation. The budget is
+# checked by the PhaseTimer whenever a phase starts, and the expensive phases
+# degrade instead of overrunning:
+#
+#   - transpile: the preferred optimization level may use part of the
+#     remaining budget (aborted through the pass manager callback), then the
+#     circuit is transpiled again at level 1
+#   - simulation: a pilot job sizes how many shots fit (chunked_run.py)
+#   - job waits: jobs are cancelled through the provider API when the budget
+#     runs out, or when the run is interrupted while waiting
+#
+# SIGTERM / SIGINT raise RunInterrupted in the main thread, so the scripts'
+# finally blocks still write a partial results JSON. Both exceptions derive
+# from BaseException (like KeyboardInterrupt) so the scripts' broad
+# `except Exception` fallbacks do not swallow them.
+
+import signal
+import sys
+import threading
+import time
+
+import run_context
+
+# Once counts exist, finishing the analysis is cheaper than losing them.
+UNCHECKED_PHASES = ("plot", "post_process", "write")
+# Share of the remaining budget the preferred optimization level may spend.
+TRANSPILE_SHARE = 0.5
+FALLBACK_OPTIMIZATION_LEVEL = 1
+MIN_POLL_SEC = 0.05
+MAX_POLL_SEC = 5.0
+SIGNALS = ("SIGTERM", "SIGINT")
+
+
+# --- Helper Functions (Logging to stderr) ---
+def log_stderr(*args, **kwargs):
+    """Prints messages to stderr."""
+    print(*args, file=sys.stderr, **kwargs)
+
+
+class DeadlineExceeded(BaseException):
+    """The run's --deadline budget ran out."""
+
+    reason = "deadline"
+
+    def __init__(self, message, phase=None):
+        super().__init__(message)
+        self.phase = phase
+
+
+class RunInterrupted(BaseException):
+    """SIGTERM / SIGINT received while the run was in progress."""
+
+    def __init__(self, signal_name):
+        super().__init__(f"Interrupted by {signal_name}")
+        self.reason = signal_name
+        self.phase = None
+
+
+class _LevelBudgetExceeded(BaseException): # Must get past optimize_circuit's fallback handler
+    pass
+
+
+# --- Budget ---
+class Deadline:
+    """Wall-clock budget in seconds, measured by `clock` (seconds since the run's origin)."""
+
+    def __init__(self, budget_sec, clock):
+        self.budget_sec = float(budget_sec)
+        self.clock = clock
+        self.degraded = [] # What was cut to stay within the budget
+
+    def remaining(self):
+        return self.budget_sec - self.clock()
+
+    def expired(self):
+        return self.remaining() <= 0
+
+    def check(self, phase):
+        if phase not in UNCHECKED_PHASES and self.expired():
+            raise DeadlineExceeded(f"Deadline of {self.budget_sec:g}s reached before the {phase} phase.", phase=phase)
+
+    def degrade(self, phase, **details):
+        entry = dict(phase=phase, at_sec=round(self.clock(), 3), **details)
+        self.degraded.append(entry)
+        log_stderr(f"Deadline: degraded {phase} ({', '.join(f'{k}={v}' for k, v in details.items())}).")
+
+    def report(self):
+        return {"budget_sec": self.budget_sec, "remaining_sec": round(self.remaining(), 3), "degraded": self.degraded}
+
+
+def transpile(qc, backend, optimize_fn, seed, budget, optimization_level):
+    """run_context.transpile under a budget: the preferred level is aborted after TRANSPILE_SHARE
+       of the remaining time and the circuit is transpiled again at the fallback level."""
+    if budget is None:
+        return run_context.transpile(qc, backend, optimize_fn, seed)
+    levels = [optimization_level]
+    if optimization_level > FALLBACK_OPTIMIZATION_LEVEL:
+        levels.append(FALLBACK_OPTIMIZATION_LEVEL)
+    for level in levels:
+        final = level == levels[-1]
+        allowance = max(0.0, budget.remaining()) * (1.0 if final else TRANSPILE_SHARE)
+        stop_at = time.perf_counter() + allowance
+
+        def callback(**kwargs):
+            if time.perf_counter() > stop_at:
+                if final:
+                    raise DeadlineExceeded(f"Deadline of {budget.budget_sec:g}s reached while transpiling.", phase="transpile")
+                raise _LevelBudgetExceeded()
+
+        try:
+            # The preferred level keeps the plain cache key, shared with runs without a deadline
+            return run_context.transpile(qc, backend, optimize_fn, seed,
+                                         optimization_level=None if level == optimization_level else level,
+                                         callback=callback)
+        except _LevelBudgetExceeded:
+            budget.degrade("transpile", optimization_level=levels[levels.index(level) + 1], from_level=level,
+                           after_sec=round(allowance, 3))
+
+
+# --- Jobs ---
+def _cancel(job):
+    try:
+        job.cancel()
+        log_stderr(f"Cancelled job {job.job_id()}.")
+    except Exception as e:
+        log_stderr(f"Warning: Could not cancel job: {e}")
+
+
+def wait_for_result(job, budget=None, cancel=None):
+    """job.result(), polling against the budget. The job is cancelled if the budget runs out or
+       the run is interrupted, unless the `cancel` predicate says otherwise (a job shared with
+       other requesters, see coalesce.py). Other failures leave the job alone: submission.collect
+       polls it again, or cancels it once the wait is given up."""
+    try:
+        if budget is not None:
+            interval = MIN_POLL_SEC
+            while not job.done():
+                if budget.expired():
+                    raise DeadlineExceeded(f"Deadline of {budget.budget_sec:g}s reached waiting for job {job.job_id()}.",
+                                           phase="execute")
+                time.sleep(max(0.0, min(interval, budget.remaining())))
+                interval = min(interval * 1.5, MAX_POLL_SEC)
+        return job.result()
+    except (DeadlineExceeded, RunInterrupted, KeyboardInterrupt):
+        if cancel is None or cancel():
+            _cancel(job)
+        raise
+
+
+# --- Signals ---
+class SignalGuard:
+    """Turns the first SIGTERM / SIGINT into RunInterrupted while armed. Once disarmed (the
+       results are being written) signals are only recorded, so the JSON is never cut short."""
+
+    def __init__(self):
+        self.received = None
+        self.armed = False
+        self._previous = {}
+
+    def install(self):
+        if threading.current_thread() is not threading.main_thread():
+            return self # Signal handlers can only be set from the main thread
+        for name in SIGNALS:
+            signum = getattr(signal, name, None)
+            if signum is not None:
+                self._previous[signum] = signal.signal(signum, self._handle)
+        self.armed = True
+        return self
+
+    def _handle(self, signum, frame):
+        name = signal.Signals(signum).name
+        first = self.received is None
+        self.received = self.received or name
+        if self.armed and first:
+            self.armed = False
+            raise RunInterrupted(name)
+        log_stderr(f"{name} received while writing results; finishing the write first.")
+
+    def disarm(self):
+        self.armed = False
+
+    def restore(self):
+        for signum, handler in self._previous.items():
+            signal.signal(signum, handler)
+        self._previous = {}
+
+
+def partial_report(timer, error):
+    """Where a stopped run got to, for the partial results JSON."""
+    stopped_in = error.phase or timer.failed_phase
+    return {
+        "reason": error.reason,
+        "stopped_in_phase": stopped_in,
+        "phases_completed": [p for p in timer.summary() if p != stopped_in],
+    }
+
+
+def exit_code(results):
+    """128 + signal number for interrupted runs (shell convention), else None."""
+    partial = results.get("partial") or {}
+    signal_name = partial.get("reason")
+    if results.get("status") == "interrupted" and signal_name in SIGNALS:
+        return 128 + getattr(signal, signal_name)
+    return None
@@ -0,0 +1,103 @@
+# exact_distribution.py
+#
+# Exact measurement distributions for simulator runs (`--exact`). Sampling
+# --shots from AerSimulator draws from a distribution the simulator already
+# holds exactly; here the final measurements are replaced by a
+# save_probabilities instruction on the measured qubits (in classical bit
+# order), so one simulation returns that distribution whatever the shot
+# count. The scripts decide success and run Shor's post-processing on it, and
+# only sample shots from it for the plot and counts outputs, so the outcome of
+# an --exact run does not depend on the seed.
+#
+# Probabilities are rounded to ROUND_DIGITS, so round-off never breaks a tie
+# between equally likely outcomes (ties go to the smallest outcome, as with
+# counts).
+
+import sys
+
+import numpy as np
+from qiskit_aer.library import SaveProbabilities
+
+import result_io
+
+DEFAULT_TOP_K = 1024
+ROUND_DIGITS = 12 # Simulation round-off is ~1e-15; coarser than that, finer than any real difference
+
+
+# --- Helper Functions (Logging to stderr) ---
+def log_stderr(*args, **kwargs):
+    """Prints messages to stderr."""
+    print(*args, file=sys.stderr, **kwargs)
+
+
+# --- Circuits ---
+def probability_circuit(qc):
+    """`qc` with its measurements replaced by one save_probabilities over the measured qubits,
+       qubit i measured into classical bit i. Measurements must be final."""
+    measured = {}
+    circuit = qc.copy_empty_like()
+    for instruction in qc.data:
+        if instruction.operation.name == "measure":
+            measured[qc.find_bit(instruction.clbits[0]).index] = instruction.qubits[0]
+        elif measured and any(q in measured.values() for q in instruction.qubits) and instruction.operation.name != "barrier":
+            raise ValueError(f"--exact needs final measurements; {instruction.operation.name} follows a measurement.")
+        else:
+            circuit.append(instruction)
+    if sorted(measured) != list(range(qc.num_clbits)):
+        raise ValueError(f"--exact needs every classical bit measured ({len(measured)} of {qc.num_clbits} are).")
+    qubits = [measured[i] for i in range(qc.num_clbits)]
+    circuit.append(SaveProbabilities(len(qubits), label="probabilities"), qubits)
+    return circuit
+
+
+# --- Execution ---
+def run(qc, backend):
+    """One simulation of the transpiled circuit `qc` on an AerSimulator. Returns (outcomes,
+       probabilities): the outcomes with non-zero probability, in ascending order."""
+    log_stderr(f"\nComputing the exact distribution of {qc.num_clbits} measured qubit(s) on {backend.name}...")
+    result = backend.run(probability_circuit(qc), shots=1).result()
+    if not result.success:
+        raise RuntimeError(f"Exact simulation failed: {result.status}")
+    probabilities = np.round(np.asarray(result.data(0)["probabilities"], dtype=np.float64), ROUND_DIGITS)
+    outcomes = np.flatnonzero(probabilities)
+    log_stderr(f"Exact distribution has {len(outcomes)} outcome(s) with non-zero probability.")
+    return outcomes.astype(np.int64), probabilities[outcomes]
+
+
+def top(outcomes, probabilities):
+    """Most probable outcome (ties go to the smallest). Returns (outcome, probability)."""
+    if len(probabilities) == 0:
+        return None, None
+    idx = int(np.argmax(probabilities))
+    return int(outcomes[idx]), float(probabilities[idx])
+
+
+def sample(outcomes, probabilities, shots, seed=None):
+    """`shots` samples from the distribution as (outcomes, frequencies), like run_circuit's counts."""
+    frequencies = np.random.default_rng(seed).multinomial(shots, probabilities / probabilities.sum())
+    keep = frequencies > 0
+    return outcomes[keep], frequencies[keep].astype(np.int64)
+
+
+def report(outcomes, probabilities, num_bits, top_k=DEFAULT_TOP_K, threshold=0.0, sampled_shots=None):
+    """The results JSON's "exact" entry: the distribution as a sparse {bit-string: probability} dict
+       of the top_k outcomes with probability >= threshold, or the full 2^num_bits vector when top_k
+       is 0."""
+    top_outcome, top_probability = top(outcomes, probabilities)
+    info = {
+        "support": int(len(outcomes)),
+        "top_state": None if top_outcome is None else result_io.outcome_to_bitstring(top_outcome, num_bits),
+        "top_probability": top_probability,
+        "sampled_shots": sampled_shots, # Only the plot / counts outputs use these
+    }
+    if top_k == 0:
+        vector = np.zeros(1 << num_bits)
+        vector[outcomes] = probabilities
+        info["probabilities"] = vector.tolist() # Index = outcome integer (qubit 0 is bit 0)
+        return info
+    keep = np.flatnonzero(probabilities >= threshold)
+    keep = keep[np.argsort(-probabilities[keep], kind="stable")[:top_k]]
+    info["distribution"] = {result_io.outcome_to_bitstring(int(outcomes[i]), num_bits): float(probabilities[i])
+                            for i in keep}
+    info["truncated"] = len(keep) < len(outcomes)
+    return info
@@ -0,0 +1,294 @@
+# fleet_survey.py
+#
+# Fleet-wide calibration survey. Every hardware backend's target (calibration
+# data) and status are fetched concurrently with a thread pool and reduced to
+# a few sorted arrays per backend: readout errors per qubit, two-qubit gate
+# errors per edge, the median single-qubit gate error and T1/T2 medians. The
+# snapshot is cached next to backend_registry's backend list, so a later run's
+# backend choice is a local lookup ranked by expected fidelity for its circuit
+# size and by queue length. Only the top STATUS_CHECK_TOP operational
+# candidates get a status() call, to re-rank them on their current queue and
+# skip any that have gone offline since the survey.
+#
+#   python fleet_survey.py survey --api_token TOKEN
+#   python fleet_survey.py survey --fake      # recorded calibrations of qiskit-ibm-runtime's fake backends
+#   python fleet_survey.py rank --fake --num_qubits 5 --two_qubit_gates 40
+
+import argparse
+import concurrent.futures
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+import backend_registry
+import result_io
+
+SURVEY_VERSION = 1
+DEFAULT_WORKERS = 8
+ONE_QUBIT_GATES = ("sx", "x")
+TWO_QUBIT_GATES = ("ecr", "cz", "cx")
+# Gate counts assumed per circuit qubit when the caller does not know them yet
+# (backend selection runs before the circuit is transpiled)
+DEFAULT_TWO_QUBIT_GATES_PER_QUBIT = 10
+DEFAULT_ONE_QUBIT_GATES_PER_QUBIT = 20
+# Score = ln(expected fidelity) - QUEUE_WEIGHT * ln(1 + pending jobs): a backend
+# with e times the queue needs ~5% higher expected fidelity to rank equal
+DEFAULT_QUEUE_WEIGHT = 0.05
+# Top-ranked candidates whose current status is checked before one is chosen
+STATUS_CHECK_TOP = 3
+
+
+# --- Helper Functions (Logging to stderr) ---
+def log_stderr(*args, **kwargs):
+    """Prints messages to stderr."""
+    print(*args, file=sys.stderr, **kwargs)
+
+
+def snapshot_path(account, cache_dir=None):
+    return os.path.join(cache_dir or backend_registry.default_cache_dir(), f"{account}.survey.json")
+
+
+def _sorted_finite(values):
+    values = np.asarray(values, dtype=np.float64)
+    return np.sort(values[np.isfinite(values)])
+
+
+def _median(values):
+    return float(np.median(values)) if len(values) else None
+
+
+# --- Survey ---
+def summarize_target(target, num_qubits):
+    """Reduces a backend target to sorted error arrays and medians (errors as probabilities,
+       T1/T2 in microseconds)."""
+    readout = np.full(num_qubits, np.nan)
+    if "measure" in target.operation_names:
+        for qargs, props in target["measure"].items():
+            if qargs and props is not None and props.error is not None:
+                readout[qargs[0]] = props.error
+    one_qubit, two_qubit = [], []
+    for name in target.operation_names:
+        if name in ONE_QUBIT_GATES or name in TWO_QUBIT_GATES:
+            errors = [props.error for qargs, props in target[name].items()
+                      if qargs and props is not None and props.error is not None]
+            (one_qubit if name in ONE_QUBIT_GATES else two_qubit).extend(errors)
+    t1 = np.array([p.t1 for p in (target.qubit_properties or []) if p is not None and p.t1 is not None]) * 1e6
+    t2 = np.array([p.t2 for p in (target.qubit_properties or []) if p is not None and p.t2 is not None]) * 1e6
+    return {
+        "readout_errors": _sorted_finite(readout).tolist(),
+        "two_qubit_errors": _sorted_finite(two_qubit).tolist(),
+        "one_qubit_error": _median(_sorted_finite(one_qubit)),
+        "t1_us": _median(t1),
+        "t2_us": _median(t2),
+    }
+
+
+def _survey_backend(backend):
+    """One backend's status and calibration summary; runs in a worker thread."""
+    operational, pending_jobs, status_msg = backend_registry._status(backend)
+    entry = {"name": backend.name, "num_qubits": backend.num_qubits, "operational": operational,
+             "pending_jobs": pending_jobs, "status_msg": status_msg}
+    entry.update(summarize_target(backend.target, backend.num_qubits))
+    return entry
+
+
+def survey(service, account="default", cache_dir=None, workers=DEFAULT_WORKERS):
+    """Surveys every hardware backend concurrently and writes the snapshot (and backend_registry's
+       backend list, which it supersedes). Returns the snapshot."""
+    start = time.perf_counter()
+    backends = list(service.backends(simulator=False))
+    now = time.time()
+    entries, failed = [], {}
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        futures = {pool.submit(_survey_backend, backend): backend for backend in backends}
+        for future in concurrent.futures.as_completed(futures):
+            backend = futures[future]
+            try:
+                entries.append(future.result())
+            except Exception as e:
+                log_stderr(f"Warning: Could not survey backend {backend.name}: {e}")
+                failed[backend.name] = str(e)
+    entries.sort(key=lambda entry: entry["name"])
+    for backend in backends:
+        backend_registry._BACKENDS[(account, backend.name)] = (service, backend, now)
+
+    snapshot = {"version": SURVEY_VERSION, "fetched_at": now, "survey_sec": round(time.perf_counter() - start, 3),
+                "backends": entries, "failed": failed}
+    listing = {"version": backend_registry.REGISTRY_VERSION, "fetched_at": now,
+               "backends": [{k: entry[k] for k in ("name", "num_qubits", "operational", "pending_jobs", "status_msg")}
+                            for entry in entries]}
+    try:
+        path = snapshot_path(account, cache_dir)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        result_io.write_json_atomic(path, snapshot)
+        backend_registry.write_listing(listing, account, cache_dir)
+    except Exception as e:
+        log_stderr(f"Warning: Could not write survey snapshot: {e}")
+    return snapshot
+
+
+def load_snapshot(account="default", cache_dir=None, ttl=None, path=None):
+    """The cached snapshot, or None if missing, unreadable or older than ttl seconds."""
+    try:
+        with open(path or snapshot_path(account, cache_dir), "r") as f:
+            snapshot = json.load(f)
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        log_stderr(f"Warning: Ignoring unreadable survey snapshot: {e}")
+        return None
+    if snapshot.get("version") != SURVEY_VERSION:
+        return None
+    if ttl is not None and time.time() - snapshot["fetched_at"] > ttl:
+        return None
+    return snapshot
+
+
+# --- Ranking ---
+def _best_k_mean(arrays, k):
+    """Mean of the k smallest entries of each sorted array (fewer if shorter; NaN if empty)."""
+    width = max([k] + [len(a) for a in arrays])
+    padded = np.full((len(arrays), width), np.nan)
+    for row, values in enumerate(arrays):
+        padded[row, :len(values)] = values
+    best = padded[:, :k]
+    counts = np.isfinite(best).sum(axis=1)
+    with np.errstate(invalid="ignore"):
+        return np.where(counts > 0, np.nansum(best, axis=1) / np.maximum(counts, 1), np.nan)
+
+
+def rank(snapshot, num_qubits, two_qubit_gates=None, one_qubit_gates=None, queue_weight=DEFAULT_QUEUE_WEIGHT):
+    """Ranks the snapshot's operational backends with num_qubits+ qubits, best first.
+
+    Expected fidelity assumes the layout lands on the num_qubits best-measured qubits
+    and the num_qubits best edges: (1 - readout)^n * (1 - e2)^g2 * (1 - e1)^g1, with the
+    mean error over those qubits / edges and the median single-qubit gate error.
+    Backends without calibration data rank last.
+    """
+    entries = [e for e in snapshot["backends"] if e["operational"] and e["num_qubits"] >= num_qubits]
+    if not entries:
+        return []
+    g2 = DEFAULT_TWO_QUBIT_GATES_PER_QUBIT * num_qubits if two_qubit_gates is None else two_qubit_gates
+    g1 = DEFAULT_ONE_QUBIT_GATES_PER_QUBIT * num_qubits if one_qubit_gates is None else one_qubit_gates
+
+    readout = _best_k_mean([e["readout_errors"] for e in entries], num_qubits)
+    two_qubit = _best_k_mean([e["two_qubit_errors"] for e in entries], max(1, num_qubits))
+    one_qubit = np.array([np.nan if e["one_qubit_error"] is None else e["one_qubit_error"] for e in entries])
+    pending = np.array([e["pending_jobs"] for e in entries], dtype=np.float64)
+
+    # Missing data counts as error-free in the product; flagged below so it cannot win on that
+    def log_success(errors, count):
+        return count * np.log1p(-np.clip(np.nan_to_num(errors, nan=0.0), 0.0, 1.0 - 1e-12))
+    log_fidelity = (log_success(readout, num_qubits) + log_success(two_qubit, g2) + log_success(one_qubit, g1))
+    calibrated = np.isfinite(readout) & np.isfinite(two_qubit)
+    score = np.where(calibrated, log_fidelity - queue_weight * np.log1p(pending), -np.inf)
+
+    ranking = []
+    for i in np.argsort(-score, kind="stable"):
+        ranking.append({
+            "name": entries[i]["name"],
+            "expected_fidelity": round(float(np.exp(log_fidelity[i])), 6) if calibrated[i] else None,
+            "pending_jobs": int(pending[i]),
+            "score": round(float(score[i]), 6) if calibrated[i] else None,
+        })
+    return ranking
+
+
+def select_backend(service, snapshot, min_num_qubits, account="default", ttl=backend_registry.DEFAULT_TTL_SEC,
+                   two_qubit_gates=None, one_qubit_gates=None, exclude=()):
+    """backend_registry.select_backend from a survey snapshot. The snapshot's queue lengths and
+       operational flags may be up to ttl old, so the first STATUS_CHECK_TOP ranked candidates that
+       are currently operational are re-scored on their current queue. Returns (backend, info)."""
+    ranking = [choice for choice in rank(snapshot, min_num_qubits, two_qubit_gates, one_qubit_gates)
+               if choice["name"] not in exclude]
+    if not ranking:
+        raise backend_registry.NoCandidateBackends(f"No surveyed backend has {min_num_qubits}+ qubits and is operational "
+                           f"(survey from {time.time() - snapshot['fetched_at']:.0f}s ago).")
+    checked = [] # (position, choice, backend, current pending jobs)
+    for position, choice in enumerate(ranking):
+        if len(checked) >= STATUS_CHECK_TOP:
+            break
+        try:
+            backend = backend_registry.get_backend(service, choice["name"], account, ttl)
+            operational, pending_jobs, status_msg = backend_registry._status(backend)
+        except Exception as e:
+            log_stderr(f"Warning: Skipping backend {choice['name']}: {e}")
+            continue
+        if not operational:
+            log_stderr(f"Warning: Skipping backend {choice['name']}: no longer operational ({status_msg}).")
+            continue
+        checked.append((position, choice, backend, pending_jobs))
+    if not checked:
+        raise backend_registry.NoCandidateBackends(f"None of the {len(ranking)} surveyed backend(s) is currently operational.")
+
+    def current_score(item):
+        position, choice, _, pending_jobs = item
+        if choice["expected_fidelity"] is None: # Uncalibrated: keep ranking last, in survey order
+            return (0, 0.0, -position)
+        return (1, np.log(choice["expected_fidelity"]) - DEFAULT_QUEUE_WEIGHT * np.log1p(pending_jobs), -position)
+    position, choice, backend, pending_jobs = max(checked, key=current_score)
+    runner_up = [item[1]["name"] for item in sorted(checked, key=current_score, reverse=True)[1:2]]
+    return backend, {"pinned": False, "ranked_by": "survey", "pending_jobs": pending_jobs,
+                     "expected_fidelity": choice["expected_fidelity"], "candidates": len(ranking),
+                     "status_checked": len(checked), "rank_skipped": position,
+                     "survey_age_sec": round(time.time() - snapshot["fetched_at"], 1),
+                     "runner_up": runner_up[0] if runner_up else None}
+
+
+# --- Command Line ---
+def _service(args, parser):
+    if args.fake:
+        from qiskit_ibm_runtime.fake_provider import FakeProviderForBackendV2
+        return FakeProviderForBackendV2(), "fake"
+    if args.local:
+        return backend_registry.LocalService(), "local"
+    if not args.api_token:
+        parser.error("--api_token is required unless --local or --fake is given.")
+    from qiskit_ibm_runtime import QiskitRuntimeService
+    return (QiskitRuntimeService(channel="ibm_quantum", token=args.api_token),
+            backend_registry.account_key(args.api_token))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Survey calibration data across all backends and rank them for a circuit size.")
+    parser.add_argument('command', choices=['survey', 'rank'], help='"survey" fetches every backend now; "rank" ranks the cached snapshot')
+    parser.add_argument('--api_token', type=str, default=None, help='IBM Quantum API token')
+    parser.add_argument('--local', action='store_true', help='Use the offline LocalService stand-in instead of IBM Quantum')
+    parser.add_argument('--fake', action='store_true', help="Use qiskit-ibm-runtime's fake backends (recorded calibration data)")
+    parser.add_argument('--cache_dir', type=str, default=None, help='Backend cache directory (default: shared temp cache)')
+    parser.add_argument('--snapshot', type=str, default=None, help='With rank: read this snapshot file instead of the cache')
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS, help=f'Concurrent backend fetches (default: {DEFAULT_WORKERS})')
+    parser.add_argument('--num_qubits', type=int, default=5, help='With rank: circuit width (default: 5)')
+    parser.add_argument('--two_qubit_gates', type=int, default=None, help=f'With rank: two-qubit gate count (default: {DEFAULT_TWO_QUBIT_GATES_PER_QUBIT} per qubit)')
+    parser.add_argument('--one_qubit_gates', type=int, default=None, help=f'With rank: single-qubit gate count (default: {DEFAULT_ONE_QUBIT_GATES_PER_QUBIT} per qubit)')
+    parser.add_argument('--queue_weight', type=float, default=DEFAULT_QUEUE_WEIGHT, help=f'With rank: score penalty per ln(1 + pending jobs) (default: {DEFAULT_QUEUE_WEIGHT})')
+    args = parser.parse_args(argv)
+
+    if args.command == 'survey':
+        service, account = _service(args, parser)
+        snapshot = survey(service, account, args.cache_dir, args.workers)
+        log_stderr(f"Surveyed {len(snapshot['backends'])} backend(s) in {snapshot['survey_sec']}s "
+                   f"({len(snapshot['failed'])} failed); snapshot: {snapshot_path(account, args.cache_dir)}")
+        print(json.dumps({k: snapshot[k] for k in ("fetched_at", "survey_sec", "failed")}, indent=2))
+        return 0
+
+    if args.snapshot:
+        snapshot = load_snapshot(path=args.snapshot)
+    else:
+        account = "fake" if args.fake else "local" if args.local else backend_registry.account_key(args.api_token)
+        snapshot = load_snapshot(account, args.cache_dir)
+    if snapshot is None:
+        log_stderr("No survey snapshot found; run the survey command first.")
+        return 1
+    ranking = rank(snapshot, args.num_qubits, args.two_qubit_gates, args.one_qubit_gates, args.queue_weight)
+    log_stderr(f"{len(ranking)} candidate(s) for {args.num_qubits} qubits, survey from "
+               f"{time.time() - snapshot['fetched_at']:.0f}s ago.")
+    print(json.dumps(ranking, indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,27 +1,54 @@
 # grover_search.py
 
+import time
+_IMPORT_START = time.perf_counter() # Start of the "import" phase (qiskit imports dominate it)
 import math
 import numpy as np
-from qiskit import QuantumCircuit, transpile
+from qiskit import QuantumCircuit, ClassicalRegister, transpile
 from qiskit.circuit.library import GroverOperator, MCMT, ZGate
-from qiskit.visualization import plot_histogram
 from qiskit_ibm_runtime import QiskitRuntimeService, SamplerV2 as Sampler
 from qiskit.transpiler.preset_passmanagers import generate_preset_pass_manager
-import matplotlib.pyplot as plt
 from qiskit_aer import AerSimulator # Import AerSimulator directly
 
 # For Command Line Args, JSON output, Time, Exit codes
 import argparse
-import json
-import time
 import sys
 import traceback # For detailed error logging
 
+import cnf_oracle
+import result_io
+import telemetry
+import profiling
+import run_context
+import result_cache
+import chunked_run
+import results_store
+import resource_estimate
+import backend_registry
+import readout_mitigation
+import deadline
+import sim_compile
+import submission
+import exact_distribution
+import coalesce
+import qpu_budget
+import worker_metrics
+import plot_render
+_IMPORT_END = time.perf_counter()
+
+# Optimization level 3 is standard for Grover; --deadline may fall back to a cheaper level
+OPTIMIZATION_LEVEL = 3
+
 # --- Helper Functions (Logging to stderr) ---
 def log_stderr(*args, **kwargs):
     """Prints messages to stderr."""
     print(*args, file=sys.stderr, **kwargs)
 
+def log_debug(*args, **kwargs):
+    """Prints verbose per-qubit / per-gate messages to stderr (only with --log_level debug)."""
+    if telemetry.debug_enabled():
+        print(*args, file=sys.stderr, **kwargs)
+
 # --- Oracle Construction ---
 # Maps a list of marked bit-strings to a quantum oracle.
 def grover_oracle(marked_states, num_qubits):
@@ -53,6 +80,44 @@ def grover_oracle(marked_states, num_qubits):
 
 
 # --- Grover Circuit Assembly ---
+def optimal_grover_iterations(num_marked, n):
+    """Optimal number of Grover iterations for num_marked solutions among 2^n states."""
+    # Handle case where num_marked is 0 or >= 2^n (though input validation should prevent this)
+    if num_marked == 0:
+         return 0
+    elif num_marked >= 2**n:
+         return 0 # Or handle as error, search is trivial
+    return math.floor(math.pi / (4 * math.asin(math.sqrt(num_marked / 2**n))))
+
+
+def assemble_grover_circuit(oracle, n, iterations):
+    """Superposition + `iterations` Grover operators + measurement of the n search qubits.
+       Any extra oracle qubits (ancillas) are left unmeasured."""
+    if oracle.num_qubits > n:
+        grover_op = GroverOperator(oracle, reflection_qubits=list(range(n)))
+    else:
+        grover_op = GroverOperator(oracle)
+
+    qc = QuantumCircuit(oracle.num_qubits, name="GroverSearch")
+    # 1. Create superposition
+    qc.h(range(n))
+    qc.barrier()
+
+    # 2. Apply Grover operator iteratively
+    if iterations > 0:
+        qc.compose(grover_op.power(iterations), inplace=True)
+
+    # 3. Measure the search qubits
+    if oracle.num_qubits > n:
+        meas = ClassicalRegister(n, name="meas") # Same register name as measure_all()
+        qc.add_register(meas)
+        qc.barrier()
+        qc.measure(range(n), meas)
+    else:
+        qc.measure_all() # Adds classical register named 'meas' by default
+    return qc
+
+
 # Builds the complete circuit with optimal iterations.
 def build_grover_circuit(marked_states):
     log_stderr("Building Grover Circuit...")
@@ -63,34 +128,36 @@ def build_grover_circuit(marked_states):
     log_stderr(f"  Number of qubits (n): {num_qubits}")
 
     oracle = grover_oracle(marked_states, num_qubits)
-    grover_op = GroverOperator(oracle)
 
     # Compute the optimal number of iterations:
-    num_marked = len(marked_states)
-    n = num_qubits
-    # Handle case where num_marked is 0 or >= 2^n (though input validation should prevent this)
-    if num_marked == 0:
-         optimal_iterations = 0
-    elif num_marked >= 2**n:
-         optimal_iterations = 0 # Or handle as error, search is trivial
-    else:
-         optimal_iterations = math.floor(math.pi / (4 * math.asin(math.sqrt(num_marked / 2**n))))
+    optimal_iterations = optimal_grover_iterations(len(marked_states), num_qubits)
     log_stderr(f"  Optimal number of Grover iterations: {optimal_iterations}")
 
-    # Assemble the circuit
-    qc = QuantumCircuit(n, name="GroverSearch")
-    # 1. Create superposition
-    qc.h(range(n))
-    qc.barrier()
+    qc = assemble_grover_circuit(oracle, num_qubits, optimal_iterations)
+    log_stderr("Grover circuit construction complete.")
+    return qc, num_qubits
 
-    # 2. Apply Grover operator iteratively
-    if optimal_iterations > 0:
-        qc.compose(grover_op.power(optimal_iterations), inplace=True)
 
-    # 3. Measure all qubits
-    qc.measure_all() # Adds classical register named 'meas' by default
+# Builds the circuit for a compiled predicate oracle (CNF / Boolean expression).
+def build_grover_circuit_from_oracle(oracle, num_vars, iterations):
+    log_stderr("Building Grover Circuit from compiled oracle...")
+    log_stderr(f"  Search qubits: {num_vars}, ancillas: {oracle.num_qubits - num_vars}, iterations: {iterations}")
+    qc = assemble_grover_circuit(oracle, num_vars, iterations)
     log_stderr("Grover circuit construction complete.")
-    return qc, num_qubits
+    return qc, num_vars
+
+
+def load_oracle_source(args):
+    """Parses --oracle_cnf / --oracle_expr. Returns (source, num_vars, formula, variable_names)."""
+    if args.oracle_cnf:
+        log_stderr(f"Loading DIMACS CNF oracle from {args.oracle_cnf}")
+        num_vars, clauses = cnf_oracle.load_dimacs(args.oracle_cnf)
+        formula = cnf_oracle.cnf_to_formula(clauses)
+        names = [str(i + 1) for i in range(num_vars)]
+        return "cnf", num_vars, formula, names
+    log_stderr(f"Parsing Boolean expression oracle: {args.oracle_expr}")
+    names, formula = cnf_oracle.parse_boolean_expression(args.oracle_expr)
+    return "expression", len(names), formula, names
 
 
 # --- Get Backend Noise Properties ---
@@ -134,19 +201,19 @@ def get_backend_noise_metrics(backend):
                     if hasattr(props, 't1'):
                         t1 = props.t1(qubit)
                         t1_values.append(t1 * 1e6)  # Convert to microseconds
-                        log_stderr(f"T1 for qubit {qubit}: {t1 * 1e6:.2f} μs")
+                        log_debug(f"T1 for qubit {qubit}: {t1 * 1e6:.2f} μs")
                     
                     if hasattr(props, 't2'):
                         t2 = props.t2(qubit)
                         t2_values.append(t2 * 1e6)  # Convert to microseconds
-                        log_stderr(f"T2 for qubit {qubit}: {t2 * 1e6:.2f} μs")
+                        log_debug(f"T2 for qubit {qubit}: {t2 * 1e6:.2f} μs")
                     
                     if hasattr(props, 'readout_error'):
                         re = props.readout_error(qubit)
                         readout_errors.append(re)
-                        log_stderr(f"Readout error for qubit {qubit}: {re * 100:.4f}%")
+                        log_debug(f"Readout error for qubit {qubit}: {re * 100:.4f}%")
                 except Exception as e:
-                    log_stderr(f"Error accessing direct properties for qubit {qubit}: {e}")
+                    log_debug(f"Error accessing direct properties for qubit {qubit}: {e}")
             
             # Set metrics if we found values
             if t1_values:
@@ -172,7 +239,7 @@ def get_backend_noise_metrics(backend):
                         measure_props = backend.target["measure"][(qubit,)]
                         if hasattr(measure_props, 'error'):
                             readout_errors.append(measure_props.error)
-                            log_stderr(f"Readout error from target for qubit {qubit}: {measure_props.error * 100:.4f}%")
+                            log_debug(f"Readout error from target for qubit {qubit}: {measure_props.error * 100:.4f}%")
                 
                 if readout_errors:
                     metrics["readout_error"] = sum(readout_errors) / len(readout_errors) * 100  # Convert to percentage
@@ -194,12 +261,12 @@ def get_backend_noise_metrics(backend):
                         # Modern backends return these as attributes
                         if hasattr(qubit_props, 'T1'):
                             t1_times.append(qubit_props.T1 * 1e6)  # Make sure it's in μs
-                            log_stderr(f"T1 from qubit_properties for qubit {qubit}: {qubit_props.T1 * 1e6:.2f} μs")
+                            log_debug(f"T1 from qubit_properties for qubit {qubit}: {qubit_props.T1 * 1e6:.2f} μs")
                         if hasattr(qubit_props, 'T2'):
                             t2_times.append(qubit_props.T2 * 1e6)  # Make sure it's in μs
-                            log_stderr(f"T2 from qubit_properties for qubit {qubit}: {qubit_props.T2 * 1e6:.2f} μs")
+                            log_debug(f"T2 from qubit_properties for qubit {qubit}: {qubit_props.T2 * 1e6:.2f} μs")
                 except Exception as e:
-                    log_stderr(f"Error accessing qubit_properties for qubit {qubit}: {e}")
+                    log_debug(f"Error accessing qubit_properties for qubit {qubit}: {e}")
             
             # Update metrics if we found values
             if t1_times and metrics["t1_time"] is None:
@@ -234,7 +301,7 @@ def get_backend_noise_metrics(backend):
                             break
                     
                     if is_two_qubit_gate:
-                        log_stderr(f"Found two-qubit gate: {gate_str}")
+                        log_debug(f"Found two-qubit gate: {gate_str}")
                         
                         # Get all qubit tuples where this gate is defined
                         if gate_name in backend.target:
@@ -248,7 +315,7 @@ def get_backend_noise_metrics(backend):
                                     if hasattr(props, 'error') and props.error is not None:
                                         error_value = props.error
                                         gate_errors[gate_type_key].append(error_value)
-                                        log_stderr(f"  {gate_str} error on qubits {qubits}: {error_value * 100:.6f}%")
+                                        log_debug(f"  {gate_str} error on qubits {qubits}: {error_value * 100:.6f}%")
                 
                 # If we found any errors, calculate the average for each gate type and overall
                 if gate_errors:
@@ -340,52 +407,73 @@ def get_backend_noise_metrics(backend):
     return metrics
 
 # --- Circuit Optimisation (returns metrics) ---
-def optimize_circuit(qc, backend):
-    """Optimize the circuit and return metrics."""
+def optimize_circuit(qc, backend, seed=None, optimization_level=OPTIMIZATION_LEVEL, callback=None):
+    """Optimize the circuit and return metrics. A seed makes layout/routing reproducible;
+       callback is called after every pass (deadline.py aborts slow transpiles through it)."""
     log_stderr(f"\nOptimizing circuit for backend: {backend.name}...")
+    target = backend.target
+    pm = generate_preset_pass_manager(target=target, optimization_level=optimization_level, seed_transpiler=seed)
+    optimized_circuit = pm.run(qc, callback=callback)
+    log_stderr("Optimization complete.")
+    depth = 0
+    cx_count = 0
+    gate_count = 0
     try:
-        target = backend.target
-        # Optimization level 3 is standard for Grover, but 2 might be faster compromise
-        pm = generate_preset_pass_manager(target=target, optimization_level=3)
-        optimized_circuit = pm.run(qc)
-        log_stderr("Optimization complete.")
-        depth = 0
-        cx_count = 0
-        gate_count = 0
-        try:
-            depth = optimized_circuit.depth()
-            ops = optimized_circuit.count_ops()
-            cx_count = ops.get('cx', 0) # CX is often key metric for noise
-            gate_count = sum(ops.values())
-            log_stderr(f"Optimized circuit depth: {depth}")
-            log_stderr(f"Optimized CX gate count: {cx_count}")
-            log_stderr(f"Optimized total gate count: {gate_count}")
-        except Exception as e:
-            log_stderr(f"Warning: Could not calculate depth/gate counts: {e}")
-        return optimized_circuit, depth, cx_count, gate_count
+        depth = optimized_circuit.depth()
+        ops = optimized_circuit.count_ops()
+        cx_count = ops.get('cx', 0) # CX is often key metric for noise
+        gate_count = sum(ops.values())
+        log_stderr(f"Optimized circuit depth: {depth}")
+        log_stderr(f"Optimized CX gate count: {cx_count}")
+        log_stderr(f"Optimized total gate count: {gate_count}")
     except Exception as e:
-        log_stderr(f"ERROR during circuit optimization: {e}")
-        log_stderr(traceback.format_exc())
-        # Return original circuit and zero metrics if optimization fails
-        return qc, 0, 0, 0
+        log_stderr(f"Warning: Could not calculate depth/gate counts: {e}")
+    return optimized_circuit, depth, cx_count, gate_count
 
 
-# --- Execution on Hardware/Simulator (returns job_id, counts) ---
-def run_circuit(qc, backend, shots):
-    """Run the circuit using SamplerV2 primitive."""
+# --- Execution on Hardware/Simulator (returns job_id, counts arrays) ---
+def run_circuit(qc, backend, shots, timer=None):
+    """Run the circuit using SamplerV2 primitive.
+       Counts are returned as (outcomes, frequencies) integer arrays."""
+    timer = timer or telemetry.PhaseTimer("grover_search")
     log_stderr(f"\nRunning circuit on backend: {backend.name} with {shots} shots.")
-    sampler = Sampler(mode=backend)
-    sampler.options.default_shots = shots
-    # Use default resilience/optimization level for Sampler
-    # sampler.options.optimization_level = 1
-
-    job = sampler.run([qc])
-    job_id = job.job_id()
-    log_stderr(f"Job ID: {job_id}")
+    job = submit_circuit(qc, backend, shots, timer)
     log_stderr("Waiting for job to complete...")
+    return collect_job(job, qc, timer)
+
+def submit_circuit(qc, backend, shots, timer):
+    """Submits the circuit without waiting; returns the job."""
+    with timer.phase("submit"):
+        sampler = Sampler(mode=backend)
+        sampler.options.default_shots = shots
+        # Use default resilience/optimization level for Sampler
+        # sampler.options.optimization_level = 1
+
+        job = sampler.run([qc])
+    worker_metrics.job_started(job.job_id(), worker_metrics.labels_for(timer.script, backend.name, timer.labels.get("qubits")))
+    log_stderr(f"Job ID: {job.job_id()}")
+    return job
+
+def collect_job(job, qc, timer, cancel=None):
+    """Waits for a submitted job and extracts (job_id, counts arrays, qpu_time). cancel is
+       deadline.wait_for_result's predicate for cancelling the job if the wait is cut short."""
+    job_id = job.job_id()
     # result() waits for completion and returns list of PubResults
     # For a single circuit, we access the first element.
-    result_list = job.result()
+    wait_start = time.perf_counter()
+    try:
+        with timer.profiled("execute"):
+            result_list = deadline.wait_for_result(job, timer.deadline, cancel)
+    finally:
+        worker_metrics.job_finished(job_id)
+    wait_sec = time.perf_counter() - wait_start
+    # Split the wait into queue / execute from the job's own timestamps when available
+    queue_sec, _ = telemetry.job_queue_execute_split(job)
+    if queue_sec is not None:
+        timer.record("queue", min(queue_sec, wait_sec), source="job_metrics")
+        timer.record("execute", wait_sec - min(queue_sec, wait_sec), source="job_metrics")
+    else:
+        timer.record("execute", wait_sec)
     if not result_list:
         raise RuntimeError(f"Job {job_id} did not return any results.")
     result = result_list[0]
@@ -401,103 +489,51 @@ def run_circuit(qc, backend, shots):
     except Exception as e:
         log_stderr(f"Unable to retrieve QPU time: {e}")
 
-    counts = {}
-    # Extract counts robustly from SamplerV2 result
-    # The default classical register name from measure_all() is 'meas'
-    pub_result = result.data
-    data_container = None
-
-    if hasattr(pub_result, 'meas'):
-        data_container = pub_result.meas
-        log_stderr("Extracting counts from default data field: meas")
-    else:
-        # Fallback: check other potential fields if 'meas' isn't present
-        # (Though measure_all() should consistently produce 'meas')
-        for field_name, container in pub_result.__fields_items__():
-             if hasattr(container, 'get_counts'):
-                 data_container = container
-                 log_stderr(f"Extracting counts from data field: {field_name}")
-                 break
-
-    if data_container and hasattr(data_container, 'get_counts'):
-        # Sampler returns counts with keys as hex (0x...) or binary strings
-        # depending on backend/version. Get counts converts to binary strings.
-        counts = data_container.get_counts()
-    elif data_container and isinstance(data_container, dict): # Aer can sometimes return dict
-         counts = data_container # Assume keys are already binary strings or compatible
-         # Optional: Convert hex keys if necessary
-         # counts = {bin(int(k, 16))[2:].zfill(qc.num_qubits): v for k, v in data_container.items() if k.startswith('0x')}
-    else:
-        log_stderr("Warning: Could not extract counts from SamplerV2 result data structure.")
-        log_stderr(f"Result data type: {type(pub_result)}")
-        log_stderr(f"Result data content: {pub_result}")
+    with timer.phase("extract_counts"):
+        counts = (np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64))
+        # The classical register from measure_all() is 'meas'; histogram straight
+        # from the packed BitArray, no bit-string dict in between
+        try:
+            measurements = result_io.Measurements.from_pub_result(result, "meas", qc.num_clbits)
+            log_stderr(f"Extracting counts from data field: {measurements.register}")
+            counts = measurements.histogram()
+        except ValueError as e:
+            log_stderr(f"Warning: Could not extract counts from SamplerV2 result data structure: {e}")
 
     log_stderr("Measurement counts received.")
     return job_id, counts, qpu_time
 
-# --- Plotting Function ---
-def generate_plot(counts, num_qubits, input_marked_states, backend_name, theme, plot_file_path):
-    """Generates and saves the histogram plot, highlighting marked states."""
-    log_stderr(f"\nGenerating plot ({theme} theme) to {plot_file_path}...")
-    try:
-        text_color = 'black' if theme == 'light' else 'white'
-        bar_color = '#648fff' # Adjusted blue color
-        marked_color = '#ffb000' # Amber/Orange for marked states
-        grid_color = '#cccccc' if theme == 'light' else '#555555'
-
-        plt.style.use('seaborn-v0_8-darkgrid' if theme == 'dark' else 'seaborn-v0_8-whitegrid')
-        fig, ax = plt.subplots(figsize=(12, 7)) # Slightly wider plot
-        fig.patch.set_alpha(0.0) # Transparent background
-        ax.patch.set_alpha(0.0)
-
-        if not counts:
-             log_stderr("No counts data to plot.")
-             ax.set_title("No Measurement Data Received", color=text_color)
+# --- Plot Data ---
+def build_plot_series(outcomes, frequencies, num_qubits, input_marked_states, backend_name, theme,
+                      max_bars=plot_render.DEFAULT_MAX_BARS, aggregate="top_k"):
+    """Builds the bounded histogram series (stored as plot_data), highlighting marked states."""
+    series = plot_render.histogram_series(outcomes, frequencies, num_qubits, max_bars=max_bars,
+                                          aggregate=aggregate, highlight_states=input_marked_states)
+    title = f"Grover Search Results on {backend_name}"
+    if input_marked_states:
+        if len(input_marked_states) <= 8:
+            title += f"\nTarget States: {', '.join(input_marked_states)} (highlighted)"
         else:
-             # Ensure keys are bitstrings, convert if needed (e.g., from int keys)
-             str_counts = {str(k): v for k, v in counts.items()}
+            title += f"\n{len(input_marked_states)} Target States (highlighted)"
+    series.update({
+        "theme": theme,
+        "title": title,
+        "xlabel": "Measured State (Bitstring)",
+        "ylabel": "Counts",
+        "xtick_rotation": 75, # Rotate labels if many qubits
+        "figsize": [12, 7], # Slightly wider plot
+        "highlight_label": "Marked State",
+        "colors": {"bar": '#648fff', "highlight": '#ffb000'}, # Blue bars, amber marked states
+    })
+    return series
 
-             # Pad keys with leading zeros if needed
-             padded_counts = {k.zfill(num_qubits): v for k, v in str_counts.items()}
 
-             # Plot all bars
-             sorted_keys = sorted(padded_counts.keys())
-             values = [padded_counts[k] for k in sorted_keys]
-
-             colors = [marked_color if k in input_marked_states else bar_color for k in sorted_keys]
-
-             ax.bar(sorted_keys, values, color=colors)
-
-             ax.set_xlabel("Measured State (Bitstring)", color=text_color)
-             ax.set_ylabel("Counts", color=text_color)
-             title = f"Grover Search Results on {backend_name}"
-             if input_marked_states:
-                  title += f"\nTarget States: {', '.join(input_marked_states)} (highlighted)"
-             ax.set_title(title, color=text_color)
-
-             ax.tick_params(axis='x', colors=text_color, rotation=75) # Rotate labels if many qubits
-             ax.tick_params(axis='y', colors=text_color)
-
-             # Adjust x-ticks frequency if too many states
-             if num_qubits > 5:
-                 step = 2**(num_qubits - 4) # Show roughly 16 ticks
-                 ax.set_xticks(sorted_keys[::step])
-
-             for spine in ax.spines.values():
-                 spine.set_edgecolor(text_color)
-
-             # Add a simple legend entry for the marked state color
-             from matplotlib.patches import Patch
-             legend_elements = [Patch(facecolor=marked_color, edgecolor=marked_color, label='Marked State')]
-             legend = ax.legend(handles=legend_elements, loc='best')
-             plt.setp(legend.get_texts(), color=text_color)
-             legend.get_frame().set_alpha(0.5)
-
-             ax.grid(axis='y', linestyle='--', color=grid_color, alpha=0.7)
-
-        # Save with transparent background
-        plt.savefig(plot_file_path, transparent=True, dpi=150, bbox_inches='tight')
-        plt.close(fig) # Close the plot figure
+# --- Plotting Function ---
+def generate_plot(series, plot_file_path):
+    """Renders the histogram series to a PNG file."""
+    log_stderr(f"\nGenerating plot ({series['theme']} theme) to {plot_file_path}...")
+    try:
+        plot_render.render_png(series, plot_file_path)
         log_stderr(f"Plot saved successfully to {plot_file_path}")
         return True
     except Exception as e:
@@ -507,20 +543,85 @@ def generate_plot(counts, num_qubits, input_marked_states, backend_name, theme,
 
 
 # --- Main Execution ---
-def main():
+def build_arg_parser():
     parser = argparse.ArgumentParser(description="Run Grover's search algorithm using Qiskit.")
     parser.add_argument('--api_token', type=str, required=True, help='IBM Quantum API Token')
-    parser.add_argument('--marked_states', type=str, required=True, help='Comma-separated list of binary strings to mark (e.g., "101,010")')
+    oracle_group = parser.add_mutually_exclusive_group(required=True)
+    oracle_group.add_argument('--marked_states', type=str, help='Comma-separated list of binary strings to mark (e.g., "101,010")')
+    oracle_group.add_argument('--oracle_cnf', type=str, help='Path to a DIMACS CNF file; its satisfying assignments are searched for')
+    oracle_group.add_argument('--oracle_expr', type=str, help='Boolean expression to search for, e.g. "(a | ~b) & (b ^ c)"')
+    parser.add_argument('--oracle_cache_dir', type=str, default=None, help='Directory for compiled oracle cache (default: shared temp cache)')
+    parser.add_argument('--search_rounds', type=int, default=8, help='Max exponential-search rounds when the solution count is only estimated (default: 8)')
     parser.add_argument('--shots', type=int, default=4096, help='Number of shots to run (default: 4096)')
     parser.add_argument('--run_on_hardware', action='store_true', help='Run on real hardware instead of simulator')
-    parser.add_argument('--plot_file', type=str, required=True, help='Path to save the output plot PNG file')
+    parser.add_argument('--plot_file', type=str, default=None, help='Path to save the output plot PNG file (omit for data-only output)')
+    parser.add_argument('--plot_mode', type=str, default='sync', choices=['sync', 'background', 'none'], help='Render the PNG before writing results (sync), in a detached process afterwards (background), or not at all (none); plot_data is always included (default: sync)')
+    parser.add_argument('--plot_max_bars', type=int, default=plot_render.DEFAULT_MAX_BARS, help=f'Max histogram bars regardless of qubit count (default: {plot_render.DEFAULT_MAX_BARS})')
+    parser.add_argument('--plot_aggregate', type=str, default='top_k', choices=['top_k', 'binned'], help='How to reduce outcomes beyond --plot_max_bars (default: top_k)')
     parser.add_argument('--plot_theme', type=str, required=True, choices=['light', 'dark'], help='Plot theme (light or dark)')
     parser.add_argument('--output_json', type=str, required=True, help='Path to save the output JSON results file')
-    args = parser.parse_args()
+    parser.add_argument('--counts_top_k', type=int, default=1024, help='Max outcomes kept inline in raw_counts; full counts go to the .counts.npz sidecar (default: 1024, 0 disables the inline summary)')
+    parser.add_argument('--counts_threshold', type=float, default=0.0, help='Only keep inline outcomes with at least this fraction of shots (default: 0)')
+    parser.add_argument('--event_stream', type=str, default=None, help='Emit JSON-line phase/progress events to "stdout", "stderr" or a file path')
+    parser.add_argument('--log_level', type=str, default='info', choices=list(telemetry.LOG_LEVELS), help='Use "debug" to log per-qubit calibration details (default: info)')
+    parser.add_argument('--seed', type=int, default=None, help='Seed for the simulator, transpiler and randomized schedules; fixes simulator results')
+    parser.add_argument('--result_cache', action='store_true', help='Reuse stored counts for identical simulator runs (circuit, simulator config, shots, seed)')
+    parser.add_argument('--result_cache_dir', type=str, default=None, help='Directory for cached simulator results (default: shared temp cache)')
+    parser.add_argument('--result_cache_max_mb', type=float, default=result_cache.DEFAULT_MAX_MB, help=f'Size bound for the result cache; least recently used entries are evicted (default: {result_cache.DEFAULT_MAX_MB})')
+    parser.add_argument('--backend', type=str, default=None, help='Pin a hardware backend by name instead of selecting the least busy one')
+    parser.add_argument('--backend_cache_ttl', type=float, default=backend_registry.DEFAULT_TTL_SEC, help=f'Seconds the cached hardware backend list stays valid (default: {backend_registry.DEFAULT_TTL_SEC})')
+    parser.add_argument('--dry_run', action='store_true', help='Build and transpile only; report estimated QPU time and success probability without submitting')
+    parser.add_argument('--readout_mitigation', type=str, default='none', choices=list(readout_mitigation.METHODS), help='Correct readout error: per-qubit assignment errors from the cached backend calibration ("calibration") or from two calibration circuits run alongside ("circuits"); raw counts are kept (default: none)')
+    parser.add_argument('--readout_calibration_shots', type=int, default=readout_mitigation.DEFAULT_CALIBRATION_SHOTS, help=f'Shots per calibration circuit for --readout_mitigation circuits (default: {readout_mitigation.DEFAULT_CALIBRATION_SHOTS})')
+    parser.add_argument('--mitigation_distance', type=int, default=readout_mitigation.DEFAULT_MAX_DISTANCE, help=f'Max bit flips between observed outcomes coupled by the correction (default: {readout_mitigation.DEFAULT_MAX_DISTANCE})')
+    parser.add_argument('--sim_compile', type=str, choices=sim_compile.MODES, default='native', help='Simulator compile path: "native" keeps the oracle / multipliers as Aer diagonal / unitary blocks with no layout or routing; "preset" uses the hardware pass manager (default: native)')
+    parser.add_argument('--exact', action='store_true', help='Simulator only: compute the exact distribution of the measured qubits in one simulation and decide success on it; --shots are only sampled from it for the plot and counts outputs')
+    parser.add_argument('--exact_top_k', type=int, default=exact_distribution.DEFAULT_TOP_K, help=f'With --exact, keep the most probable outcomes in the results JSON; 0 stores the full probability vector (default: {exact_distribution.DEFAULT_TOP_K})')
+    parser.add_argument('--exact_threshold', type=float, default=0.0, help='With --exact, only keep outcomes with at least this probability (default: 0)')
+    parser.add_argument('--deadline', type=float, default=None, help='Wall-clock budget in seconds: slow transpiles fall back to a cheaper level, simulations to fewer shots, and jobs still running at the deadline are cancelled; a partial results JSON is written either way')
+    parser.add_argument('--max_attempts', type=int, default=submission.DEFAULT_MAX_ATTEMPTS, help=f'Attempts per backend for transient submission failures (network, rate limits), with exponential backoff (default: {submission.DEFAULT_MAX_ATTEMPTS})')
+    parser.add_argument('--max_backends', type=int, default=submission.DEFAULT_MAX_BACKENDS, help=f'Backends to try when jobs fail on the device; 1 disables failover (default: {submission.DEFAULT_MAX_BACKENDS})')
+    parser.add_argument('--retry_base_delay', type=float, default=submission.DEFAULT_BASE_DELAY_SEC, help=f'Backoff before the first retry in seconds, doubling per attempt, with full jitter (default: {submission.DEFAULT_BASE_DELAY_SEC})')
+    parser.add_argument('--no_coalesce', action='store_true', help='Always submit a new hardware job, instead of sharing an identical one already in flight from another run')
+    parser.add_argument('--coalesce_dir', type=str, default=None, help='Directory of the in-flight hardware job registry shared by runs on this machine (default: shared temp cache)')
+    parser.add_argument('--qpu_ledger', type=str, default=None, help='SQLite QPU-seconds ledger: price hardware runs before submission, admit them against the project\'s allocation and charge the QPU time used (see qpu_budget.py)')
+    parser.add_argument('--qpu_project', type=str, default='default', help='Project whose allocation --qpu_ledger charges (default: default)')
+    parser.add_argument('--qpu_user', type=str, default=None, help='User recorded with the charge (default: login name)')
+    parser.add_argument('--qpu_policy', type=str, choices=qpu_budget.POLICIES, default='downscale', help='Runs that exceed their share of the allocation: run fewer shots, fail, or defer with exit code 75 (default: downscale)')
+    parser.add_argument('--qpu_max_share', type=float, default=qpu_budget.DEFAULT_MAX_SHARE, help=f'Largest share of the remaining allocation one run may spend, so the budget covers many runs (default: {qpu_budget.DEFAULT_MAX_SHARE})')
+    parser.add_argument('--qpu_min_shots', type=int, default=qpu_budget.DEFAULT_MIN_SHOTS, help=f'Fewest shots --qpu_policy downscale runs; below that the run is rejected (default: {qpu_budget.DEFAULT_MIN_SHOTS})')
+    parser.add_argument('--results_db', type=str, default=None, help='Append this run (parameters, metrics, phase timings, counts reference) to a SQLite history database')
+    parser.add_argument('--shot_chunk', type=int, default=0, help='Run the shots as jobs of at most this many shots, merging counts incrementally (default: 0, one job)')
+    parser.add_argument('--checkpoint_every', type=int, default=1, help='With --shot_chunk, checkpoint partial counts every N chunks (default: 1)')
+    parser.add_argument('--resume', action='store_true', help='With --shot_chunk, continue from the checkpoint next to --output_json')
+    parser.add_argument('--profile', action='append', choices=list(profiling.PROFILE_MODES), help='Profile each phase: "cpu" (cProfile dumps) and/or "mem" (tracemalloc + peak RSS); reports are written next to --output_json')
+    return parser
+
+
+def parse_args(argv=None):
+    return build_arg_parser().parse_args(argv)
+
+
+def run(args, import_sec=None, origin=None):
+    """Runs one configuration and writes its results JSON. Returns the results dict.
+       Never exits the interpreter, so it can be called repeatedly (see batch_runner.py)."""
+    telemetry.set_log_level(args.log_level)
+    timer = telemetry.PhaseTimer("grover_search", telemetry.EventStream(args.event_stream), origin=origin)
+    profilers = profiling.install(timer, args.profile)
+    if import_sec is not None:
+        timer.record("import", import_sec)
+    if args.deadline is not None:
+        timer.deadline = deadline.Deadline(args.deadline, timer.now)
+    # SIGTERM / SIGINT stop the run but still write a partial results JSON
+    signal_guard = deadline.SignalGuard().install()
+    retry_policy = submission.RetryPolicy(args.max_attempts, args.max_backends, args.retry_base_delay, args.seed)
 
     results = {
         "status": "failure",
         "input_marked_states": None,
+        "oracle_source": "marked_states" if args.marked_states else ("cnf" if args.oracle_cnf else "expression"),
+        "oracle": None, # Compiled predicate oracle details (CNF / expression sources only)
+        "grover_iterations": None,
         "top_measured_state": None, # The single most frequent state measured
         "top_measured_count": None,
         "found_correct_state": False, # Did the top state match one of the inputs?
@@ -532,147 +633,481 @@ def main():
         "num_qubits": None,
         "backend_used": None,
         "job_id": None,
+        "seed": args.seed,
+        "cached": False, # True when counts came from the --result_cache store
+        "result_cache_key": None,
+        "chunked": None, # Chunk size / count / job ids for --shot_chunk runs
+        "backend_selection": None, # Pinned / queue length / candidates for hardware runs
+        "dry_run": None, # Resource / success estimate when --dry_run skips submission
+        "deadline": None, # --deadline budget and what was degraded to meet it
+        "compile_path": None, # "hardware", or the --sim_compile path of simulator runs
+        "partial": None, # Reason and completed phases when a deadline or signal stopped the run
+        "submission": submission.new_report(), # Connect / selection / job attempts, retries and failovers
+        "coalesced": None, # Shared in-flight hardware job(s): role, job IDs, requested / received shots
+        "qpu_budget": None, # --qpu_ledger admission decision (estimate, allowance, shots) and the charge
+        "exact": None, # --exact: the exact distribution the result was decided on
+        "readout_mitigation": None, # --readout_mitigation report with the mitigated (quasi-probability) counts
         "shots": args.shots,
         "ran_on_hardware": args.run_on_hardware,
         "plot_file_path": None,
+        "plot_status": "skipped", # rendered | pending | failed | skipped
+        "plot_data": None, # Bounded histogram series the renderer can draw directly
         "error_message": None,
-        "raw_counts": None,
+        "raw_counts": None, # Inline summary; see counts_file for the full histogram
+        "raw_counts_truncated": False,
+        "distinct_outcomes": None,
+        "counts_file": None,
         # Add noise metrics to results
         "gate_error": None,
         "readout_error": None,
         "t1_time": None,
         "t2_time": None,
         "quantum_volume": None,
+        "phase_timings": None, # Seconds per phase (monotonic clock), see telemetry.PHASES
+        "profile": None, # Headline --profile numbers; full reports sit next to the results file
     }
     start_time = time.time()
+    timer.event("run_start", shots=args.shots, run_on_hardware=args.run_on_hardware)
+    plot_series = None
 
     try:
         # --- Input Validation ---
-        marked_states_list = [s.strip() for s in args.marked_states.split(',') if s.strip()]
-        if not marked_states_list:
-            raise ValueError("No marked states provided. Use --marked_states argument.")
-        results["input_marked_states"] = marked_states_list
-
-        # Check if all marked states are binary and have the same length
-        num_qubits = len(marked_states_list[0])
-        if num_qubits == 0:
-             raise ValueError("Marked states cannot be empty strings.")
-        for state in marked_states_list:
-            if len(state) != num_qubits:
-                raise ValueError("All marked states must have the same length (number of qubits).")
-            if not all(c in '01' for c in state):
-                raise ValueError(f"Marked state '{state}' is not a valid binary string.")
-        results["num_qubits"] = num_qubits
-        log_stderr(f"Input valid: Searching for {len(marked_states_list)} marked state(s) ({', '.join(marked_states_list)}) using {num_qubits} qubits.")
+        marked_states_list = []
+        oracle_formula = None
+        if args.marked_states:
+            marked_states_list = [s.strip() for s in args.marked_states.split(',') if s.strip()]
+            if not marked_states_list:
+                raise ValueError("No marked states provided. Use --marked_states argument.")
+            results["input_marked_states"] = marked_states_list
+
+            # Check if all marked states are binary and have the same length
+            num_qubits = len(marked_states_list[0])
+            if num_qubits == 0:
+                 raise ValueError("Marked states cannot be empty strings.")
+            for state in marked_states_list:
+                if len(state) != num_qubits:
+                    raise ValueError("All marked states must have the same length (number of qubits).")
+                if not all(c in '01' for c in state):
+                    raise ValueError(f"Marked state '{state}' is not a valid binary string.")
+            log_stderr(f"Input valid: Searching for {len(marked_states_list)} marked state(s) ({', '.join(marked_states_list)}) using {num_qubits} qubits.")
+        else:
+            with timer.phase("build", step="oracle"):
+                oracle_source, num_qubits, oracle_formula, variable_names = load_oracle_source(args)
+                if oracle_formula == cnf_oracle.FALSE:
+                    # An expression whose terms contradict each other, e.g. "a & ~a"
+                    results["error_message"] = "Formula is unsatisfiable; there is no state for Grover search to find."
+                    raise ValueError(results["error_message"])
+                oracle, oracle_stats = cnf_oracle.get_phase_oracle(num_qubits, oracle_formula, args.oracle_cache_dir)
+                solution_info = cnf_oracle.count_solutions(oracle_formula, num_qubits, args.seed)
+            results["oracle"] = dict(oracle_stats,
+                                     variables=variable_names,
+                                     num_solutions=solution_info["count"],
+                                     solution_count_method=solution_info["method"],
+                                     sample_solutions=solution_info["solutions"])
+            log_stderr(f"Oracle valid: {num_qubits} variable(s), {oracle_stats['num_clauses']} clause(s), "
+                       f"{solution_info['count']} solution(s) ({solution_info['method']}).")
+            if solution_info["count"] == 0 and solution_info["method"] == "exact":
+                results["error_message"] = "Formula is unsatisfiable; there is no state for Grover search to find."
+                raise ValueError(results["error_message"])
+            if solution_info["method"] == "exact":
+                # Highlight the known solutions in the plot, like explicit marked states.
+                marked_states_list = solution_info["solutions"]
+        results["num_qubits"] = timer.labels["qubits"] = num_qubits
+        if args.search_rounds < 1:
+            raise ValueError("--search_rounds must be at least 1.")
+
+        def is_solution(state):
+            if oracle_formula is None:
+                return state in marked_states_list
+            return cnf_oracle.bitstring_satisfies(oracle_formula, state)
+
+        if args.shot_chunk < 0 or args.checkpoint_every < 1:
+            raise ValueError("--shot_chunk must be >= 0 and --checkpoint_every >= 1.")
+        if args.exact and args.run_on_hardware:
+            log_stderr("Warning: --exact only applies to simulator runs; ignoring it.")
+            args.exact = False
+        if args.exact and (args.shot_chunk or args.result_cache):
+            log_stderr("Warning: --shot_chunk and --result_cache do not apply to --exact runs (one simulation); ignoring them.")
+            args.shot_chunk, args.result_cache = 0, False
+
+        # --- Result Cache (simulator only) ---
+        result_store = None
+        if args.result_cache and args.dry_run:
+            log_stderr("Warning: --result_cache has no effect with --dry_run; ignoring it.")
+        elif args.result_cache and args.run_on_hardware:
+            log_stderr("Warning: --result_cache only applies to simulator runs; ignoring it.")
+        elif args.result_cache:
+            if args.seed is None:
+                args.seed = result_cache.DEFAULT_SEED
+                results["seed"] = args.seed
+                log_stderr(f"No --seed given; using seed {args.seed} so cached results are reproducible.")
+            result_store = result_cache.ResultCache(args.result_cache_dir, args.result_cache_max_mb)
 
         # --- Connect to IBM Quantum ---
-        log_stderr("\nConnecting to IBM Quantum...")
-        # Allow fallback to environment variable if token arg is empty string?
-        service = QiskitRuntimeService(channel="ibm_quantum", token=args.api_token)
-        log_stderr("Connected.")
+        with timer.phase("connect"):
+            if result_store is not None:
+                # Local simulation never needs the service; skip the network round trip
+                service = None
+                log_stderr("\nSkipping IBM Quantum connection (result-cached simulator run).")
+            else:
+                log_stderr("\nConnecting to IBM Quantum...")
+                # Allow fallback to environment variable if token arg is empty string?
+                service = submission.retry(
+                    lambda: run_context.get_service(
+                        args.api_token, lambda: QiskitRuntimeService(channel="ibm_quantum", token=args.api_token)),
+                    retry_policy, timer, results["submission"], "connect")
+                log_stderr("Connected.")
 
         # --- Select Backend ---
-        backend = None
-        required_qubits = num_qubits
-        if args.run_on_hardware:
-            log_stderr("Selecting least busy real hardware backend...")
-            try:
-                # Ensure simulator=False and min_num_qubits requirement
-                backend = service.least_busy(min_num_qubits=required_qubits, operational=True, simulator=False)
-                log_stderr(f"Selected real hardware backend: {backend.name}")
-            except Exception as e:
-                 results["error_message"] = f"Could not find suitable IBM hardware backend ({required_qubits}+ qubits): {e}"
-                 raise RuntimeError(results["error_message"])
-        else:
-            log_stderr("Selecting local Aer simulator...")
-            try:
-                 # Use default AerSimulator (most flexible)
-                 backend = AerSimulator()
-                 # Optional: Check if AerSimulator can handle required qubits? (Usually fine)
-                 log_stderr(f"Selected backend: {backend.name}")
-            except ImportError:
-                 results["error_message"] = "qiskit-aer not installed. Cannot run simulator."
-                 raise ImportError(results["error_message"])
-            except Exception as e:
-                 results["error_message"] = f"Failed to initialize AerSimulator: {e}"
-                 raise RuntimeError(results["error_message"])
+        with timer.phase("backend_selection"):
+            backend = None
+            required_qubits = num_qubits if oracle_formula is None else results["oracle"]["oracle_qubits"]
+            if args.run_on_hardware:
+                log_stderr(f"Using pinned hardware backend {args.backend}..." if args.backend
+                           else "Selecting real hardware backend (fleet survey ranking if cached, else least busy)...")
+                try:
+                    # Fresh fleet_survey.py snapshot, else cached backend list + current queue lengths
+                    backend, results["backend_selection"] = submission.retry(
+                        lambda: backend_registry.select_backend(
+                            service, required_qubits, pinned=args.backend,
+                            account=backend_registry.account_key(args.api_token), ttl=args.backend_cache_ttl),
+                        retry_policy, timer, results["submission"], "backend_selection")
+                    log_stderr(f"Selected real hardware backend: {backend.name} "
+                               f"({results['backend_selection']['pending_jobs']} pending job(s)"
+                               + (f", expected fidelity {results['backend_selection']['expected_fidelity']}"
+                                  if results['backend_selection'].get('expected_fidelity') is not None else "") + ")")
+                except Exception as e:
+                     results["error_message"] = f"Could not find suitable IBM hardware backend ({required_qubits}+ qubits): {e}"
+                     raise RuntimeError(results["error_message"])
+            else:
+                if args.backend:
+                    log_stderr(f"Warning: --backend {args.backend} only applies with --run_on_hardware; ignoring it.")
+                log_stderr("Selecting local Aer simulator...")
+                try:
+                     # Use default AerSimulator (most flexible)
+                     backend = AerSimulator(**run_context.simulator_options(),
+                                            **({} if args.seed is None else {"seed_simulator": args.seed}))
+                     # Optional: Check if AerSimulator can handle required qubits? (Usually fine)
+                     log_stderr(f"Selected backend: {backend.name}")
+                except ImportError:
+                     results["error_message"] = "qiskit-aer not installed. Cannot run simulator."
+                     raise ImportError(results["error_message"])
+                except Exception as e:
+                     results["error_message"] = f"Failed to initialize AerSimulator: {e}"
+                     raise RuntimeError(results["error_message"])
+
+            results["backend_used"] = backend.name
+            results["compile_path"] = "hardware" if args.run_on_hardware else args.sim_compile
+            native_compile = results["compile_path"] == "native"
+
+        def compile_circuit(qc, target_backend=None):
+            """Simulator runs skip the hardware pass manager (sim_compile.py)."""
+            target_backend = target_backend or backend
+            if native_compile:
+                return run_context.transpile(qc, target_backend, sim_compile.optimize, args.seed, variant="simulator")
+            return deadline.transpile(qc, target_backend, optimize_circuit, args.seed, timer.deadline, OPTIMIZATION_LEVEL)
+
+        def load_noise_metrics():
+            with timer.phase("noise_metrics"):
+                metrics = run_context.noise_metrics(backend, get_backend_noise_metrics)
+            results["gate_error"] = metrics["gate_error"]
+            results["readout_error"] = metrics["readout_error"]
+            results["t1_time"] = metrics["t1_time"]
+            results["t2_time"] = metrics["t2_time"]
+            results["quantum_volume"] = metrics["quantum_volume"]
+            return metrics
+
+        def fail_over(qc, excluded):
+            """Next-ranked hardware backend after a failed job, with the circuit re-transpiled for it
+               (through the transpile cache). Used by submission.run_with_failover."""
+            nonlocal backend, noise_metrics
+            with timer.phase("backend_selection", step="failover"):
+                backend, results["backend_selection"] = backend_registry.select_backend(
+                    service, required_qubits, account=backend_registry.account_key(args.api_token),
+                    ttl=args.backend_cache_ttl, exclude=excluded)
+            results["backend_used"] = backend.name
+            noise_metrics = load_noise_metrics()
+            with timer.phase("transpile", step="failover"):
+                compiled, results["circuit_depth"], results["cx_gate_count"], results["total_gate_count"] = compile_circuit(qc)
+            return backend, compiled
+
+        def retrying(fn, step):
+            """fn(circuit, backend, shots, timer) with transient failures retried (see submission.py)."""
+            return lambda circuit, target_backend, shots, timer: submission.retry(
+                lambda: fn(circuit, target_backend, shots, timer), retry_policy, timer, results["submission"],
+                step, target_backend.name)
+
+        def collecting(fn, backend_name):
+            """fn(job, circuit, timer, cancel) with transient wait failures re-polled on the same job
+               rather than resubmitted (see submission.collect)."""
+            return lambda job, circuit, timer, cancel=None: submission.collect(
+                lambda current: fn(current, circuit, timer, cancel), job, retry_policy, timer, results["submission"],
+                backend_name, getattr(service, "job", None), cancel)
+
+        def run_hardware_job(circuit, target_backend, shots, timer):
+            """run_circuit with the submission retried and the wait re-polled on transient failures."""
+            log_stderr(f"\nRunning circuit on backend: {target_backend.name} with {shots} shots.")
+            job = retrying(submit_circuit, "submit")(circuit, target_backend, shots, timer)
+            log_stderr("Waiting for job to complete...")
+            return collecting(collect_job, target_backend.name)(job, circuit, timer)
+
+        def run_hardware(circuit, target_backend):
+            """run_hardware_job, sharing the job with identical in-flight requests unless --no_coalesce."""
+            if args.no_coalesce:
+                return run_hardware_job(circuit, target_backend, args.shots, timer)
+            log_stderr(f"\nRunning circuit on backend: {target_backend.name} with {args.shots} shots.")
+            job_id, counts, qpu_time, results["coalesced"] = coalesce.run(
+                circuit, target_backend, args.shots, timer, retrying(submit_circuit, "submit"),
+                collecting(collect_job, target_backend.name), getattr(service, "job", None),
+                backend_registry.account_key(args.api_token), args.coalesce_dir)
+            results["shots"] = results["coalesced"]["shots"] # At least the shots requested
+            return job_id, counts, qpu_time
 
-        results["backend_used"] = backend.name
-        
         # --- Get Backend Noise Metrics (if hardware) ---
+        noise_metrics = None
         if args.run_on_hardware:
-            noise_metrics = get_backend_noise_metrics(backend)
-            results["gate_error"] = noise_metrics["gate_error"]
-            results["readout_error"] = noise_metrics["readout_error"]
-            results["t1_time"] = noise_metrics["t1_time"]
-            results["t2_time"] = noise_metrics["t2_time"]
-            results["quantum_volume"] = noise_metrics["quantum_volume"]
-
-        # --- Build Circuit ---
-        qc, nq = build_grover_circuit(marked_states_list)
-        # Ensure num_qubits from build matches expectation
-        if nq != results["num_qubits"]:
-            log_stderr(f"Warning: Circuit built with {nq} qubits, expected {results['num_qubits']}. Using {nq}.")
-            results["num_qubits"] = nq
-
-        # --- Optimize Circuit ---
-        # Optimization is crucial for real hardware
-        qc_optimized, depth, cx_count, gate_count = optimize_circuit(qc, backend)
-        results["circuit_depth"] = depth
-        results["cx_gate_count"] = cx_count
-        results["total_gate_count"] = gate_count
-
-        # --- Run Circuit ---
-        job_id, counts, qpu_time = run_circuit(qc_optimized, backend, args.shots)
-        results["job_id"] = job_id
-        results["qpu_time_sec"] = qpu_time  # Add QPU time to results
-        # Ensure counts keys are padded if necessary before storing/processing
-        padded_counts = {k.zfill(results["num_qubits"]): v for k, v in counts.items()}
-        results["raw_counts"] = padded_counts
-
-        # --- Plot Results ---
-        plot_success = generate_plot(padded_counts, results["num_qubits"], marked_states_list, backend.name, args.plot_theme, args.plot_file)
-        if plot_success:
-            results["plot_file_path"] = args.plot_file
+            noise_metrics = load_noise_metrics()
+
+        # --- Iteration Schedule ---
+        if oracle_formula is None:
+            schedule = [None] # Marked-state oracle computes its own optimal iteration count
+        elif results["oracle"]["solution_count_method"] == "exact":
+            schedule = [optimal_grover_iterations(results["oracle"]["num_solutions"], num_qubits)]
         else:
-            # Log error but continue processing results
-            results["error_message"] = (results.get("error_message") or "") + " Failed to generate plot."
+            # Solution count is only estimated: use randomized exponential search (BBHT)
+            log_stderr(f"Solution count is an estimate; using exponential search (up to {args.search_rounds} rounds).")
+            schedule = list(cnf_oracle.exponential_search_iterations(num_qubits, np.random.default_rng(args.seed),
+                                                                     args.search_rounds))
+
+        search_rounds = []
+        sim_oracle = None
+        exact = None # (outcomes, probabilities) with --exact
+        for iterations in schedule:
+            # --- Build Circuit ---
+            with timer.phase("build"):
+                if oracle_formula is None:
+                    iterations = optimal_grover_iterations(len(marked_states_list), num_qubits)
+                if native_compile:
+                    # Oracle as native phase flips / one diagonal on the search qubits; no ancillas needed
+                    if sim_oracle is None:
+                        sim_oracle = (sim_compile.marked_states_oracle(marked_states_list) if oracle_formula is None
+                                           else sim_compile.formula_oracle(oracle_formula, num_qubits))
+                    qc, nq = sim_compile.grover_circuit(sim_oracle, iterations), num_qubits
+                elif oracle_formula is None:
+                    qc, nq = build_grover_circuit(marked_states_list)
+                else:
+                    qc, nq = build_grover_circuit_from_oracle(oracle, num_qubits, iterations)
+                results["grover_iterations"] = iterations
+                # Ensure num_qubits from build matches expectation
+                if nq != results["num_qubits"]:
+                    log_stderr(f"Warning: Circuit built with {nq} qubits, expected {results['num_qubits']}. Using {nq}.")
+                    results["num_qubits"] = nq
+
+            # --- Result Cache Lookup ---
+            cached = None
+            if result_store is not None:
+                with timer.phase("result_cache"):
+                    results["result_cache_key"] = result_store.key(qc, backend, args.shots, args.seed,
+                                                                   results["compile_path"])
+                    cached = result_store.get(results["result_cache_key"])
+            if cached is not None:
+                log_stderr(f"Result cache hit ({results['result_cache_key'][:12]}); skipping transpile and simulation.")
+                outcomes, frequencies = cached["outcomes"], cached["frequencies"]
+                results.update(cached["metrics"])
+                results["cached"] = True
+                job_id = results["job_id"]
+                measured_circuit = None
+            else:
+                # --- Optimize Circuit ---
+                with timer.phase("transpile"):
+                    # Optimization is crucial for real hardware
+                    qc_optimized, depth, cx_count, gate_count = compile_circuit(qc)
+                    results["circuit_depth"] = depth
+                    results["cx_gate_count"] = cx_count
+                    results["total_gate_count"] = gate_count
+                measured_circuit = qc_optimized
+
+                if args.dry_run:
+                    break
+
+                # --- QPU Budget Admission ---
+                if args.qpu_ledger and args.run_on_hardware:
+                    with timer.phase("admission"):
+                        results["qpu_budget"] = qpu_budget.admit(
+                            args.qpu_ledger, args.qpu_project, args.qpu_user or qpu_budget.default_user(), "grover_search",
+                            backend.name, [resource_estimate.estimate(qc_optimized, backend, args.shots, noise_metrics)],
+                            args.shots, args.qpu_policy, args.qpu_max_share, args.qpu_min_shots)
+                    args.shots = results["shots"] = results["qpu_budget"]["shots"]
+
+                # --- Run Circuit ---
+                split = False # Deadline-sized simulation run as pilot + sized job
+                if args.exact:
+                    # One simulation for any shot count; the shots are drawn from the exact distribution
+                    with timer.phase("execute", step="exact"):
+                        exact = exact_distribution.run(qc_optimized, backend)
+                    with timer.phase("sample"):
+                        outcomes, frequencies = exact_distribution.sample(*exact, args.shots, args.seed)
+                    job_id, qpu_time = None, None
+                elif args.shot_chunk and args.shots > args.shot_chunk:
+                    # Chunks retry transient failures but stay on one backend, so the merged counts do too
+                    job_id, (outcomes, frequencies), qpu_time, results["chunked"] = chunked_run.run_chunked(
+                        run_hardware_job if args.run_on_hardware else run_circuit, qc_optimized, backend, args.shots, args.shot_chunk, timer,
+                        chunked_run.checkpoint_path(args.output_json), args.resume, args.seed, args.checkpoint_every)
+                    results["shots"] = results["chunked"]["shots_done"]
+                elif timer.deadline is not None and not args.run_on_hardware:
+                    # Simulations shrink to the shots that fit the deadline
+                    job_id, (outcomes, frequencies), qpu_time, results["shots"], split = chunked_run.run_within_deadline(
+                        run_circuit, qc_optimized, backend, args.shots, timer, args.seed)
+                elif args.run_on_hardware:
+                    # Transient failures are retried; device failures move to the next-ranked backend
+                    (job_id, (outcomes, frequencies), qpu_time), backend, qc_optimized = submission.run_with_failover(
+                        run_hardware, qc, qc_optimized, backend, retry_policy, timer, results["submission"],
+                        None if args.backend else fail_over)
+                    measured_circuit = qc_optimized
+                else:
+                    job_id, (outcomes, frequencies), qpu_time = run_circuit(qc_optimized, backend, args.shots, timer)
+                results["job_id"] = job_id
+                results["qpu_time_sec"] = qpu_time  # Add QPU time to results
+                results["cached"] = False
+                if results["qpu_budget"] is not None:
+                    qpu_budget.settle(args.qpu_ledger, results["qpu_budget"], results)
+                # Cut-short runs, pilot + sized runs and chunked runs (seed + i per chunk) would not match
+                # a fresh single-job run; not cached
+                if result_store is not None and results["shots"] == args.shots and not split and results["chunked"] is None:
+                    result_store.put(results["result_cache_key"], outcomes, frequencies, results["num_qubits"],
+                                     {k: results[k] for k in ("circuit_depth", "cx_gate_count", "total_gate_count", "job_id")})
+
+            if oracle_formula is not None and results["oracle"]["solution_count_method"] != "exact":
+                top, _ = exact_distribution.top(*exact) if exact is not None else result_io.top_outcome(outcomes, frequencies)
+                top = None if top is None else result_io.outcome_to_bitstring(top, results["num_qubits"])
+                search_rounds.append({"iterations": iterations, "job_id": job_id, "top_state": top})
+                if top is not None and is_solution(top):
+                    break
+        if search_rounds:
+            results["oracle"]["search_rounds"] = search_rounds
+
+        # --- Dry Run: estimate and stop before submission ---
+        if args.dry_run:
+            with timer.phase("estimate"):
+                results["dry_run"] = resource_estimate.estimate(
+                    qc_optimized, backend, args.shots, noise_metrics if args.run_on_hardware else None)
+                if len(schedule) > 1:
+                    # Exponential search stops at the first round that finds a solution
+                    results["dry_run"]["search_rounds_max"] = len(schedule)
+            resource_estimate.log_estimate(results["dry_run"])
+            results["status"] = "success"
+            return results # The finally block still writes the results JSON
 
+        # --- Store Counts ---
+        with timer.phase("write"):
+            results["distinct_outcomes"] = int(len(outcomes))
+            try:
+                results["counts_file"] = result_io.write_counts_sidecar(
+                    result_io.sidecar_path(args.output_json), outcomes, frequencies, results["num_qubits"])
+                log_stderr(f"Counts sidecar written to {results['counts_file']}")
+            except Exception as e:
+                log_stderr(f"Warning: Could not write counts sidecar: {e}")
+            if args.counts_top_k > 0 or results["counts_file"] is None:
+                results["raw_counts"], results["raw_counts_truncated"] = result_io.summarize_counts(
+                    outcomes, frequencies, results["num_qubits"],
+                    top_k=args.counts_top_k if args.counts_top_k > 0 else None, threshold=args.counts_threshold)
+
+        # --- Readout Mitigation ---
+        mitigated_outcomes = mitigated_quasi = None
+        if args.readout_mitigation != "none":
+            if measured_circuit is None:
+                log_stderr("Warning: --readout_mitigation needs the transpiled circuit; skipping it for cached counts.")
+            else:
+                with timer.phase("mitigate"):
+                    try:
+                        mitigated_outcomes, mitigated_quasi, results["readout_mitigation"] = readout_mitigation.apply(
+                            measured_circuit, backend, outcomes, frequencies, args.readout_mitigation,
+                            noise_metrics if args.run_on_hardware else None, args.mitigation_distance,
+                            args.readout_calibration_shots, args.counts_top_k if args.counts_top_k > 0 else None)
+                    except Exception as e:
+                        log_stderr(f"Warning: Readout mitigation failed; using raw counts: {e}")
+                        results["readout_mitigation"] = {"method": args.readout_mitigation, "status": "failed", "error": str(e)}
+
+        # --- Plot Data (PNG rendering happens after analysis) ---
+        with timer.phase("plot"):
+            plot_series = build_plot_series(outcomes, frequencies, results["num_qubits"], marked_states_list,
+                                            backend.name, args.plot_theme, args.plot_max_bars, args.plot_aggregate)
+            results["plot_data"] = plot_series
 
         # --- Process Results ---
-        log_stderr("\n--- Analysing Results ---")
-        if not padded_counts:
-             results["error_message"] = (results.get("error_message") or "") + " No measurement counts received."
-             raise ValueError("No measurement counts received.")
-
-        # Find the most frequent measurement outcome
-        # Sort by count (descending), then by key (ascending for tie-breaking)
-        sorted_counts = sorted(padded_counts.items(), key=lambda item: (-item[1], item[0]))
-        top_state, top_count = sorted_counts[0]
-        results["top_measured_state"] = top_state
-        results["top_measured_count"] = top_count
-
-        log_stderr(f"Most frequent measured state: |{top_state}> with {top_count} counts.")
-
-        # Check if the top measured state is one of the marked states
-        if top_state in marked_states_list:
-            results["status"] = "success"
-            results["found_correct_state"] = True
-            log_stderr(f"Success! The most frequent state |{top_state}> matches one of the marked states.")
-            log_stderr(f"\n====================================")
-            log_stderr(f"Grover search successful for target(s): {', '.join(marked_states_list)}")
-            log_stderr(f"Found state |{top_state}> with highest probability.")
-            log_stderr(f"====================================")
-        else:
-            # Status remains "failure" (as initialized)
-            results["found_correct_state"] = False
-            results["error_message"] = (results.get("error_message") or "") + f" Top measured state |{top_state}> did not match any marked state."
-            log_stderr(f"Failure: The most frequent state |{top_state}> is NOT among the marked states: {marked_states_list}.")
-            log_stderr("\n------------------------------------")
-            log_stderr("Grover search did not yield a marked state as the most probable outcome.")
-            log_stderr("Check histogram plot and logs. Possible reasons: noise, insufficient shots/iterations, decoherence.")
-            log_stderr("------------------------------------")
+        with timer.phase("post_process"):
+            log_stderr("\n--- Analysing Results ---")
+            if len(outcomes) == 0:
+                 results["error_message"] = (results.get("error_message") or "") + " No measurement counts received."
+                 raise ValueError("No measurement counts received.")
+
+            if exact is not None:
+                # Decide on the exact distribution; the sampled counts only feed the plot and counts output
+                top_outcome, top_probability = exact_distribution.top(*exact)
+                top_count = int(frequencies[outcomes == top_outcome].sum())
+                results["exact"] = exact_distribution.report(*exact, results["num_qubits"], args.exact_top_k,
+                                                             args.exact_threshold, results["shots"])
+                solutions = (np.isin(exact[0], [int(state, 2) for state in marked_states_list]) if oracle_formula is None
+                             else cnf_oracle.evaluate_formula(oracle_formula, exact[0]))
+                results["exact"]["success_probability"] = round(float(exact[1][solutions].sum()), exact_distribution.ROUND_DIGITS)
+            else:
+                # Find the most frequent measurement outcome (ties go to the smallest bit-string)
+                top_outcome, top_count = result_io.top_outcome(outcomes, frequencies)
+            top_state = result_io.outcome_to_bitstring(top_outcome, results["num_qubits"])
+            results["top_measured_state"] = top_state
+            results["top_measured_count"] = top_count
+
+            if exact is not None:
+                log_stderr(f"Most probable state: |{top_state}> with exact probability {top_probability:.6f} "
+                           f"(success probability {results['exact']['success_probability']:.6f}).")
+            else:
+                log_stderr(f"Most frequent measured state: |{top_state}> with {top_count} counts.")
+            if mitigated_quasi is not None:
+                # Decide on the readout-corrected distribution; the raw top state stays reported
+                top_state = results["readout_mitigation"]["top_state"]
+                log_stderr(f"Most probable state after readout mitigation: |{top_state}> "
+                           f"(quasi-probability {results['readout_mitigation']['top_probability']:.4f}, "
+                           f"raw {top_count / results['shots']:.4f}).")
+
+            # Check if the top measured state is one of the marked states
+            if is_solution(top_state):
+                results["status"] = "success"
+                results["found_correct_state"] = True
+                log_stderr(f"Success! The most frequent state |{top_state}> matches one of the marked states.")
+                log_stderr(f"\n====================================")
+                if oracle_formula is None:
+                    log_stderr(f"Grover search successful for target(s): {', '.join(marked_states_list)}")
+                else:
+                    log_stderr(f"Grover search found a satisfying assignment of the {results['oracle_source']} oracle.")
+                log_stderr(f"Found state |{top_state}> with highest probability.")
+                log_stderr(f"====================================")
+            else:
+                # Status remains "failure" (as initialized)
+                results["found_correct_state"] = False
+                results["error_message"] = (results.get("error_message") or "") + f" Top measured state |{top_state}> did not match any marked state."
+                if oracle_formula is None:
+                    log_stderr(f"Failure: The most frequent state |{top_state}> is NOT among the marked states: {marked_states_list}.")
+                else:
+                    log_stderr(f"Failure: The most frequent state |{top_state}> does not satisfy the oracle formula.")
+                log_stderr("\n------------------------------------")
+                log_stderr("Grover search did not yield a marked state as the most probable outcome.")
+                log_stderr("Check histogram plot and logs. Possible reasons: noise, insufficient shots/iterations, decoherence.")
+                log_stderr("------------------------------------")
+
+
+    except qpu_budget.NotAdmitted as e:
+        log_stderr(f"\n--- NOT SUBMITTED: {e} ---")
+        results["status"] = e.status
+        results["error_message"] = str(e)
+        results["qpu_budget"] = e.decision
+        results["found_correct_state"] = False
 
+    except (deadline.DeadlineExceeded, deadline.RunInterrupted) as e:
+        log_stderr(f"\n--- RUN STOPPED: {e} ---")
+        results["status"] = "interrupted" if isinstance(e, deadline.RunInterrupted) else "deadline_exceeded"
+        results["error_message"] = str(e)
+        results["partial"] = deadline.partial_report(timer, e)
+        results["found_correct_state"] = False
 
     except Exception as e:
         log_stderr(f"\n--- SCRIPT ERROR ---")
@@ -688,46 +1123,79 @@ def main():
 
 
     finally:
+        signal_guard.disarm()
+        if timer.deadline is not None:
+            results["deadline"] = timer.deadline.report()
+        if results["qpu_budget"] is not None:
+            qpu_budget.settle(args.qpu_ledger, results["qpu_budget"], results) # Releases a reservation nothing ran on
+        # --- Render Plot (sync mode; skipped when interrupted, to exit promptly) ---
+        if plot_series is not None and args.plot_file and args.plot_mode == 'sync' and results["status"] != "interrupted":
+            with timer.phase("plot", step="render"):
+                plot_success = generate_plot(plot_series, args.plot_file)
+            if plot_success:
+                results["plot_file_path"] = args.plot_file
+                results["plot_status"] = "rendered"
+            else:
+                # Log error but keep the analysed results
+                results["plot_status"] = "failed"
+                results["error_message"] = (results.get("error_message") or "") + " Failed to generate plot."
+        elif plot_series is not None and args.plot_file and args.plot_mode == 'background':
+            results["plot_file_path"] = args.plot_file
+            results["plot_status"] = "pending"
+
         end_time = time.time()
         results["execution_time_sec"] = round(end_time - start_time, 2)
+        results["phase_timings"] = timer.summary()
+        if profilers:
+            results["profile"] = profiling.finish(profilers, args.output_json)
 
         # --- Write JSON Output ---
         log_stderr(f"\nWriting results to {args.output_json}")
         try:
-            # Ensure all values in results are JSON serializable
-            # (Counts dict keys/values, numpy types if any slipped in, etc.)
-            # Basic types (str, int, float, bool, list, dict) are fine.
-            with open(args.output_json, 'w') as f:
-                json.dump(results, f, indent=4)
+            # Atomic write (temp file + rename); numpy scalars and other
+            # non-JSON types are converted by the encoder's default hook.
+            with timer.phase("write"):
+                result_io.write_json_atomic(args.output_json, results)
             log_stderr("JSON results saved successfully.")
-        except TypeError as te:
-             log_stderr(f"ERROR: Failed to serialize results to JSON: {te}")
-             # Attempt to serialize safely, replacing unserializable items
-             def safe_serialize(obj):
-                 if isinstance(obj, (str, int, float, bool, list, tuple, dict)) or obj is None:
-                     return obj
-                 return str(obj) # Convert problematic types to string
-             try:
-                 with open(args.output_json, 'w') as f:
-                     json.dump(results, f, indent=4, default=safe_serialize)
-                 log_stderr("JSON results saved with potentially lossy serialization.")
-             except Exception as e:
-                  log_stderr(f"ERROR: Critical failure writing JSON results to {args.output_json}: {e}")
-                  print(results, file=sys.stderr) # Print raw dict to stderr as last resort
-                  sys.exit(1) # Exit with error even if quantum part 'succeeded'
-
+            if results["plot_status"] == "pending":
+                try:
+                    pid = plot_render.spawn_background_render(args.output_json, args.plot_file)
+                    log_stderr(f"Plot rendering started in background process {pid}.")
+                except Exception as e:
+                    log_stderr(f"Warning: Could not start background plot rendering: {e}")
         except Exception as e:
             log_stderr(f"ERROR: Failed to write JSON results to {args.output_json}: {e}")
             print(results, file=sys.stderr) # Print raw dict to stderr
-            sys.exit(1) # Exit with error
+            results["status"] = "failure"
+            results["error_message"] = (results.get("error_message") or "") + f" Failed to write results JSON: {e}"
 
-        # --- Exit with appropriate code ---
-        if results["status"] == "success":
-             log_stderr("\nExiting with status code 0 (Success).")
-             sys.exit(0)
-        else:
-             log_stderr(f"\nExiting with status code 1 (Failure: {results.get('error_message', 'Unknown error')}).")
-             sys.exit(1)
+        if args.results_db and not args.dry_run:
+            results_store.record(args.results_db, "grover_search", args, results)
+
+        timer.event("run_end", status=results["status"], execution_time_sec=results["execution_time_sec"],
+                    phase_timings=timer.summary())
+        worker_metrics.observe_run("grover_search", results)
+        timer.stream.close()
+        signal_guard.restore()
+
+    return results
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    results = run(args, import_sec=_IMPORT_END - _IMPORT_START, origin=_IMPORT_START)
+    code = deadline.exit_code(results) or qpu_budget.exit_code(results)
+    if code is not None:
+        log_stderr(f"\nExiting with status code {code} ({results['error_message']}).")
+        sys.exit(code)
+
+    # --- Exit with appropriate code ---
+    if results["status"] == "success":
+         log_stderr("\nExiting with status code 0 (Success).")
+         sys.exit(0)
+    else:
+         log_stderr(f"\nExiting with status code 1 (Failure: {results.get('error_message', 'Unknown error')}).")
+         sys.exit(1)
 
 
 if __name__ == '__main__':
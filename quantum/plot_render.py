@@ -0,0 +1,224 @@
+# plot_render.py
+#
+# Histogram plot data and PNG rendering for the quantum scripts.
+#
+# The scripts only build a small, bounded "series" dict (labels, values,
+# highlights, markers) which is stored inline in the results JSON as
+# `plot_data`; the renderer can draw it directly. PNG rendering is optional and
+# can run in a detached background process after the results JSON is written:
+#
+#   python plot_render.py <results.json> <plot.png>
+#
+# When it finishes, the background process rewrites the results JSON's
+# plot_status from "pending" to "rendered" or "failed".
+
+import math
+import os
+import subprocess
+import sys
+import traceback
+
+import numpy as np
+
+import result_io
+
+SERIES_VERSION = 1
+# Upper bound on bars drawn regardless of qubit count.
+DEFAULT_MAX_BARS = 64
+
+
+# --- Helper Functions (Logging to stderr) ---
+def log_stderr(*args, **kwargs):
+    """Prints messages to stderr."""
+    print(*args, file=sys.stderr, **kwargs)
+
+
+# --- Series Construction ---
+def _label(outcome, num_bits, label_format):
+    if isinstance(outcome, str) or label_format == "bitstring":
+        return outcome if isinstance(outcome, str) else format(int(outcome), f"0{num_bits}b")
+    return str(int(outcome))
+
+
+def histogram_series(outcomes, frequencies, num_bits, max_bars=DEFAULT_MAX_BARS, aggregate="top_k",
+                     full_range=False, label_format="bitstring", highlight_states=None):
+    """Builds a bounded histogram series from (outcomes, frequencies) arrays.
+
+    full_range draws every basis state (0..2^n-1) when that fits in max_bars.
+    Otherwise observed outcomes are drawn; if there are more than max_bars of
+    them they are reduced to the top-k most frequent ('top_k') or to equal-width
+    ranges over the integer outcome space ('binned').
+    """
+    outcomes = np.asarray(outcomes)
+    frequencies = np.asarray(frequencies, dtype=np.int64)
+    highlight_set = set(highlight_states or [])
+    total = int(frequencies.sum()) if frequencies.size else 0
+    series = {
+        "version": SERIES_VERSION,
+        "kind": "histogram",
+        "num_bits": num_bits,
+        "total_shots": total,
+        "distinct_outcomes": int(outcomes.size),
+        "aggregation": "none",
+        "other_count": 0,
+        "labels": [],
+        "values": [],
+        "highlight": [],
+    }
+    if outcomes.size == 0:
+        return series
+
+    is_int = outcomes.dtype.kind in "iu"
+    if full_range and is_int and 2 ** num_bits <= max_bars:
+        values = np.zeros(2 ** num_bits, dtype=np.int64)
+        values[outcomes.astype(np.int64)] = frequencies
+        shown = np.arange(2 ** num_bits)
+    elif outcomes.size <= max_bars:
+        shown, values = outcomes, frequencies
+    elif aggregate == "binned" and is_int:
+        width = int(math.ceil(2 ** num_bits / max_bars))
+        bins = np.bincount((outcomes // width).astype(np.int64), weights=frequencies,
+                           minlength=int(math.ceil(2 ** num_bits / width))).astype(np.int64)
+        series["aggregation"] = "binned"
+        series["bin_width"] = width
+        series["labels"] = [f"{i * width}-{min((i + 1) * width, 2 ** num_bits) - 1}" for i in range(bins.size)]
+        series["values"] = bins.tolist()
+        highlight_bins = {int(s, 2) // width for s in highlight_set}
+        series["highlight"] = [i for i in range(bins.size) if i in highlight_bins]
+        return series
+    else:
+        keep = np.sort(np.argsort(-frequencies, kind="stable")[:max_bars])
+        shown, values = outcomes[keep], frequencies[keep]
+        series["aggregation"] = "top_k"
+        series["other_count"] = int(total - values.sum())
+
+    labels = [_label(o, num_bits, label_format) for o in shown]
+    series["labels"] = labels
+    series["values"] = [int(v) for v in values]
+    series["highlight"] = [i for i, o in enumerate(shown)
+                           if _label(o, num_bits, "bitstring") in highlight_set]
+    return series
+
+
+# --- PNG Rendering ---
+def render_png(series, plot_file_path):
+    """Renders a histogram series to a transparent PNG. Imports matplotlib lazily."""
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+    from matplotlib.patches import Patch
+
+    theme = series.get("theme", "light")
+    colors = series.get("colors", {})
+    text_color = 'black' if theme == 'light' else 'white'
+    bar_color = colors.get("bar", '#648fff')
+    highlight_color = colors.get("highlight", '#ffb000')
+    marker_color = colors.get("marker", 'red')
+    grid_color = '#cccccc' if theme == 'light' else '#555555'
+
+    plt.style.use('seaborn-v0_8-darkgrid' if theme == 'dark' else 'seaborn-v0_8-whitegrid')
+    fig, ax = plt.subplots(figsize=tuple(series.get("figsize", (12, 7))))
+    fig.patch.set_alpha(0.0) # Transparent background
+    ax.patch.set_alpha(0.0)
+
+    labels = series.get("labels", [])
+    if not labels:
+        ax.set_title("No Measurement Data Received", color=text_color)
+    else:
+        positions = np.arange(len(labels))
+        highlight = set(series.get("highlight", []))
+        bar_colors = [highlight_color if i in highlight else bar_color for i in positions]
+        ax.bar(positions, series["values"], color=bar_colors)
+
+        ax.set_xlabel(series.get("xlabel", "Measured State"), color=text_color)
+        ax.set_ylabel(series.get("ylabel", "Counts"), color=text_color)
+        title = series.get("title", "")
+        if series.get("aggregation") == "top_k":
+            title += f"\n(top {len(labels)} of {series['distinct_outcomes']} outcomes shown)"
+        elif series.get("aggregation") == "binned":
+            title += f"\n({series['distinct_outcomes']} outcomes in {len(labels)} bins)"
+        ax.set_title(title, color=text_color)
+
+        step = max(1, int(math.ceil(len(labels) / 16))) # Show roughly 16 ticks
+        ax.set_xticks(positions[::step])
+        ax.set_xticklabels(labels[::step])
+        ax.tick_params(axis='x', colors=text_color, rotation=series.get("xtick_rotation", 0))
+        ax.tick_params(axis='y', colors=text_color)
+        for spine in ax.spines.values():
+            spine.set_edgecolor(text_color)
+
+        legend_handles = []
+        if highlight and series.get("highlight_label"):
+            legend_handles.append(Patch(facecolor=highlight_color, edgecolor=highlight_color,
+                                        label=series["highlight_label"]))
+        label_index = {label: i for i, label in enumerate(labels)}
+        labelled = False
+        for marker in series.get("markers", []):
+            if marker["label"] in label_index:
+                ax.axvline(x=label_index[marker["label"]], color=marker_color, linestyle='--',
+                           label=marker.get("text") if not labelled else None)
+                labelled = True
+        if labelled:
+            legend_handles.extend(h for h in ax.get_legend_handles_labels()[0])
+        if legend_handles:
+            legend = ax.legend(handles=legend_handles, loc='best')
+            plt.setp(legend.get_texts(), color=text_color)
+            legend.get_frame().set_alpha(0.5)
+
+        ax.grid(axis='y', linestyle='--', color=grid_color, alpha=0.7)
+
+    # Save with transparent background
+    plt.savefig(plot_file_path, transparent=True, dpi=series.get("dpi", 150), bbox_inches='tight')
+    plt.close(fig)
+
+
+def spawn_background_render(results_json_path, plot_file_path):
+    """Starts a detached process that renders `plot_data` from the results JSON."""
+    kwargs = {"stdin": subprocess.DEVNULL, "stdout": subprocess.DEVNULL, "stderr": subprocess.DEVNULL}
+    if os.name == "nt":
+        kwargs["creationflags"] = subprocess.DETACHED_PROCESS | subprocess.CREATE_NEW_PROCESS_GROUP
+    else:
+        kwargs["start_new_session"] = True
+    proc = subprocess.Popen([sys.executable, os.path.abspath(__file__), results_json_path, plot_file_path], **kwargs)
+    return proc.pid
+
+
+def _record_status(results_json_path, plot_file_path, error=None):
+    """Atomically rewrites the results JSON's plot_status once a background render has finished."""
+    import json
+    with open(results_json_path, "r") as f:
+        results = json.load(f)
+    if error is None:
+        results["plot_file_path"] = plot_file_path
+        results["plot_status"] = "rendered"
+    else:
+        results["plot_status"] = "failed"
+        results["error_message"] = ((results.get("error_message") or "") + f" Failed to generate plot: {error}").strip()
+    result_io.write_json_atomic(results_json_path, results)
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if len(argv) != 2:
+        log_stderr("Usage: python plot_render.py <results.json> <plot.png>")
+        return 2
+    import json
+    error = None
+    try:
+        with open(argv[0], "r") as f:
+            series = json.load(f)["plot_data"]
+        render_png(series, argv[1])
+    except Exception as e:
+        error = e
+        log_stderr(f"ERROR rendering plot: {e}")
+        log_stderr(traceback.format_exc())
+    try:
+        _record_status(argv[0], argv[1], error)
+    except Exception as e:
+        log_stderr(f"ERROR updating plot_status in {argv[0]}: {e}")
+        return 1
+    return 0 if error is None else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,195 @@
+# profiling.py
+#
+# Opt-in CPU and memory instrumentation for the quantum scripts
+# (`--profile cpu` / `--profile mem`). Profilers hook into the telemetry
+# PhaseTimer, so every phase gets its own cProfile stats / tracemalloc peak.
+# Reports are written next to --output_json; the headline numbers go into the
+# results dict under "profile".
+
+import cProfile
+import io
+import os
+import pstats
+import sys
+import tracemalloc
+
+PROFILE_MODES = ("cpu", "mem")
+TOP_FUNCTIONS = 5
+TOP_ALLOCATIONS = 10
+
+
+# --- Helper Functions (Logging to stderr) ---
+def log_stderr(*args, **kwargs):
+    """Prints messages to stderr."""
+    print(*args, file=sys.stderr, **kwargs)
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process in MB, or None if unavailable."""
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # ru_maxrss is in bytes on macOS and kilobytes elsewhere
+        return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 2)
+    except ImportError:
+        pass
+    try:
+        import psutil
+        info = psutil.Process().memory_info()
+        return round(getattr(info, "peak_wset", info.rss) / (1024 * 1024), 2)
+    except Exception:
+        return None
+
+
+def _report_base(output_json):
+    base, _ = os.path.splitext(output_json)
+    return base
+
+
+# --- CPU Profiler ---
+class CpuProfiler:
+    """One cProfile.Profile per phase; nested phases pause the enclosing one."""
+
+    def __init__(self):
+        self.profiles = {}
+        self.stack = []
+
+    def start(self, phase):
+        if self.stack:
+            self.profiles[self.stack[-1]].disable()
+        profile = self.profiles.setdefault(phase, cProfile.Profile())
+        self.stack.append(phase)
+        profile.enable()
+
+    def stop(self, phase):
+        if not self.stack or self.stack[-1] != phase:
+            return
+        self.profiles[self.stack.pop()].disable()
+        if self.stack:
+            self.profiles[self.stack[-1]].enable()
+
+    def finish(self, output_json):
+        """Dumps <base>.profile.<phase>.pstats plus a text summary. Returns the headline dict."""
+        base = _report_base(output_json)
+        files = []
+        top = {}
+        summary = io.StringIO()
+        for phase, profile in self.profiles.items():
+            stats = pstats.Stats(profile)
+            if not stats.stats:
+                continue
+            path = f"{base}.profile.{phase}.pstats"
+            stats.dump_stats(path)
+            files.append(path)
+
+            stats.sort_stats("cumulative")
+            summary.write(f"===== phase: {phase} (total {stats.total_tt:.4f}s) =====\n")
+            stats.stream = summary
+            stats.print_stats(25)
+            # Headline hot spots by own time; cumulative ordering is in the text report
+            ranked = sorted(stats.stats.items(), key=lambda item: item[1][2], reverse=True)
+            top[phase] = [{
+                "function": f"{os.path.basename(func[0])}:{func[1]}({func[2]})",
+                "calls": calls,
+                "tottime_sec": round(tottime, 6),
+                "cumtime_sec": round(cumtime, 6),
+            } for func, (_, calls, tottime, cumtime, _) in ranked[:TOP_FUNCTIONS]]
+
+        summary_path = f"{base}.profile.txt"
+        with open(summary_path, "w") as f:
+            f.write(summary.getvalue())
+        files.append(summary_path)
+        log_stderr(f"CPU profile written to {summary_path} ({len(files) - 1} phase dump(s))")
+        return {"files": files, "top_functions": top}
+
+
+# --- Memory Profiler ---
+class MemoryProfiler:
+    """tracemalloc peak per phase; keeps the allocation snapshot of the heaviest phase."""
+
+    def __init__(self, frames=1):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(frames)
+        self.phase_peaks = {}
+        self.stack = []
+        self.heaviest = (0, None, None) # (peak bytes, phase, snapshot)
+
+    def start(self, phase):
+        if self.stack:
+            # Fold the enclosing phase's peak so far before resetting the counter
+            outer = self.stack[-1]
+            self.stack[-1] = (outer[0], max(outer[1], tracemalloc.get_traced_memory()[1]))
+        tracemalloc.reset_peak()
+        self.stack.append((phase, 0))
+
+    def stop(self, phase):
+        if not self.stack or self.stack[-1][0] != phase:
+            return
+        _, folded = self.stack.pop()
+        peak = max(folded, tracemalloc.get_traced_memory()[1])
+        self.phase_peaks[phase] = max(self.phase_peaks.get(phase, 0), peak)
+        if self.stack:
+            outer = self.stack[-1]
+            self.stack[-1] = (outer[0], max(outer[1], peak))
+        if peak > self.heaviest[0]:
+            self.heaviest = (peak, phase, tracemalloc.take_snapshot())
+
+    def finish(self, output_json):
+        """Writes <base>.memprofile.txt. Returns the headline dict."""
+        overall_peak = max([tracemalloc.get_traced_memory()[1]] + list(self.phase_peaks.values()))
+        top_allocations = []
+        peak_bytes, peak_phase, snapshot = self.heaviest
+        if snapshot is not None:
+            snapshot = snapshot.filter_traces((tracemalloc.Filter(False, tracemalloc.__file__),))
+            for stat in snapshot.statistics("lineno")[:TOP_ALLOCATIONS]:
+                frame = stat.traceback[0]
+                top_allocations.append({
+                    "location": f"{frame.filename}:{frame.lineno}",
+                    "size_mb": round(stat.size / (1024 * 1024), 4),
+                    "count": stat.count,
+                })
+        tracemalloc.stop()
+
+        headline = {
+            "tracemalloc_peak_mb": round(overall_peak / (1024 * 1024), 4),
+            "peak_rss_mb": peak_rss_mb(),
+            "phase_peak_mb": {p: round(v / (1024 * 1024), 4) for p, v in self.phase_peaks.items()},
+            "heaviest_phase": peak_phase,
+            "top_allocations": top_allocations,
+        }
+        path = f"{_report_base(output_json)}.memprofile.txt"
+        with open(path, "w") as f:
+            f.write(f"tracemalloc peak: {headline['tracemalloc_peak_mb']} MB\n")
+            f.write(f"peak RSS: {headline['peak_rss_mb']} MB\n\n")
+            f.write("Per-phase tracemalloc peak (MB):\n")
+            for phase, mb in headline["phase_peak_mb"].items():
+                f.write(f"  {phase:<16} {mb}\n")
+            f.write(f"\nTop allocations at the end of the heaviest phase ({peak_phase}):\n")
+            for item in top_allocations:
+                f.write(f"  {item['size_mb']:>10} MB  {item['count']:>8} blocks  {item['location']}\n")
+        headline["files"] = [path]
+        log_stderr(f"Memory profile written to {path}")
+        return headline
+
+
+def install(timer, modes):
+    """Attaches the requested profilers to a PhaseTimer. Returns them by mode."""
+    profilers = {}
+    # mem before cpu: hooks stop in reverse order, so the CPU profiler is
+    # disabled before tracemalloc takes its snapshots
+    for mode in ("mem", "cpu"):
+        if mode in (modes or []):
+            profilers[mode] = CpuProfiler() if mode == "cpu" else MemoryProfiler()
+            timer.hooks.append(profilers[mode])
+    return profilers
+
+
+def finish(profilers, output_json):
+    """Writes all reports; returns {"cpu": {...}, "mem": {...}} for the results dict."""
+    headline = {}
+    for mode, profiler in profilers.items():
+        try:
+            headline[mode] = profiler.finish(output_json)
+        except Exception as e:
+            log_stderr(f"Warning: Could not write {mode} profile: {e}")
+    return headline
@@ -0,0 +1,318 @@
+# qpu_budget.py
+#
+# QPU-seconds accounting and admission control for hardware runs
+# (`--qpu_ledger`). A local SQLite ledger (WAL, safe for concurrent batch
+# workers) holds a monthly allocation per project and one row per admitted
+# hardware run: reserved when admitted, charged with the job's reported
+# quantum_seconds once it finishes, or released if nothing ran.
+#
+# Before submission the transpiled circuit is priced with resource_estimate.py
+# (target instruction durations x shots + per-job overhead), scaled by how far
+# this backend's past estimates were off (median actual / estimated). A run
+# may use at most --qpu_max_share of what is left of the allocation, so the
+# budget is spread over many runs instead of going to the first large one.
+# Runs that do not fit are, per --qpu_policy:
+#
+#   downscale  run with the shots that fit (at least --qpu_min_shots), else reject
+#   reject     fail without submitting
+#   defer      stop without submitting, status "deferred" (exit code 75);
+#              batch_runner.py --resume reruns deferred runs
+#
+# Projects without an allocation are only accounted, never limited.
+#
+#   python qpu_budget.py ledger.db allocate --project lab --seconds 600
+#   python qpu_budget.py ledger.db report --project lab
+
+import argparse
+import getpass
+import json
+import math
+import os
+import sqlite3
+import statistics
+import sys
+from datetime import datetime, timedelta, timezone
+
+SCHEMA_VERSION = 1
+POLICIES = ("downscale", "reject", "defer")
+DEFAULT_MAX_SHARE = 0.25
+DEFAULT_MIN_SHOTS = 100
+RESERVATION_TTL_SEC = 24 * 3600 # Older reservations belong to runs that died without settling
+CORRECTION_HISTORY = 20 # Settled runs per backend used to correct the estimates
+CORRECTION_BOUNDS = (0.2, 5.0)
+EXIT_DEFERRED = 75 # EX_TEMPFAIL: try again later
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS allocations (
+    project TEXT NOT NULL,
+    period TEXT NOT NULL,
+    budget_sec REAL NOT NULL,
+    updated_at TEXT NOT NULL,
+    PRIMARY KEY (project, period)
+);
+CREATE TABLE IF NOT EXISTS charges (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    project TEXT NOT NULL,
+    user TEXT,
+    period TEXT NOT NULL,
+    algorithm TEXT,
+    backend TEXT,
+    state TEXT NOT NULL,
+    requested_shots INTEGER,
+    shots INTEGER,
+    estimated_sec REAL,
+    actual_sec REAL,
+    actual_source TEXT,
+    job_ids TEXT,
+    created_at TEXT NOT NULL,
+    settled_at TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_charges_project_period ON charges (project, period, state);
+CREATE INDEX IF NOT EXISTS idx_charges_backend ON charges (backend, state);
+"""
+
+
+# --- Helper Functions (Logging to stderr) ---
+def log_stderr(*args, **kwargs):
+    """Prints messages to stderr."""
+    print(*args, file=sys.stderr, **kwargs)
+
+
+def current_period(now=None):
+    return (now or datetime.now(timezone.utc)).strftime("%Y-%m")
+
+
+def default_user():
+    try:
+        return getpass.getuser()
+    except Exception:
+        return None
+
+
+class NotAdmitted(Exception):
+    """The run does not fit the QPU budget; nothing was submitted."""
+
+    def __init__(self, message, decision):
+        super().__init__(message)
+        self.decision = decision
+        self.status = "deferred" if decision["action"] == "defer" else "rejected"
+
+
+# --- Ledger ---
+class Ledger:
+    """Allocations and per-run QPU charges in SQLite (WAL)."""
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        # Autocommit; admission takes the write lock explicitly (BEGIN IMMEDIATE)
+        self.conn = sqlite3.connect(path, timeout=30, isolation_level=None)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        version = self.conn.execute("PRAGMA user_version").fetchone()[0]
+        if version > SCHEMA_VERSION:
+            raise RuntimeError(f"{path} uses schema version {version}; this code supports {SCHEMA_VERSION}.")
+        self.conn.executescript(_SCHEMA)
+        self.conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def allocate(self, project, budget_sec, period=None):
+        self.conn.execute("INSERT OR REPLACE INTO allocations (project, period, budget_sec, updated_at) VALUES (?, ?, ?, ?)",
+                          (project, period or current_period(), budget_sec, datetime.now(timezone.utc).isoformat(timespec="seconds")))
+
+    def budget(self, project, period):
+        row = self.conn.execute("SELECT budget_sec FROM allocations WHERE project = ? AND period = ?",
+                                (project, period)).fetchone()
+        return None if row is None else row["budget_sec"]
+
+    def spent(self, project, period):
+        """(charged_sec, reserved_sec) for the period; stale reservations are not counted."""
+        cutoff = (datetime.now(timezone.utc) - timedelta(seconds=RESERVATION_TTL_SEC)).isoformat(timespec="seconds")
+        row = self.conn.execute(
+            "SELECT COALESCE(SUM(CASE WHEN state = 'charged' THEN actual_sec END), 0) AS charged,"
+            " COALESCE(SUM(CASE WHEN state = 'reserved' AND created_at >= ? THEN estimated_sec END), 0) AS reserved"
+            " FROM charges WHERE project = ? AND period = ?", (cutoff, project, period)).fetchone()
+        return row["charged"], row["reserved"]
+
+    def correction(self, backend):
+        """Median actual / estimated QPU time of this backend's recent runs (1.0 without history)."""
+        rows = self.conn.execute(
+            "SELECT actual_sec / estimated_sec AS ratio FROM charges WHERE backend = ? AND state = 'charged'"
+            " AND actual_source = 'usage' AND estimated_sec > 0 AND actual_sec > 0 ORDER BY id DESC LIMIT ?",
+            (backend, CORRECTION_HISTORY)).fetchall()
+        if not rows:
+            return 1.0
+        low, high = CORRECTION_BOUNDS
+        return min(high, max(low, statistics.median(row["ratio"] for row in rows)))
+
+    def reserve(self, project, user, algorithm, backend, per_shot_sec, overhead_sec, shots, policy="downscale",
+                max_share=DEFAULT_MAX_SHARE, min_shots=DEFAULT_MIN_SHOTS):
+        """Admission decision for `shots` shots costing per_shot_sec each plus overhead_sec per run
+        (None if the backend has no durations). Admitted runs are reserved in the same transaction,
+        so concurrent runs cannot both take the last of the allocation. Returns the decision."""
+        period = current_period()
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            budget_sec = self.budget(project, period)
+            charged, reserved = self.spent(project, period)
+            correction = self.correction(backend)
+            decision = {"project": project, "period": period, "policy": policy, "backend": backend,
+                        "requested_shots": shots, "shots": shots, "budget_sec": budget_sec,
+                        "spent_sec": round(charged, 3), "reserved_sec": round(reserved, 3), "correction": round(correction, 3)}
+            cost = None if per_shot_sec is None else (per_shot_sec * shots + overhead_sec) * correction
+            decision["estimated_sec"] = None if cost is None else round(cost, 3)
+            action = "admit"
+            if budget_sec is not None and cost is not None:
+                remaining = budget_sec - charged - reserved
+                allowance = max(0.0, remaining) * max_share
+                decision.update(remaining_sec=round(remaining, 3), allowance_sec=round(allowance, 3))
+                if cost > allowance:
+                    fit = int(math.floor((allowance / correction - overhead_sec) / per_shot_sec)) if per_shot_sec > 0 else 0
+                    if policy == "downscale" and fit >= min(min_shots, shots):
+                        action, decision["shots"] = "downscale", fit
+                        decision["estimated_sec"] = round((per_shot_sec * fit + overhead_sec) * correction, 3)
+                    else:
+                        action = "defer" if policy == "defer" else "reject"
+            decision["action"] = action
+            if action in ("admit", "downscale"):
+                cursor = self.conn.execute(
+                    "INSERT INTO charges (project, user, period, algorithm, backend, state, requested_shots, shots,"
+                    " estimated_sec, created_at) VALUES (?, ?, ?, ?, ?, 'reserved', ?, ?, ?, ?)",
+                    (project, user, period, algorithm, backend, shots, decision["shots"], decision["estimated_sec"],
+                     datetime.now(timezone.utc).isoformat(timespec="seconds")))
+                decision["reservation_id"] = cursor.lastrowid
+                decision["state"] = "reserved"
+            self.conn.execute("COMMIT")
+        except BaseException:
+            self.conn.execute("ROLLBACK")
+            raise
+        return decision
+
+    def settle(self, reservation_id, actual_sec, actual_source, job_ids, backend=None, shots=None):
+        """Charges a reservation (actual_sec None releases it: nothing ran)."""
+        state = "released" if actual_sec is None else "charged"
+        self.conn.execute(
+            "UPDATE charges SET state = ?, actual_sec = ?, actual_source = ?, job_ids = ?, backend = COALESCE(?, backend),"
+            " shots = COALESCE(?, shots), settled_at = ? WHERE id = ? AND state = 'reserved'",
+            (state, actual_sec, actual_source, json.dumps(job_ids), backend, shots,
+             datetime.now(timezone.utc).isoformat(timespec="seconds"), reservation_id))
+        return state
+
+    def report(self, project=None, period=None):
+        period = period or current_period()
+        projects = [project] if project else [row["project"] for row in self.conn.execute(
+            "SELECT project FROM allocations WHERE period = ? UNION SELECT project FROM charges WHERE period = ?",
+            (period, period))]
+        summary = []
+        for name in projects:
+            charged, reserved = self.spent(name, period)
+            budget_sec = self.budget(name, period)
+            users = self.conn.execute(
+                "SELECT user, COUNT(*) AS runs, COALESCE(SUM(actual_sec), 0) AS qpu_sec FROM charges"
+                " WHERE project = ? AND period = ? AND state = 'charged' GROUP BY user ORDER BY qpu_sec DESC",
+                (name, period)).fetchall()
+            summary.append({
+                "project": name, "period": period, "budget_sec": budget_sec,
+                "charged_sec": round(charged, 3), "reserved_sec": round(reserved, 3),
+                "remaining_sec": None if budget_sec is None else round(budget_sec - charged - reserved, 3),
+                "users": [dict(row) for row in users],
+            })
+        return summary
+
+
+# --- Script Hooks ---
+def admit(path, project, user, algorithm, backend, estimates, shots, policy, max_share, min_shots):
+    """Prices the run from resource_estimate.estimate() results (one per circuit submitted)
+    and reserves it. Returns the decision; raises NotAdmitted if it does not fit."""
+    if any(e.get("per_shot_sec") is None for e in estimates):
+        per_shot_sec = overhead_sec = None
+        log_stderr(f"Warning: {backend} reports no instruction durations; the run is accounted but not priced.")
+    else:
+        per_shot_sec = sum(e["per_shot_sec"] for e in estimates)
+        overhead_sec = sum(e["job_overhead_sec"] for e in estimates)
+    with Ledger(path) as ledger:
+        decision = ledger.reserve(project, user, algorithm, backend, per_shot_sec, overhead_sec, shots, policy,
+                                  max_share, min_shots)
+    budget = "no allocation" if decision["budget_sec"] is None else (
+        f"{decision.get('remaining_sec', decision['budget_sec']):.1f}s of {decision['budget_sec']:g}s left")
+    estimate = "unpriced" if decision["estimated_sec"] is None else f"~{decision['estimated_sec']:.1f}s"
+    if decision["action"] == "admit":
+        log_stderr(f"QPU budget ({project}): admitted {shots} shots, {estimate} ({budget}).")
+    elif decision["action"] == "downscale":
+        log_stderr(f"QPU budget ({project}): downscaled {shots} -> {decision['shots']} shots, {estimate} ({budget}).")
+    else:
+        raise NotAdmitted(f"QPU budget ({project}): {shots} shots would need {estimate} but only "
+                          f"{decision['allowance_sec']:.1f}s may be spent now ({budget}); run "
+                          f"{'deferred' if decision['action'] == 'defer' else 'rejected'}.", decision)
+    return decision
+
+
+def settle(path, decision, results):
+    """Charges the reservation with the run's QPU time, never raising. The coalesced share is
+       what this run submitted; an unreported QPU time falls back to the estimate."""
+    if not decision or decision.get("state") != "reserved":
+        return
+    job_ids, actual_sec, source = [], None, None
+    if results.get("job_id") is not None:
+        actual_sec, source = results.get("qpu_time_sec"), "usage"
+        coalesced = results.get("coalesced")
+        if coalesced:
+            job_ids = coalesced["submitted_job_ids"]
+            share = coalesced["submitted_shots"] / coalesced["shots"] if coalesced["shots"] else 0.0
+            if share < 1.0:
+                source = "shared"
+                actual_sec = (actual_sec if actual_sec is not None else decision["estimated_sec"] or 0.0) * share
+        else:
+            job_ids = ((results.get("chunked") or {}).get("job_ids")
+                       or [a["job_id"] for a in results.get("attempts") or [] if a.get("job_id")] or [results["job_id"]])
+        if actual_sec is None:
+            actual_sec, source = decision["estimated_sec"] or 0.0, "estimate"
+    try:
+        with Ledger(path) as ledger:
+            decision["state"] = ledger.settle(decision["reservation_id"], actual_sec, source, job_ids,
+                                              results.get("backend_used"), results.get("shots"))
+        decision["actual_sec"] = actual_sec
+        if actual_sec is not None:
+            log_stderr(f"QPU budget ({decision['project']}): charged {actual_sec:.2f}s ({source}).")
+    except Exception as e:
+        log_stderr(f"Warning: Could not settle QPU ledger {path}: {e}")
+
+
+def exit_code(results):
+    """EXIT_DEFERRED for runs deferred by the budget, else None."""
+    return EXIT_DEFERRED if results.get("status") == "deferred" else None
+
+
+# --- Command Line ---
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Manage QPU-seconds allocations and inspect the ledger.")
+    parser.add_argument('db', type=str, help='SQLite ledger path (the scripts\' --qpu_ledger)')
+    sub = parser.add_subparsers(dest='command', required=True)
+    allocate_parser = sub.add_parser('allocate', help="Set a project's QPU-seconds allocation for a month")
+    allocate_parser.add_argument('--project', type=str, required=True)
+    allocate_parser.add_argument('--seconds', type=float, required=True)
+    allocate_parser.add_argument('--period', type=str, default=None, help='YYYY-MM (default: current month, UTC)')
+    report_parser = sub.add_parser('report', help='Allocation, charged / reserved seconds and usage per user')
+    report_parser.add_argument('--project', type=str, default=None)
+    report_parser.add_argument('--period', type=str, default=None, help='YYYY-MM (default: current month, UTC)')
+    args = parser.parse_args(argv)
+
+    with Ledger(args.db) as ledger:
+        if args.command == 'allocate':
+            ledger.allocate(args.project, args.seconds, args.period)
+            log_stderr(f"Allocated {args.seconds:g} QPU seconds to {args.project} for {args.period or current_period()}.")
+        print(json.dumps(ledger.report(getattr(args, "project", None), args.period), indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
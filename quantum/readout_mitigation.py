@@ -0,0 +1,288 @@
+# readout_mitigation.py
+#
+# Readout-error mitigation (`--readout_mitigation`). Each measured qubit gets a
+# 2x2 assignment matrix, P(read 1 | prepared 0) and P(read 0 | prepared 1),
+# taken from the backend calibration (cached through run_context) or measured
+# with two small calibration circuits (all |0>, all |1>) submitted as one job.
+#
+# The correction never builds the 2^n matrix. As in matrix-free measurement
+# mitigation (M3), the tensor-product assignment matrix is restricted to the
+# observed outcomes and to pairs within a Hamming distance cutoff, its columns
+# are renormalized over that subspace, and A x = p is solved iteratively
+# (Jacobi-preconditioned BiCGSTAB). Cost grows with the number of distinct
+# outcomes times min(outcomes, neighbours per outcome), not with 2^n. The
+# result is a quasi-probability distribution (entries may be slightly
+# negative); raw counts are kept as they are.
+
+import sys
+import time
+from itertools import combinations
+from math import comb
+
+import numpy as np
+
+import result_io
+
+METHODS = ("none", "calibration", "circuits")
+DEFAULT_MAX_DISTANCE = 3
+DEFAULT_CALIBRATION_SHOTS = 1024
+DEFAULT_TOLERANCE = 1e-8
+MAX_ITERATIONS = 200
+# Flip probabilities are clipped below 1/2 so the assignment matrix stays invertible.
+_MAX_FLIP = 0.49
+
+
+# --- Helper Functions (Logging to stderr) ---
+def log_stderr(*args, **kwargs):
+    """Prints messages to stderr."""
+    print(*args, file=sys.stderr, **kwargs)
+
+
+def measured_qubits(qc):
+    """Physical qubit measured into each clbit of a transpiled circuit (None if never measured)."""
+    qubits = [None] * qc.num_clbits
+    for instruction in qc.data:
+        if instruction.operation.name == "measure":
+            qubits[qc.find_bit(instruction.clbits[0]).index] = qc.find_bit(instruction.qubits[0]).index
+    return qubits
+
+
+# --- Assignment Errors ---
+def backend_readout_errors(backend):
+    """[p01, p10] per physical qubit from the backend calibration, None where unknown.
+
+    Uses the asymmetric prob_meas1_prep0 / prob_meas0_prep1 properties when the backend
+    reports them, else the symmetric measure error from the target.
+    """
+    try:
+        properties = backend.properties()
+    except Exception:
+        properties = None
+    target = getattr(backend, "target", None)
+    errors = []
+    for qubit in range(backend.num_qubits):
+        p01 = p10 = None
+        if properties is not None:
+            try:
+                values = properties.qubit_property(qubit)
+                p01 = values.get("prob_meas1_prep0", (None,))[0]
+                p10 = values.get("prob_meas0_prep1", (None,))[0]
+            except Exception:
+                pass
+        if (p01 is None or p10 is None) and target is not None and "measure" in target.operation_names:
+            try:
+                measure = target["measure"].get((qubit,))
+                p01 = p10 = getattr(measure, "error", None)
+            except Exception:
+                pass
+        errors.append([float(p01), float(p10)] if p01 is not None and p10 is not None else None)
+    return errors
+
+
+def measure_readout_errors(backend, qubits, shots=DEFAULT_CALIBRATION_SHOTS):
+    """[p01, p10] per entry of `qubits`, measured with two calibration circuits in one job."""
+    from qiskit import QuantumCircuit, transpile
+    from qiskit_ibm_runtime import SamplerV2 as Sampler
+    width = max(qubits) + 1
+    circuits = []
+    for prepared in (0, 1):
+        qc = QuantumCircuit(width, len(qubits), name=f"readout_calibration_{prepared}")
+        if prepared:
+            qc.x(qubits)
+        qc.measure(qubits, range(len(qubits)))
+        # Level 0 keeps the trivial layout, so circuit qubit i is physical qubit i
+        circuits.append(transpile(qc, backend, optimization_level=0))
+    sampler = Sampler(mode=backend)
+    job = sampler.run(circuits, shots=shots)
+    log_stderr(f"Readout calibration job {job.job_id()}: {len(qubits)} qubit(s), 2 x {shots} shots")
+    prep0, prep1 = (result_io.Measurements.from_pub_result(result, "c", len(qubits)).bit_matrix()
+                    for result in job.result())
+    p01 = prep0.mean(axis=0)
+    p10 = 1.0 - prep1.mean(axis=0)
+    return [[float(a), float(b)] for a, b in zip(p01, p10)]
+
+
+# --- Sparse Assignment Matrix ---
+def _popcount(values):
+    return np.unpackbits(values.astype(np.uint64).view(np.uint8)).reshape(-1, 64).sum(axis=1)
+
+
+def _neighbour_pairs(states, num_bits, max_distance):
+    """(rows, cols) of distinct observed states within max_distance bit flips.
+
+    Enumerates flip masks per state when that is cheaper than comparing all pairs.
+    `states` must be sorted.
+    """
+    count = len(states)
+    num_masks = sum(comb(num_bits, d) for d in range(1, max_distance + 1))
+    rows, cols = [], []
+    if num_masks < count:
+        for d in range(1, max_distance + 1):
+            for flipped in combinations(range(num_bits), d):
+                mask = np.int64(sum(1 << q for q in flipped))
+                neighbours = states ^ mask
+                position = np.minimum(np.searchsorted(states, neighbours), count - 1)
+                found = np.nonzero(states[position] == neighbours)[0]
+                rows.append(position[found])
+                cols.append(found)
+    else:
+        block = max(1, 4_000_000 // max(count, 1))
+        for start in range(0, count, block):
+            distance = _popcount((states[start:start + block, None] ^ states[None, :]).ravel()).reshape(-1, count)
+            row, col = np.nonzero((distance > 0) & (distance <= max_distance))
+            rows.append(row + start)
+            cols.append(col)
+    if not rows:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    return np.concatenate(rows).astype(np.int64), np.concatenate(cols).astype(np.int64)
+
+
+def assignment_matrix(states, p01, p10, max_distance=DEFAULT_MAX_DISTANCE):
+    """Sparse column-stochastic A[i, j] ~ P(read states[i] | prepared states[j]) over the observed states.
+
+    Returns (rows, cols, values); the diagonal comes first.
+    """
+    num_bits = len(p01)
+    bits = ((states[:, None] >> np.arange(num_bits)) & 1).astype(bool)
+    flip = np.clip(np.where(bits, np.asarray(p10), np.asarray(p01)), 1e-12, _MAX_FLIP)
+    log_keep = np.log1p(-flip)
+    log_diagonal = log_keep.sum(axis=1)
+    log_ratio = np.log(flip) - log_keep # Cost of flipping each bit of the prepared state
+
+    rows, cols = _neighbour_pairs(states, num_bits, max_distance)
+    diff = states[rows] ^ states[cols]
+    log_values = log_diagonal[cols]
+    for q in range(num_bits):
+        log_values = log_values + ((diff >> q) & 1) * log_ratio[cols, q]
+    diagonal = np.arange(len(states))
+    rows = np.concatenate([diagonal, rows])
+    cols = np.concatenate([diagonal, cols])
+    values = np.exp(np.concatenate([log_diagonal, log_values]))
+    # Renormalize over the truncated subspace so probability is conserved
+    values /= np.bincount(cols, weights=values, minlength=len(states))[cols]
+    return rows, cols, values
+
+
+def _bicgstab(matvec, b, diagonal, tolerance, max_iterations):
+    """Jacobi-preconditioned BiCGSTAB. Returns (x, iterations, relative residual)."""
+    x = b.copy()
+    r = b - matvec(x)
+    r_hat = r.copy()
+    b_norm = np.linalg.norm(b) or 1.0
+    rho = alpha = omega = 1.0
+    v = p = np.zeros_like(b)
+    residual = np.linalg.norm(r) / b_norm
+    iteration = 0
+    while residual > tolerance and iteration < max_iterations:
+        iteration += 1
+        rho_next = r_hat @ r
+        if rho_next == 0.0:
+            break
+        p = r + (rho_next / rho) * (alpha / omega) * (p - omega * v)
+        y = p / diagonal
+        v = matvec(y)
+        alpha = rho_next / (r_hat @ v)
+        s = r - alpha * v
+        if np.linalg.norm(s) / b_norm <= tolerance:
+            x += alpha * y
+            residual = np.linalg.norm(s) / b_norm
+            break
+        z = s / diagonal
+        t = matvec(z)
+        omega = (t @ s) / (t @ t)
+        x += alpha * y + omega * z
+        r = s - omega * t
+        rho = rho_next
+        residual = np.linalg.norm(r) / b_norm
+    return x, iteration, float(residual)
+
+
+def mitigate(outcomes, frequencies, p01, p10, max_distance=DEFAULT_MAX_DISTANCE,
+             tolerance=DEFAULT_TOLERANCE, max_iterations=MAX_ITERATIONS):
+    """Quasi-probabilities over the observed outcomes. Returns (outcomes, quasi_probabilities, info).
+
+    p01[i] / p10[i] are the assignment errors of clbit i (bit i of each integer outcome).
+    """
+    if len(outcomes) == 0:
+        raise ValueError("No outcomes to mitigate.")
+    if np.asarray(outcomes).dtype.kind not in "iu":
+        raise ValueError("Readout mitigation needs integer outcomes (at most 63 measured bits).")
+    order = np.argsort(outcomes, kind="stable")
+    states = np.asarray(outcomes, dtype=np.int64)[order]
+    probabilities = np.asarray(frequencies, dtype=np.float64)[order]
+    probabilities /= probabilities.sum()
+
+    rows, cols, values = assignment_matrix(states, p01, p10, max_distance)
+    count = len(states)
+
+    def matvec(x):
+        return np.bincount(rows, weights=values * x[cols], minlength=count)
+
+    quasi, iterations, residual = _bicgstab(matvec, probabilities, values[:count], tolerance, max_iterations)
+    info = {
+        "max_distance": max_distance,
+        "matrix_entries": int(len(values)),
+        "iterations": iterations,
+        "converged": residual <= tolerance,
+        "residual": residual,
+        "negative_mass": round(float(np.maximum(-quasi, 0.0).sum()), 6),
+        # Sampling-noise amplification of the correction (1 = none)
+        "quasi_norm": round(float(np.abs(quasi).sum()), 6),
+    }
+    return states, quasi, info
+
+
+# --- Script Entry Point ---
+def apply(qc, backend, outcomes, frequencies, method, noise_metrics=None, max_distance=DEFAULT_MAX_DISTANCE,
+          calibration_shots=DEFAULT_CALIBRATION_SHOTS, top_k=None):
+    """Mitigates counts from the transpiled circuit `qc` run on `backend`.
+
+    Returns (outcomes, quasi_probabilities, report); the arrays are None when there is nothing
+    to correct (no readout error data, e.g. an ideal simulator).
+    """
+    import run_context
+    start = time.perf_counter()
+    qubits = measured_qubits(qc)
+    if None in qubits:
+        raise ValueError("Every clbit must be measured from a qubit for readout mitigation.")
+    report = {"method": method, "physical_qubits": qubits}
+    if method == "circuits":
+        errors = run_context.calibration(
+            backend, lambda b: measure_readout_errors(b, qubits, calibration_shots),
+            "readout calibration circuits", extra=[qubits, calibration_shots])
+        report["calibration_shots"] = 2 * calibration_shots
+    else:
+        device = run_context.calibration(backend, backend_readout_errors, "readout errors")
+        errors = [device[q] if q < len(device) else None for q in qubits]
+    # Qubits without calibration data fall back to the backend-averaged readout error (percent)
+    average = (noise_metrics or {}).get("readout_error")
+    fallback = [average / 100.0] * 2 if isinstance(average, (int, float)) else [0.0, 0.0]
+    missing = sum(1 for e in errors if e is None)
+    errors = [e if e is not None else fallback for e in errors]
+    p01 = np.array([e[0] for e in errors])
+    p10 = np.array([e[1] for e in errors])
+    report.update(mean_p01=round(float(p01.mean()), 6), mean_p10=round(float(p10.mean()), 6),
+                  qubits_without_calibration=missing)
+    if not (p01.any() or p10.any()):
+        report.update(status="skipped", note="No readout error data for this backend; nothing to correct.")
+        log_stderr("Readout mitigation skipped: no readout error data for this backend.")
+        return None, None, report
+
+    states, quasi, info = mitigate(outcomes, frequencies, p01, p10, max_distance)
+    top = int(np.argmax(quasi))
+    report.update(info, status="applied", top_state=result_io.outcome_to_bitstring(states[top], len(qubits)),
+                  top_probability=round(float(quasi[top]), 6))
+    report["mitigated_counts"], report["mitigated_counts_truncated"] = summarize(states, quasi, len(qubits), top_k)
+    report["mitigation_sec"] = round(time.perf_counter() - start, 6)
+    log_stderr(f"Readout mitigation ({method}): {len(states)} outcome(s), {info['matrix_entries']} matrix entries, "
+               f"{info['iterations']} iteration(s), residual {info['residual']:.1e}, quasi norm {info['quasi_norm']:.4f}")
+    return states, quasi, report
+
+
+def summarize(states, quasi, num_bits, top_k=None):
+    """Inline {bitstring: quasi-probability} for the top_k largest entries. Returns (dict, truncated)."""
+    keep = np.argsort(-quasi, kind="stable")
+    truncated = top_k is not None and len(keep) > top_k
+    if truncated:
+        keep = keep[:top_k]
+    return {result_io.outcome_to_bitstring(states[i], num_bits): round(float(quasi[i]), 6) for i in sorted(keep)}, truncated
@@ -0,0 +1,204 @@
+# resource_estimate.py
+#
+# Pre-submission estimates for `--dry_run`: schedules a transpiled circuit
+# with the backend target's instruction durations (ASAP, per qubit) to get the
+# per-shot and total execution time, and combines the target's per-instruction
+# errors and qubit T1/T2 into an estimated success probability (ESP).
+# Instructions without target data fall back to the backend-averaged noise
+# metrics (cached by run_context with a TTL), so no extra calibration fetch is
+# needed. Nothing is submitted.
+
+import math
+import sys
+
+# Repetition delay between shots when the backend does not report one (IBM default).
+DEFAULT_REP_DELAY_SEC = 250e-6
+# Rough fixed cost per job (loading, compilation on the service side); reported separately.
+JOB_OVERHEAD_SEC = 2.0
+_ZERO_DURATION = {"barrier"}
+
+
+# --- Helper Functions (Logging to stderr) ---
+def log_stderr(*args, **kwargs):
+    """Prints messages to stderr."""
+    print(*args, file=sys.stderr, **kwargs)
+
+
+def _target_properties(target, name, qargs):
+    """InstructionProperties for (name, qargs) or None."""
+    if target is None or name not in target.operation_names:
+        return None
+    try:
+        return target[name].get(qargs)
+    except Exception:
+        return None
+
+
+def _rep_delay(backend):
+    try:
+        delay = backend.configuration().default_rep_delay
+        if delay:
+            return float(delay)
+    except Exception:
+        pass
+    return DEFAULT_REP_DELAY_SEC
+
+
+def _qubit_coherence(target, qubit, noise_metrics):
+    """(T1, T2) in seconds from the target, else the averaged metrics (microseconds)."""
+    t1 = t2 = None
+    try:
+        props = target.qubit_properties[qubit] if target is not None and target.qubit_properties else None
+        if props is not None:
+            t1, t2 = props.t1, props.t2
+    except Exception:
+        pass
+    if t1 is None and noise_metrics and noise_metrics.get("t1_time"):
+        t1 = noise_metrics["t1_time"] * 1e-6
+    if t2 is None and noise_metrics and noise_metrics.get("t2_time"):
+        t2 = noise_metrics["t2_time"] * 1e-6
+    return t1, t2
+
+
+def schedule(qc, target):
+    """ASAP schedule with target durations.
+
+    Returns (duration_sec, idle_sec per active qubit index, instructions missing a duration).
+    Idle time is the gap between a qubit's first and last operation not spent in gates.
+    """
+    dt = getattr(target, "dt", None) if target is not None else None
+    qubit_index = {q: i for i, q in enumerate(qc.qubits)}
+    clbit_index = {c: i for i, c in enumerate(qc.clbits)}
+    qubit_free = [0.0] * qc.num_qubits
+    clbit_free = [0.0] * qc.num_clbits
+    first_use = [None] * qc.num_qubits
+    gate_time = [0.0] * qc.num_qubits
+    missing = 0
+    for instruction in qc.data:
+        op = instruction.operation
+        qargs = tuple(qubit_index[q] for q in instruction.qubits)
+        cargs = [clbit_index[c] for c in instruction.clbits]
+        if op.name == "delay":
+            duration = float(op.duration) * (dt or 1.0) if op.unit == "dt" else float(op.duration)
+        elif op.name in _ZERO_DURATION:
+            duration = 0.0
+        else:
+            props = _target_properties(target, op.name, qargs)
+            duration = getattr(props, "duration", None)
+            if duration is None:
+                missing += 1
+                duration = 0.0
+        start = max([qubit_free[q] for q in qargs] + [clbit_free[c] for c in cargs] + [0.0])
+        end = start + duration
+        for q in qargs:
+            qubit_free[q] = end
+            gate_time[q] += duration
+            if first_use[q] is None and op.name not in _ZERO_DURATION:
+                first_use[q] = start
+        for c in cargs:
+            clbit_free[c] = end
+    duration = max(qubit_free + clbit_free + [0.0])
+    idle = {q: max(0.0, qubit_free[q] - first_use[q] - gate_time[q])
+            for q in range(qc.num_qubits) if first_use[q] is not None}
+    return duration, idle, missing
+
+
+def success_probability(qc, target, idle, noise_metrics=None):
+    """ESP = prod(1 - gate error) * prod(1 - readout error) * prod(exp(-t_idle / T)) over active qubits.
+
+    Gate errors already include decoherence during the gate, so only idle time is charged to T1/T2.
+    """
+    qubit_index = {q: i for i, q in enumerate(qc.qubits)}
+    average_gate = (noise_metrics or {}).get("gate_error")
+    average_readout = (noise_metrics or {}).get("readout_error")
+    gate_fidelity = readout_fidelity = 1.0
+    missing = 0
+    for instruction in qc.data:
+        op = instruction.operation
+        if op.name in _ZERO_DURATION or op.name == "delay":
+            continue
+        qargs = tuple(qubit_index[q] for q in instruction.qubits)
+        props = _target_properties(target, op.name, qargs)
+        error = getattr(props, "error", None)
+        if error is None:
+            error = average_readout if op.name == "measure" else average_gate
+        if error is None:
+            missing += 1
+            continue
+        if op.name == "measure":
+            readout_fidelity *= 1.0 - error
+        else:
+            gate_fidelity *= 1.0 - error
+
+    decoherence = 1.0
+    for qubit, window in idle.items():
+        t1, t2 = _qubit_coherence(target, qubit, noise_metrics)
+        coherence = min(t for t in (t1, t2) if t) if (t1 or t2) else None
+        if coherence:
+            decoherence *= math.exp(-window / coherence)
+    return gate_fidelity, readout_fidelity, decoherence, missing
+
+
+def estimate(qc, backend, shots, noise_metrics=None):
+    """Resource and success estimate for running the transpiled circuit `qc` `shots` times."""
+    target = getattr(backend, "target", None)
+    ops = qc.count_ops()
+    result = {
+        "backend": backend.name,
+        "shots": shots,
+        "num_qubits_used": len({q for instruction in qc.data for q in instruction.qubits
+                                if instruction.operation.name not in _ZERO_DURATION}),
+        "circuit_depth": qc.depth(),
+        "two_qubit_gate_count": sum(1 for instruction in qc.data
+                                    if len(instruction.qubits) == 2 and instruction.operation.name not in _ZERO_DURATION),
+        "gate_counts": dict(ops),
+    }
+
+    duration, idle, missing_durations = schedule(qc, target)
+    if duration > 0:
+        rep_delay = _rep_delay(backend)
+        per_shot = duration + rep_delay
+        result.update(
+            circuit_duration_sec=duration,
+            rep_delay_sec=rep_delay,
+            per_shot_sec=per_shot,
+            execution_sec=per_shot * shots,
+            job_overhead_sec=JOB_OVERHEAD_SEC,
+            estimated_qpu_time_sec=round(per_shot * shots + JOB_OVERHEAD_SEC, 3),
+            instructions_without_duration=missing_durations,
+        )
+    else:
+        result.update(circuit_duration_sec=None, estimated_qpu_time_sec=None,
+                      duration_note="Backend target has no instruction durations (simulator?).")
+
+    gate_fidelity, readout_fidelity, decoherence, missing_errors = success_probability(qc, target, idle, noise_metrics)
+    if missing_errors == sum(v for k, v in ops.items() if k not in _ZERO_DURATION and k != "delay"):
+        result.update(estimated_success_probability=None,
+                      success_note="No calibration data (target errors or noise metrics) for this backend.")
+    else:
+        result.update(
+            gate_fidelity=round(gate_fidelity, 6),
+            readout_fidelity=round(readout_fidelity, 6),
+            decoherence_factor=round(decoherence, 6),
+            estimated_success_probability=round(gate_fidelity * readout_fidelity * decoherence, 6),
+            instructions_without_error=missing_errors,
+        )
+    return result
+
+
+def log_estimate(estimate_info):
+    log_stderr("\n--- Dry Run Estimate (nothing submitted) ---")
+    log_stderr(f"Backend: {estimate_info['backend']}, depth {estimate_info['circuit_depth']}, "
+               f"{estimate_info['two_qubit_gate_count']} two-qubit gate(s) on {estimate_info['num_qubits_used']} qubit(s)")
+    if estimate_info.get("circuit_duration_sec") is not None:
+        log_stderr(f"Schedule: {estimate_info['circuit_duration_sec'] * 1e6:.2f} us per circuit, "
+                   f"{estimate_info['per_shot_sec'] * 1e6:.2f} us per shot incl. rep delay")
+        log_stderr(f"Estimated QPU time: {estimate_info['estimated_qpu_time_sec']:.3f} s for {estimate_info['shots']} shots")
+    else:
+        log_stderr(estimate_info["duration_note"])
+    if estimate_info.get("estimated_success_probability") is not None:
+        log_stderr(f"Estimated success probability: {estimate_info['estimated_success_probability']:.4f} "
+                   f"(gates {estimate_info['gate_fidelity']:.4f}, readout {estimate_info['readout_fidelity']:.4f}, "
+                   f"decoherence {estimate_info['decoherence_factor']:.4f})")
+    else:
+        log_stderr(estimate_info["success_note"])
@@ -0,0 +1,126 @@
+# result_cache.py
+#
+# Opt-in memoization of simulator results (`--result_cache`). Entries are keyed
+# by (logical circuit hash, simulator configuration, shots, seed, compile
+# path); with a fixed seed the simulator is deterministic, so a hit returns
+# exactly the counts a fresh run would produce, without transpiling or
+# simulating.
+#
+# Each entry is a counts sidecar (<key>.npz, same layout as result_io) plus a
+# small metrics file (<key>.json). The directory is bounded in size; the least
+# recently used entries are evicted first.
+
+import hashlib
+import json
+import os
+import sys
+import time
+
+import result_io
+import run_context
+
+RESULT_CACHE_VERSION = 1
+DEFAULT_MAX_MB = 256
+# Seed used when --result_cache is given without --seed.
+DEFAULT_SEED = 0
+
+
+# --- Helper Functions (Logging to stderr) ---
+def log_stderr(*args, **kwargs):
+    """Prints messages to stderr."""
+    print(*args, file=sys.stderr, **kwargs)
+
+
+def default_cache_dir():
+    from cnf_oracle import default_cache_dir as base_dir
+    return os.path.join(base_dir(), "results")
+
+
+def engine_config(backend):
+    """Simulator settings that change the sampled counts for a given seed."""
+    import qiskit
+    import qiskit_aer
+    options = getattr(backend, "options", None)
+    return {
+        "backend": backend.name,
+        "method": str(getattr(options, "method", None)),
+        "noise_model": getattr(options, "noise_model", None) is not None,
+        "qiskit": qiskit.__version__,
+        "qiskit_aer": qiskit_aer.__version__,
+    }
+
+
+class ResultCache:
+    """Size-bounded on-disk store of (outcomes, frequencies, metrics) per run key."""
+
+    def __init__(self, directory=None, max_mb=DEFAULT_MAX_MB):
+        self.directory = directory or default_cache_dir()
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        os.makedirs(self.directory, exist_ok=True)
+
+    def key(self, qc, backend, shots, seed, variant=None):
+        """variant names the compile path (--sim_compile), whose circuit metrics differ."""
+        identity = [RESULT_CACHE_VERSION, run_context.circuit_hash(qc), engine_config(backend), int(shots), seed]
+        if variant is not None:
+            identity.append(variant)
+        return hashlib.sha256(json.dumps(identity, sort_keys=True).encode("utf-8")).hexdigest()
+
+    def _paths(self, key):
+        base = os.path.join(self.directory, key)
+        return base + ".counts.npz", base + ".json"
+
+    def get(self, key):
+        """Returns {"outcomes", "frequencies", "num_bits", "metrics"} or None."""
+        counts_path, meta_path = self._paths(key)
+        try:
+            with open(meta_path, "r") as f:
+                meta = json.load(f)
+            outcomes, frequencies, num_bits = result_io.load_counts_sidecar(counts_path)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            log_stderr(f"Warning: Ignoring unreadable result cache entry {key[:12]}: {e}")
+            return None
+        now = time.time()
+        for path in (counts_path, meta_path):
+            try:
+                os.utime(path, (now, now)) # Mark as recently used for eviction
+            except OSError:
+                pass
+        return {"outcomes": outcomes, "frequencies": frequencies, "num_bits": num_bits,
+                "metrics": meta.get("metrics", {}), "created_at": meta.get("created_at")}
+
+    def put(self, key, outcomes, frequencies, num_bits, metrics):
+        counts_path, meta_path = self._paths(key)
+        try:
+            result_io.write_counts_sidecar(counts_path, outcomes, frequencies, num_bits)
+            result_io.write_json_atomic(meta_path, {"version": RESULT_CACHE_VERSION,
+                                                    "created_at": time.time(), "metrics": metrics})
+        except Exception as e:
+            log_stderr(f"Warning: Could not write result cache entry: {e}")
+            return
+        self.evict()
+
+    def evict(self):
+        """Deletes least recently used entries until the directory fits in max_bytes."""
+        entries = {}
+        try:
+            for name in os.listdir(self.directory):
+                key = name.split(".", 1)[0]
+                path = os.path.join(self.directory, name)
+                stat = os.stat(path)
+                size, used = entries.get(key, (0, 0))
+                entries[key] = (size + stat.st_size, max(used, stat.st_mtime))
+        except OSError as e:
+            log_stderr(f"Warning: Could not scan result cache: {e}")
+            return
+        total = sum(size for size, _ in entries.values())
+        for key, (size, _) in sorted(entries.items(), key=lambda item: item[1][1]):
+            if total <= self.max_bytes:
+                break
+            for path in self._paths(key):
+                try:
+                    os.unlink(path)
+                except OSError:
+                    pass
+            total -= size
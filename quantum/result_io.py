@@ -0,0 +1,307 @@
+# result_io.py
+#
+# Compact counts representation and result serialization shared by the
+# quantum scripts. Counts are kept as a pair of NumPy arrays
+# (outcomes, frequencies) sorted by outcome, taken directly from the packed
+# SamplerV2 BitArray; bit-string dictionaries are only built for the small
+# inline summary written to the results JSON.
+
+import json
+import os
+import sys
+import tempfile
+
+import numpy as np
+
+try:
+    import orjson # Optional fast JSON encoder
+except ImportError:
+    orjson = None
+
+# Outcomes wider than this cannot be stored as int64 and are kept as bit-strings.
+MAX_INT_OUTCOME_BITS = 63
+# Up to this width, accumulated histograms are a dense preallocated array (8 MB at 20 bits).
+DENSE_HISTOGRAM_MAX_BITS = 20
+
+
+# --- Helper Functions (Logging to stderr) ---
+def log_stderr(*args, **kwargs):
+    """Prints messages to stderr."""
+    print(*args, file=sys.stderr, **kwargs)
+
+
+# --- Shot-Level Measurements ---
+class Measurements:
+    """Per-shot results of one classical register, kept as the packed BitArray matrix.
+
+    `packed` has one row per shot and ceil(num_bits / 8) big-endian bytes: the
+    last bit of the last byte is clbit 0. Bit order is handled here only;
+    everywhere else clbit i is bit i of the integer outcome, i.e. the i-th
+    character from the right of a bit-string.
+    """
+
+    def __init__(self, packed, num_bits, register=None):
+        packed = np.asarray(packed, dtype=np.uint8)
+        self.packed = packed.reshape(-1, packed.shape[-1]) if packed.ndim else packed.reshape(0, 1)
+        self.num_bits = int(num_bits)
+        self.register = register
+
+    @classmethod
+    def from_bitarray(cls, bit_array, register=None):
+        return cls(bit_array.array, bit_array.num_bits, register)
+
+    @classmethod
+    def from_bool_matrix(cls, bits, register=None):
+        """bits[shot, i] is clbit i."""
+        bits = np.asarray(bits, dtype=bool)
+        num_bits = bits.shape[1]
+        pad = (-num_bits) % 8
+        ordered = np.concatenate([np.zeros((bits.shape[0], pad), dtype=bool), bits[:, ::-1]], axis=1)
+        return cls(np.packbits(ordered, axis=1), num_bits, register)
+
+    @classmethod
+    def from_counts(cls, counts, num_bits, register=None):
+        """Expands a counts dict (some Aer versions return one) into shots."""
+        outcomes, frequencies = counts_arrays_from_dict(counts, num_bits)
+        if outcomes.dtype.kind in "US":
+            bits = np.array([[c == "1" for c in o[::-1]] for o in outcomes], dtype=bool)
+        else:
+            bits = ((outcomes[:, None] >> np.arange(num_bits)) & 1).astype(bool)
+        return cls.from_bool_matrix(np.repeat(bits, frequencies, axis=0), register)
+
+    @classmethod
+    def from_pub_result(cls, pub_result, register=None, num_bits=None):
+        """Picks `register` from a SamplerV2 pub result, else its only / first bit-array field.
+           num_bits sizes a counts-dict fallback whose keys are hex."""
+        data = pub_result.data
+        fields = list(data.items()) if hasattr(data, "items") else list(data.__fields_items__())
+        if register is not None:
+            fields = [(name, value) for name, value in fields if name == register] or fields
+        for name, value in fields:
+            if hasattr(value, "array") and hasattr(value, "num_bits"):
+                return cls.from_bitarray(value, name)
+            if isinstance(value, dict):
+                return cls.from_counts(value, num_bits or len(next(iter(value), "")), name)
+        raise ValueError(f"No measurement data in result fields {[name for name, _ in fields]}.")
+
+    @property
+    def num_shots(self):
+        return self.packed.shape[0]
+
+    def bit_matrix(self):
+        """(shots, num_bits) bool array; column i is clbit i."""
+        unpacked = np.unpackbits(self.packed, axis=1)
+        return unpacked[:, ::-1][:, :self.num_bits].astype(bool)
+
+    def integers(self):
+        """Per-shot outcomes as int64 (registers up to MAX_INT_OUTCOME_BITS wide)."""
+        if self.num_bits > MAX_INT_OUTCOME_BITS:
+            raise ValueError(f"{self.num_bits}-bit outcomes do not fit in int64; use bitstrings().")
+        values = np.zeros(self.num_shots, dtype=np.int64)
+        for column in range(self.packed.shape[1]):
+            # Bytes are big-endian: the first byte holds the most significant bits.
+            values = (values << 8) | self.packed[:, column].astype(np.int64)
+        return values
+
+    def bitstrings(self):
+        """Per-shot bit-strings (clbit 0 rightmost); only build these when really needed."""
+        chars = np.where(self.bit_matrix()[:, ::-1], "1", "0")
+        return np.array(["".join(row) for row in chars])
+
+    def histogram(self):
+        """Sorted (outcomes, frequencies); outcomes are int64, or bit-strings above 63 bits."""
+        if self.num_bits <= MAX_INT_OUTCOME_BITS:
+            outcomes, frequencies = np.unique(self.integers(), return_counts=True)
+            return outcomes, frequencies.astype(np.int64)
+        rows, frequencies = np.unique(self.packed, axis=0, return_counts=True)
+        outcomes = Measurements(rows, self.num_bits).bitstrings()
+        order = np.argsort(outcomes, kind="stable")
+        return outcomes[order], frequencies[order].astype(np.int64)
+
+    def marginal(self, indices):
+        """Measurements over the given clbits; new clbit j is old clbit indices[j]."""
+        return Measurements.from_bool_matrix(self.bit_matrix()[:, list(indices)], self.register)
+
+
+# --- Counts Arrays ---
+def counts_arrays_from_bitarray(bit_array):
+    """Histogram of a SamplerV2 BitArray as (outcomes, frequencies) int64 arrays."""
+    return Measurements.from_bitarray(bit_array).histogram()
+
+
+def counts_arrays_from_dict(counts, num_bits):
+    """Converts a {bit-string or hex or int: count} dict into sorted (outcomes, frequencies)."""
+    if not counts:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    keys = []
+    for key in counts:
+        if isinstance(key, str):
+            key = key.replace(" ", "")
+            keys.append(int(key, 16) if key.startswith("0x") else int(key, 2))
+        else:
+            keys.append(int(key))
+    freqs = np.fromiter((int(v) for v in counts.values()), dtype=np.int64, count=len(counts))
+    if num_bits > MAX_INT_OUTCOME_BITS:
+        outcomes = np.array([format(k, f"0{num_bits}b") for k in keys])
+    else:
+        outcomes = np.array(keys, dtype=np.int64)
+    order = np.argsort(outcomes, kind="stable")
+    return outcomes[order], freqs[order]
+
+
+def counts_arrays(data_container, num_bits):
+    """Extracts (outcomes, frequencies) from whatever the SamplerV2 result field holds."""
+    if hasattr(data_container, "array") and hasattr(data_container, "num_bits"):
+        return counts_arrays_from_bitarray(data_container)
+    if hasattr(data_container, "get_counts"):
+        return counts_arrays_from_dict(data_container.get_counts(), num_bits)
+    if isinstance(data_container, dict):
+        return counts_arrays_from_dict(data_container, num_bits)
+    raise TypeError(f"Unsupported counts container: {type(data_container)}")
+
+
+class CountsAccumulator:
+    """Merges (outcomes, frequencies) batches into one histogram.
+
+    Narrow registers use a dense preallocated array, so memory does not grow with
+    the number of shots; wider ones keep a sparse sorted pair of arrays that is
+    bounded by the number of distinct outcomes.
+    """
+
+    def __init__(self, num_bits):
+        self.num_bits = num_bits
+        self.total = 0
+        self.dense = None
+        if num_bits <= DENSE_HISTOGRAM_MAX_BITS:
+            self.dense = np.zeros(2 ** num_bits, dtype=np.int64)
+        else:
+            dtype = np.int64 if num_bits <= MAX_INT_OUTCOME_BITS else str
+            self.outcomes = np.zeros(0, dtype=dtype)
+            self.frequencies = np.zeros(0, dtype=np.int64)
+
+    def add(self, outcomes, frequencies):
+        frequencies = np.asarray(frequencies, dtype=np.int64)
+        self.total += int(frequencies.sum())
+        if self.dense is not None:
+            np.add.at(self.dense, np.asarray(outcomes, dtype=np.int64), frequencies)
+            return
+        merged, inverse = np.unique(np.concatenate([self.outcomes, outcomes]), return_inverse=True)
+        self.frequencies = np.bincount(inverse, weights=np.concatenate([self.frequencies, frequencies]),
+                                       minlength=merged.size).astype(np.int64)
+        self.outcomes = merged
+
+    def arrays(self):
+        """Current histogram as sorted (outcomes, frequencies), zero-count outcomes dropped."""
+        if self.dense is not None:
+            nonzero = np.flatnonzero(self.dense)
+            return nonzero.astype(np.int64), self.dense[nonzero]
+        return self.outcomes, self.frequencies
+
+    def distinct(self):
+        if self.dense is not None:
+            return int(np.count_nonzero(self.dense))
+        return int(self.outcomes.size)
+
+
+def outcome_to_bitstring(outcome, num_bits):
+    if isinstance(outcome, str):
+        return outcome
+    return format(int(outcome), f"0{num_bits}b")
+
+
+def counts_to_dict(outcomes, frequencies, num_bits):
+    """Zero-padded bit-string dictionary (only for small outputs / legacy consumers)."""
+    return {outcome_to_bitstring(o, num_bits): int(f) for o, f in zip(outcomes, frequencies)}
+
+
+def top_outcome(outcomes, frequencies):
+    """Most frequent outcome; ties go to the smallest outcome. Returns (outcome, count)."""
+    if len(frequencies) == 0:
+        return None, None
+    idx = int(np.argmax(frequencies)) # First maximum == smallest outcome (arrays are sorted)
+    return outcomes[idx], int(frequencies[idx])
+
+
+def summarize_counts(outcomes, frequencies, num_bits, top_k=None, threshold=0.0):
+    """Inline summary: the top_k most frequent outcomes whose share is >= threshold.
+
+    Returns (counts_dict, truncated). top_k=None keeps every outcome.
+    """
+    total = int(frequencies.sum()) if len(frequencies) else 0
+    keep = np.arange(len(frequencies))
+    if threshold and total:
+        keep = keep[frequencies[keep] >= threshold * total]
+    if top_k is not None and len(keep) > top_k:
+        # Stable sort on -frequency keeps outcome order for ties
+        keep = keep[np.argsort(-frequencies[keep], kind="stable")[:top_k]]
+        keep.sort()
+    truncated = len(keep) < len(frequencies)
+    return counts_to_dict(outcomes[keep], frequencies[keep], num_bits), truncated
+
+
+# --- Binary Counts Sidecar ---
+def sidecar_path(output_json):
+    """<results>.json -> <results>.counts.npz"""
+    base, _ = os.path.splitext(output_json)
+    return base + ".counts.npz"
+
+
+def write_counts_sidecar(path, outcomes, frequencies, num_bits):
+    """Writes the full histogram as a compressed .npz (keys: outcomes, counts, num_bits)."""
+    tmp_path = path + ".tmp.npz"
+    np.savez_compressed(tmp_path, outcomes=outcomes, counts=frequencies, num_bits=np.int64(num_bits))
+    os.replace(tmp_path, path)
+    return path
+
+
+def load_counts_sidecar(path):
+    """Reads a sidecar written by write_counts_sidecar. Returns (outcomes, frequencies, num_bits)."""
+    with np.load(path, allow_pickle=False) as data:
+        return data["outcomes"], data["counts"], int(data["num_bits"])
+
+
+# --- JSON Output ---
+def _json_default(obj):
+    if isinstance(obj, np.integer):
+        return int(obj)
+    if isinstance(obj, np.floating):
+        return float(obj)
+    if isinstance(obj, np.bool_):
+        return bool(obj)
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    return str(obj) # Convert problematic types to string
+
+
+def dumps_json(obj, indent=None):
+    """Serializes to UTF-8 bytes, using orjson when it is installed."""
+    if orjson is not None:
+        option = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        return orjson.dumps(obj, default=_json_default, option=option)
+    separators = None if indent else (",", ":")
+    return json.dumps(obj, indent=indent, separators=separators, default=_json_default).encode("utf-8")
+
+
+# os.umask can only be read by setting it, which is not thread-safe; read once at import
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+
+
+def write_json_atomic(path, obj, indent=None):
+    """Writes JSON to a temp file in the target directory and renames it into place,
+       so readers never see a partially written results file."""
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(prefix=".tmp_", suffix=".json", dir=directory)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(dumps_json(obj, indent))
+        os.chmod(tmp_path, 0o666 & ~_UMASK) # mkstemp creates 0600; give the usual mode of a new file
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
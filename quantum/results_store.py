@@ -0,0 +1,272 @@
+# results_store.py
+#
+# Optional historical results sink (`--results_db`). Every run is appended to a
+# local SQLite database in WAL mode (safe for concurrent batch workers) with
+# its parameters, phase timings, circuit / noise metrics and a reference to the
+# results JSON and counts sidecar. Indexed on backend, algorithm, qubit count
+# and date so dashboard history queries stay fast.
+#
+#   python results_store.py runs.db query --algorithm grover_search --since 2025-01-01
+#   python results_store.py runs.db aggregate --group_by backend,num_qubits
+#   python results_store.py runs.db import results/*.json
+
+import argparse
+import json
+import os
+import sqlite3
+import statistics
+import sys
+from datetime import datetime, timezone
+
+SCHEMA_VERSION = 1
+# Never persisted with the run parameters.
+SECRET_PARAMS = ("api_token",)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    run_at TEXT NOT NULL,
+    run_date TEXT NOT NULL,
+    algorithm TEXT NOT NULL,
+    backend TEXT,
+    ran_on_hardware INTEGER,
+    num_qubits INTEGER,
+    shots INTEGER,
+    status TEXT,
+    success INTEGER,
+    execution_time_sec REAL,
+    qpu_time_sec REAL,
+    circuit_depth INTEGER,
+    cx_gate_count INTEGER,
+    total_gate_count INTEGER,
+    gate_error REAL,
+    readout_error REAL,
+    t1_time REAL,
+    t2_time REAL,
+    quantum_volume REAL,
+    job_id TEXT,
+    seed INTEGER,
+    cached INTEGER,
+    output_json TEXT,
+    counts_file TEXT,
+    error_message TEXT,
+    params_json TEXT,
+    phase_timings_json TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_runs_backend ON runs (backend);
+CREATE INDEX IF NOT EXISTS idx_runs_algorithm_date ON runs (algorithm, run_date);
+CREATE INDEX IF NOT EXISTS idx_runs_num_qubits ON runs (num_qubits);
+CREATE INDEX IF NOT EXISTS idx_runs_date ON runs (run_date);
+"""
+
+# results-dict keys copied verbatim into same-named columns
+_RESULT_COLUMNS = (
+    "status", "execution_time_sec", "qpu_time_sec", "circuit_depth", "cx_gate_count", "total_gate_count",
+    "gate_error", "readout_error", "t1_time", "t2_time", "quantum_volume", "job_id", "seed", "counts_file",
+    "error_message",
+)
+FILTERS = ("algorithm", "backend", "num_qubits", "status", "ran_on_hardware")
+
+
+# --- Helper Functions (Logging to stderr) ---
+def log_stderr(*args, **kwargs):
+    """Prints messages to stderr."""
+    print(*args, file=sys.stderr, **kwargs)
+
+
+def _number(value):
+    """Noise metrics may be missing or non-numeric strings; store those as NULL."""
+    try:
+        return None if value is None else float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class ResultsStore:
+    """Append-only run history in SQLite (WAL)."""
+
+    def __init__(self, path):
+        self.path = path
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self.conn = sqlite3.connect(path, timeout=30)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        version = self.conn.execute("PRAGMA user_version").fetchone()[0]
+        if version > SCHEMA_VERSION:
+            raise RuntimeError(f"{path} uses schema version {version}; this code supports {SCHEMA_VERSION}.")
+        with self.conn:
+            self.conn.executescript(_SCHEMA)
+            self.conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # --- Writes ---
+    def record_run(self, algorithm, params, results, output_json=None, num_qubits=None, run_at=None):
+        """Appends one run. `params` are the script arguments; secrets are dropped."""
+        run_at = run_at or datetime.now(timezone.utc)
+        row = {k: results.get(k) for k in _RESULT_COLUMNS}
+        for key in ("gate_error", "readout_error", "t1_time", "t2_time", "quantum_volume"):
+            row[key] = _number(row[key])
+        row.update(
+            run_at=run_at.isoformat(timespec="seconds"),
+            run_date=run_at.date().isoformat(),
+            algorithm=algorithm,
+            backend=results.get("backend_used"),
+            ran_on_hardware=int(bool(results.get("ran_on_hardware"))),
+            num_qubits=num_qubits if num_qubits is not None else results.get("num_qubits"),
+            shots=results.get("shots"),
+            success=int(results.get("status") == "success"),
+            cached=int(bool(results.get("cached"))),
+            output_json=os.path.abspath(output_json) if output_json else None,
+            params_json=json.dumps({k: v for k, v in (params or {}).items() if k not in SECRET_PARAMS},
+                                   default=str, sort_keys=True),
+            phase_timings_json=json.dumps(results.get("phase_timings")),
+        )
+        columns = ", ".join(row)
+        placeholders = ", ".join("?" for _ in row)
+        with self.conn:
+            cursor = self.conn.execute(f"INSERT INTO runs ({columns}) VALUES ({placeholders})", list(row.values()))
+        return cursor.lastrowid
+
+    def import_results_file(self, path):
+        """Backfills a run from an existing results JSON (algorithm inferred from its keys)."""
+        with open(path, "r") as f:
+            results = json.load(f)
+        if "factors" in results:
+            algorithm, num_qubits = "shor_n15", None
+        else:
+            algorithm, num_qubits = "grover_search", results.get("num_qubits")
+        run_at = datetime.fromtimestamp(os.path.getmtime(path), timezone.utc)
+        return self.record_run(algorithm, {}, results, path, num_qubits, run_at)
+
+    # --- Queries ---
+    def _where(self, filters, since=None, until=None):
+        clauses, values = [], []
+        for key in FILTERS:
+            if filters.get(key) is not None:
+                clauses.append(f"{key} = ?")
+                values.append(filters[key])
+        if since:
+            clauses.append("run_date >= ?")
+            values.append(since)
+        if until:
+            clauses.append("run_date <= ?")
+            values.append(until)
+        return (" WHERE " + " AND ".join(clauses)) if clauses else "", values
+
+    def query(self, since=None, until=None, limit=100, **filters):
+        """Most recent runs matching the filters, as dicts."""
+        where, values = self._where(filters, since, until)
+        rows = self.conn.execute(f"SELECT * FROM runs{where} ORDER BY run_at DESC, id DESC LIMIT ?",
+                                 values + [int(limit)]).fetchall()
+        return [dict(row) for row in rows]
+
+    def aggregate(self, group_by=("algorithm", "backend"), since=None, until=None, **filters):
+        """Per-group run count, success rate, median depth / CX count and QPU seconds."""
+        group_by = tuple(group_by)
+        unknown = [g for g in group_by if g not in FILTERS + ("run_date",)]
+        if unknown:
+            raise ValueError(f"Cannot group by {unknown}; expected columns from {FILTERS + ('run_date',)}.")
+        where, values = self._where(filters, since, until)
+        keys = ", ".join(group_by)
+        groups = {}
+        cursor = self.conn.execute(
+            f"SELECT {keys}, success, circuit_depth, cx_gate_count, qpu_time_sec, execution_time_sec "
+            f"FROM runs{where} ORDER BY {keys}", values)
+        for row in cursor:
+            key = tuple(row[g] for g in group_by)
+            g = groups.setdefault(key, {"runs": 0, "successes": 0, "depths": [], "cx": [], "qpu": 0.0, "wall": 0.0})
+            g["runs"] += 1
+            g["successes"] += row["success"] or 0
+            if row["circuit_depth"] is not None:
+                g["depths"].append(row["circuit_depth"])
+            if row["cx_gate_count"] is not None:
+                g["cx"].append(row["cx_gate_count"])
+            g["qpu"] += row["qpu_time_sec"] or 0.0
+            g["wall"] += row["execution_time_sec"] or 0.0
+        summary = []
+        for key, g in groups.items():
+            item = dict(zip(group_by, key))
+            item.update(
+                runs=g["runs"],
+                success_rate=round(g["successes"] / g["runs"], 4),
+                median_depth=statistics.median(g["depths"]) if g["depths"] else None,
+                median_cx_count=statistics.median(g["cx"]) if g["cx"] else None,
+                qpu_seconds=round(g["qpu"], 3),
+                mean_execution_time_sec=round(g["wall"] / g["runs"], 3),
+            )
+            summary.append(item)
+        return summary
+
+
+def record(db_path, algorithm, args, results, num_qubits=None):
+    """Convenience for the scripts: append one run, never raising."""
+    try:
+        with ResultsStore(db_path) as store:
+            row_id = store.record_run(algorithm, vars(args), results, args.output_json, num_qubits)
+        log_stderr(f"Run recorded in results database {db_path} (id {row_id}).")
+        return row_id
+    except Exception as e:
+        log_stderr(f"Warning: Could not record run in results database {db_path}: {e}")
+        return None
+
+
+# --- Command Line ---
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Query or backfill the quantum results database.")
+    parser.add_argument('db', type=str, help='SQLite database path')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    def add_filters(p):
+        p.add_argument('--algorithm', type=str, default=None, help='grover_search or shor_n15')
+        p.add_argument('--backend', type=str, default=None)
+        p.add_argument('--num_qubits', type=int, default=None)
+        p.add_argument('--status', type=str, default=None, help='success or failure')
+        p.add_argument('--hardware', dest='ran_on_hardware', type=int, choices=[0, 1], default=None)
+        p.add_argument('--since', type=str, default=None, help='First run date (YYYY-MM-DD)')
+        p.add_argument('--until', type=str, default=None, help='Last run date (YYYY-MM-DD)')
+
+    query_parser = sub.add_parser('query', help='List recent runs')
+    add_filters(query_parser)
+    query_parser.add_argument('--limit', type=int, default=100)
+    aggregate_parser = sub.add_parser('aggregate', help='Success rate, median depth and QPU seconds per group')
+    add_filters(aggregate_parser)
+    aggregate_parser.add_argument('--group_by', type=str, default='algorithm,backend',
+                                  help='Comma-separated columns (default: algorithm,backend)')
+    import_parser = sub.add_parser('import', help='Backfill runs from existing results JSON files')
+    import_parser.add_argument('files', nargs='+')
+    args = parser.parse_args(argv)
+
+    with ResultsStore(args.db) as store:
+        if args.command == 'import':
+            imported = 0
+            for path in args.files:
+                try:
+                    store.import_results_file(path)
+                    imported += 1
+                except Exception as e:
+                    log_stderr(f"Skipping {path}: {e}")
+            log_stderr(f"Imported {imported} of {len(args.files)} file(s).")
+            return 0 if imported == len(args.files) else 1
+
+        filters = {k: getattr(args, k) for k in FILTERS}
+        if args.command == 'query':
+            output = store.query(since=args.since, until=args.until, limit=args.limit, **filters)
+        else:
+            group_by = [g.strip() for g in args.group_by.split(",") if g.strip()]
+            output = store.aggregate(group_by, since=args.since, until=args.until, **filters)
+    print(json.dumps(output, indent=2, default=str))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
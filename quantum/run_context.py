@@ -0,0 +1,258 @@
+# run_context.py
+#
+# Process-wide state for runs executed in-process (the batch runner's
+# workers call the scripts' run() many times in one interpreter). Provides:
+#
+#   - a fixed Aer thread count, so parallel workers do not oversubscribe cores
+#   - a reused QiskitRuntimeService per API token
+#   - a transpile cache keyed by (circuit hash, backend identity)
+#   - a backend calibration (noise metrics, readout errors) cache with a TTL
+#
+# Both caches live in memory and, when a cache directory is configured, on
+# disk so that every worker process shares them. Until configure() is called
+# (i.e. for a normal single CLI run) everything is a pass-through.
+
+import hashlib
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+from qiskit import qpy
+
+CACHE_VERSION = 1
+DEFAULT_CALIBRATION_TTL_SEC = 900
+
+_settings = {
+    "enabled": False,
+    "cache_dir": None,
+    "aer_threads": None,
+    "calibration_ttl_sec": DEFAULT_CALIBRATION_TTL_SEC,
+}
+_SERVICES = {}
+_TRANSPILE_CACHE = {}
+_CALIBRATION_CACHE = {}
+stats = {"transpile_hits": 0, "transpile_misses": 0, "calibration_hits": 0, "calibration_misses": 0}
+
+
+# --- Helper Functions (Logging to stderr) ---
+def log_stderr(*args, **kwargs):
+    """Prints messages to stderr."""
+    print(*args, file=sys.stderr, **kwargs)
+
+
+def configure(cache_dir=None, aer_threads=None, calibration_ttl_sec=DEFAULT_CALIBRATION_TTL_SEC):
+    """Enables the caches for this process. cache_dir=None keeps them in memory only."""
+    _settings.update(enabled=True, cache_dir=cache_dir, aer_threads=aer_threads,
+                     calibration_ttl_sec=calibration_ttl_sec)
+    if aer_threads:
+        # Also caps BLAS / OpenMP pools used outside Aer's own option
+        os.environ["OMP_NUM_THREADS"] = str(aer_threads)
+
+
+def enabled():
+    return _settings["enabled"]
+
+
+def simulator_options():
+    """Keyword arguments for AerSimulator(); pins the thread count when configured."""
+    if _settings["aer_threads"]:
+        return {"max_parallel_threads": _settings["aer_threads"]}
+    return {}
+
+
+def get_service(token, factory):
+    """Returns factory(), reusing the instance for the same token once configured."""
+    if not enabled():
+        return factory()
+    if token not in _SERVICES:
+        _SERVICES[token] = factory()
+    return _SERVICES[token]
+
+
+# --- Disk Helpers ---
+def _cache_path(kind, key):
+    if not _settings["cache_dir"]:
+        return None
+    return os.path.join(_settings["cache_dir"], kind, key)
+
+
+def _write_atomic(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(prefix=".tmp_", dir=os.path.dirname(path))
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+# --- Backend Identity ---
+def _calibration_stamp(backend):
+    """Last calibration time of a hardware backend, or None (simulators)."""
+    try:
+        properties = backend.properties()
+        if properties is not None and getattr(properties, "last_update_date", None):
+            return str(properties.last_update_date)
+    except Exception:
+        pass
+    return None
+
+
+def backend_identity(backend):
+    return {
+        "name": backend.name,
+        "num_qubits": getattr(backend, "num_qubits", None),
+        "calibration": _calibration_stamp(backend),
+    }
+
+
+def _hash_operation(op, digest, standard_gates):
+    params = [p.tobytes() if isinstance(p, np.ndarray) else str(p) for p in op.params]
+    digest.update(repr((op.name, op.num_qubits, op.num_clbits, params, getattr(op, "ctrl_state", None))).encode("utf-8"))
+    if op.name in standard_gates or type(op).__module__.startswith("qiskit.circuit.library"):
+        return # Fully determined by name / size / params
+    base_gate = getattr(op, "base_gate", None)
+    if base_gate is not None:
+        # Controlled custom gate: hash the base gate instead of building the controlled definition
+        _hash_operation(base_gate, digest, standard_gates)
+    elif getattr(op, "definition", None) is not None:
+        # Custom gates (oracles, Grover operators, modular multipliers) hash by their definition
+        _hash_circuit(op.definition, digest, standard_gates)
+
+
+def _hash_circuit(qc, digest, standard_gates):
+    qubit_index = {q: i for i, q in enumerate(qc.qubits)}
+    clbit_index = {c: i for i, c in enumerate(qc.clbits)}
+    digest.update(repr((qc.num_qubits, [(r.name, r.size) for r in qc.cregs], str(qc.global_phase))).encode("utf-8"))
+    for instruction in qc.data:
+        digest.update(repr(([qubit_index[q] for q in instruction.qubits],
+                            [clbit_index[c] for c in instruction.clbits])).encode("utf-8"))
+        _hash_operation(instruction.operation, digest, standard_gates)
+
+
+def circuit_hash(qc):
+    """Structural hash of a circuit; stable across processes (unlike qpy, which embeds
+       random names for custom gates) and independent of the circuit's own name."""
+    from qiskit.circuit.library import get_standard_gate_name_mapping
+    digest = hashlib.sha256()
+    _hash_circuit(qc, digest, set(get_standard_gate_name_mapping()) | {"measure", "barrier", "reset"})
+    return digest.hexdigest()
+
+
+# --- Transpile Cache ---
+def transpile(qc, backend, optimize_fn, seed=None, optimization_level=None, callback=None, variant=None):
+    """Returns optimize_fn(qc, backend, seed) -> (circuit, depth, cx_count, gate_count), cached.
+
+    optimization_level overrides the script's default level (and is part of the cache key);
+    callback is passed on to the pass manager (see deadline.py). variant names an alternative
+    optimize_fn (e.g. "simulator", see sim_compile.py) so its results are cached separately.
+    """
+    options = {k: v for k, v in (("optimization_level", optimization_level), ("callback", callback)) if v is not None}
+    if not enabled():
+        return optimize_fn(qc, backend, seed, **options)
+    try:
+        material = [CACHE_VERSION, circuit_hash(qc), backend_identity(backend), seed]
+        if optimization_level is not None:
+            material.append(optimization_level)
+        if variant is not None:
+            material.append(variant)
+        identity = json.dumps(material, sort_keys=True)
+        key = hashlib.sha256(identity.encode("utf-8")).hexdigest()
+    except Exception as e:
+        log_stderr(f"Warning: Circuit not hashable for the transpile cache ({e}); transpiling directly.")
+        return optimize_fn(qc, backend, seed, **options)
+
+    if key in _TRANSPILE_CACHE:
+        stats["transpile_hits"] += 1
+        log_stderr(f"Reusing transpiled circuit from cache ({key[:12]}).")
+        return _TRANSPILE_CACHE[key]
+
+    path = _cache_path("transpiled", key)
+    if path:
+        try:
+            with open(path + ".qpy", "rb") as f:
+                circuit = qpy.load(f)[0]
+            with open(path + ".json", "r") as f:
+                metrics = json.load(f)
+            entry = (circuit, metrics["depth"], metrics["cx_count"], metrics["gate_count"])
+            _TRANSPILE_CACHE[key] = entry
+            stats["transpile_hits"] += 1
+            log_stderr(f"Loaded transpiled circuit from cache ({key[:12]}).")
+            return entry
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            log_stderr(f"Warning: Ignoring unreadable transpile cache entry {key[:12]}: {e}")
+
+    stats["transpile_misses"] += 1
+    entry = optimize_fn(qc, backend, seed, **options)
+    _TRANSPILE_CACHE[key] = entry
+    if path:
+        try:
+            buffer = io.BytesIO()
+            qpy.dump(entry[0], buffer)
+            _write_atomic(path + ".qpy", buffer.getvalue())
+            metrics = {"depth": entry[1], "cx_count": entry[2], "gate_count": entry[3]}
+            _write_atomic(path + ".json", json.dumps(metrics).encode("utf-8"))
+        except Exception as e:
+            log_stderr(f"Warning: Could not write transpile cache entry: {e}")
+    return entry
+
+
+# --- Calibration Cache ---
+def noise_metrics(backend, fetch_fn):
+    """Returns fetch_fn(backend) (the scripts' get_backend_noise_metrics), cached with a TTL."""
+    return calibration(backend, fetch_fn, "noise metrics")
+
+
+def calibration(backend, fetch_fn, kind, extra=None):
+    """Returns fetch_fn(backend), cached with a TTL per backend calibration, `kind` and
+       JSON-serializable `extra` key material (e.g. the measured qubits)."""
+    if not enabled():
+        return fetch_fn(backend)
+    identity = backend_identity(backend)
+    material = [CACHE_VERSION, kind, identity, extra]
+    key = hashlib.sha256(json.dumps(material, sort_keys=True).encode("utf-8")).hexdigest()
+    ttl = _settings["calibration_ttl_sec"]
+    now = time.time()
+
+    entry = _CALIBRATION_CACHE.get(key)
+    path = _cache_path("calibration", key + ".json")
+    if entry is None and path:
+        try:
+            with open(path, "r") as f:
+                entry = json.load(f)
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            log_stderr(f"Warning: Ignoring unreadable calibration cache entry {key[:12]}: {e}")
+    if entry is not None and now - entry["fetched_at"] <= ttl:
+        _CALIBRATION_CACHE[key] = entry
+        stats["calibration_hits"] += 1
+        log_stderr(f"Using cached {kind} for {backend.name} "
+                   f"(fetched {now - entry['fetched_at']:.0f}s ago).")
+        return _copy(entry["metrics"])
+
+    stats["calibration_misses"] += 1
+    metrics = fetch_fn(backend)
+    entry = {"fetched_at": now, "backend": identity, "metrics": metrics}
+    _CALIBRATION_CACHE[key] = entry
+    if path:
+        try:
+            _write_atomic(path, json.dumps(entry, default=str).encode("utf-8"))
+        except Exception as e:
+            log_stderr(f"Warning: Could not write calibration cache entry: {e}")
+    return _copy(metrics)
+
+
+def _copy(metrics):
+    return dict(metrics) if isinstance(metrics, dict) else list(metrics)
@@ -0,0 +1,341 @@
+# run_stats.py
+#
+# Cross-run statistics over archives of results JSON files (and their binary
+# counts sidecars), for the dashboard's comparison views. Runs are grouped by
+# configuration (algorithm, backend, problem, qubits, iterations) and reduced
+# to:
+#
+#   - run success rate (found_correct_state / factors found) with a Wilson CI
+#   - marked-state probability mass (Grover), pooled over shots with a Wilson
+#     CI, plus the per-run mean / standard deviation
+#   - total variation distance from the ideal output distribution
+#   - Shor period-recovery and factor-recovery rates per shot
+#
+# Files are streamed one at a time and each configuration keeps only running
+# sums, so memory does not grow with the size of the archive.
+#
+#   python run_stats.py results/ archive/*.json --group_by algorithm,backend
+
+import argparse
+import json
+import math
+import os
+import sys
+from fractions import Fraction
+
+import numpy as np
+
+import result_io
+
+DEFAULT_Z = 1.96 # 95% confidence
+# Largest Shor control register for which the ideal distribution is built densely.
+MAX_IDEAL_BITS = result_io.DENSE_HISTOGRAM_MAX_BITS
+CONFIG_FIELDS = ("algorithm", "backend", "ran_on_hardware", "num_qubits", "problem", "grover_iterations")
+
+
+# --- Helper Functions (Logging to stderr) ---
+def log_stderr(*args, **kwargs):
+    """Prints messages to stderr."""
+    print(*args, file=sys.stderr, **kwargs)
+
+
+def wilson_interval(successes, trials, z=DEFAULT_Z):
+    """Wilson score interval for a binomial proportion; (low, high), or (None, None) without trials."""
+    if trials <= 0:
+        return None, None
+    p = successes / trials
+    denominator = 1 + z * z / trials
+    center = (p + z * z / (2 * trials)) / denominator
+    half = z * math.sqrt(p * (1 - p) / trials + z * z / (4 * trials * trials)) / denominator
+    return max(0.0, center - half), min(1.0, center + half)
+
+
+# --- Loading ---
+def iter_result_files(paths):
+    """Yields results JSON paths from files and (recursively) directories, lazily."""
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                for name in sorted(files):
+                    if name.endswith(".json"):
+                        yield os.path.join(root, name)
+        else:
+            yield path
+
+
+def load_run(path):
+    """Returns (results, (outcomes, frequencies) or None, num_bits) or None if not a results file."""
+    with open(path, "r") as f:
+        results = json.load(f)
+    if not isinstance(results, dict) or "backend_used" not in results or "status" not in results:
+        return None
+    algorithm = "shor_n15" if "factors" in results else "grover_search"
+    num_bits = results.get("num_qubits") if algorithm == "grover_search" else None
+
+    counts = None
+    sidecars = [results.get("counts_file"), result_io.sidecar_path(path)]
+    for sidecar in sidecars:
+        if sidecar and os.path.exists(sidecar):
+            outcomes, frequencies, num_bits = result_io.load_counts_sidecar(sidecar)
+            counts = (outcomes, frequencies)
+            break
+    if counts is None and results.get("raw_counts") and not results.get("raw_counts_truncated"):
+        if num_bits is None:
+            num_bits = len(next(iter(results["raw_counts"])))
+        counts = result_io.counts_arrays_from_dict(results["raw_counts"], num_bits)
+    results["_algorithm"] = algorithm
+    return results, counts, num_bits
+
+
+# --- Ideal Distributions ---
+def grover_marked_states(results):
+    """Full list of marked bit-strings, or None when only a sample of the solutions is known."""
+    if results.get("input_marked_states"):
+        return list(results["input_marked_states"])
+    oracle = results.get("oracle") or {}
+    solutions = oracle.get("sample_solutions") or []
+    if oracle.get("solution_count_method") == "exact" and len(solutions) == oracle.get("num_solutions"):
+        return list(solutions)
+    return None
+
+
+def grover_success_probability(num_marked, num_bits, iterations):
+    """sin^2((2k+1) theta) with sin^2(theta) = M / 2^n."""
+    theta = math.asin(math.sqrt(num_marked / 2 ** num_bits))
+    return math.sin((2 * iterations + 1) * theta) ** 2
+
+
+def multiplicative_order(a, N):
+    if math.gcd(a, N) != 1:
+        return None
+    r, value = 1, a % N
+    while value != 1:
+        value = (value * a) % N
+        r += 1
+    return r
+
+
+def shor_ideal_distribution(a, N, t):
+    """Exact output distribution of the t-bit phase register for a^x mod N (dense, 2^t entries)."""
+    r = multiplicative_order(a, N)
+    size = 2 ** t
+    y = np.arange(size)
+    probabilities = np.zeros(size)
+    for j in range(r):
+        k = np.arange(j, size, r)
+        amplitudes = np.exp(2j * np.pi * np.outer(y, k) / size).sum(axis=1) / size
+        probabilities += np.abs(amplitudes) ** 2
+    return probabilities / probabilities.sum()
+
+
+def total_variation(observed_p, ideal_p_observed, ideal_mass_unobserved):
+    """TVD when the ideal distribution is only evaluated on the observed outcomes."""
+    return 0.5 * (float(np.abs(observed_p - ideal_p_observed).sum()) + max(0.0, ideal_mass_unobserved))
+
+
+def shor_recovery_masks(a, N, t, outcomes):
+    """Per observed outcome: does continued fractions give the true period / a non-trivial factor?"""
+    r_true = multiplicative_order(a, N)
+    period = np.zeros(len(outcomes), dtype=bool)
+    factor = np.zeros(len(outcomes), dtype=bool)
+    for i, y in enumerate(outcomes.tolist()):
+        if y == 0:
+            continue
+        r = Fraction(y, 2 ** t).limit_denominator(N).denominator
+        period[i] = r == r_true
+        if r % 2 == 0 and pow(a, r, N) == 1:
+            term = pow(a, r // 2, N)
+            if (term + 1) % N != 0:
+                g = math.gcd(term - 1, N)
+                factor[i] = 1 < g < N
+    return period, factor
+
+
+# --- Per-Run Reduction ---
+def run_metrics(results, counts, num_bits):
+    """Configuration key fields plus the per-run quantities that feed the accumulators."""
+    algorithm = results["_algorithm"]
+    config = {
+        "algorithm": algorithm,
+        "backend": results.get("backend_used"),
+        "ran_on_hardware": bool(results.get("ran_on_hardware")),
+        "num_qubits": results.get("num_qubits") if algorithm == "grover_search" else num_bits,
+        "grover_iterations": results.get("grover_iterations"),
+    }
+    metrics = {"success": results.get("status") == "success", "qpu_time_sec": results.get("qpu_time_sec") or 0.0}
+
+    if algorithm == "grover_search":
+        marked = grover_marked_states(results)
+        oracle = results.get("oracle") or {}
+        config["problem"] = ",".join(sorted(marked)) if results.get("input_marked_states") else oracle.get("formula_hash")
+        metrics["success"] = metrics["success"] and bool(results.get("found_correct_state"))
+        if counts is not None and marked is not None and num_bits:
+            outcomes, frequencies = counts
+            shots = int(frequencies.sum())
+            if outcomes.dtype.kind in "US":
+                is_marked = np.isin(outcomes, np.array(marked))
+            else:
+                is_marked = np.isin(outcomes, np.array([int(m, 2) for m in marked], dtype=np.int64))
+            marked_shots = int(frequencies[is_marked].sum())
+            metrics.update(shots=shots, marked_shots=marked_shots)
+            iterations = results.get("grover_iterations")
+            num_marked, space = len(marked), 2 ** num_bits
+            if isinstance(iterations, int) and 0 < num_marked < space:
+                p_success = grover_success_probability(num_marked, num_bits, iterations)
+                ideal = np.where(is_marked, p_success / num_marked, (1 - p_success) / (space - num_marked))
+                unobserved = 1.0 - float(ideal.sum())
+                metrics["tvd"] = total_variation(frequencies / shots, ideal, unobserved)
+    else:
+        a, N = results.get("a_value"), results.get("n_value")
+        config["problem"] = f"a={a},N={N}"
+        metrics["success"] = metrics["success"] and bool(results.get("factors"))
+        if counts is not None and a and N and num_bits and counts[0].dtype.kind not in "US":
+            outcomes, frequencies = counts
+            shots = int(frequencies.sum())
+            period, factor = shor_recovery_masks(a, N, num_bits, outcomes)
+            metrics.update(shots=shots, period_shots=int(frequencies[period].sum()),
+                           factor_shots=int(frequencies[factor].sum()))
+            if num_bits <= MAX_IDEAL_BITS:
+                ideal = shor_ideal_distribution(a, N, num_bits)[outcomes]
+                metrics["tvd"] = total_variation(frequencies / shots, ideal, 1.0 - float(ideal.sum()))
+    return config, metrics
+
+
+# --- Streaming Aggregation ---
+class ConfigStats:
+    """Running sums for one configuration; O(1) memory regardless of run count."""
+
+    def __init__(self):
+        self.runs = 0
+        self.run_successes = 0
+        self.runs_with_counts = 0
+        self.shots = 0
+        self.marked_runs = 0
+        self.marked_trials = 0
+        self.marked_shots = 0
+        self.mass_sum = 0.0
+        self.mass_sq_sum = 0.0
+        self.period_shots = 0
+        self.factor_shots = 0
+        self.tvd_runs = 0
+        self.tvd_sum = 0.0
+        self.tvd_sq_sum = 0.0
+        self.tvd_max = 0.0
+        self.qpu_time_sec = 0.0
+
+    def add(self, metrics):
+        self.runs += 1
+        self.run_successes += int(metrics["success"])
+        self.qpu_time_sec += metrics["qpu_time_sec"]
+        if "shots" in metrics:
+            self.runs_with_counts += 1
+            self.shots += metrics["shots"]
+        if "marked_shots" in metrics:
+            self.marked_runs += 1
+            self.marked_trials += metrics["shots"]
+            self.marked_shots += metrics["marked_shots"]
+            mass = metrics["marked_shots"] / metrics["shots"] if metrics["shots"] else 0.0
+            self.mass_sum += mass
+            self.mass_sq_sum += mass * mass
+        if "period_shots" in metrics:
+            self.period_shots += metrics["period_shots"]
+            self.factor_shots += metrics["factor_shots"]
+        if "tvd" in metrics:
+            self.tvd_runs += 1
+            self.tvd_sum += metrics["tvd"]
+            self.tvd_sq_sum += metrics["tvd"] ** 2
+            self.tvd_max = max(self.tvd_max, metrics["tvd"])
+
+    @staticmethod
+    def _mean_std(total, sq_total, n):
+        if n == 0:
+            return None, None
+        mean = total / n
+        variance = max(0.0, sq_total / n - mean * mean) * n / (n - 1) if n > 1 else 0.0
+        return round(mean, 6), round(math.sqrt(variance), 6)
+
+    @staticmethod
+    def _rate(successes, trials, z):
+        low, high = wilson_interval(successes, trials, z)
+        if low is None:
+            return None
+        return {"rate": round(successes / trials, 6), "ci_low": round(low, 6), "ci_high": round(high, 6),
+                "successes": successes, "trials": trials}
+
+    def summary(self, algorithm, z=DEFAULT_Z):
+        summary = {
+            "runs": self.runs,
+            "run_success": self._rate(self.run_successes, self.runs, z),
+            "runs_with_counts": self.runs_with_counts,
+            "shots": self.shots,
+            "qpu_time_sec": round(self.qpu_time_sec, 3),
+        }
+        if algorithm == "grover_search":
+            mean, std = self._mean_std(self.mass_sum, self.mass_sq_sum, self.marked_runs)
+            summary["marked_mass"] = self._rate(self.marked_shots, self.marked_trials, z)
+            summary["marked_mass_run_mean"], summary["marked_mass_run_std"] = mean, std
+        else:
+            summary["period_recovery"] = self._rate(self.period_shots, self.shots, z)
+            summary["factor_recovery"] = self._rate(self.factor_shots, self.shots, z)
+        mean, std = self._mean_std(self.tvd_sum, self.tvd_sq_sum, self.tvd_runs)
+        summary["tvd"] = None if mean is None else {"mean": mean, "std": std, "max": round(self.tvd_max, 6),
+                                                    "runs": self.tvd_runs}
+        return summary
+
+
+def aggregate(paths, group_by=CONFIG_FIELDS, z=DEFAULT_Z):
+    """Streams over the results files under `paths`; returns {"groups": [...], "files": {...}}."""
+    groups = {}
+    scanned = skipped = 0
+    for path in iter_result_files(paths):
+        scanned += 1
+        try:
+            loaded = load_run(path)
+        except Exception as e:
+            log_stderr(f"Skipping {path}: {e}")
+            skipped += 1
+            continue
+        if loaded is None:
+            skipped += 1
+            continue
+        config, metrics = run_metrics(*loaded)
+        key = tuple(config.get(field) for field in group_by)
+        if key not in groups:
+            groups[key] = (config["algorithm"], ConfigStats())
+        groups[key][1].add(metrics)
+
+    output = []
+    for key, (algorithm, stats) in sorted(groups.items(), key=lambda item: [str(k) for k in item[0]]):
+        entry = dict(zip(group_by, key))
+        entry.update(stats.summary(algorithm, z))
+        output.append(entry)
+    return {"groups": output, "files": {"scanned": scanned, "skipped": skipped, "runs": scanned - skipped}}
+
+
+# --- Command Line ---
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Aggregate success rates and distribution statistics across runs.")
+    parser.add_argument('paths', nargs='+', help='Results JSON files or directories (searched recursively)')
+    parser.add_argument('--group_by', type=str, default=",".join(CONFIG_FIELDS),
+                        help=f'Comma-separated configuration fields (default: {",".join(CONFIG_FIELDS)})')
+    parser.add_argument('--confidence_z', type=float, default=DEFAULT_Z, help=f'z-score for Wilson intervals (default: {DEFAULT_Z})')
+    parser.add_argument('--output_json', type=str, default=None, help='Write the statistics here instead of stdout')
+    args = parser.parse_args(argv)
+
+    group_by = tuple(g.strip() for g in args.group_by.split(",") if g.strip())
+    unknown = [g for g in group_by if g not in CONFIG_FIELDS]
+    if unknown:
+        parser.error(f"Unknown --group_by field(s) {unknown}; choose from {', '.join(CONFIG_FIELDS)}.")
+    stats = aggregate(args.paths, group_by, args.confidence_z)
+    log_stderr(f"Aggregated {stats['files']['runs']} run(s) into {len(stats['groups'])} group(s) "
+               f"({stats['files']['skipped']} file(s) skipped).")
+    if args.output_json:
+        result_io.write_json_atomic(args.output_json, stats, indent=2)
+    else:
+        print(result_io.dumps_json(stats, indent=2).decode("utf-8"))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,10 +1,11 @@
+import time
+_IMPORT_START = time.perf_counter() # Start of the "import" phase (qiskit imports dominate it)
 import math
 import numpy as np
 from math import gcd, isqrt
 from fractions import Fraction
 from qiskit import QuantumCircuit, QuantumRegister, ClassicalRegister, transpile
 from qiskit.circuit.library import QFT
-import matplotlib.pyplot as plt
 from qiskit_ibm_runtime import QiskitRuntimeService, SamplerV2 as Sampler
 from qiskit.transpiler.preset_passmanagers import generate_preset_pass_manager
 from qiskit.circuit import Gate
@@ -12,11 +13,29 @@ from qiskit_aer import AerSimulator # Import AerSimulator directly
 
 # For Command Line Args, JSON output, Time, Exit codes
 import argparse
-import json
-import time
 import sys
 import traceback # For detailed error logging
 
+import result_io
+import plot_render
+import telemetry
+import profiling
+import run_context
+import result_cache
+import chunked_run
+import results_store
+import resource_estimate
+import backend_registry
+import readout_mitigation
+import deadline
+import submission
+import exact_distribution
+import coalesce
+import qpu_budget
+import worker_metrics
+import sim_compile
+_IMPORT_END = time.perf_counter()
+
 # --- Fixed Parameters ---
 N = 15
 # Using the specific base 'a' for which optimized circuits are available
@@ -24,20 +43,32 @@ a = 7
 # Fixed qubit counts for N=15
 n_work = 4
 n_control = 4
+# Bases coprime to N that --bases can choose from
+COPRIME_BASES = tuple(b for b in range(2, N) if gcd(b, N) == 1)
+# Every unit mod 15 is +-2^j: multiplier k -> (j, negate)
+_MOD15_MULTIPLIERS = {(sign * 2**j) % 15: (j, sign < 0) for j in range(4) for sign in (1, -1)}
+# Transpiler optimization level; --deadline may fall back to a cheaper level
+OPTIMIZATION_LEVEL = 2
 
 # --- Helper Functions (Logging to stderr) ---
 def log_stderr(*args, **kwargs):
     """Prints messages to stderr."""
     print(*args, file=sys.stderr, **kwargs)
 
+def log_debug(*args, **kwargs):
+    """Prints verbose per-qubit / per-gate messages to stderr (only with --log_level debug)."""
+    if telemetry.debug_enabled():
+        print(*args, file=sys.stderr, **kwargs)
+
 # --- Optimized Modular Exponentiation for N=15, a=7 (as before) ---
 # (Keeping the U_a_pow_mod15 function exactly as in the original script)
 def U_a_pow_mod15(a, power, n_work):
     """Creates the gate U^(a^power) mod 15 on n_work qubits.
-       Uses known optimized circuits for a=7, N=15."""
-    if a not in [7]: # Restricting to a=7 as discussed
-         log_stderr(f"ERROR: This script is hardcoded for a=7 with N=15.")
-         raise ValueError(f"Optimized circuit for a={a} not implemented/selected.")
+       Uses known optimized circuits for a=7, N=15; other coprime bases
+       multiply by +-2^j (a bit rotation, then X on every qubit to negate)."""
+    if a not in COPRIME_BASES:
+         log_stderr(f"ERROR: Base a={a} is not coprime to 15.")
+         raise ValueError(f"Base a={a} must be one of {', '.join(map(str, COPRIME_BASES))}.")
     if n_work != 4:
         raise ValueError("This implementation requires n_work=4 for N=15.")
 
@@ -46,6 +77,16 @@ def U_a_pow_mod15(a, power, n_work):
 
     log_stderr(f"  Building gate for multiplication by {k} = ({a}^{power} mod 15)")
 
+    if a != 7:
+        shifts, negate = _MOD15_MULTIPLIERS[k]
+        for _ in range(shifts): # *2 mod 15 is a cyclic left shift of the 4 bits
+            U.swap(2, 3)
+            U.swap(1, 2)
+            U.swap(0, 1)
+        if negate: # -x mod 15 = 15 - x flips every bit
+            U.x(range(n_work))
+        return U.to_gate()
+
     # Specific implementations for a=7, N=15
     if k == 7: # U^1 = *7 mod 15
         U.swap(0, 1)
@@ -63,8 +104,8 @@ def U_a_pow_mod15(a, power, n_work):
 
 # --- Circuit Construction (as before, using log_stderr) ---
 def build_shor_circuit_n15(n_control, n_work, a):
-    """Builds the quantum circuit for Shor's algorithm for N=15, a=7."""
-    log_stderr("Building Shor Circuit (N=15, a=7)...")
+    """Builds the quantum circuit for Shor's algorithm for N=15 with base a."""
+    log_stderr(f"Building Shor Circuit (N=15, a={a})...")
     ctrl = QuantumRegister(n_control, name='ctrl')
     work = QuantumRegister(n_work, name='work')
     creg = ClassicalRegister(n_control, name='c') # Measure control bits
@@ -100,9 +141,10 @@ def build_shor_circuit_n15(n_control, n_work, a):
     return qc
 
 # --- Classical Post-Processing (as before, using log_stderr) ---
-def process_measurement(bitstr, t, a, N):
-    """Processes the measurement result to find the period and factors."""
-    y = int(bitstr, 2)
+def process_measurement(measured, t, a, N):
+    """Processes the measurement result (integer outcome or bit-string) to find the period and factors."""
+    y = int(measured, 2) if isinstance(measured, str) else int(measured)
+    bitstr = format(y, f"0{t}b")
     log_stderr(f"\n--- Processing Measurement: {bitstr} (y = {y}) ---")
 
     if y == 0:
@@ -160,6 +202,27 @@ def process_measurement(bitstr, t, a, N):
         log_stderr(traceback.format_exc())
         return None, None
 
+def multiplicative_order(a, N):
+    """Smallest r > 0 with a^r = 1 mod N (classical; used for the expected peaks)."""
+    r, value = 1, a % N
+    while value != 1:
+        value = (value * a) % N
+        r += 1
+    return r
+
+def find_factors(outcomes, frequencies, a, N):
+    """Tries outcomes from most to least frequent. Returns (sorted factors, bit-string) or (None, None)."""
+    # Sort counts by frequency (stable, so ties keep ascending outcome order)
+    order = np.argsort(-frequencies, kind="stable")
+    for i in order: # Process all results or top N
+        bitstr = result_io.outcome_to_bitstring(outcomes[i], n_control)
+        log_stderr(f"\nTrying measurement outcome: {bitstr} (Counts: {int(frequencies[i])})")
+        factor1, factor2 = process_measurement(outcomes[i], n_control, a, N) # Integer outcome, no re-parsing
+        if factor1 is not None and factor2 is not None:
+            log_stderr(f"Factors {factor1}, {factor2} found from bitstring {bitstr}.")
+            return sorted([factor1, factor2]), bitstr # Stop after finding the first valid factors
+    return None, None
+
 # --- Get Backend Noise Properties ---
 def get_backend_noise_metrics(backend):
     """Retrieve noise and error metrics from the backend if available."""
@@ -201,19 +264,19 @@ def get_backend_noise_metrics(backend):
                     if hasattr(props, 't1'):
                         t1 = props.t1(qubit)
                         t1_values.append(t1 * 1e6)  # Convert to microseconds
-                        log_stderr(f"T1 for qubit {qubit}: {t1 * 1e6:.2f} μs")
+                        log_debug(f"T1 for qubit {qubit}: {t1 * 1e6:.2f} μs")
                     
                     if hasattr(props, 't2'):
                         t2 = props.t2(qubit)
                         t2_values.append(t2 * 1e6)  # Convert to microseconds
-                        log_stderr(f"T2 for qubit {qubit}: {t2 * 1e6:.2f} μs")
+                        log_debug(f"T2 for qubit {qubit}: {t2 * 1e6:.2f} μs")
                     
                     if hasattr(props, 'readout_error'):
                         re = props.readout_error(qubit)
                         readout_errors.append(re)
-                        log_stderr(f"Readout error for qubit {qubit}: {re * 100:.4f}%")
+                        log_debug(f"Readout error for qubit {qubit}: {re * 100:.4f}%")
                 except Exception as e:
-                    log_stderr(f"Error accessing direct properties for qubit {qubit}: {e}")
+                    log_debug(f"Error accessing direct properties for qubit {qubit}: {e}")
             
             # Set metrics if we found values
             if t1_values:
@@ -239,7 +302,7 @@ def get_backend_noise_metrics(backend):
                         measure_props = backend.target["measure"][(qubit,)]
                         if hasattr(measure_props, 'error'):
                             readout_errors.append(measure_props.error)
-                            log_stderr(f"Readout error from target for qubit {qubit}: {measure_props.error * 100:.4f}%")
+                            log_debug(f"Readout error from target for qubit {qubit}: {measure_props.error * 100:.4f}%")
                 
                 if readout_errors:
                     metrics["readout_error"] = sum(readout_errors) / len(readout_errors) * 100  # Convert to percentage
@@ -261,12 +324,12 @@ def get_backend_noise_metrics(backend):
                         # Modern backends return these as attributes
                         if hasattr(qubit_props, 'T1'):
                             t1_times.append(qubit_props.T1 * 1e6)  # Make sure it's in μs
-                            log_stderr(f"T1 from qubit_properties for qubit {qubit}: {qubit_props.T1 * 1e6:.2f} μs")
+                            log_debug(f"T1 from qubit_properties for qubit {qubit}: {qubit_props.T1 * 1e6:.2f} μs")
                         if hasattr(qubit_props, 'T2'):
                             t2_times.append(qubit_props.T2 * 1e6)  # Make sure it's in μs
-                            log_stderr(f"T2 from qubit_properties for qubit {qubit}: {qubit_props.T2 * 1e6:.2f} μs")
+                            log_debug(f"T2 from qubit_properties for qubit {qubit}: {qubit_props.T2 * 1e6:.2f} μs")
                 except Exception as e:
-                    log_stderr(f"Error accessing qubit_properties for qubit {qubit}: {e}")
+                    log_debug(f"Error accessing qubit_properties for qubit {qubit}: {e}")
             
             # Update metrics if we found values
             if t1_times and metrics["t1_time"] is None:
@@ -301,7 +364,7 @@ def get_backend_noise_metrics(backend):
                             break
                     
                     if is_two_qubit_gate:
-                        log_stderr(f"Found two-qubit gate: {gate_str}")
+                        log_debug(f"Found two-qubit gate: {gate_str}")
                         
                         # Get all qubit tuples where this gate is defined
                         if gate_name in backend.target:
@@ -315,7 +378,7 @@ def get_backend_noise_metrics(backend):
                                     if hasattr(props, 'error') and props.error is not None:
                                         error_value = props.error
                                         gate_errors[gate_type_key].append(error_value)
-                                        log_stderr(f"  {gate_str} error on qubits {qubits}: {error_value * 100:.6f}%")
+                                        log_debug(f"  {gate_str} error on qubits {qubits}: {error_value * 100:.6f}%")
                 
                 # If we found any errors, calculate the average for each gate type and overall
                 if gate_errors:
@@ -407,12 +470,13 @@ def get_backend_noise_metrics(backend):
     return metrics
 
 # --- Circuit Optimisation (returns metrics) ---
-def optimize_circuit(qc, backend):
-    """Optimize the circuit and return metrics."""
+def optimize_circuit(qc, backend, seed=None, optimization_level=OPTIMIZATION_LEVEL, callback=None):
+    """Optimize the circuit and return metrics. A seed makes layout/routing reproducible;
+       callback is called after every pass (deadline.py aborts slow transpiles through it)."""
     log_stderr(f"\nOptimizing circuit for backend: {backend.name}...")
     target = backend.target
-    pm = generate_preset_pass_manager(target=target, optimization_level=2)
-    optimized_circuit = pm.run(qc)
+    pm = generate_preset_pass_manager(target=target, optimization_level=optimization_level, seed_transpiler=seed)
+    optimized_circuit = pm.run(qc, callback=callback)
     log_stderr("Optimization complete.")
     depth = 0
     cx_count = 0
@@ -430,18 +494,45 @@ def optimize_circuit(qc, backend):
     return optimized_circuit, depth, cx_count, gate_count
 
 
-# --- Execution on Hardware/Simulator (returns job_id, counts) ---
-def run_circuit(qc, backend, shots):
-    """Run the circuit using SamplerV2 primitive."""
+# --- Execution on Hardware/Simulator (returns job_id, counts arrays) ---
+def run_circuit(qc, backend, shots, timer=None):
+    """Run the circuit using SamplerV2 primitive.
+       Counts are returned as (outcomes, frequencies) integer arrays."""
+    timer = timer or telemetry.PhaseTimer("shor_n15")
     log_stderr(f"\nRunning circuit on backend: {backend.name} with {shots} shots.")
-    sampler = Sampler(mode=backend)
-    sampler.options.default_shots = shots
-
-    job = sampler.run([qc])
-    job_id = job.job_id()
-    log_stderr(f"Job ID: {job_id}")
+    job = submit_circuit(qc, backend, shots, timer)
     log_stderr("Waiting for job to complete...")
-    result = job.result()[0] # Waits for completion
+    return collect_job(job, qc, timer)
+
+def submit_circuit(qc, backend, shots, timer):
+    """Submits the circuit without waiting; returns the job."""
+    with timer.phase("submit"):
+        sampler = Sampler(mode=backend)
+        sampler.options.default_shots = shots
+
+        job = sampler.run([qc])
+    worker_metrics.job_started(job.job_id(), worker_metrics.labels_for(timer.script, backend.name, timer.labels.get("qubits")))
+    log_stderr(f"Job ID: {job.job_id()}")
+    return job
+
+def collect_job(job, qc, timer, cancel=None):
+    """Waits for a submitted job and extracts (job_id, counts arrays, qpu_time). cancel is
+       deadline.wait_for_result's predicate for cancelling the job if the wait is cut short."""
+    job_id = job.job_id()
+    wait_start = time.perf_counter()
+    try:
+        with timer.profiled("execute"):
+            result = deadline.wait_for_result(job, timer.deadline, cancel)[0] # Waits for completion
+    finally:
+        worker_metrics.job_finished(job_id)
+    wait_sec = time.perf_counter() - wait_start
+    # Split the wait into queue / execute from the job's own timestamps when available
+    queue_sec, _ = telemetry.job_queue_execute_split(job)
+    if queue_sec is not None:
+        timer.record("queue", min(queue_sec, wait_sec), source="job_metrics")
+        timer.record("execute", wait_sec - min(queue_sec, wait_sec), source="job_metrics")
+    else:
+        timer.record("execute", wait_sec)
     log_stderr("Job finished.")
     
     # Get QPU time if available
@@ -454,94 +545,142 @@ def run_circuit(qc, backend, shots):
     except Exception as e:
         log_stderr(f"Unable to retrieve QPU time: {e}")
 
-    counts = {}
-    # Extract counts robustly from SamplerV2 result
-    data_container = None
-    pub_result = result.data # Access the PubResult directly
-
-    # SamplerV2 stores results per classical register. Ours is named 'c'.
-    if hasattr(pub_result, 'c'):
-        data_container = pub_result.c
-        log_stderr("Extracting counts from data field: c")
-    elif hasattr(pub_result, 'meas'): # Fallback check
-         data_container = pub_result.meas
-         log_stderr("Extracting counts from data field: meas")
-    # Add more fallbacks if needed based on future Qiskit versions
-
-    if data_container and hasattr(data_container, 'get_counts'):
-        counts = data_container.get_counts()
-    elif data_container and isinstance(data_container, dict): # Aer sometimes returns dict
-         counts = data_container
-    else:
-        log_stderr("Warning: Could not extract counts from SamplerV2 result data structure.")
-        log_stderr(f"Result data type: {type(pub_result)}")
-        log_stderr(f"Result data content: {pub_result}")
+    with timer.phase("extract_counts"):
+        counts = (np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64))
+        # SamplerV2 stores results per classical register. Ours is named 'c'.
+        try:
+            measurements = result_io.Measurements.from_pub_result(result, "c", qc.num_clbits)
+            log_stderr(f"Extracting counts from data field: {measurements.register}")
+            counts = measurements.histogram()
+        except ValueError as e:
+            log_stderr(f"Warning: Could not extract counts from SamplerV2 result data structure: {e}")
 
 
     log_stderr("Measurement counts received.")
     return job_id, counts, qpu_time
 
-# --- Plotting Function ---
-def generate_plot(counts, n_control, a, N, backend_name, theme, plot_file_path):
-    """Generates and saves the histogram plot."""
-    log_stderr(f"\nGenerating plot ({theme} theme) to {plot_file_path}...")
+# --- Plot Data ---
+def build_plot_series(outcomes, frequencies, n_control, a, N, backend_name, theme,
+                      max_bars=plot_render.DEFAULT_MAX_BARS, aggregate="top_k"):
+    """Builds the bounded histogram series (stored as plot_data) with the expected peaks marked."""
+    series = plot_render.histogram_series(outcomes, frequencies, n_control, max_bars=max_bars,
+                                          aggregate=aggregate, full_range=True, label_format="integer")
+    # Expected peaks at multiples of 2^n_control / r (r = 4 for a=7)
+    period_r = multiplicative_order(a, N)
+    expected_peaks = [s * (2**n_control // period_r) for s in range(period_r)]
+    series.update({
+        "theme": theme,
+        "title": f"Shor's N={N} (a={a}) Results on {backend_name}",
+        "xlabel": "Measurement Outcome (Integer)",
+        "ylabel": "Counts",
+        "figsize": [10, 6],
+        "colors": {"bar": '#1976d2', "marker": 'red'}, # A common blue, works on light/dark
+        # Don't label the peak at 0 usually
+        "markers": [{"label": str(peak), "text": f"Expected Peak (y={peak})"} for peak in expected_peaks if peak != 0],
+    })
+    return series
+
+
+# --- Multi-Base Attempts ---
+SIMULATOR_POLL_SEC = 0.05
+HARDWARE_POLL_SEC = 5.0
+
+def parse_bases(text):
+    """'all' or a comma-separated list of bases coprime to N (order kept, duplicates dropped)."""
+    if text.strip().lower() == "all":
+        return list(COPRIME_BASES)
+    bases = []
+    for part in text.split(","):
+        if part.strip():
+            base = int(part)
+            if base not in COPRIME_BASES:
+                raise ValueError(f"--bases: {base} is not a base coprime to {N} ({', '.join(map(str, COPRIME_BASES))}).")
+            if base not in bases:
+                bases.append(base)
+    if not bases:
+        raise ValueError("--bases needs at least one base.")
+    return bases
+
+def run_bases(circuits, backend, shots, timer, poll_interval, submit=submit_circuit, collect=collect_job):
+    """Submits one job per base, then processes whichever finishes first. The first
+       verified factorization, the --deadline or an interrupt cancels the jobs still
+       queued or running.
+
+    circuits is a list of (a, transpiled circuit); submit(qc, backend, shots, timer) -> job
+    and collect(job, qc, timer) default to submit_circuit and collect_job. Returns (winning base or None,
+    {a: (job_id, (outcomes, frequencies), qpu_time)} for completed bases, factors,
+    bit-string, attempts).
+    """
+    attempts = {a: {"a": a, "job_id": None, "status": "pending", "factors": None, "time_to_result_sec": None,
+                    "qpu_time_sec": None} for a, _ in circuits}
+    pending, completed = {}, {}
+    start = time.perf_counter()
+    for a, qc in circuits:
+        log_stderr(f"\nSubmitting base a={a} to {backend.name} with {shots} shots.")
+        try:
+            job = submit(qc, backend, shots, timer)
+        except Exception as e:
+            log_stderr(f"Warning: Submission for base a={a} failed: {e}")
+            attempts[a].update(status="error", error=str(e))
+            continue
+        attempts[a]["job_id"] = job.job_id()
+        # Each job's queue / execute split is kept per attempt; the waits overlap
+        pending[a] = (job, qc, telemetry.PhaseTimer(timer.script, stream=timer.stream, origin=timer.origin))
+
+    winner, factors, bitstr = None, None, None
+    log_stderr(f"Waiting for {len(pending)} job(s); the first factorization cancels the rest...")
     try:
-        text_color = 'black' if theme == 'light' else 'white'
-        bar_color = '#1976d2' # A common blue, works on light/dark
-        expected_line_color = 'red'
-        grid_color = '#cccccc' if theme == 'light' else '#555555'
-
-        plt.style.use('seaborn-v0_8-darkgrid' if theme == 'dark' else 'seaborn-v0_8-whitegrid')
-        fig, ax = plt.subplots(figsize=(10, 6))
-        fig.patch.set_alpha(0.0) # Make figure background transparent
-        ax.patch.set_alpha(0.0)  # Make axes background transparent
-
+        with timer.phase("execute", step="multi_base"):
+            while pending and winner is None:
+                if timer.deadline is not None and timer.deadline.expired():
+                    log_stderr(f"Deadline reached with {len(pending)} job(s) still pending.")
+                    timer.deadline.degrade("execute", bases_completed=len(completed), bases_cancelled=len(pending))
+                    break
+                finished = [a for a, (job, _, _) in pending.items() if job.done()]
+                if not finished:
+                    time.sleep(poll_interval)
+                    continue
+                for a in finished:
+                    job, qc, attempt_timer = pending.pop(a)
+                    elapsed = round(time.perf_counter() - start, 3)
+                    try:
+                        job_id, counts, qpu_time = collect(job, qc, attempt_timer)
+                    except Exception as e:
+                        log_stderr(f"Warning: Job for base a={a} failed: {e}")
+                        attempts[a].update(status="error", error=str(e), time_to_result_sec=elapsed)
+                        timer.event("base_result", a=a, status="error", elapsed_sec=elapsed)
+                        continue
+                    completed[a] = (job_id, counts, qpu_time)
+                    log_stderr(f"\n--- Base a={a} finished after {elapsed}s ---")
+                    found, found_bitstr = find_factors(counts[0], counts[1], a, N)
+                    attempts[a].update(status="factored" if found else "no_factors", factors=found,
+                                       time_to_result_sec=elapsed, qpu_time_sec=qpu_time,
+                                       phase_timings=attempt_timer.summary())
+                    timer.event("base_result", a=a, status=attempts[a]["status"], factors=found, elapsed_sec=elapsed)
+                    if found:
+                        winner, factors, bitstr = a, found, found_bitstr
+                        break
+    finally:
+        # Also runs when a signal stops the wait, so no job is left queued
+        for a, (job, _, _) in pending.items():
+            try:
+                job.cancel()
+            except Exception as e:
+                log_stderr(f"Warning: Could not cancel job for base a={a}: {e}")
+            worker_metrics.job_finished(job.job_id())
+            attempts[a]["status"] = "cancelled"
+            timer.event("base_cancelled", a=a, job_id=attempts[a]["job_id"])
+        if pending:
+            log_stderr(f"Cancelled {len(pending)} remaining job(s): bases {', '.join(map(str, pending))}.")
+    return winner, completed, factors, bitstr, [attempts[a] for a, _ in circuits]
 
-        int_counts = {int(k, 2): v for k, v in counts.items()}
-        if not int_counts:
-             log_stderr("No counts data to plot.")
-             # Create an empty plot as placeholder? Or handle upstream.
-             # For now, save an empty transparent plot
-             plt.title("No Measurement Data Received", color=text_color)
 
-        else:
-             max_outcome = 2**n_control -1
-             all_outcomes = range(max_outcome + 1)
-             all_counts = [int_counts.get(i, 0) for i in all_outcomes]
-
-             ax.bar(all_outcomes, all_counts, color=bar_color)
-             ax.set_xlabel("Measurement Outcome (Integer)", color=text_color)
-             ax.set_ylabel("Counts", color=text_color)
-             ax.set_title(f"Shor's N={N} (a={a}) Results on {backend_name}", color=text_color)
-
-             ax.tick_params(axis='x', colors=text_color)
-             ax.tick_params(axis='y', colors=text_color)
-
-             for spine in ax.spines.values():
-                 spine.set_edgecolor(text_color)
-
-             # Expected peaks for N=15, a=7 (r=4)
-             period_r = 4 # Hardcoded for N=15, a=7
-             expected_peaks = [s * (2**n_control // period_r) for s in range(period_r)]
-             has_peaks = False
-             for i, peak in enumerate(expected_peaks):
-                  if peak != 0: # Don't label the peak at 0 usually
-                      label = f"Expected Peak (y={peak})" if not has_peaks else ""
-                      ax.axvline(x=peak, color=expected_line_color, linestyle='--', label=label)
-                      has_peaks = True
-
-             if has_peaks:
-                 legend = ax.legend(loc='best')
-                 plt.setp(legend.get_texts(), color=text_color)
-                 legend.get_frame().set_alpha(0.5) # Slightly visible frame can help
-
-             ax.grid(axis='y', linestyle='--', color=grid_color, alpha=0.7)
-             ax.set_xticks(np.arange(0, 2**n_control, step=max(1, 2**n_control // 16))) # Adjust ticks
-
-
-        # Save with transparent background
-        plt.savefig(plot_file_path, transparent=True, dpi=150, bbox_inches='tight')
-        plt.close(fig) # Close the plot figure
+# --- Plotting Function ---
+def generate_plot(series, plot_file_path):
+    """Renders the histogram series to a PNG file."""
+    log_stderr(f"\nGenerating plot ({series['theme']} theme) to {plot_file_path}...")
+    try:
+        plot_render.render_png(series, plot_file_path)
         log_stderr(f"Plot saved successfully to {plot_file_path}")
         return True
     except Exception as e:
@@ -551,21 +690,83 @@ def generate_plot(counts, n_control, a, N, backend_name, theme, plot_file_path):
 
 
 # --- Main Execution ---
-def main():
+def build_arg_parser():
     parser = argparse.ArgumentParser(description="Run Shor's algorithm for N=15, a=7 using Qiskit.")
     parser.add_argument('--api_token', type=str, required=True, help='IBM Quantum API Token')
     parser.add_argument('--shots', type=int, default=4096, help='Number of shots to run (default: 4096)')
     parser.add_argument('--run_on_hardware', action='store_true', help='Run on real hardware instead of simulator')
-    parser.add_argument('--plot_file', type=str, required=True, help='Path to save the output plot PNG file')
+    parser.add_argument('--plot_file', type=str, default=None, help='Path to save the output plot PNG file (omit for data-only output)')
+    parser.add_argument('--plot_mode', type=str, default='sync', choices=['sync', 'background', 'none'], help='Render the PNG before writing results (sync), in a detached process afterwards (background), or not at all (none); plot_data is always included (default: sync)')
+    parser.add_argument('--plot_max_bars', type=int, default=plot_render.DEFAULT_MAX_BARS, help=f'Max histogram bars regardless of qubit count (default: {plot_render.DEFAULT_MAX_BARS})')
+    parser.add_argument('--plot_aggregate', type=str, default='top_k', choices=['top_k', 'binned'], help='How to reduce outcomes beyond --plot_max_bars (default: top_k)')
     parser.add_argument('--plot_theme', type=str, required=True, choices=['light', 'dark'], help='Plot theme (light or dark)')
     parser.add_argument('--output_json', type=str, required=True, help='Path to save the output JSON results file')
-    args = parser.parse_args()
+    parser.add_argument('--counts_top_k', type=int, default=1024, help='Max outcomes kept inline in raw_counts; full counts go to the .counts.npz sidecar (default: 1024, 0 disables the inline summary)')
+    parser.add_argument('--counts_threshold', type=float, default=0.0, help='Only keep inline outcomes with at least this fraction of shots (default: 0)')
+    parser.add_argument('--event_stream', type=str, default=None, help='Emit JSON-line phase/progress events to "stdout", "stderr" or a file path')
+    parser.add_argument('--log_level', type=str, default='info', choices=list(telemetry.LOG_LEVELS), help='Use "debug" to log per-qubit calibration details (default: info)')
+    parser.add_argument('--seed', type=int, default=None, help='Seed for the simulator, transpiler and randomized schedules; fixes simulator results')
+    parser.add_argument('--result_cache', action='store_true', help='Reuse stored counts for identical simulator runs (circuit, simulator config, shots, seed)')
+    parser.add_argument('--result_cache_dir', type=str, default=None, help='Directory for cached simulator results (default: shared temp cache)')
+    parser.add_argument('--result_cache_max_mb', type=float, default=result_cache.DEFAULT_MAX_MB, help=f'Size bound for the result cache; least recently used entries are evicted (default: {result_cache.DEFAULT_MAX_MB})')
+    parser.add_argument('--backend', type=str, default=None, help='Pin a hardware backend by name instead of selecting the least busy one')
+    parser.add_argument('--backend_cache_ttl', type=float, default=backend_registry.DEFAULT_TTL_SEC, help=f'Seconds the cached hardware backend list stays valid (default: {backend_registry.DEFAULT_TTL_SEC})')
+    parser.add_argument('--dry_run', action='store_true', help='Build and transpile only; report estimated QPU time and success probability without submitting')
+    parser.add_argument('--readout_mitigation', type=str, default='none', choices=list(readout_mitigation.METHODS), help='Correct readout error: per-qubit assignment errors from the cached backend calibration ("calibration") or from two calibration circuits run alongside ("circuits"); raw counts are kept (default: none)')
+    parser.add_argument('--readout_calibration_shots', type=int, default=readout_mitigation.DEFAULT_CALIBRATION_SHOTS, help=f'Shots per calibration circuit for --readout_mitigation circuits (default: {readout_mitigation.DEFAULT_CALIBRATION_SHOTS})')
+    parser.add_argument('--mitigation_distance', type=int, default=readout_mitigation.DEFAULT_MAX_DISTANCE, help=f'Max bit flips between observed outcomes coupled by the correction (default: {readout_mitigation.DEFAULT_MAX_DISTANCE})')
+    parser.add_argument('--sim_compile', type=str, choices=sim_compile.MODES, default='native', help='Simulator compile path: "native" keeps the oracle / multipliers as Aer diagonal / unitary blocks with no layout or routing; "preset" uses the hardware pass manager (default: native)')
+    parser.add_argument('--exact', action='store_true', help='Simulator only: compute the exact distribution of the control register in one simulation and find factors from it; --shots are only sampled from it for the plot and counts outputs')
+    parser.add_argument('--exact_top_k', type=int, default=exact_distribution.DEFAULT_TOP_K, help=f'With --exact, keep the most probable outcomes in the results JSON; 0 stores the full probability vector (default: {exact_distribution.DEFAULT_TOP_K})')
+    parser.add_argument('--exact_threshold', type=float, default=0.0, help='With --exact, only keep outcomes with at least this probability (default: 0)')
+    parser.add_argument('--deadline', type=float, default=None, help='Wall-clock budget in seconds: slow transpiles fall back to a cheaper level, simulations to fewer shots, and jobs still running at the deadline are cancelled; a partial results JSON is written either way')
+    parser.add_argument('--max_attempts', type=int, default=submission.DEFAULT_MAX_ATTEMPTS, help=f'Attempts per backend for transient submission failures (network, rate limits), with exponential backoff (default: {submission.DEFAULT_MAX_ATTEMPTS})')
+    parser.add_argument('--max_backends', type=int, default=submission.DEFAULT_MAX_BACKENDS, help=f'Backends to try when jobs fail on the device; 1 disables failover (default: {submission.DEFAULT_MAX_BACKENDS})')
+    parser.add_argument('--retry_base_delay', type=float, default=submission.DEFAULT_BASE_DELAY_SEC, help=f'Backoff before the first retry in seconds, doubling per attempt, with full jitter (default: {submission.DEFAULT_BASE_DELAY_SEC})')
+    parser.add_argument('--no_coalesce', action='store_true', help='Always submit a new hardware job, instead of sharing an identical one already in flight from another run')
+    parser.add_argument('--coalesce_dir', type=str, default=None, help='Directory of the in-flight hardware job registry shared by runs on this machine (default: shared temp cache)')
+    parser.add_argument('--qpu_ledger', type=str, default=None, help='SQLite QPU-seconds ledger: price hardware runs before submission, admit them against the project\'s allocation and charge the QPU time used (see qpu_budget.py)')
+    parser.add_argument('--qpu_project', type=str, default='default', help='Project whose allocation --qpu_ledger charges (default: default)')
+    parser.add_argument('--qpu_user', type=str, default=None, help='User recorded with the charge (default: login name)')
+    parser.add_argument('--qpu_policy', type=str, choices=qpu_budget.POLICIES, default='downscale', help='Runs that exceed their share of the allocation: run fewer shots, fail, or defer with exit code 75 (default: downscale)')
+    parser.add_argument('--qpu_max_share', type=float, default=qpu_budget.DEFAULT_MAX_SHARE, help=f'Largest share of the remaining allocation one run may spend, so the budget covers many runs (default: {qpu_budget.DEFAULT_MAX_SHARE})')
+    parser.add_argument('--qpu_min_shots', type=int, default=qpu_budget.DEFAULT_MIN_SHOTS, help=f'Fewest shots --qpu_policy downscale runs; below that the run is rejected (default: {qpu_budget.DEFAULT_MIN_SHOTS})')
+    parser.add_argument('--results_db', type=str, default=None, help='Append this run (parameters, metrics, phase timings, counts reference) to a SQLite history database')
+    parser.add_argument('--bases', type=str, default=None, help=f'Try several bases at once, e.g. "2,7,11" or "all" ({",".join(map(str, COPRIME_BASES))}); the first verified factorization cancels the other jobs (default: a={a} only)')
+    parser.add_argument('--shot_chunk', type=int, default=0, help='Run the shots as jobs of at most this many shots, merging counts incrementally (default: 0, one job)')
+    parser.add_argument('--checkpoint_every', type=int, default=1, help='With --shot_chunk, checkpoint partial counts every N chunks (default: 1)')
+    parser.add_argument('--resume', action='store_true', help='With --shot_chunk, continue from the checkpoint next to --output_json')
+    parser.add_argument('--profile', action='append', choices=list(profiling.PROFILE_MODES), help='Profile each phase: "cpu" (cProfile dumps) and/or "mem" (tracemalloc + peak RSS); reports are written next to --output_json')
+    return parser
+
+
+def parse_args(argv=None):
+    return build_arg_parser().parse_args(argv)
+
+
+def run(args, import_sec=None, origin=None):
+    """Runs one configuration and writes its results JSON. Returns the results dict.
+       Never exits the interpreter, so it can be called repeatedly (see batch_runner.py)."""
+    telemetry.set_log_level(args.log_level)
+    timer = telemetry.PhaseTimer("shor_n15", telemetry.EventStream(args.event_stream), origin=origin)
+    timer.labels["qubits"] = n_control + n_work
+    profilers = profiling.install(timer, args.profile)
+    if import_sec is not None:
+        timer.record("import", import_sec)
+    if args.deadline is not None:
+        timer.deadline = deadline.Deadline(args.deadline, timer.now)
+    # SIGTERM / SIGINT stop the run but still write a partial results JSON
+    signal_guard = deadline.SignalGuard().install()
+    retry_policy = submission.RetryPolicy(args.max_attempts, args.max_backends, args.retry_base_delay, args.seed)
 
     results = {
         "status": "failure",
         "n_value": N,
         "a_value": a,
         "factors": None,
+        "bases": None, # --bases list; a_value is then the base whose counts are reported
+        "attempts": None, # Per-base job / outcome / timing for --bases runs
+        "time_to_factor_sec": None,
         "execution_time_sec": None,
         "qpu_time_sec": None,
         "circuit_depth": None,
@@ -573,128 +774,439 @@ def main():
         "total_gate_count": None,
         "backend_used": None,
         "job_id": None,
+        "seed": args.seed,
+        "cached": False, # True when counts came from the --result_cache store
+        "result_cache_key": None,
+        "chunked": None, # Chunk size / count / job ids for --shot_chunk runs
+        "backend_selection": None, # Pinned / queue length / candidates for hardware runs
+        "dry_run": None, # Resource / success estimate when --dry_run skips submission
+        "deadline": None, # --deadline budget and what was degraded to meet it
+        "compile_path": None, # "hardware", or the --sim_compile path of simulator runs
+        "partial": None, # Reason and completed phases when a deadline or signal stopped the run
+        "submission": submission.new_report(), # Connect / selection / job attempts, retries and failovers
+        "coalesced": None, # Shared in-flight hardware job(s): role, job IDs, requested / received shots
+        "qpu_budget": None, # --qpu_ledger admission decision (estimate, allowance, shots) and the charge
+        "exact": None, # --exact: the exact distribution the factors were found from
+        "readout_mitigation": None, # --readout_mitigation report with the mitigated (quasi-probability) counts
         "shots": args.shots,
         "ran_on_hardware": args.run_on_hardware,
         "plot_file_path": None,
+        "plot_status": "skipped", # rendered | pending | failed | skipped
+        "plot_data": None, # Bounded histogram series the renderer can draw directly
         "error_message": None,
-        "raw_counts": None,
+        "raw_counts": None, # Inline summary; see counts_file for the full histogram
+        "raw_counts_truncated": False,
+        "distinct_outcomes": None,
+        "counts_file": None,
         # Add noise metrics to results
         "gate_error": None,
         "readout_error": None,
         "t1_time": None,
         "t2_time": None,
         "quantum_volume": None,
+        "phase_timings": None, # Seconds per phase (monotonic clock), see telemetry.PHASES
+        "profile": None, # Headline --profile numbers; full reports sit next to the results file
     }
     start_time = time.time()
+    timer.event("run_start", shots=args.shots, run_on_hardware=args.run_on_hardware)
+    plot_series = None
 
     try:
         # --- Initial Checks (Classical) ---
-        log_stderr(f"Attempting to factor N = {N} using base a = {a}")
-        if N % 2 == 0 or isqrt(N)**2 == N or gcd(a, N) != 1:
+        bases = parse_bases(args.bases) if args.bases else [a]
+        a_used = bases[0]
+        if args.bases:
+            results["bases"] = bases
+            log_stderr(f"Attempting to factor N = {N} using bases a = {', '.join(map(str, bases))}")
+        else:
+            log_stderr(f"Attempting to factor N = {N} using base a = {a}")
+        if N % 2 == 0 or isqrt(N)**2 == N or any(gcd(base, N) != 1 for base in bases):
              # Should not happen for N=15, a=7 but good practice
-             results["error_message"] = "N=15, a=7 failed basic classical checks (should not happen)."
+             results["error_message"] = f"N=15, a={a_used} failed basic classical checks (should not happen)."
              raise ValueError(results["error_message"])
-        log_stderr(f"N={N}, a={a} passed classical checks. Proceeding with quantum algorithm.")
+        log_stderr(f"N={N}, a={', '.join(map(str, bases))} passed classical checks. Proceeding with quantum algorithm.")
+
+        if args.shot_chunk < 0 or args.checkpoint_every < 1:
+            raise ValueError("--shot_chunk must be >= 0 and --checkpoint_every >= 1.")
+        if args.bases and (args.shot_chunk or args.result_cache):
+            log_stderr("Warning: --shot_chunk and --result_cache do not apply to --bases runs; ignoring them.")
+            args.shot_chunk, args.result_cache = 0, False
+        if args.exact and (args.run_on_hardware or args.bases):
+            log_stderr("Warning: --exact only applies to single-base simulator runs; ignoring it.")
+            args.exact = False
+        if args.exact and (args.shot_chunk or args.result_cache):
+            log_stderr("Warning: --shot_chunk and --result_cache do not apply to --exact runs (one simulation); ignoring them.")
+            args.shot_chunk, args.result_cache = 0, False
+
+        # --- Result Cache (simulator only) ---
+        result_store = None
+        if args.result_cache and args.dry_run:
+            log_stderr("Warning: --result_cache has no effect with --dry_run; ignoring it.")
+        elif args.result_cache and args.run_on_hardware:
+            log_stderr("Warning: --result_cache only applies to simulator runs; ignoring it.")
+        elif args.result_cache:
+            if args.seed is None:
+                args.seed = result_cache.DEFAULT_SEED
+                results["seed"] = args.seed
+                log_stderr(f"No --seed given; using seed {args.seed} so cached results are reproducible.")
+            result_store = result_cache.ResultCache(args.result_cache_dir, args.result_cache_max_mb)
 
         # --- Connect to IBM Quantum ---
-        log_stderr("\nConnecting to IBM Quantum...")
-        service = QiskitRuntimeService(channel="ibm_quantum", token=args.api_token)
-        log_stderr("Connected.")
+        with timer.phase("connect"):
+            if result_store is not None:
+                # Local simulation never needs the service; skip the network round trip
+                service = None
+                log_stderr("\nSkipping IBM Quantum connection (result-cached simulator run).")
+            else:
+                log_stderr("\nConnecting to IBM Quantum...")
+                service = submission.retry(
+                    lambda: run_context.get_service(
+                        args.api_token, lambda: QiskitRuntimeService(channel="ibm_quantum", token=args.api_token)),
+                    retry_policy, timer, results["submission"], "connect")
+                log_stderr("Connected.")
 
         # --- Select Backend ---
-        backend = None
-        if args.run_on_hardware:
-            log_stderr("Selecting least busy real hardware backend...")
-            try:
-                # Ensure simulator=False and min_num_qubits requirement
-                backend = service.least_busy(min_num_qubits=(n_control + n_work), operational=True, simulator=False)
-                log_stderr(f"Selected real hardware backend: {backend.name}")
-            except Exception as e:
-                 results["error_message"] = f"Could not find suitable IBM hardware backend: {e}"
-                 raise RuntimeError(results["error_message"])
-        else:
-            log_stderr("Selecting local Aer simulator...")
-            try:
-                 # Use default AerSimulator (most flexible)
-                 backend = AerSimulator()
-                 log_stderr(f"Selected backend: {backend.name}")
-            except ImportError:
-                 results["error_message"] = "qiskit-aer not installed. Cannot run simulator."
-                 raise ImportError(results["error_message"])
-            except Exception as e:
-                 results["error_message"] = f"Failed to initialize AerSimulator: {e}"
-                 raise RuntimeError(results["error_message"])
-
-        results["backend_used"] = backend.name
+        with timer.phase("backend_selection"):
+            backend = None
+            if args.run_on_hardware:
+                log_stderr(f"Using pinned hardware backend {args.backend}..." if args.backend
+                           else "Selecting real hardware backend (fleet survey ranking if cached, else least busy)...")
+                try:
+                    # Fresh fleet_survey.py snapshot, else cached backend list + current queue lengths
+                    backend, results["backend_selection"] = submission.retry(
+                        lambda: backend_registry.select_backend(
+                            service, (n_control + n_work), pinned=args.backend,
+                            account=backend_registry.account_key(args.api_token), ttl=args.backend_cache_ttl),
+                        retry_policy, timer, results["submission"], "backend_selection")
+                    log_stderr(f"Selected real hardware backend: {backend.name} "
+                               f"({results['backend_selection']['pending_jobs']} pending job(s)"
+                               + (f", expected fidelity {results['backend_selection']['expected_fidelity']}"
+                                  if results['backend_selection'].get('expected_fidelity') is not None else "") + ")")
+                except Exception as e:
+                     results["error_message"] = f"Could not find suitable IBM hardware backend: {e}"
+                     raise RuntimeError(results["error_message"])
+            else:
+                if args.backend:
+                    log_stderr(f"Warning: --backend {args.backend} only applies with --run_on_hardware; ignoring it.")
+                log_stderr("Selecting local Aer simulator...")
+                try:
+                     # Use default AerSimulator (most flexible)
+                     backend = AerSimulator(**run_context.simulator_options(),
+                                            **({} if args.seed is None else {"seed_simulator": args.seed}))
+                     log_stderr(f"Selected backend: {backend.name}")
+                except ImportError:
+                     results["error_message"] = "qiskit-aer not installed. Cannot run simulator."
+                     raise ImportError(results["error_message"])
+                except Exception as e:
+                     results["error_message"] = f"Failed to initialize AerSimulator: {e}"
+                     raise RuntimeError(results["error_message"])
+
+            results["backend_used"] = backend.name
+            results["compile_path"] = "hardware" if args.run_on_hardware else args.sim_compile
+            native_compile = results["compile_path"] == "native"
+
+        def compile_circuit(qc, target_backend=None):
+            """Simulator runs skip the hardware pass manager (sim_compile.py)."""
+            target_backend = target_backend or backend
+            if native_compile:
+                return run_context.transpile(qc, target_backend, sim_compile.optimize, args.seed, variant="simulator")
+            return deadline.transpile(qc, target_backend, optimize_circuit, args.seed, timer.deadline, OPTIMIZATION_LEVEL)
+
+        def load_noise_metrics():
+            with timer.phase("noise_metrics"):
+                metrics = run_context.noise_metrics(backend, get_backend_noise_metrics)
+            results["gate_error"] = metrics["gate_error"]
+            results["readout_error"] = metrics["readout_error"]
+            results["t1_time"] = metrics["t1_time"]
+            results["t2_time"] = metrics["t2_time"]
+            results["quantum_volume"] = metrics["quantum_volume"]
+            return metrics
+
+        def fail_over(qc, excluded):
+            """Next-ranked hardware backend after a failed job, with the circuit re-transpiled for it
+               (through the transpile cache). Used by submission.run_with_failover."""
+            nonlocal backend, noise_metrics
+            with timer.phase("backend_selection", step="failover"):
+                backend, results["backend_selection"] = backend_registry.select_backend(
+                    service, (n_control + n_work), account=backend_registry.account_key(args.api_token),
+                    ttl=args.backend_cache_ttl, exclude=excluded)
+            results["backend_used"] = backend.name
+            noise_metrics = load_noise_metrics()
+            with timer.phase("transpile", step="failover"):
+                compiled, results["circuit_depth"], results["cx_gate_count"], results["total_gate_count"] = compile_circuit(qc)
+            return backend, compiled
+
+        def retrying(fn, step):
+            """fn(circuit, backend, shots, timer) with transient failures retried (see submission.py)."""
+            return lambda circuit, target_backend, shots, timer: submission.retry(
+                lambda: fn(circuit, target_backend, shots, timer), retry_policy, timer, results["submission"],
+                step, target_backend.name)
+
+        def collecting(fn, backend_name):
+            """fn(job, circuit, timer, cancel) with transient wait failures re-polled on the same job
+               rather than resubmitted (see submission.collect)."""
+            return lambda job, circuit, timer, cancel=None: submission.collect(
+                lambda current: fn(current, circuit, timer, cancel), job, retry_policy, timer, results["submission"],
+                backend_name, getattr(service, "job", None), cancel)
+
+        def run_hardware_job(circuit, target_backend, shots, timer):
+            """run_circuit with the submission retried and the wait re-polled on transient failures."""
+            log_stderr(f"\nRunning circuit on backend: {target_backend.name} with {shots} shots.")
+            job = retrying(submit_circuit, "submit")(circuit, target_backend, shots, timer)
+            log_stderr("Waiting for job to complete...")
+            return collecting(collect_job, target_backend.name)(job, circuit, timer)
+
+        def run_hardware(circuit, target_backend):
+            """run_hardware_job, sharing the job with identical in-flight requests unless --no_coalesce."""
+            if args.no_coalesce:
+                return run_hardware_job(circuit, target_backend, args.shots, timer)
+            log_stderr(f"\nRunning circuit on backend: {target_backend.name} with {args.shots} shots.")
+            job_id, counts, qpu_time, results["coalesced"] = coalesce.run(
+                circuit, target_backend, args.shots, timer, retrying(submit_circuit, "submit"),
+                collecting(collect_job, target_backend.name), getattr(service, "job", None),
+                backend_registry.account_key(args.api_token), args.coalesce_dir)
+            results["shots"] = results["coalesced"]["shots"] # At least the shots requested
+            return job_id, counts, qpu_time
+
+        def admit(compiled_circuits):
+            """Prices the hardware jobs about to be submitted against --qpu_ledger and reserves them;
+               a downscaled run continues with fewer shots. Raises qpu_budget.NotAdmitted."""
+            if not (args.qpu_ledger and args.run_on_hardware):
+                return
+            with timer.phase("admission"):
+                results["qpu_budget"] = qpu_budget.admit(
+                    args.qpu_ledger, args.qpu_project, args.qpu_user or qpu_budget.default_user(), "shor_n15",
+                    backend.name, [resource_estimate.estimate(circuit, backend, args.shots, noise_metrics)
+                                   for circuit in compiled_circuits],
+                    args.shots, args.qpu_policy, args.qpu_max_share, args.qpu_min_shots)
+            args.shots = results["shots"] = results["qpu_budget"]["shots"]
 
         # --- Get Backend Noise Metrics (if hardware) ---
+        noise_metrics = None
         if args.run_on_hardware:
-            noise_metrics = get_backend_noise_metrics(backend)
-            results["gate_error"] = noise_metrics["gate_error"]
-            results["readout_error"] = noise_metrics["readout_error"]
-            results["t1_time"] = noise_metrics["t1_time"]
-            results["t2_time"] = noise_metrics["t2_time"]
-            results["quantum_volume"] = noise_metrics["quantum_volume"]
-
-        # --- Build Circuit ---
-        qc = build_shor_circuit_n15(n_control, n_work, a)
-
-        # --- Optimize Circuit ---
-        qc_optimized, depth, cx_count, gate_count = optimize_circuit(qc, backend)
-        results["circuit_depth"] = depth
-        results["cx_gate_count"] = cx_count
-        results["total_gate_count"] = gate_count
-
-        # --- Run Circuit ---
-        job_id, counts, qpu_time = run_circuit(qc_optimized, backend, args.shots)
-        results["job_id"] = job_id
-        results["raw_counts"] = counts # Include raw counts in JSON
-        results["qpu_time_sec"] = qpu_time  # Add QPU time to results
-
-        # --- Plot Results ---
-        plot_success = generate_plot(counts, n_control, a, N, backend.name, args.plot_theme, args.plot_file)
-        if plot_success:
-            results["plot_file_path"] = args.plot_file
+            noise_metrics = load_noise_metrics()
+
+        multi_base_factors = None
+        exact = None # (outcomes, probabilities) with --exact
+        if args.bases:
+            # --- Build and Optimize One Circuit per Base ---
+            circuits = []
+            for base in bases:
+                with timer.phase("build"):
+                    qc = build_shor_circuit_n15(n_control, n_work, base)
+                with timer.phase("transpile"):
+                    qc_optimized, depth, cx_count, gate_count = compile_circuit(qc)
+                circuits.append((base, qc_optimized,
+                                 {"circuit_depth": depth, "cx_gate_count": cx_count, "total_gate_count": gate_count}))
+
+            # --- Dry Run: estimate every base and stop before submission ---
+            if args.dry_run:
+                with timer.phase("estimate"):
+                    estimates = {str(base): resource_estimate.estimate(
+                        qc_optimized, backend, args.shots, noise_metrics if args.run_on_hardware else None)
+                        for base, qc_optimized, _ in circuits}
+                for estimate_info in estimates.values():
+                    resource_estimate.log_estimate(estimate_info)
+                qpu_estimates = [e["estimated_qpu_time_sec"] for e in estimates.values()]
+                results["dry_run"] = {"bases": estimates, "estimated_qpu_time_sec":
+                                      None if None in qpu_estimates else round(sum(qpu_estimates), 3)}
+                results["status"] = "success"
+                return results # The finally block still writes the results JSON
+
+            admit([qc_optimized for _, qc_optimized, _ in circuits])
+
+            # --- Run All Bases, Stop at the First Factorization ---
+            poll_interval = HARDWARE_POLL_SEC if args.run_on_hardware else SIMULATOR_POLL_SEC
+            # Submissions retry and waits re-poll transient failures; the bases share one backend, so there is no failover
+            winner, completed, factors, bitstr, attempts = run_bases(
+                [(base, qc_optimized) for base, qc_optimized, _ in circuits], backend, args.shots, timer, poll_interval,
+                retrying(submit_circuit, "submit") if args.run_on_hardware else submit_circuit,
+                collecting(collect_job, backend.name) if args.run_on_hardware else collect_job)
+            for attempt, (_, _, metrics) in zip(attempts, circuits):
+                attempt.update(metrics)
+            results["attempts"] = attempts
+            if not completed:
+                if timer.deadline is not None and timer.deadline.expired():
+                    raise deadline.DeadlineExceeded(
+                        f"Deadline of {timer.deadline.budget_sec:g}s reached before any base finished.", phase="execute")
+                results["error_message"] = "No base produced measurement counts."
+                raise RuntimeError(results["error_message"])
+            # Report the winning base, else the first base that completed
+            a_used = winner if winner is not None else next(base for base in bases if base in completed)
+            results["a_value"] = a_used
+            job_id, (outcomes, frequencies), _ = completed[a_used]
+            results.update(next(metrics for base, _, metrics in circuits if base == a_used))
+            results["job_id"] = job_id
+            qpu_times = [qpu_time for _, _, qpu_time in completed.values() if qpu_time is not None]
+            results["qpu_time_sec"] = round(sum(qpu_times), 3) if qpu_times else None
+            if winner is not None:
+                results["time_to_factor_sec"] = next(t["time_to_result_sec"] for t in attempts if t["a"] == winner)
+            multi_base_factors = (factors, bitstr)
+            measured_circuit = next(qc_optimized for base, qc_optimized, _ in circuits if base == a_used)
         else:
-            results["error_message"] = (results.get("error_message") or "") + " Failed to generate plot."
-            # Continue processing results even if plot fails
+            # --- Build Circuit ---
+            with timer.phase("build"):
+                qc = build_shor_circuit_n15(n_control, n_work, a)
+
+            # --- Result Cache Lookup ---
+            cached = None
+            if result_store is not None:
+                with timer.phase("result_cache"):
+                    results["result_cache_key"] = result_store.key(qc, backend, args.shots, args.seed,
+                                                                   results["compile_path"])
+                    cached = result_store.get(results["result_cache_key"])
+            if cached is not None:
+                log_stderr(f"Result cache hit ({results['result_cache_key'][:12]}); skipping transpile and simulation.")
+                outcomes, frequencies = cached["outcomes"], cached["frequencies"]
+                results.update(cached["metrics"])
+                results["cached"] = True
+                measured_circuit = None
+            else:
+                # --- Optimize Circuit ---
+                with timer.phase("transpile"):
+                    qc_optimized, depth, cx_count, gate_count = compile_circuit(qc)
+                    results["circuit_depth"] = depth
+                    results["cx_gate_count"] = cx_count
+                    results["total_gate_count"] = gate_count
+                measured_circuit = qc_optimized
+
+                # --- Dry Run: estimate and stop before submission ---
+                if args.dry_run:
+                    with timer.phase("estimate"):
+                        results["dry_run"] = resource_estimate.estimate(
+                            qc_optimized, backend, args.shots, noise_metrics if args.run_on_hardware else None)
+                    resource_estimate.log_estimate(results["dry_run"])
+                    results["status"] = "success"
+                    return results # The finally block still writes the results JSON
+
+                admit([qc_optimized])
+
+                # --- Run Circuit ---
+                split = False # Deadline-sized simulation run as pilot + sized job
+                if args.exact:
+                    # One simulation for any shot count; the shots are drawn from the exact distribution
+                    with timer.phase("execute", step="exact"):
+                        exact = exact_distribution.run(qc_optimized, backend)
+                    with timer.phase("sample"):
+                        outcomes, frequencies = exact_distribution.sample(*exact, args.shots, args.seed)
+                    job_id, qpu_time = None, None
+                elif args.shot_chunk and args.shots > args.shot_chunk:
+                    # Chunks retry transient failures but stay on one backend, so the merged counts do too
+                    job_id, (outcomes, frequencies), qpu_time, results["chunked"] = chunked_run.run_chunked(
+                        run_hardware_job if args.run_on_hardware else run_circuit, qc_optimized, backend, args.shots, args.shot_chunk, timer,
+                        chunked_run.checkpoint_path(args.output_json), args.resume, args.seed, args.checkpoint_every)
+                    results["shots"] = results["chunked"]["shots_done"]
+                elif timer.deadline is not None and not args.run_on_hardware:
+                    # Simulations shrink to the shots that fit the deadline
+                    job_id, (outcomes, frequencies), qpu_time, results["shots"], split = chunked_run.run_within_deadline(
+                        run_circuit, qc_optimized, backend, args.shots, timer, args.seed)
+                elif args.run_on_hardware:
+                    # Transient failures are retried; device failures move to the next-ranked backend
+                    (job_id, (outcomes, frequencies), qpu_time), backend, qc_optimized = submission.run_with_failover(
+                        run_hardware, qc, qc_optimized, backend, retry_policy, timer, results["submission"],
+                        None if args.backend else fail_over)
+                    measured_circuit = qc_optimized
+                else:
+                    job_id, (outcomes, frequencies), qpu_time = run_circuit(qc_optimized, backend, args.shots, timer)
+                results["job_id"] = job_id
+                results["qpu_time_sec"] = qpu_time  # Add QPU time to results
+                # Cut-short runs, pilot + sized runs and chunked runs (seed + i per chunk) would not match
+                # a fresh single-job run; not cached
+                if result_store is not None and results["shots"] == args.shots and not split and results["chunked"] is None:
+                    result_store.put(results["result_cache_key"], outcomes, frequencies, n_control,
+                                     {k: results[k] for k in ("circuit_depth", "cx_gate_count", "total_gate_count", "job_id")})
+
+        # --- Store Counts ---
+        with timer.phase("write"):
+            results["distinct_outcomes"] = int(len(outcomes))
+            try:
+                results["counts_file"] = result_io.write_counts_sidecar(
+                    result_io.sidecar_path(args.output_json), outcomes, frequencies, n_control)
+                log_stderr(f"Counts sidecar written to {results['counts_file']}")
+            except Exception as e:
+                log_stderr(f"Warning: Could not write counts sidecar: {e}")
+            if args.counts_top_k > 0 or results["counts_file"] is None:
+                results["raw_counts"], results["raw_counts_truncated"] = result_io.summarize_counts(
+                    outcomes, frequencies, n_control,
+                    top_k=args.counts_top_k if args.counts_top_k > 0 else None, threshold=args.counts_threshold)
+
+        # --- Readout Mitigation ---
+        mitigated_outcomes = mitigated_quasi = None
+        if args.readout_mitigation != "none":
+            if measured_circuit is None:
+                log_stderr("Warning: --readout_mitigation needs the transpiled circuit; skipping it for cached counts.")
+            else:
+                with timer.phase("mitigate"):
+                    try:
+                        mitigated_outcomes, mitigated_quasi, results["readout_mitigation"] = readout_mitigation.apply(
+                            measured_circuit, backend, outcomes, frequencies, args.readout_mitigation,
+                            noise_metrics if args.run_on_hardware else None, args.mitigation_distance,
+                            args.readout_calibration_shots, args.counts_top_k if args.counts_top_k > 0 else None)
+                    except Exception as e:
+                        log_stderr(f"Warning: Readout mitigation failed; using raw counts: {e}")
+                        results["readout_mitigation"] = {"method": args.readout_mitigation, "status": "failed", "error": str(e)}
+
+        # --- Plot Data (PNG rendering happens after factor finding) ---
+        with timer.phase("plot"):
+            plot_series = build_plot_series(outcomes, frequencies, n_control, a_used, N, backend.name,
+                                            args.plot_theme, args.plot_max_bars, args.plot_aggregate)
+            results["plot_data"] = plot_series
 
         # --- Process Measurements ---
-        log_stderr("\n--- Factor Finding ---")
-        log_stderr(f"Expected peaks near multiples of 2^{n_control}/4 = {2**n_control // 4}")
-
-        if not counts:
-            results["error_message"] = (results.get("error_message") or "") + " No measurement counts received."
-            raise ValueError("No measurement counts received.")
-
-        # Sort counts by frequency
-        sorted_counts = sorted(counts.items(), key=lambda item: item[1], reverse=True)
-        factors_found = False
-        successful_bitstr = None
-
-        for bitstr, count in sorted_counts: # Process all results or top N
-            log_stderr(f"\nTrying measurement outcome: {bitstr} (Counts: {count})")
-            factor1, factor2 = process_measurement(bitstr, n_control, a, N)
-            if factor1 is not None and factor2 is not None:
-                results["factors"] = sorted([factor1, factor2])
+        with timer.phase("post_process"):
+            log_stderr("\n--- Factor Finding ---")
+            period_r = multiplicative_order(a_used, N)
+            log_stderr(f"Expected peaks near multiples of 2^{n_control}/{period_r} = {2**n_control // period_r}")
+
+            if len(outcomes) == 0:
+                results["error_message"] = (results.get("error_message") or "") + " No measurement counts received."
+                raise ValueError("No measurement counts received.")
+
+            if multi_base_factors is not None and (multi_base_factors[0] is not None or mitigated_quasi is None):
+                factors, successful_bitstr = multi_base_factors # Already processed as the jobs finished
+            elif exact is not None:
+                # Peaks from the exact distribution (probabilities scaled to shots); the sampled counts only feed the plot
+                results["exact"] = exact_distribution.report(*exact, n_control, args.exact_top_k, args.exact_threshold,
+                                                             results["shots"])
+                log_stderr("Trying outcomes in order of exact probability.")
+                factors, successful_bitstr = find_factors(exact[0], exact[1] * results["shots"], a_used, N)
+            elif mitigated_quasi is not None:
+                # Peaks from the readout-corrected distribution (quasi-probabilities scaled to shots)
+                log_stderr("Trying outcomes in order of mitigated probability.")
+                factors, successful_bitstr = find_factors(mitigated_outcomes, mitigated_quasi * results["shots"], a_used, N)
+            else:
+                factors, successful_bitstr = find_factors(outcomes, frequencies, a_used, N)
+            factors_found = factors is not None
+            if factors_found:
+                results["factors"] = factors
                 results["status"] = "success"
-                factors_found = True
-                successful_bitstr = bitstr
-                log_stderr(f"Factors {factor1}, {factor2} found from bitstring {bitstr}.")
-                break # Stop after finding the first valid factors
-
-        if factors_found:
-             log_stderr(f"\n====================================")
-             log_stderr(f"Successfully factored N={N} into {results['factors'][0]} and {results['factors'][1]}")
-             log_stderr(f"Using measurement result {successful_bitstr}.")
-             log_stderr(f"====================================")
-        else:
-             results["error_message"] = (results.get("error_message") or "") + " Failed to find non-trivial factors from measurements."
-             log_stderr("\n------------------------------------")
-             log_stderr(f"Failed to find factors for N={N} with a={a}.")
-             log_stderr("Check histogram plot and logs. Possible reasons: noise, insufficient shots, unlucky results.")
-             log_stderr("------------------------------------")
-             # Keep status as "failure"
+
+            if factors_found:
+                 log_stderr(f"\n====================================")
+                 log_stderr(f"Successfully factored N={N} into {results['factors'][0]} and {results['factors'][1]}")
+                 log_stderr(f"Using measurement result {successful_bitstr} (a={a_used}).")
+                 log_stderr(f"====================================")
+            else:
+                 results["error_message"] = (results.get("error_message") or "") + " Failed to find non-trivial factors from measurements."
+                 log_stderr("\n------------------------------------")
+                 log_stderr(f"Failed to find factors for N={N} with a={', '.join(map(str, bases))}.")
+                 log_stderr("Check histogram plot and logs. Possible reasons: noise, insufficient shots, unlucky results.")
+                 log_stderr("------------------------------------")
+                 # Keep status as "failure"
+
+    except qpu_budget.NotAdmitted as e:
+        log_stderr(f"\n--- NOT SUBMITTED: {e} ---")
+        results["status"] = e.status
+        results["error_message"] = str(e)
+        results["qpu_budget"] = e.decision
+        results["factors"] = None
+
+    except (deadline.DeadlineExceeded, deadline.RunInterrupted) as e:
+        log_stderr(f"\n--- RUN STOPPED: {e} ---")
+        results["status"] = "interrupted" if isinstance(e, deadline.RunInterrupted) else "deadline_exceeded"
+        results["error_message"] = str(e)
+        results["partial"] = deadline.partial_report(timer, e)
+        results["factors"] = None
 
     except Exception as e:
         log_stderr(f"\n--- SCRIPT ERROR ---")
@@ -707,30 +1219,81 @@ def main():
         results["factors"] = None
 
     finally:
+        signal_guard.disarm()
+        if timer.deadline is not None:
+            results["deadline"] = timer.deadline.report()
+        if results["qpu_budget"] is not None:
+            qpu_budget.settle(args.qpu_ledger, results["qpu_budget"], results) # Charges the QPU time, or releases
+        # --- Render Plot (sync mode; skipped when interrupted, to exit promptly) ---
+        if plot_series is not None and args.plot_file and args.plot_mode == 'sync' and results["status"] != "interrupted":
+            with timer.phase("plot", step="render"):
+                plot_success = generate_plot(plot_series, args.plot_file)
+            if plot_success:
+                results["plot_file_path"] = args.plot_file
+                results["plot_status"] = "rendered"
+            else:
+                # Keep the factoring results even if plot fails
+                results["plot_status"] = "failed"
+                results["error_message"] = (results.get("error_message") or "") + " Failed to generate plot."
+        elif plot_series is not None and args.plot_file and args.plot_mode == 'background':
+            results["plot_file_path"] = args.plot_file
+            results["plot_status"] = "pending"
+
         end_time = time.time()
         results["execution_time_sec"] = round(end_time - start_time, 2)
+        results["phase_timings"] = timer.summary()
+        if profilers:
+            results["profile"] = profiling.finish(profilers, args.output_json)
 
         # --- Write JSON Output ---
         log_stderr(f"\nWriting results to {args.output_json}")
         try:
-            with open(args.output_json, 'w') as f:
-                json.dump(results, f, indent=4)
+            # Atomic write (temp file + rename) so readers never see a partial file
+            with timer.phase("write"):
+                result_io.write_json_atomic(args.output_json, results)
             log_stderr("JSON results saved successfully.")
+            if results["plot_status"] == "pending":
+                try:
+                    pid = plot_render.spawn_background_render(args.output_json, args.plot_file)
+                    log_stderr(f"Plot rendering started in background process {pid}.")
+                except Exception as e:
+                    log_stderr(f"Warning: Could not start background plot rendering: {e}")
         except Exception as e:
             log_stderr(f"ERROR: Failed to write JSON results to {args.output_json}: {e}")
             # If JSON writing fails, we can't communicate results back easily
             # Print results to stderr as a last resort?
-            print(json.dumps(results, indent=4), file=sys.stderr)
-            # Exit with error code even if factors were found, because output failed
-            sys.exit(1)
-
-        # --- Exit with appropriate code ---
-        if results["status"] == "success":
-             log_stderr("Exiting with status code 0 (Success).")
-             sys.exit(0)
-        else:
-             log_stderr(f"Exiting with status code 1 (Failure: {results.get('error_message', 'Unknown error')}).")
-             sys.exit(1)
+            print(result_io.dumps_json(results, indent=4).decode("utf-8"), file=sys.stderr)
+            # Report failure even if factors were found, because output failed
+            results["status"] = "failure"
+            results["error_message"] = (results.get("error_message") or "") + f" Failed to write results JSON: {e}"
+
+        if args.results_db and not args.dry_run:
+            results_store.record(args.results_db, "shor_n15", args, results, num_qubits=n_control + n_work)
+
+        timer.event("run_end", status=results["status"], execution_time_sec=results["execution_time_sec"],
+                    phase_timings=timer.summary())
+        worker_metrics.observe_run("shor_n15", results, num_qubits=n_control + n_work)
+        timer.stream.close()
+        signal_guard.restore()
+
+    return results
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    results = run(args, import_sec=_IMPORT_END - _IMPORT_START, origin=_IMPORT_START)
+    code = deadline.exit_code(results) or qpu_budget.exit_code(results)
+    if code is not None:
+        log_stderr(f"\nExiting with status code {code} ({results['error_message']}).")
+        sys.exit(code)
+
+    # --- Exit with appropriate code ---
+    if results["status"] == "success":
+         log_stderr("Exiting with status code 0 (Success).")
+         sys.exit(0)
+    else:
+         log_stderr(f"Exiting with status code 1 (Failure: {results.get('error_message', 'Unknown error')}).")
+         sys.exit(1)
 
 
 if __name__ == '__main__':
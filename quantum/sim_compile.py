@@ -0,0 +1,138 @@
+# sim_compile.py
+#
+# Compile path for AerSimulator runs (`--sim_compile native`, the default for
+# simulator runs). The preset pass managers target hardware: they decompose
+# the Grover oracle's MCMT and Shor's controlled multipliers into basis gates,
+# which the simulator then applies one by one, and run layout and routing for
+# a device that does not exist. Here the circuits keep blocks Aer executes
+# natively instead:
+#
+#   - phase oracles as multi-controlled phase flips (`mcphase`) when they mark
+#     few states, else as one `diagonal` over the search qubits; either way
+#     the compiled oracle's ancillas are not needed
+#   - the diffuser as H^n X^n, one `mcphase`, X^n H^n
+#   - other multi-qubit blocks (the controlled modular multipliers, a small
+#     inverse QFT) fused into one `diagonal` or `unitary` each
+#
+# Anything Aer cannot run directly is unrolled at optimization level 0 with no
+# coupling map, i.e. without layout or routing. Hardware runs keep the
+# scripts' preset pass managers.
+#
+# A `diagonal` carries all 2^n phases as instruction parameters, which are
+# validated and handed to Aer again on every Grover iteration; a parameter-free
+# `mcphase` per marked state is cheaper until about MAX_MCPHASE_STATES states.
+
+import sys
+
+import numpy as np
+from qiskit import QuantumCircuit, transpile
+from qiskit.circuit.library import DiagonalGate, UnitaryGate
+from qiskit.quantum_info import Operator
+
+import cnf_oracle
+
+MODES = ("native", "preset")
+MAX_MCPHASE_STATES = 16
+# Same width as Aer's own gate fusion: applying a wider fused unitary costs more
+# than the gates it replaces
+MAX_FUSED_QUBITS = 5
+# Instructions that are never fused (not unitary, or already native blocks)
+_PASS_THROUGH = {"measure", "barrier", "reset", "delay", "diagonal", "unitary", "mcphase"}
+
+
+# --- Helper Functions (Logging to stderr) ---
+def log_stderr(*args, **kwargs):
+    """Prints messages to stderr."""
+    print(*args, file=sys.stderr, **kwargs)
+
+
+# --- Phase Oracles ---
+def _phase_flip(qc, index, qubits):
+    """Flips the phase of basis state `index` (bit i = qubits[i])."""
+    zeros = [q for i, q in enumerate(qubits) if not (index >> i) & 1]
+    if zeros:
+        qc.x(zeros)
+    qc.mcp(np.pi, qubits[:-1], qubits[-1])
+    if zeros:
+        qc.x(zeros)
+
+
+def phase_oracle(num_qubits, marked):
+    """Oracle flipping the phase of the basis states whose indices are in `marked`, as a
+       circuit of mcphase flips or a single DiagonalGate (see MAX_MCPHASE_STATES)."""
+    marked = np.unique(np.asarray(marked, dtype=np.int64))
+    oracle = QuantumCircuit(num_qubits, name="Oracle")
+    if len(marked) <= MAX_MCPHASE_STATES:
+        for index in marked:
+            _phase_flip(oracle, int(index), list(range(num_qubits)))
+    else:
+        diagonal = np.ones(1 << num_qubits)
+        diagonal[marked] = -1
+        oracle.append(DiagonalGate(diagonal.tolist()), range(num_qubits))
+    return oracle
+
+
+def marked_states_oracle(marked_states):
+    """grover_search.grover_oracle for the simulator (bit-strings are qubit 0 rightmost)."""
+    return phase_oracle(len(marked_states[0]), [int(state, 2) for state in marked_states])
+
+
+def formula_oracle(formula, num_vars):
+    """cnf_oracle.compile_phase_oracle for the simulator: the formula is evaluated over all
+       2^n assignments, so the compute / uncompute ancillas disappear."""
+    assignments = np.arange(1 << num_vars, dtype=np.int64)
+    return phase_oracle(num_vars, np.flatnonzero(cnf_oracle.evaluate_formula(formula, assignments)))
+
+
+# --- Circuits ---
+def grover_circuit(oracle, iterations):
+    """grover_search.assemble_grover_circuit for a phase_oracle: the same search, measured
+       into the same 'meas' register."""
+    n = oracle.num_qubits
+    qubits = list(range(n))
+    qc = QuantumCircuit(n, name="GroverSearch")
+    qc.h(qubits)
+    for _ in range(iterations):
+        qc.compose(oracle, qubits, inplace=True)
+        qc.h(qubits)
+        _phase_flip(qc, 0, qubits) # Reflection about |0...0>, up to a global phase
+        qc.h(qubits)
+    qc.measure_all()
+    return qc
+
+
+def fuse(qc, max_qubits=MAX_FUSED_QUBITS):
+    """Replaces each top-level multi-qubit block of up to max_qubits with its matrix: a
+       DiagonalGate when the block is diagonal, else a UnitaryGate. Other instructions are
+       kept as they are."""
+    fused = qc.copy_empty_like()
+    for instruction in qc.data:
+        operation = instruction.operation
+        if (operation.name in _PASS_THROUGH or operation.num_qubits < 2 or operation.num_qubits > max_qubits
+                or operation.num_clbits or getattr(operation, "definition", None) is None):
+            fused.append(instruction)
+            continue
+        matrix = Operator(operation).data
+        diagonal = np.diagonal(matrix)
+        if np.allclose(matrix, np.diag(diagonal)):
+            block = DiagonalGate(diagonal.tolist())
+        else:
+            block = UnitaryGate(matrix, label=operation.name)
+        fused.append(block, instruction.qubits)
+    return fused
+
+
+def optimize(qc, backend, seed=None, **_):
+    """The scripts' optimize_circuit for the simulator path. Returns (circuit, depth, cx_count,
+       gate_count); seed and the pass manager options do not apply without layout / routing."""
+    log_stderr(f"\nCompiling circuit for simulator {backend.name} (native blocks, no layout/routing)...")
+    compiled = fuse(qc)
+    native = set(backend.operation_names)
+    if any(inst.operation.name not in native for inst in compiled.data if inst.operation.name != "barrier"):
+        # The simulator's target has no coupling map, so this only unrolls to its instruction set
+        compiled = transpile(compiled, target=backend.target, optimization_level=0)
+    ops = compiled.count_ops()
+    depth, cx_count, gate_count = compiled.depth(), ops.get('cx', 0), sum(ops.values())
+    log_stderr(f"Compiled circuit depth: {depth}, gate count: {gate_count} "
+               f"({ops.get('mcphase', 0)} mcphase, {ops.get('diagonal', 0)} diagonal, {ops.get('unitary', 0)} unitary)")
+    return compiled, depth, cx_count, gate_count
@@ -0,0 +1,214 @@
+# submission.py
+#
+# Retries and failover for hardware submissions. Each failure is classified:
+#
+#   transient  network / rate-limit / timeout errors: retried on the same
+#              backend with exponential backoff and full jitter
+#   device     the job errored or was cancelled on the device, or the device
+#              went offline: the circuit is re-transpiled (through the
+#              transpile cache) for the next-ranked backend
+#   permanent  invalid circuits, bad arguments, authorization: raised at once
+#
+# A transient failure that persists for --max_attempts attempts also fails
+# over. Every attempt is recorded for the results JSON, and backoff sleeps
+# never run past the run's --deadline.
+#
+# Only submissions are retried by resubmitting. A transient failure while
+# waiting for or fetching a submitted job re-polls the same job id (collect),
+# so a dropped connection never pays for the job twice or loses its place in
+# the queue; the job is cancelled only once the wait is given up.
+#
+# backend_registry.LocalService(faults=...) injects these failures offline.
+
+import random
+import sys
+import time
+
+TRANSIENT = "transient"
+DEVICE = "device"
+PERMANENT = "permanent"
+
+DEFAULT_MAX_ATTEMPTS = 3 # Per backend
+DEFAULT_MAX_BACKENDS = 3
+DEFAULT_BASE_DELAY_SEC = 2.0
+MAX_DELAY_SEC = 120.0
+
+# Exception class names (qiskit-ibm-runtime and builtins) that decide the class outright
+_CLASS_BY_TYPE = {
+    "ConnectionError": TRANSIENT,
+    "ConnectionResetError": TRANSIENT,
+    "TimeoutError": TRANSIENT,
+    "RequestsApiError": TRANSIENT,
+    "RuntimeJobTimeoutError": TRANSIENT,
+    "RuntimeJobFailureException": DEVICE,
+    "IBMBackendError": DEVICE,
+    "IBMNotAuthorizedError": PERMANENT,
+    "NoCandidateBackends": PERMANENT, # backend_registry: nothing left to fail over to
+    "IBMInputValueError": PERMANENT,
+    "RuntimeJobMaxTimeoutError": PERMANENT, # Would exceed the limit again anywhere
+    "TranspilerError": PERMANENT,
+    "CircuitError": PERMANENT,
+    "ValueError": PERMANENT,
+    "TypeError": PERMANENT,
+    "KeyError": PERMANENT,
+}
+# Checked in this order against the lower-cased message of other exceptions
+_MARKERS = (
+    (PERMANENT, ("invalid", "not supported", "unauthorized", "forbidden", "401", "403", "exceeds the maximum")),
+    (TRANSIENT, ("timed out", "timeout", "temporarily", "rate limit", "too many requests", "429", "502", "503",
+                 "504", "connection", "reset by peer", "try again")),
+    (DEVICE, ("cancel", "offline", "maintenance", "not operational", "internal error", "calibrat")),
+)
+
+
+# --- Helper Functions (Logging to stderr) ---
+def log_stderr(*args, **kwargs):
+    """Prints messages to stderr."""
+    print(*args, file=sys.stderr, **kwargs)
+
+
+def classify(error):
+    """TRANSIENT, DEVICE or PERMANENT. Unrecognized failures count as transient, so they are
+       retried a few times and then fail over rather than ending an unattended run."""
+    for cls in type(error).__mro__:
+        if cls.__name__ in _CLASS_BY_TYPE:
+            return _CLASS_BY_TYPE[cls.__name__]
+    message = str(error).lower()
+    for kind, markers in _MARKERS:
+        if any(marker in message for marker in markers):
+            return kind
+    return TRANSIENT
+
+
+class RetryPolicy:
+    """Attempt limits and backoff: attempt k waits uniform(0, min(MAX_DELAY_SEC, base * 2^(k-1)))."""
+
+    def __init__(self, max_attempts=DEFAULT_MAX_ATTEMPTS, max_backends=DEFAULT_MAX_BACKENDS,
+                 base_delay_sec=DEFAULT_BASE_DELAY_SEC, seed=None, sleep=time.sleep):
+        self.max_attempts = max(1, max_attempts)
+        self.max_backends = max(1, max_backends)
+        self.base_delay_sec = base_delay_sec
+        self.rng = random.Random(seed)
+        self.sleep = sleep
+
+    def delay(self, attempt):
+        return self.rng.uniform(0, min(MAX_DELAY_SEC, self.base_delay_sec * 2 ** (attempt - 1)))
+
+    def backoff(self, attempt, timer):
+        """Sleeps before retry `attempt` + 1. Returns the delay, or None if the deadline would pass."""
+        delay = self.delay(attempt)
+        if timer.deadline is not None and delay >= timer.deadline.remaining():
+            return None
+        self.sleep(delay)
+        return delay
+
+
+def new_report():
+    """The results JSON's "submission" entry, filled in by retry / run_with_failover."""
+    return {"attempts": [], "failed_backends": [], "failovers": 0}
+
+
+def _record(report, timer, step, backend_name, attempt, error=None, kind=None):
+    entry = {"step": step, "backend": backend_name, "attempt": attempt,
+             "outcome": "success" if error is None else kind, "error": None if error is None else str(error),
+             "backoff_sec": None, "at_sec": round(timer.now(), 3)}
+    report["attempts"].append(entry)
+    timer.event("submission_attempt", **{k: v for k, v in entry.items() if k not in ("backoff_sec", "at_sec")})
+    return entry
+
+
+# --- Retries ---
+def retry(fn, policy, timer, report, step, backend_name=None):
+    """fn() with transient failures retried (backoff between attempts). Device and permanent
+       failures, and the last transient one, are raised."""
+    for attempt in range(1, policy.max_attempts + 1):
+        try:
+            result = fn()
+        except Exception as e:
+            kind = classify(e)
+            entry = _record(report, timer, step, backend_name, attempt, e, kind)
+            if kind != TRANSIENT or attempt == policy.max_attempts:
+                raise
+            delay = policy.backoff(attempt, timer)
+            if delay is None:
+                log_stderr(f"Warning: {step} failed ({e}); no time left before the deadline to retry.")
+                raise
+            entry["backoff_sec"] = round(delay, 3)
+            log_stderr(f"Warning: {step} failed ({kind}: {e}); retry {attempt + 1}/{policy.max_attempts} "
+                       f"in {delay:.1f}s.")
+            continue
+        _record(report, timer, step, backend_name, attempt)
+        return result
+
+
+def _finished(job):
+    try:
+        return bool(job.in_final_state())
+    except Exception:
+        return False
+
+
+def _cancel_unfinished(job, cancel=None):
+    """Cancels a job whose wait was given up, unless it already finished or `cancel` says it
+       is shared with other requesters (see coalesce.py)."""
+    if _finished(job) or (cancel is not None and not cancel()):
+        return
+    try:
+        job.cancel()
+        log_stderr(f"Cancelled job {job.job_id()}.")
+    except Exception as e:
+        log_stderr(f"Warning: Could not cancel job: {e}")
+
+
+def collect(collect_fn, job, policy, timer, report, backend_name=None, get_job=None, cancel=None):
+    """collect_fn(job) (wait for the result and extract it) with transient failures re-polled on
+       the same job instead of resubmitting; get_job(job_id) re-fetches the job handle between
+       attempts when given (e.g. service.job). A job that already ended (failed or cancelled)
+       is not polled again. Device and permanent failures, and the last transient one, cancel
+       the job if it is still running and are raised."""
+    job_id = job.job_id()
+    for attempt in range(1, policy.max_attempts + 1):
+        try:
+            result = collect_fn(job)
+        except Exception as e:
+            kind = classify(e)
+            entry = _record(report, timer, "collect", backend_name, attempt, e, kind)
+            repoll = kind == TRANSIENT and attempt < policy.max_attempts and not _finished(job)
+            delay = policy.backoff(attempt, timer) if repoll else None
+            if delay is None:
+                _cancel_unfinished(job, cancel)
+                raise
+            entry["backoff_sec"] = round(delay, 3)
+            log_stderr(f"Warning: Waiting for job {job_id} failed ({kind}: {e}); polling it again "
+                       f"({attempt + 1}/{policy.max_attempts}) in {delay:.1f}s.")
+            if get_job is not None:
+                try:
+                    job = get_job(job_id)
+                except Exception as fetch_error:
+                    log_stderr(f"Warning: Could not re-fetch job {job_id} ({fetch_error}); reusing its handle.")
+            continue
+        _record(report, timer, "collect", backend_name, attempt)
+        return result
+
+
+def run_with_failover(run_fn, qc, compiled, backend, policy, timer, report, failover=None):
+    """run_fn(compiled, backend), which retries its own submission and wait (retry / collect).
+    After a device failure, or a transient one that outlasted those retries,
+    failover(qc, excluded_names) -> (backend, compiled) picks the next-ranked backend and
+    re-transpiles the logical circuit `qc` for it; failover=None (a pinned backend) does not
+    fail over. Returns (run_fn's result, backend, compiled).
+    """
+    while True:
+        try:
+            return run_fn(compiled, backend), backend, compiled
+        except Exception as e:
+            kind = classify(e)
+            report["failed_backends"].append(backend.name)
+            if kind == PERMANENT or failover is None or len(report["failed_backends"]) >= policy.max_backends:
+                raise
+            log_stderr(f"Backend {backend.name} failed ({kind}: {e}); failing over to the next-ranked backend...")
+            backend, compiled = retry(lambda: failover(qc, list(report["failed_backends"])), policy, timer, report,
+                                      "failover")
+            report["failovers"] += 1
+            report["attempts"][-1]["backend"] = backend.name
+            log_stderr(f"Failed over to backend {backend.name}.")
@@ -0,0 +1,156 @@
+# telemetry.py
+#
+# Per-phase timing and a structured progress event stream for the quantum
+# scripts. Human-readable logs keep going to stderr; events are JSON lines on
+# a dedicated stream (stdout or a file) so callers can parse them without
+# scraping log text:
+#
+#   {"event": "phase_end", "phase": "transpile", "t": 1.234, "duration_sec": 0.812, ...}
+#
+# `t` is seconds on the monotonic clock since the script started importing.
+
+import json
+import os
+import sys
+import time
+from contextlib import contextmanager
+
+# Phase names, in the order they normally occur.
+PHASES = (
+    "import", "connect", "backend_selection", "noise_metrics", "build", "result_cache", "transpile", "estimate",
+    "submit", "queue", "execute", "extract_counts", "mitigate", "plot", "post_process", "write",
+)
+
+LOG_LEVELS = ("debug", "info")
+_log_level = "info"
+
+
+# --- Log Level ---
+def set_log_level(level):
+    global _log_level
+    if level not in LOG_LEVELS:
+        raise ValueError(f"Unknown log level '{level}'. Expected one of {LOG_LEVELS}.")
+    _log_level = level
+
+
+def debug_enabled():
+    """True when verbose (per-qubit / per-gate) logging is enabled."""
+    return _log_level == "debug"
+
+
+# --- Event Stream ---
+class EventStream:
+    """Writes one JSON object per line to stdout, stderr or a file (appending)."""
+
+    def __init__(self, destination=None):
+        self.destination = destination
+        self._file = None
+        self._owns_file = False
+        if destination == "stdout":
+            self._file = sys.stdout
+        elif destination == "stderr":
+            self._file = sys.stderr
+        elif destination:
+            self._file = open(destination, "a", buffering=1)
+            self._owns_file = True
+
+    def emit(self, record):
+        if self._file is None:
+            return
+        try:
+            self._file.write(json.dumps(record, separators=(",", ":"), default=str) + "\n")
+            self._file.flush()
+        except Exception:
+            pass # Telemetry must never break a run
+
+    def close(self):
+        if self._owns_file and self._file is not None:
+            self._file.close()
+        self._file = None
+
+
+# --- Phase Timer ---
+class PhaseTimer:
+    """Times named phases on the monotonic clock and emits start/end events.
+
+    Repeated phases (e.g. several search rounds) accumulate into one total.
+    Objects in `hooks` (e.g. profilers) get start(phase)/stop(phase) calls
+    around every timed block. A `deadline` (deadline.Deadline) is checked
+    whenever a phase starts.
+    """
+
+    def __init__(self, script, stream=None, origin=None):
+        self.script = script
+        self.stream = stream or EventStream(None)
+        self.origin = time.perf_counter() if origin is None else origin
+        self.durations = {}
+        self.hooks = []
+        self.deadline = None
+        self.failed_phase = None # Innermost phase left by an exception, for partial results
+        self.labels = {} # Metric labels of the run beyond script / backend, e.g. qubits (worker_metrics.py)
+
+    def now(self):
+        return time.perf_counter() - self.origin
+
+    def event(self, event, **fields):
+        record = {"event": event, "script": self.script, "pid": os.getpid(), "t": round(self.now(), 6)}
+        record.update(fields)
+        self.stream.emit(record)
+        return record
+
+    def record(self, phase, duration, **fields):
+        """Adds an externally measured phase (e.g. queue time from job metrics)."""
+        duration = max(0.0, float(duration))
+        self.durations[phase] = self.durations.get(phase, 0.0) + duration
+        self.event("phase_end", phase=phase, duration_sec=round(duration, 6), status="ok", **fields)
+
+    @contextmanager
+    def profiled(self, phase):
+        """Runs the hooks around a block without recording it as a phase (used where
+           the phase duration is measured externally, e.g. waiting on job.result())."""
+        for hook in self.hooks:
+            hook.start(phase)
+        try:
+            yield self
+        finally:
+            for hook in reversed(self.hooks):
+                hook.stop(phase)
+
+    @contextmanager
+    def phase(self, phase, **fields):
+        if self.deadline is not None:
+            self.deadline.check(phase)
+        self.failed_phase = None
+        self.event("phase_start", phase=phase, **fields)
+        start = time.perf_counter()
+        status = "ok"
+        try:
+            with self.profiled(phase):
+                yield self
+        except BaseException:
+            status = "error"
+            self.failed_phase = self.failed_phase or phase
+            raise
+        finally:
+            duration = time.perf_counter() - start
+            self.durations[phase] = self.durations.get(phase, 0.0) + duration
+            self.event("phase_end", phase=phase, duration_sec=round(duration, 6), status=status, **fields)
+
+    def summary(self):
+        """Phase durations in seconds, in canonical phase order."""
+        ordered = [p for p in PHASES if p in self.durations]
+        ordered += [p for p in self.durations if p not in PHASES]
+        return {p: round(self.durations[p], 6) for p in ordered}
+
+
+def job_queue_execute_split(job):
+    """Returns (queue_sec, execute_sec) from runtime job metrics timestamps, or (None, None)."""
+    try:
+        metrics = job.metrics()
+        stamps = metrics.get("timestamps", {})
+        from datetime import datetime
+        parse = lambda s: datetime.fromisoformat(s.replace("Z", "+00:00"))
+        created, running, finished = (parse(stamps[k]) for k in ("created", "running", "finished"))
+        return (running - created).total_seconds(), (finished - running).total_seconds()
+    except Exception:
+        return None, None
@@ -0,0 +1,279 @@
+# worker_metrics.py
+#
+# OpenMetrics / Prometheus exposition for long-running workers (batch_runner.py
+# --metrics_port / --metrics_file, or any process calling the scripts' run()
+# repeatedly). Every run() reports its phase timings, cache hits, shots, QPU
+# seconds and memory high-water mark here when it finishes, and hardware /
+# simulator jobs are counted while they are in flight. All run metrics are
+# labelled by algorithm, backend and qubit count:
+#
+#   keystone_runs_total                 runs by final status
+#   keystone_run_duration_seconds       histogram of run wall time
+#   keystone_phase_duration_seconds     histogram per phase (build, transpile, execute, queue, plot, ...)
+#   keystone_cache_requests_total       result / transpile / calibration cache lookups and
+#                                       coalesced hardware jobs, by result (hit | miss)
+#   keystone_active_jobs                jobs submitted and not yet collected or cancelled
+#   keystone_qpu_seconds_total          QPU seconds reported by the jobs
+#   keystone_shots_total                shots actually run
+#   keystone_memory_peak_bytes          peak RSS of the process that ran the runs
+#
+# The registry is per process. batch_runner's workers forward their
+# observations to the parent over a queue (forward_to), so one endpoint covers
+# the whole pool. No client library is needed; the text format is written here.
+
+import http.server
+import os
+import queue
+import sys
+import threading
+
+import profiling
+import run_context
+
+LABELS = ("algorithm", "backend", "qubits")
+DURATION_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0, 1800.0, 3600.0)
+DEFAULT_HOST = "127.0.0.1"
+PROMETHEUS_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+OPENMETRICS_TYPE = "application/openmetrics-text; version=1.0.0; charset=utf-8"
+
+
+# --- Helper Functions (Logging to stderr) ---
+def log_stderr(*args, **kwargs):
+    """Prints messages to stderr."""
+    print(*args, file=sys.stderr, **kwargs)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in labels) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+# --- Registry ---
+class Family:
+    """One metric family: samples keyed by their label values."""
+
+    def __init__(self, name, kind, help_text, label_names, buckets=None):
+        self.name = name
+        self.kind = kind # counter | gauge | histogram
+        self.help = help_text
+        self.label_names = label_names
+        self.buckets = buckets
+        self.samples = {} # label values -> value, or [bucket counts, sum, count] for histograms
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, "")) for name in self.label_names)
+
+    def inc(self, labels, amount=1.0):
+        key = self._key(labels)
+        self.samples[key] = self.samples.get(key, 0.0) + amount
+
+    def set(self, labels, value):
+        self.samples[self._key(labels)] = value
+
+    def set_max(self, labels, value):
+        key = self._key(labels)
+        self.samples[key] = max(self.samples.get(key, 0.0), value)
+
+    def observe(self, labels, value):
+        key = self._key(labels)
+        state = self.samples.setdefault(key, [[0] * len(self.buckets), 0.0, 0])
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                state[0][i] += 1
+        state[1] += value
+        state[2] += 1
+
+    def render(self, openmetrics):
+        # OpenMetrics names a counter family without its _total suffix
+        family = self.name[:-len("_total")] if openmetrics and self.kind == "counter" else self.name
+        lines = [f"# HELP {family} {self.help}", f"# TYPE {family} {self.kind}"]
+        for key in sorted(self.samples):
+            labels = list(zip(self.label_names, key))
+            if self.kind != "histogram":
+                lines.append(f"{self.name}{_format_labels(labels)} {_format_value(self.samples[key])}")
+                continue
+            bucket_counts, total, count = self.samples[key]
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), bucket_counts + [count]):
+                lines.append(f"{self.name}_bucket{_format_labels(labels + [('le', _format_value(float(bound)))])} {bucket_count}")
+            lines.append(f"{self.name}_sum{_format_labels(labels)} {_format_value(float(total))}")
+            lines.append(f"{self.name}_count{_format_labels(labels)} {count}")
+        return lines
+
+
+class Registry:
+    """The process's metric families. Updates arrive as operations (see apply), so the same
+       stream can be applied locally or forwarded from a worker process."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.families = {}
+        for name, kind, help_text, extra, buckets in (
+            ("keystone_runs_total", "counter", "Finished runs by status.", ("status",), None),
+            ("keystone_run_duration_seconds", "histogram", "Run wall time in seconds.", (), DURATION_BUCKETS),
+            ("keystone_phase_duration_seconds", "histogram", "Time spent per phase and run in seconds.", ("phase",),
+             DURATION_BUCKETS),
+            ("keystone_cache_requests_total", "counter", "Cache lookups and coalesced hardware jobs by result.",
+             ("cache", "result"), None),
+            ("keystone_active_jobs", "gauge", "Jobs submitted and not yet collected or cancelled.", (), None),
+            ("keystone_qpu_seconds_total", "counter", "QPU seconds reported by hardware jobs.", (), None),
+            ("keystone_shots_total", "counter", "Shots run.", (), None),
+            ("keystone_memory_peak_bytes", "gauge", "Peak resident set size of the process that ran the runs.", (),
+             None),
+        ):
+            self.families[name] = Family(name, kind, help_text, LABELS + extra, buckets)
+
+    def apply(self, operation):
+        method, name, labels, value = operation
+        with self.lock:
+            getattr(self.families[name], method)(labels, value)
+
+    def render(self, openmetrics=False):
+        with self.lock:
+            lines = [line for family in self.families.values() for line in family.render(openmetrics)]
+        if openmetrics:
+            lines.append("# EOF")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+_sink = REGISTRY.apply
+_active_jobs = {} # job_id -> labels of the jobs this process submitted
+_stats_seen = {}
+
+
+def forward_to(target):
+    """Sends this process's updates to `target` (a multiprocessing queue) instead of the local registry."""
+    global _sink
+    _sink = target.put
+
+
+def _emit(method, name, labels, value):
+    try:
+        _sink((method, name, labels, value))
+    except Exception:
+        pass # Metrics must never break a run
+
+
+def labels_for(algorithm, backend=None, qubits=None):
+    return {"algorithm": algorithm, "backend": backend or "none", "qubits": "" if qubits is None else str(qubits)}
+
+
+# --- Observations ---
+def job_started(job_id, labels):
+    _active_jobs[job_id] = labels
+    _emit("inc", "keystone_active_jobs", labels, 1.0)
+
+
+def job_finished(job_id):
+    """Collected, failed or cancelled; jobs this process did not submit (coalesced) are ignored."""
+    labels = _active_jobs.pop(job_id, None)
+    if labels is not None:
+        _emit("inc", "keystone_active_jobs", labels, -1.0)
+
+
+def observe_run(algorithm, results, num_qubits=None):
+    """Records a finished run from its results dict (called from the scripts' finally block)."""
+    labels = labels_for(algorithm, results.get("backend_used"),
+                        num_qubits if num_qubits is not None else results.get("num_qubits"))
+    _emit("inc", "keystone_runs_total", dict(labels, status=results.get("status")), 1.0)
+    if results.get("execution_time_sec") is not None:
+        _emit("observe", "keystone_run_duration_seconds", labels, float(results["execution_time_sec"]))
+    for phase, seconds in (results.get("phase_timings") or {}).items():
+        _emit("observe", "keystone_phase_duration_seconds", dict(labels, phase=phase), float(seconds))
+
+    lookups = []
+    if results.get("result_cache_key") is not None:
+        lookups.append(("result", bool(results.get("cached"))))
+    if results.get("coalesced"):
+        lookups.append(("inflight", results["coalesced"]["role"] != "submitted"))
+    for cache in ("transpile", "calibration"):
+        # run_context.stats are process totals; the difference since the last run is this run's
+        for result, key in (("hit", f"{cache}_hits"), ("miss", f"{cache}_misses")):
+            delta = run_context.stats.get(key, 0) - _stats_seen.get(key, 0)
+            _stats_seen[key] = run_context.stats.get(key, 0)
+            if delta > 0:
+                _emit("inc", "keystone_cache_requests_total", dict(labels, cache=cache, result=result), float(delta))
+    for cache, hit in lookups:
+        _emit("inc", "keystone_cache_requests_total", dict(labels, cache=cache, result="hit" if hit else "miss"), 1.0)
+
+    if results.get("qpu_time_sec"):
+        _emit("inc", "keystone_qpu_seconds_total", labels, float(results["qpu_time_sec"]))
+    if not results.get("cached") and (results.get("job_id") is not None or results.get("exact")):
+        # Multi-base Shor runs --shots per base that finished
+        jobs = sum(1 for attempt in results.get("attempts") or [] if attempt.get("status") in ("factored", "no_factors"))
+        _emit("inc", "keystone_shots_total", labels, float((results.get("shots") or 0) * max(1, jobs)))
+    peak_mb = profiling.peak_rss_mb()
+    if peak_mb is not None:
+        _emit("set_max", "keystone_memory_peak_bytes", labels, int(peak_mb * 1024 * 1024))
+
+
+# --- Exposition ---
+def write_textfile(path, registry=REGISTRY):
+    """Atomically writes the Prometheus text format (for node_exporter's textfile collector)."""
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(registry.render())
+    os.replace(tmp_path, path)
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    registry = REGISTRY
+
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/metrics", "/"):
+            self.send_error(404)
+            return
+        openmetrics = "application/openmetrics-text" in self.headers.get("Accept", "")
+        body = self.registry.render(openmetrics).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", OPENMETRICS_TYPE if openmetrics else PROMETHEUS_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass # Scrapes every few seconds would flood stderr
+
+
+def serve(port, host=DEFAULT_HOST, registry=REGISTRY):
+    """Serves /metrics from a daemon thread. Returns the server (server_address has the bound port)."""
+    handler = type("Handler", (_Handler,), {"registry": registry})
+    server = http.server.ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    log_stderr(f"Serving metrics on http://{host}:{server.server_address[1]}/metrics")
+    return server
+
+
+def drain(source, registry=REGISTRY, on_update=None, stop=None):
+    """Applies updates forwarded by worker processes (runs on a thread). on_update() is called
+       whenever the queue has been emptied; once `stop` is set, what is queued is applied and it returns."""
+    dirty = False
+    while True:
+        stopping = stop is not None and stop.is_set()
+        try:
+            registry.apply(source.get_nowait() if stopping else source.get(timeout=0.5))
+            dirty = True
+            if not source.empty():
+                continue
+        except queue.Empty:
+            if stopping:
+                break
+        except (EOFError, OSError):
+            break
+        if dirty and on_update is not None:
+            on_update()
+        dirty = False
+    if dirty and on_update is not None:
+        on_update()
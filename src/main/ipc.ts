@@ -959,13 +959,15 @@ export function setupEncryptionIPC() {
  * @param {number} shots - Number of shots to run
  * @param {boolean} runOnHardware - Whether to run on real quantum hardware
  * @param {string} plotTheme - Plot theme (light or dark)
+ * @param {WebContents} sender - Renderer that receives each JSON-line event as it arrives
  * @returns {Promise<Object>} Result object with status, output data, logs, and plot path
  */
 async function runQuantumWorkload(
 	apiToken: string,
 	shots: number,
 	runOnHardware: boolean,
-	plotTheme: 'light' | 'dark'
+	plotTheme: 'light' | 'dark',
+	sender?: any
 ): Promise<any> {
 	console.log('[Quantum Workload] Starting quantum workload execution...');
 
@@ -1051,6 +1053,8 @@ async function runQuantumWorkload(
 		plotTheme,
 		'--output_json',
 		jsonFilePath,
+		'--event_stream',
+		'stdout',
 	];
 
 	// Add run_on_hardware flag if true
@@ -1058,8 +1062,10 @@ async function runQuantumWorkload(
 		args.push('--run_on_hardware');
 	}
 
-	// Store logs
+	// Store logs and structured phase/progress events (JSON lines on stdout)
 	const logs: string[] = [];
+	const events: any[] = [];
+	let eventBuffer = '';
 
 	console.log(
 		`[Quantum Workload] Executing Python script: ${pythonExecutable} ${scriptPath} ${args.join(
@@ -1082,6 +1088,28 @@ async function runQuantumWorkload(
 			console.log(`[Quantum Workload Log] ${data.toString().trim()}`);
 		});
 
+		// Capture stdout as JSON-line events (partial lines are buffered)
+		pythonProcess.stdout.on('data', (data) => {
+			eventBuffer += data.toString();
+			const lines = eventBuffer.split('\n');
+			eventBuffer = lines.pop() || '';
+			for (const line of lines) {
+				if (!line.trim()) continue;
+				let parsed: any;
+				try {
+					parsed = JSON.parse(line);
+				} catch (err) {
+					logs.push(line);
+					continue;
+				}
+				events.push(parsed);
+				// Forwarded as they arrive; the full list is still returned on exit
+				if (sender && !sender.isDestroyed()) {
+					sender.send('quantum-workload-event', parsed);
+				}
+			}
+		});
+
 		// Handle process completion
 		pythonProcess.on('close', (code) => {
 			console.log(`[Quantum Workload] Python process exited with code ${code}`);
@@ -1103,6 +1131,7 @@ async function runQuantumWorkload(
 						exitCode: code,
 						data: resultData,
 						logs: logs,
+						events: events,
 						plotFilePath: plotExists ? plotFilePath : null,
 						jsonFilePath: jsonFilePath,
 					});
@@ -1145,6 +1174,7 @@ async function runQuantumWorkload(
  * @param {number} shots - Number of shots to run
  * @param {boolean} runOnHardware - Whether to run on real quantum hardware
  * @param {string} plotTheme - Plot theme (light or dark)
+ * @param {WebContents} sender - Renderer that receives each JSON-line event as it arrives
  * @returns {Promise<Object>} Result object with status, output data, logs, and plot path
  */
 async function runGroverSearch(
@@ -1152,7 +1182,8 @@ async function runGroverSearch(
 	markedStates: string,
 	shots: number,
 	runOnHardware: boolean,
-	plotTheme: 'light' | 'dark'
+	plotTheme: 'light' | 'dark',
+	sender?: any
 ): Promise<any> {
 	console.log('[Grover Search] Starting Grover search execution...');
 
@@ -1242,6 +1273,8 @@ async function runGroverSearch(
 		plotTheme,
 		'--output_json',
 		jsonFilePath,
+		'--event_stream',
+		'stdout',
 	];
 
 	// Add run_on_hardware flag if true
@@ -1249,8 +1282,10 @@ async function runGroverSearch(
 		args.push('--run_on_hardware');
 	}
 
-	// Store logs
+	// Store logs and structured phase/progress events (JSON lines on stdout)
 	const logs: string[] = [];
+	const events: any[] = [];
+	let eventBuffer = '';
 
 	console.log(
 		`[Grover Search] Executing Python script: ${pythonExecutable} ${scriptPath} ${args.join(
@@ -1273,6 +1308,28 @@ async function runGroverSearch(
 			console.log(`[Grover Search Log] ${data.toString().trim()}`);
 		});
 
+		// Capture stdout as JSON-line events (partial lines are buffered)
+		pythonProcess.stdout.on('data', (data) => {
+			eventBuffer += data.toString();
+			const lines = eventBuffer.split('\n');
+			eventBuffer = lines.pop() || '';
+			for (const line of lines) {
+				if (!line.trim()) continue;
+				let parsed: any;
+				try {
+					parsed = JSON.parse(line);
+				} catch (err) {
+					logs.push(line);
+					continue;
+				}
+				events.push(parsed);
+				// Forwarded as they arrive; the full list is still returned on exit
+				if (sender && !sender.isDestroyed()) {
+					sender.send('quantum-workload-event', parsed);
+				}
+			}
+		});
+
 		// Handle process completion
 		pythonProcess.on('close', (code) => {
 			console.log(`[Grover Search] Python process exited with code ${code}`);
@@ -1294,6 +1351,7 @@ async function runGroverSearch(
 						exitCode: code,
 						data: resultData,
 						logs: logs,
+						events: events,
 						plotFilePath: plotExists ? plotFilePath : null,
 						jsonFilePath: jsonFilePath,
 					});
@@ -1435,7 +1493,7 @@ export function setupQuantumWorkloadIPC() {
 	ipcMain.handle(
 		'run-quantum-workload',
 		async (
-			_event: IpcMainInvokeEvent,
+			event: IpcMainInvokeEvent,
 			apiToken: string,
 			shots: number,
 			runOnHardware: boolean,
@@ -1458,7 +1516,8 @@ export function setupQuantumWorkloadIPC() {
 					apiToken,
 					shots,
 					runOnHardware,
-					plotTheme
+					plotTheme,
+					event.sender
 				);
 
 				if (result.status === 'success') {
@@ -1493,7 +1552,7 @@ export function setupQuantumWorkloadIPC() {
 	ipcMain.handle(
 		'run-grover-search',
 		async (
-			_event: IpcMainInvokeEvent,
+			event: IpcMainInvokeEvent,
 			apiToken: string,
 			markedStates: string,
 			shots: number,
@@ -1518,7 +1577,8 @@ export function setupQuantumWorkloadIPC() {
 					markedStates,
 					shots,
 					runOnHardware,
-					plotTheme
+					plotTheme,
+					event.sender
 				);
 
 				if (result.status === 'success') {
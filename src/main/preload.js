@@ -216,6 +216,13 @@ contextBridge.exposeInMainWorld('quantumAPI', {
 		ipcRenderer.on('quantum-log-update', subscription);
 		return () => ipcRenderer.removeListener('quantum-log-update', subscription);
 	},
+	// Phase / progress events of a running workload (JSON lines from --event_stream)
+	onWorkloadEvent: (callback) => {
+		const subscription = (_event, ...args) => callback(...args);
+		ipcRenderer.on('quantum-workload-event', subscription);
+		return () =>
+			ipcRenderer.removeListener('quantum-workload-event', subscription);
+	},
 });
 
 // --- Add Database API ---
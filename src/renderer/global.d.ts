@@ -32,6 +32,7 @@ declare global {
 			loadApiToken: () => Promise<string | null>;
 			deleteApiToken: () => Promise<boolean>;
 			onLogUpdate: (callback: (log: string) => void) => () => void;
+			onWorkloadEvent: (callback: (event: any) => void) => () => void;
 		};
 		electron: {
 			ipcRenderer: {
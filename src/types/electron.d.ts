@@ -58,6 +58,8 @@ declare global {
 
 			onLogUpdate(callback: (logMessage: string) => void): () => void;
 
+			onWorkloadEvent(callback: (event: any) => void): () => void;
+
 			// API Token management
 			saveApiToken(apiToken: string): Promise<boolean>;
 			loadApiToken(): Promise<string | null>;
@@ -0,0 +1,124 @@
+# test_backend_registry.py
+#
+# Cached backend discovery and least-busy selection of
+# quantum/backend_registry.py against the offline LocalService, with the
+# backend list cached in a temporary directory.
+#
+#   python -m unittest discover tests
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "quantum"))
+
+import backend_registry
+
+
+class BackendRegistryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.service = backend_registry.LocalService()
+        backend_registry._BACKENDS.clear()
+        for name in backend_registry.stats:
+            backend_registry.stats[name] = 0
+
+    def tearDown(self):
+        backend_registry._BACKENDS.clear()
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+
+    def select(self, min_num_qubits, **kwargs):
+        return backend_registry.select_backend(self.service, min_num_qubits, account="test", cache_dir=self.cache_dir,
+                                               **kwargs)
+
+    def test_listing_is_cached_for_its_ttl(self):
+        first = backend_registry.get_listing(self.service, "test", self.cache_dir)
+        second = backend_registry.get_listing(self.service, "test", self.cache_dir)
+        self.assertEqual(second, first)
+        self.assertEqual(self.service.calls["backends"], 1)
+        self.assertEqual((backend_registry.stats["list_refreshes"], backend_registry.stats["list_hits"]), (1, 1))
+        self.assertEqual([b["name"] for b in first["backends"]], [d[0] for d in self.service.DEFAULT_DEVICES])
+        self.assertFalse(first["backends"][-1]["operational"])
+        # Another process finds the listing on disk
+        self.assertEqual(backend_registry.load_listing("test", self.cache_dir), first)
+        self.assertIsNone(backend_registry.load_listing("other", self.cache_dir))
+
+    def test_expired_listing_is_refreshed(self):
+        backend_registry.get_listing(self.service, "test", self.cache_dir)
+        self.service.devices["local_small"] = (5, 40, True)
+        listing = backend_registry.get_listing(self.service, "test", self.cache_dir, ttl=-1)
+        self.assertEqual(self.service.calls["backends"], 2)
+        self.assertEqual(backend_registry.stats["list_refreshes"], 2)
+        self.assertEqual(listing["backends"][0]["pending_jobs"], 40)
+
+    def test_failed_refresh_falls_back_to_stale_listing(self):
+        cached = backend_registry.get_listing(self.service, "test", self.cache_dir)
+        self.service.faults["service"] = ["transient"]
+        self.assertEqual(backend_registry.get_listing(self.service, "test", self.cache_dir, ttl=-1), cached)
+        other = tempfile.mkdtemp(dir=self.cache_dir)
+        self.service.faults["service"] = ["transient"]
+        with self.assertRaises(ConnectionError): # Nothing cached to fall back to
+            backend_registry.get_listing(self.service, "test", other)
+
+    def test_backend_objects_are_reused(self):
+        backend = backend_registry.get_backend(self.service, "local_small", "test")
+        self.assertIs(backend_registry.get_backend(self.service, "local_small", "test"), backend)
+        self.assertEqual(self.service.calls["backend"], 1)
+        self.assertEqual((backend_registry.stats["backend_fetches"], backend_registry.stats["backend_hits"]), (1, 1))
+        # Expired, another account or another service: fetched again
+        self.assertIsNot(backend_registry.get_backend(self.service, "local_small", "test", ttl=-1), backend)
+        backend_registry.get_backend(self.service, "local_small", "other")
+        backend_registry.get_backend(backend_registry.LocalService(), "local_small", "test")
+        self.assertEqual(backend_registry.stats["backend_fetches"], 4)
+
+    def test_refresh_keeps_listed_backends(self):
+        self.select(2, survey=False)
+        self.assertEqual(self.service.calls["backend"], 0) # Backends listed by the refresh are not fetched again
+        self.assertEqual(backend_registry.stats["backend_hits"], 3)
+
+    def test_least_busy_candidate_is_selected(self):
+        backend, info = self.select(2, survey=False)
+        self.assertEqual(backend.name, "local_large")
+        self.assertEqual(info, {"pinned": False, "ranked_by": "queue", "pending_jobs": 1, "candidates": 3,
+                                "listing_age_sec": info["listing_age_sec"]})
+        self.assertEqual(self.service.calls["status"], 4 + 3) # Listing, then one call per operational candidate
+        backend, info = self.select(6, survey=False)
+        self.assertEqual((backend.name, info["candidates"]), ("local_large", 2))
+
+    def test_current_queue_overrides_the_listing(self):
+        self.select(2, survey=False)
+        self.service.devices["local_large"] = (27, 50, True)
+        backend, info = self.select(2, survey=False)
+        self.assertEqual((backend.name, info["pending_jobs"]), ("local_small", 3))
+        self.service.devices["local_small"] = (5, 3, False) # Went offline since the listing
+        self.assertEqual(self.select(2, survey=False)[0].name, "local_medium")
+
+    def test_excluded_backends_are_never_selected(self):
+        backend, info = self.select(2, survey=False, exclude=("local_large",))
+        self.assertEqual((backend.name, info["candidates"]), ("local_small", 2))
+        with self.assertRaises(backend_registry.NoCandidateBackends):
+            self.select(6, survey=False, exclude=("local_large", "local_medium"))
+        with self.assertRaises(backend_registry.NoCandidateBackends):
+            self.select(100, survey=False)
+
+    def test_pinned_backend_skips_discovery(self):
+        backend, info = self.select(2, pinned="local_medium")
+        self.assertEqual((backend.name, info), ("local_medium", {"pinned": True, "pending_jobs": 12, "candidates": 1}))
+        self.assertEqual(self.service.calls["backends"], 0)
+        with self.assertRaisesRegex(RuntimeError, "qubits"):
+            self.select(6, pinned="local_small")
+        with self.assertRaisesRegex(RuntimeError, "not operational"):
+            self.select(2, pinned="local_offline")
+
+    def test_account_key_hides_the_token(self):
+        key = backend_registry.account_key("secret-token")
+        self.assertEqual(len(key), 16)
+        self.assertNotIn("secret", key)
+        self.assertNotEqual(key, backend_registry.account_key("other-token"))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,187 @@
+# test_cnf_oracle.py
+#
+# Parsing, simplification, phase-oracle compilation and the on-disk oracle
+# cache of quantum/cnf_oracle.py. Compiled oracles are checked against
+# brute-force evaluation of the formula on every assignment.
+#
+#   python -m unittest discover tests
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "quantum"))
+
+from qiskit.quantum_info import Statevector
+
+import cnf_oracle
+
+EXPRESSIONS = [
+    "a",
+    "~a & b",
+    "(a | ~b) & (b ^ c)",
+    "a & b & c",
+    "(a | b) & (~a | c) & (b | ~c)",
+    "a ^ b ^ ~c",
+    "~(a & b) | (c & ~d)",
+    "(a | b | c) & ~(a & b & c)",
+    "(a ^ ~a) & (b | c)",
+]
+
+DIMACS = """c three clauses
+p cnf 3 3
+1 -2 0
+2 3 0
+-1 -3 0
+"""
+
+
+def brute_force(formula, num_vars):
+    """Truth table of the formula over every assignment (bit i = variable i)."""
+    return cnf_oracle.evaluate_formula(formula, np.arange(2 ** num_vars, dtype=np.int64))
+
+
+class OracleTest(unittest.TestCase):
+
+    def assert_phase_oracle(self, num_vars, formula):
+        """Every basis assignment with clean ancillas gets phase (-1)^f(x) and the ancillas return to |0>."""
+        oracle, stats = cnf_oracle.compile_phase_oracle(num_vars, formula)
+        self.assertEqual(stats["oracle_qubits"], num_vars + stats["num_ancillas"])
+        truth = brute_force(formula, num_vars)
+        dimension = 2 ** oracle.num_qubits
+        for x in range(2 ** num_vars):
+            out = Statevector.from_int(x, dimension).evolve(oracle).data
+            expected = -1.0 if truth[x] else 1.0
+            self.assertAlmostEqual(out[x].real, expected, places=6, msg=f"{formula} at x={x}")
+            self.assertAlmostEqual(np.linalg.norm(out[x]), 1.0, places=6, msg=f"ancillas not uncomputed at x={x}")
+
+    def test_expression_oracles_match_brute_force(self):
+        for expr in EXPRESSIONS:
+            with self.subTest(expr=expr):
+                names, formula = cnf_oracle.parse_boolean_expression(expr)
+                self.assert_phase_oracle(len(names), formula)
+
+    def test_dimacs_oracle_matches_brute_force(self):
+        num_vars, clauses = cnf_oracle.parse_dimacs(DIMACS)
+        formula = cnf_oracle.cnf_to_formula(clauses)
+        self.assertEqual(cnf_oracle.count_clauses(formula), 3)
+        self.assert_phase_oracle(num_vars, formula)
+        truth = brute_force(formula, num_vars)
+        expected = [x for x in range(8) if (x & 1 or not x & 2) and (x & 2 or x & 4) and (not x & 1 or not x & 4)]
+        self.assertEqual(np.flatnonzero(truth).tolist(), expected)
+
+    def test_count_solutions(self):
+        _, formula = cnf_oracle.parse_boolean_expression("(a | b) & ~c")
+        result = cnf_oracle.count_solutions(formula, 3)
+        self.assertEqual((result["count"], result["method"]), (3, "exact"))
+        self.assertEqual(sorted(result["solutions"]), ["001", "010", "011"])
+        for bitstring in result["solutions"]:
+            self.assertTrue(cnf_oracle.bitstring_satisfies(formula, bitstring))
+
+
+class SimplifyTest(unittest.TestCase):
+
+    def simplified(self, expr):
+        names, formula = cnf_oracle.parse_boolean_expression(expr)
+        return cnf_oracle.formula_to_string(formula, names)
+
+    def test_folds_complements_and_constants(self):
+        self.assertEqual(self.simplified("(a | ~a) & b"), "b")
+        self.assertEqual(self.simplified("(a ^ ~a) & b"), "b")
+        self.assertEqual(self.simplified("a ^ a ^ b"), "b")
+        self.assertEqual(self.simplified("~~a & (b & c)"), "(a & b & c)")
+        self.assertEqual(self.simplified("a ^ ~b"), "~(a ^ b)")
+        _, formula = cnf_oracle.parse_boolean_expression("a & ~a & b")
+        self.assertEqual(formula, cnf_oracle.FALSE)
+
+    def test_simplified_formula_is_equivalent(self):
+        for expr in EXPRESSIONS + ["~(a ^ b) ^ c", "(a & b) ^ ~(a & b) ^ c", "(a | b) & (b | a)", "a ^ b ^ a"]:
+            with self.subTest(expr=expr):
+                names, formula = cnf_oracle.parse_boolean_expression(expr)
+                with mock.patch.object(cnf_oracle, "simplify_formula", lambda node: node):
+                    raw_names, raw = cnf_oracle.parse_boolean_expression(expr)
+                self.assertEqual(names, raw_names)
+                np.testing.assert_array_equal(brute_force(formula, len(names)), brute_force(raw, len(names)))
+
+    def test_always_true_is_rejected(self):
+        for expr in ("a | ~a", "a ^ ~a", "(a & b) | ~(a & b)"):
+            with self.subTest(expr=expr), self.assertRaisesRegex(ValueError, "always true"):
+                cnf_oracle.parse_boolean_expression(expr)
+        with self.assertRaisesRegex(ValueError, "every assignment"):
+            cnf_oracle.cnf_to_formula([[1, -1], [2, -2, 3]])
+
+
+class ParserErrorTest(unittest.TestCase):
+
+    def test_expression_errors(self):
+        cases = {
+            "": "empty",
+            "(a & b": "Unbalanced",
+            "a $ b": "Unexpected character",
+            "a b": "trailing tokens",
+            "a & | b": "Unexpected token",
+        }
+        for expr, message in cases.items():
+            with self.subTest(expr=expr), self.assertRaisesRegex(ValueError, message):
+                cnf_oracle.parse_boolean_expression(expr)
+
+    def test_dimacs_errors(self):
+        cases = {
+            "1 -2 0\n": "missing",
+            "p dnf 2 1\n1 2 0\n": "problem line",
+            "p cnf 2 1\n1 3 0\n": "exceeds",
+        }
+        for text, message in cases.items():
+            with self.subTest(text=text), self.assertRaisesRegex(ValueError, message):
+                cnf_oracle.parse_dimacs(text)
+
+    def test_keywords_and_unicode_operators(self):
+        _, keywords = cnf_oracle.parse_boolean_expression("(x1 or not x2) and (x2 xor x10)")
+        _, symbols = cnf_oracle.parse_boolean_expression("(x1 ∨ ¬x2) ∧ (x2 ⊕ x10)")
+        self.assertEqual(keywords, symbols)
+
+
+class OracleCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        cnf_oracle._ORACLE_CACHE.clear()
+        self.names, self.formula = cnf_oracle.parse_boolean_expression("(a | ~b) & (b ^ c)")
+
+    def tearDown(self):
+        cnf_oracle._ORACLE_CACHE.clear()
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+
+    def test_disk_round_trip(self):
+        oracle, stats = cnf_oracle.get_phase_oracle(3, self.formula, self.cache_dir)
+        self.assertFalse(stats["cache_hit"])
+        key = stats["formula_hash"]
+        self.assertEqual(sorted(os.listdir(self.cache_dir)), [key + ".json", key + ".qpy"]) # No temp files left
+        cnf_oracle._ORACLE_CACHE.clear()
+        loaded, loaded_stats = cnf_oracle.get_phase_oracle(3, self.formula, self.cache_dir)
+        self.assertTrue(loaded_stats["cache_hit"])
+        self.assertEqual(loaded_stats["oracle_depth"], stats["oracle_depth"])
+        dimension = 2 ** oracle.num_qubits
+        for x in range(8):
+            start = Statevector.from_int(x, dimension)
+            self.assertTrue(start.evolve(loaded).equiv(start.evolve(oracle)))
+
+    def test_unreadable_entry_is_recompiled(self):
+        _, stats = cnf_oracle.get_phase_oracle(3, self.formula, self.cache_dir)
+        cnf_oracle._ORACLE_CACHE.clear()
+        with open(os.path.join(self.cache_dir, stats["formula_hash"] + ".qpy"), "wb") as f:
+            f.write(b"not qpy")
+        _, again = cnf_oracle.get_phase_oracle(3, self.formula, self.cache_dir)
+        self.assertFalse(again["cache_hit"])
+        cnf_oracle._ORACLE_CACHE.clear()
+        _, repaired = cnf_oracle.get_phase_oracle(3, self.formula, self.cache_dir)
+        self.assertTrue(repaired["cache_hit"])
+
+
+if __name__ == '__main__':
+    unittest.main()
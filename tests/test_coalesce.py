@@ -0,0 +1,197 @@
+# test_coalesce.py
+#
+# In-flight coalescing of quantum/coalesce.py: identical requests against a
+# backend_registry.LocalService device share jobs through a registry in a
+# temporary directory.
+#
+#   python -m unittest discover tests
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "quantum"))
+
+from qiskit import QuantumCircuit
+
+import backend_registry
+import coalesce
+import result_io
+import telemetry
+
+
+def bell_circuit():
+    qc = QuantumCircuit(2, 2)
+    qc.h(0)
+    qc.cx(0, 1)
+    qc.measure([0, 1], [0, 1])
+    return qc
+
+
+class StatusJob:
+    """A job that reports a fixed status (a failed or still queued job)."""
+
+    def __init__(self, job, status):
+        self.job = job
+        self._status = status
+
+    def job_id(self):
+        return self.job.job_id()
+
+    def status(self):
+        return self._status
+
+
+class CoalesceTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.registry = coalesce.Registry(self.directory)
+        self.service = backend_registry.LocalService()
+        self.backend = self.service.backend("local_small")
+        self.qc = bell_circuit()
+        self.key = coalesce.job_key(self.qc, self.backend, "test")
+        self.fetched = []
+        coalesce._JOBS.clear()
+
+    def tearDown(self):
+        coalesce._JOBS.clear()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def submit(self, shots):
+        return self.backend.run(self.qc, shots=shots)
+
+    def get_job(self, job_id):
+        self.fetched.append(job_id)
+        raise KeyError(f"No job {job_id}")
+
+    def acquire(self, shots):
+        return coalesce.acquire(self.registry, self.key, self.backend.name, shots, self.submit, self.get_job)
+
+    def test_identical_request_attaches(self):
+        first_jobs, first = self.acquire(64)
+        second_jobs, second = self.acquire(64)
+        self.assertEqual((first["role"], second["role"]), ("submitted", "attached"))
+        self.assertEqual(self.service.calls["runs"], 1)
+        self.assertEqual([job.job_id() for job in second_jobs], [job.job_id() for job in first_jobs])
+        self.assertEqual(second["job_ids"], first["job_ids"])
+        self.assertEqual((second["requesters"], second["submitted_shots"]), (2, 0))
+        self.assertEqual(self.fetched, []) # In-process jobs are not fetched from the service
+
+    def test_fewer_shots_attach_without_top_up(self):
+        self.acquire(64)
+        _, info = self.acquire(32)
+        self.assertEqual((info["role"], info["shots"], info["requested_shots"]), ("attached", 64, 32))
+        self.assertEqual(self.service.calls["runs"], 1)
+
+    def test_more_shots_top_up(self):
+        self.acquire(64)
+        jobs, info = self.acquire(100)
+        self.assertEqual(info["role"], "topped_up")
+        self.assertEqual((info["submitted_shots"], info["shots"]), (36, 100))
+        self.assertEqual(len(jobs), 2)
+        self.assertEqual(info["submitted_job_ids"], [jobs[1].job_id()])
+        self.assertEqual(sum(sum(job.result().get_counts().values()) for job in jobs), 100)
+        # A third requester shares both jobs
+        third_jobs, third = self.acquire(100)
+        self.assertEqual((third["role"], third["requesters"]), ("attached", 3))
+        self.assertEqual(len(third_jobs), 2)
+        self.assertEqual(self.service.calls["runs"], 2)
+
+    def test_failed_job_is_resubmitted(self):
+        jobs, first = self.acquire(64)
+        coalesce._JOBS[jobs[0].job_id()] = StatusJob(jobs[0], "ERROR")
+        retry_jobs, info = self.acquire(64)
+        self.assertEqual(info["role"], "submitted")
+        self.assertEqual(info["requesters"], 1) # The failed entry was replaced, not joined
+        self.assertNotEqual(info["job_ids"], first["job_ids"])
+        self.assertEqual(self.service.calls["runs"], 2)
+
+    def test_unavailable_job_is_resubmitted(self):
+        jobs, _ = self.acquire(64)
+        coalesce._JOBS.clear() # Another process: the job has to come from the service, which no longer has it
+        _, info = self.acquire(64)
+        self.assertEqual(info["role"], "submitted")
+        self.assertEqual(self.fetched, [jobs[0].job_id()])
+
+    def test_release_counts_down_requesters(self):
+        jobs, _ = self.acquire(64)
+        self.acquire(64)
+        self.assertFalse(coalesce.sole_requester(self.registry, self.key))
+        queued = StatusJob(jobs[0], "QUEUED")
+        coalesce.release(self.registry, self.key, [queued])
+        self.assertEqual(self.registry.load(self.key)["requesters"], 1)
+        self.assertTrue(coalesce.sole_requester(self.registry, self.key)) # The remaining requester may cancel
+        jobs[0].result()
+        coalesce.release(self.registry, self.key, jobs)
+        self.assertIsNone(self.registry.load(self.key)) # All jobs final: entry dropped
+        self.assertEqual(coalesce._JOBS, {})
+        self.assertTrue(coalesce.sole_requester(self.registry, self.key))
+
+    def test_finished_jobs_drop_the_entry(self):
+        jobs, _ = self.acquire(64)
+        self.acquire(64)
+        jobs[0].result()
+        coalesce.release(self.registry, self.key, jobs)
+        # Requesters still collecting hold their job objects; later requests submit afresh
+        self.assertIsNone(self.registry.load(self.key))
+        _, info = self.acquire(64)
+        self.assertEqual(info["role"], "submitted")
+
+    def test_running_job_stays_attachable_after_release(self):
+        jobs, _ = self.acquire(64)
+        queued = StatusJob(jobs[0], "QUEUED")
+        coalesce._JOBS[queued.job_id()] = queued
+        coalesce.release(self.registry, self.key, [queued])
+        self.assertEqual(self.registry.load(self.key)["requesters"], 0)
+        _, info = self.acquire(64)
+        self.assertEqual(info["role"], "attached")
+
+    def test_stale_lock_is_removed(self):
+        lock_path = os.path.join(self.directory, self.key[:32] + ".lock")
+        open(lock_path, "w").close()
+        old = time.time() - coalesce.STALE_LOCK_SEC - 10
+        os.utime(lock_path, (old, old))
+        _, info = self.acquire(64)
+        self.assertEqual(info["role"], "submitted")
+        self.assertFalse(os.path.exists(lock_path))
+
+    def test_held_lock_times_out(self):
+        lock_path = os.path.join(self.directory, self.key[:32] + ".lock")
+        open(lock_path, "w").close()
+        with mock.patch.object(coalesce, "LOCK_TIMEOUT_SEC", 0.05), self.assertRaises(TimeoutError):
+            self.acquire(64)
+        self.assertEqual(self.service.calls["runs"], 0)
+        self.assertTrue(os.path.exists(lock_path)) # Another process's lock is left alone
+
+    def test_run_merges_shared_counts(self):
+        self.acquire(64) # Another requester already in flight
+        timer = telemetry.PhaseTimer("test")
+        cancel_checks = []
+
+        def submit_circuit(qc, backend, shots, timer):
+            return backend.run(qc, shots=shots)
+
+        def collect_job(job, qc, timer, cancel):
+            cancel_checks.append(cancel())
+            counts = job.result().get_counts()
+            return job.job_id(), result_io.counts_arrays_from_dict(counts, qc.num_clbits), 1.5
+
+        job_id, (outcomes, frequencies), qpu_time, info = coalesce.run(
+            self.qc, self.backend, 100, timer, submit_circuit, collect_job, account="test", directory=self.directory)
+        self.assertEqual(info["role"], "topped_up")
+        self.assertEqual(job_id, info["job_ids"][0])
+        self.assertEqual(int(sum(frequencies)), 100)
+        counts = result_io.counts_to_dict(outcomes, frequencies, 2)
+        self.assertGreater(counts.get("00", 0) + counts.get("11", 0), 80) # Noisy device, mostly Bell outcomes
+        self.assertEqual(qpu_time, 3.0)
+        self.assertEqual(cancel_checks, [False, False]) # The first requester still waits on the shared job
+        self.assertIsNone(self.registry.load(self.key)) # Both jobs finished
+
+
+if __name__ == '__main__':
+    unittest.main()
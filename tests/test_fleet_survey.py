@@ -0,0 +1,153 @@
+# test_fleet_survey.py
+#
+# Calibration survey, ranking and survey-based backend selection of
+# quantum/fleet_survey.py. The survey runs over qiskit-ibm-runtime's fake
+# backends (as `fleet_survey.py survey --fake`); selection runs against
+# LocalService devices with a hand-written snapshot, so the ranking is known.
+#
+#   python -m unittest discover tests
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "quantum"))
+
+from qiskit_ibm_runtime.fake_provider import FakeProviderForBackendV2
+
+import backend_registry
+import fleet_survey
+
+
+def entry(name, num_qubits, error, pending_jobs, operational=True, calibrated=True):
+    """A snapshot entry with uniform readout / two-qubit error."""
+    return {"name": name, "num_qubits": num_qubits, "operational": operational, "pending_jobs": pending_jobs,
+            "status_msg": None, "readout_errors": [error] * num_qubits if calibrated else [],
+            "two_qubit_errors": [error] * num_qubits if calibrated else [], "one_qubit_error": error / 10,
+            "t1_us": 100.0, "t2_us": 80.0}
+
+
+class FakeSurveyTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.cache_dir = tempfile.mkdtemp()
+        backend_registry._BACKENDS.clear()
+        cls.snapshot = fleet_survey.survey(FakeProviderForBackendV2(), "fake", cls.cache_dir)
+
+    @classmethod
+    def tearDownClass(cls):
+        backend_registry._BACKENDS.clear()
+        shutil.rmtree(cls.cache_dir, ignore_errors=True)
+
+    def test_snapshot_summarizes_every_backend(self):
+        self.assertEqual(self.snapshot["failed"], {})
+        names = [e["name"] for e in self.snapshot["backends"]]
+        self.assertEqual(names, sorted(names))
+        self.assertGreater(len(names), 10)
+        for e in self.snapshot["backends"]:
+            self.assertLessEqual(len(e["readout_errors"]), e["num_qubits"])
+            self.assertEqual(e["readout_errors"], sorted(e["readout_errors"]))
+            self.assertEqual(e["two_qubit_errors"], sorted(e["two_qubit_errors"]))
+
+    def test_snapshot_and_listing_are_cached(self):
+        self.assertEqual(fleet_survey.load_snapshot("fake", self.cache_dir), self.snapshot)
+        self.assertIsNone(fleet_survey.load_snapshot("fake", self.cache_dir, ttl=-1))
+        self.assertIsNone(fleet_survey.load_snapshot("other", self.cache_dir))
+        listing = backend_registry.load_listing("fake", self.cache_dir)
+        self.assertEqual([b["name"] for b in listing["backends"]], [e["name"] for e in self.snapshot["backends"]])
+
+    def test_rank_orders_candidates_by_score(self):
+        ranking = fleet_survey.rank(self.snapshot, 5)
+        sizes = {e["name"]: e["num_qubits"] for e in self.snapshot["backends"]}
+        self.assertTrue(all(sizes[choice["name"]] >= 5 for choice in ranking))
+        scores = [choice["score"] for choice in ranking if choice["score"] is not None]
+        self.assertEqual(scores, sorted(scores, reverse=True))
+        wide = fleet_survey.rank(self.snapshot, 100)
+        self.assertLess(len(wide), len(ranking))
+        deep = {c["name"]: c["expected_fidelity"] for c in fleet_survey.rank(self.snapshot, 5, two_qubit_gates=400)}
+        for choice in ranking:
+            if choice["expected_fidelity"]: # Some recorded calibrations round to 0 already
+                self.assertLess(deep[choice["name"]], choice["expected_fidelity"])
+
+    def test_rank_command(self):
+        self.assertEqual(fleet_survey.main(["rank", "--fake", "--cache_dir", self.cache_dir, "--num_qubits", "5"]), 0)
+        self.assertEqual(fleet_survey.main(["rank", "--local", "--cache_dir", self.cache_dir]), 1) # No snapshot
+
+
+class SurveySelectionTest(unittest.TestCase):
+
+    DEVICES = (("best", 27, 0, True), ("second", 27, 0, True), ("third", 27, 0, True), ("fourth", 27, 0, True),
+               ("uncalibrated", 27, 0, True))
+
+    def setUp(self):
+        backend_registry._BACKENDS.clear()
+        self.service = backend_registry.LocalService(self.DEVICES)
+        self.snapshot = {"version": fleet_survey.SURVEY_VERSION, "fetched_at": time.time(), "failed": {}, "backends": [
+            entry("best", 27, 0.001, 0), entry("second", 27, 0.002, 0), entry("third", 27, 0.003, 0),
+            entry("fourth", 27, 0.004, 0), entry("uncalibrated", 27, 0.0, 0, calibrated=False),
+            entry("small", 2, 0.0001, 0), entry("offline", 27, 0.0001, 0, operational=False)]}
+
+    def tearDown(self):
+        backend_registry._BACKENDS.clear()
+
+    def select(self, min_num_qubits=3, **kwargs):
+        return fleet_survey.select_backend(self.service, self.snapshot, min_num_qubits, "test", **kwargs)
+
+    def test_rank_skips_small_and_offline_backends(self):
+        ranking = fleet_survey.rank(self.snapshot, 3)
+        self.assertEqual([c["name"] for c in ranking], ["best", "second", "third", "fourth", "uncalibrated"])
+        self.assertIsNone(ranking[-1]["expected_fidelity"])
+
+    def test_only_top_candidates_get_status_calls(self):
+        backend, info = self.select()
+        self.assertEqual(backend.name, "best")
+        self.assertEqual(self.service.calls["status"], fleet_survey.STATUS_CHECK_TOP)
+        self.assertEqual((info["ranked_by"], info["candidates"], info["status_checked"]), ("survey", 5, 3))
+        self.assertEqual((info["rank_skipped"], info["runner_up"]), (0, "second"))
+
+    def test_current_queue_re_ranks_the_top_candidates(self):
+        self.service.devices["best"] = (27, 10000, True) # Queued up since the survey
+        backend, info = self.select()
+        self.assertEqual((backend.name, info["pending_jobs"], info["rank_skipped"]), ("second", 0, 1))
+        self.assertEqual(info["runner_up"], "third")
+        self.assertEqual(self.service.calls["status"], 3) # "fourth" is never asked
+
+    def test_offline_candidate_is_replaced_by_the_next(self):
+        self.service.devices["best"] = (27, 0, False)
+        self.service.devices["second"] = (27, 0, False)
+        backend, info = self.select()
+        self.assertEqual(backend.name, "third")
+        self.assertEqual(info["status_checked"], 3) # third, fourth and uncalibrated
+        self.assertEqual(self.service.calls["status"], 5)
+        self.assertEqual(info["runner_up"], "fourth")
+
+    def test_excluded_backends_are_never_selected(self):
+        backend, info = self.select(exclude=("best", "third"))
+        self.assertEqual((backend.name, info["candidates"]), ("second", 3))
+        with self.assertRaises(backend_registry.NoCandidateBackends):
+            self.select(exclude=("best", "second", "third", "fourth", "uncalibrated"))
+        for name, _, _, _ in self.DEVICES:
+            self.service.devices[name] = (27, 0, False)
+        with self.assertRaises(backend_registry.NoCandidateBackends):
+            self.select()
+
+    def test_registry_selects_from_a_fresh_snapshot(self):
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir, True)
+        backend_registry.write_listing({"version": backend_registry.REGISTRY_VERSION, "fetched_at": time.time(),
+                                        "backends": []}, "test", cache_dir)
+        with self.assertRaises(backend_registry.NoCandidateBackends): # No snapshot: the (empty) listing is used
+            backend_registry.select_backend(self.service, 3, account="test", cache_dir=cache_dir)
+        fleet_survey.survey(self.service, "test", cache_dir)
+        backend, info = backend_registry.select_backend(self.service, 3, account="test", cache_dir=cache_dir)
+        self.assertEqual(info["ranked_by"], "survey")
+        _, info = backend_registry.select_backend(self.service, 3, account="test", cache_dir=cache_dir, survey=False)
+        self.assertEqual(info["ranked_by"], "queue")
+
+
+if __name__ == '__main__':
+    unittest.main()
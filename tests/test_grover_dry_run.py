@@ -0,0 +1,66 @@
+# test_grover_dry_run.py
+#
+# --dry_run of quantum/grover_search.py on the local simulator, with the IBM
+# Quantum service patched out (simulator runs never use it).
+#
+#   python -m unittest discover tests
+
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "quantum"))
+
+import cnf_oracle
+import grover_search
+
+
+class GroverDryRunTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+    def dry_run(self, *extra):
+        output_json = os.path.join(self.tmp, "out.json")
+        args = grover_search.parse_args([
+            "--api_token", "unused", "--plot_theme", "dark", "--plot_mode", "none", "--dry_run", "--seed", "7",
+            "--oracle_cache_dir", os.path.join(self.tmp, "oracles"), "--output_json", output_json, *extra])
+        with mock.patch.object(grover_search, "QiskitRuntimeService", lambda **kwargs: None):
+            results = grover_search.run(args)
+        with open(output_json, "r") as f:
+            self.assertEqual(json.load(f)["status"], results["status"])
+        return results
+
+    def test_exact_solution_count(self):
+        results = self.dry_run("--oracle_expr", "(a | b) & ~c")
+        self.assertEqual(results["status"], "success", results["error_message"])
+        self.assertEqual(results["oracle"]["solution_count_method"], "exact")
+        self.assertNotIn("search_rounds_max", results["dry_run"])
+
+    def test_estimated_solution_count_uses_search_schedule(self):
+        # Formulas above EXACT_COUNT_MAX_VARS get a sampled count and the exponential search schedule
+        with mock.patch.object(cnf_oracle, "EXACT_COUNT_MAX_VARS", 2):
+            results = self.dry_run("--oracle_expr", "v0 | v1 | v2 | v3", "--search_rounds", "5")
+        self.assertEqual(results["status"], "success", results["error_message"])
+        self.assertNotEqual(results["oracle"]["solution_count_method"], "exact")
+        self.assertEqual(results["dry_run"]["search_rounds_max"], 5)
+
+    def test_transpile_failure_fails_the_run(self):
+        # The preset pass manager is optimize_circuit; a failure is not carried on untranspiled
+        with mock.patch.object(grover_search, "generate_preset_pass_manager",
+                               side_effect=RuntimeError("no layout fits the coupling map")):
+            results = self.dry_run("--oracle_expr", "a & ~b", "--sim_compile", "preset")
+        self.assertEqual(results["status"], "failure")
+        self.assertIn("no layout fits the coupling map", results["error_message"])
+        self.assertIsNone(results["dry_run"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,190 @@
+# test_qpu_budget.py
+#
+# Admission control and settlement of quantum/qpu_budget.py against a
+# temporary SQLite ledger.
+#
+#   python -m unittest discover tests
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "quantum"))
+
+import qpu_budget
+
+PER_SHOT_SEC = 0.01
+OVERHEAD_SEC = 1.0
+
+
+class LedgerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp, "ledger.db")
+        self.ledger = qpu_budget.Ledger(self.path)
+
+    def tearDown(self):
+        self.ledger.close()
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+    def reserve(self, shots, policy="downscale", project="lab", backend="ibm_test", per_shot_sec=PER_SHOT_SEC,
+                **kwargs):
+        return self.ledger.reserve(project, "alice", "grover_search", backend, per_shot_sec, OVERHEAD_SEC, shots,
+                                   policy, **kwargs)
+
+    def charge(self, ratio, source="usage", backend="ibm_test"):
+        """A settled run whose actual QPU time was `ratio` times its (corrected) estimate."""
+        decision = self.reserve(100, project="history", backend=backend)
+        self.ledger.settle(decision["reservation_id"], decision["estimated_sec"] * ratio, source, ["job"])
+
+    def test_unallocated_project_is_accounted_not_limited(self):
+        decision = self.reserve(10 ** 6)
+        self.assertEqual((decision["action"], decision["shots"]), ("admit", 10 ** 6))
+        self.assertIsNone(decision["budget_sec"])
+        self.assertEqual(self.ledger.spent("lab", decision["period"]), (0, decision["estimated_sec"]))
+
+    def test_admits_within_allowance(self):
+        self.ledger.allocate("lab", 100.0)
+        decision = self.reserve(1000)
+        self.assertEqual(decision["action"], "admit")
+        self.assertEqual((decision["estimated_sec"], decision["allowance_sec"]), (11.0, 25.0))
+        self.assertEqual(decision["state"], "reserved")
+        # The reservation counts against the next run's allowance
+        following = self.reserve(1000)
+        self.assertEqual((following["reserved_sec"], following["remaining_sec"]), (11.0, 89.0))
+        self.assertEqual(following["allowance_sec"], 22.25)
+
+    def test_downscale_fits_the_allowance(self):
+        self.ledger.allocate("lab", 100.0)
+        decision = self.reserve(5000)
+        self.assertEqual(decision["action"], "downscale")
+        self.assertEqual((decision["requested_shots"], decision["shots"]), (5000, 2400))
+        self.assertLessEqual(decision["estimated_sec"], decision["allowance_sec"])
+        row = self.ledger.conn.execute("SELECT requested_shots, shots FROM charges WHERE id = ?",
+                                       (decision["reservation_id"],)).fetchone()
+        self.assertEqual(tuple(row), (5000, 2400))
+
+    def test_too_few_shots_are_rejected_or_deferred(self):
+        self.ledger.allocate("lab", 4.0) # Allowance 1s: only the overhead fits
+        for policy, action in (("downscale", "reject"), ("reject", "reject"), ("defer", "defer")):
+            with self.subTest(policy=policy):
+                decision = self.reserve(1000, policy)
+                self.assertEqual(decision["action"], action)
+                self.assertNotIn("reservation_id", decision)
+        self.assertEqual(self.ledger.spent("lab", qpu_budget.current_period()), (0, 0))
+        self.ledger.allocate("lab", 100.0)
+        self.assertEqual(self.reserve(5000, "reject")["action"], "reject") # Only downscale shrinks runs
+
+    def test_min_shots_floor(self):
+        self.ledger.allocate("lab", 8.0) # Allowance 2s: 100 shots fit
+        self.assertEqual(self.reserve(1000, min_shots=100)["shots"], 100)
+        self.assertEqual(self.reserve(1000, min_shots=150)["action"], "reject")
+
+    def test_correction_scales_estimates(self):
+        self.assertEqual(self.ledger.correction("ibm_test"), 1.0)
+        for ratio in (2.0, 3.0, 30.0):
+            self.charge(ratio)
+        self.charge(50.0, source="estimate") # Fallback charges do not calibrate
+        self.charge(50.0, source="shared")
+        self.assertEqual(self.ledger.correction("ibm_test"), 3.0)
+        self.assertEqual(self.reserve(1000)["estimated_sec"], 33.0)
+        self.assertEqual(self.ledger.correction("ibm_other"), 1.0)
+
+    def test_correction_bounds(self):
+        low, high = qpu_budget.CORRECTION_BOUNDS
+        self.charge(100.0, backend="ibm_slow")
+        self.charge(0.001, backend="ibm_fast")
+        self.assertEqual(self.ledger.correction("ibm_slow"), high)
+        self.assertEqual(self.ledger.correction("ibm_fast"), low)
+
+    def test_stale_reservations_are_not_counted(self):
+        self.ledger.allocate("lab", 100.0)
+        decision = self.reserve(1000)
+        old = (datetime.now(timezone.utc) - timedelta(seconds=qpu_budget.RESERVATION_TTL_SEC + 60))
+        self.ledger.conn.execute("UPDATE charges SET created_at = ? WHERE id = ?",
+                                 (old.isoformat(timespec="seconds"), decision["reservation_id"]))
+        self.assertEqual(self.ledger.spent("lab", decision["period"]), (0, 0))
+        self.assertEqual(self.reserve(1000)["allowance_sec"], 25.0)
+
+    def test_settle_charges_or_releases_once(self):
+        self.ledger.allocate("lab", 100.0)
+        charged = self.reserve(1000)
+        released = self.reserve(1000)
+        self.assertEqual(self.ledger.settle(charged["reservation_id"], 12.5, "usage", ["a"], shots=990), "charged")
+        self.assertEqual(self.ledger.settle(released["reservation_id"], None, None, []), "released")
+        self.ledger.settle(charged["reservation_id"], 99.0, "usage", ["b"]) # Already settled: no effect
+        self.assertEqual(self.ledger.spent("lab", charged["period"]), (12.5, 0))
+        row = self.ledger.conn.execute("SELECT shots, job_ids FROM charges WHERE id = ?",
+                                       (charged["reservation_id"],)).fetchone()
+        self.assertEqual((row["shots"], row["job_ids"]), (990, '["a"]'))
+        report, = self.ledger.report("lab")
+        self.assertEqual((report["charged_sec"], report["remaining_sec"]), (12.5, 87.5))
+        self.assertEqual(report["users"], [{"user": "alice", "runs": 1, "qpu_sec": 12.5}])
+
+
+class ScriptHookTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp, "ledger.db")
+        with qpu_budget.Ledger(self.path) as ledger:
+            ledger.allocate("lab", 100.0)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+    def admit(self, shots, policy="downscale"):
+        estimates = [{"per_shot_sec": PER_SHOT_SEC, "job_overhead_sec": OVERHEAD_SEC}]
+        return qpu_budget.admit(self.path, "lab", "alice", "grover_search", "ibm_test", estimates, shots, policy,
+                                qpu_budget.DEFAULT_MAX_SHARE, qpu_budget.DEFAULT_MIN_SHOTS)
+
+    def charges(self):
+        with qpu_budget.Ledger(self.path) as ledger:
+            return [dict(row) for row in ledger.conn.execute(
+                "SELECT state, actual_sec, actual_source, job_ids FROM charges ORDER BY id")]
+
+    def test_defer_raises_not_admitted(self):
+        with qpu_budget.Ledger(self.path) as ledger:
+            ledger.allocate("lab", 4.0)
+        with self.assertRaises(qpu_budget.NotAdmitted) as caught:
+            self.admit(1000, "defer")
+        self.assertEqual(caught.exception.status, "deferred")
+        self.assertEqual(qpu_budget.exit_code({"status": caught.exception.status}), qpu_budget.EXIT_DEFERRED)
+        self.assertEqual(self.charges(), [])
+
+    def test_settle_own_job(self):
+        decision = self.admit(1000)
+        qpu_budget.settle(self.path, decision, {"job_id": "j1", "qpu_time_sec": 9.0, "shots": 1000})
+        self.assertEqual(decision["state"], "charged")
+        self.assertEqual(self.charges(), [{"state": "charged", "actual_sec": 9.0, "actual_source": "usage",
+                                           "job_ids": '["j1"]'}])
+
+    def test_settle_shared_job_charges_the_submitted_share(self):
+        topped_up, attached = self.admit(1000), self.admit(1000)
+        qpu_budget.settle(self.path, topped_up, {
+            "job_id": "j1", "qpu_time_sec": 10.0,
+            "coalesced": {"role": "topped_up", "submitted_job_ids": ["j2"], "submitted_shots": 250, "shots": 1000}})
+        qpu_budget.settle(self.path, attached, {
+            "job_id": "j1", "qpu_time_sec": None,
+            "coalesced": {"role": "attached", "submitted_job_ids": [], "submitted_shots": 0, "shots": 1000}})
+        self.assertEqual(self.charges(), [
+            {"state": "charged", "actual_sec": 2.5, "actual_source": "shared", "job_ids": '["j2"]'},
+            {"state": "charged", "actual_sec": 0.0, "actual_source": "shared", "job_ids": "[]"},
+        ])
+
+    def test_settle_falls_back_to_estimate_or_releases(self):
+        unreported, failed = self.admit(1000), self.admit(1000)
+        qpu_budget.settle(self.path, unreported, {"job_id": "j1", "qpu_time_sec": None})
+        qpu_budget.settle(self.path, failed, {"job_id": None})
+        self.assertEqual([(c["state"], c["actual_sec"], c["actual_source"]) for c in self.charges()],
+                         [("charged", 11.0, "estimate"), ("released", None, None)])
+        qpu_budget.settle(self.path, failed, {"job_id": "late"}) # Settled decisions are left alone
+        self.assertEqual(self.charges()[1]["state"], "released")
+
+
+if __name__ == '__main__':
+    unittest.main()
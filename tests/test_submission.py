@@ -0,0 +1,176 @@
+# test_submission.py
+#
+# Retry / failover behaviour of quantum/submission.py against the offline
+# backend_registry.LocalService, whose fault injection stands in for IBM
+# Quantum errors.
+#
+#   python -m unittest discover tests
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "quantum"))
+
+from qiskit import QuantumCircuit
+
+import backend_registry
+import submission
+import telemetry
+
+
+def bell_circuit():
+    qc = QuantumCircuit(2, 2)
+    qc.h(0)
+    qc.cx(0, 1)
+    qc.measure([0, 1], [0, 1])
+    return qc
+
+
+def counts(job):
+    return job.result().get_counts()
+
+
+class FlakyJob:
+    """A job whose first `failures` result() calls drop the connection; never_done keeps it running."""
+
+    def __init__(self, job, failures, never_done=False):
+        self.job = job
+        self.failures = failures
+        self.never_done = never_done
+        self.cancelled = False
+
+    def job_id(self):
+        return self.job.job_id()
+
+    def result(self):
+        if self.failures > 0 or self.never_done:
+            self.failures -= 1
+            raise ConnectionError("connection reset by peer while polling")
+        return self.job.result()
+
+    def in_final_state(self):
+        return not self.never_done and self.job.in_final_state()
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class SubmissionTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.timer = telemetry.PhaseTimer("test")
+        self.report = submission.new_report()
+        self.policy = submission.RetryPolicy(max_attempts=3, max_backends=3, seed=0, sleep=lambda _: None)
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+
+    def service(self, faults=None, devices=backend_registry.LocalService.DEFAULT_DEVICES):
+        self.svc = backend_registry.LocalService(devices, faults=faults)
+        return self.svc
+
+    def run_fn(self, compiled, backend):
+        """The scripts' hardware run: submission retried, wait re-polled on the same job."""
+        job = submission.retry(lambda: backend.run(compiled, shots=16), self.policy, self.timer, self.report,
+                               "submit", backend.name)
+        return submission.collect(counts, job, self.policy, self.timer, self.report, backend.name)
+
+    def fail_over(self, qc, excluded):
+        backend, _ = backend_registry.select_backend(self.svc, qc.num_qubits, account="test",
+                                                     cache_dir=self.cache_dir, survey=False, exclude=excluded)
+        return backend, qc
+
+    def outcomes(self, step=None):
+        return [a["outcome"] for a in self.report["attempts"] if step is None or a["step"] == step]
+
+    def test_classify_injected_faults(self):
+        expected = {"transient": submission.TRANSIENT, "cancel": submission.DEVICE,
+                    "outage": submission.DEVICE, "invalid": submission.PERMANENT}
+        for kind, error in backend_registry.LOCAL_FAULTS.items():
+            self.assertEqual(submission.classify(error("local_small")), expected[kind], kind)
+        self.assertEqual(submission.classify(backend_registry.NoCandidateBackends("none left")), submission.PERMANENT)
+        self.assertEqual(submission.classify(RuntimeError("something unexpected")), submission.TRANSIENT)
+
+    def test_retry_recovers_from_transient_faults(self):
+        backend = self.service({"local_small": ["transient", "transient"]}).backend("local_small")
+        result = submission.retry(lambda: counts(backend.run(bell_circuit(), shots=16)), self.policy, self.timer,
+                                  self.report, "run", backend.name)
+        self.assertEqual(sum(result.values()), 16)
+        self.assertEqual(self.outcomes(), ["transient", "transient", "success"])
+        self.assertTrue(all(a["backoff_sec"] is not None for a in self.report["attempts"][:2]))
+
+    def test_retry_gives_up_after_max_attempts(self):
+        backend = self.service({"local_small": ["transient"] * 3}).backend("local_small")
+        with self.assertRaises(ConnectionError):
+            submission.retry(lambda: counts(backend.run(bell_circuit(), shots=16)), self.policy, self.timer,
+                             self.report, "run", backend.name)
+        self.assertEqual(self.outcomes(), ["transient"] * 3)
+
+    def test_transient_wait_failure_repolls_the_same_job(self):
+        backend = self.service().backend("local_small")
+        job = FlakyJob(backend.run(bell_circuit(), shots=16), failures=2)
+        refetched = []
+        def get_job(job_id):
+            refetched.append(job_id)
+            return job
+        result = submission.collect(counts, job, self.policy, self.timer, self.report, backend.name, get_job)
+        self.assertEqual(sum(result.values()), 16)
+        self.assertEqual(self.svc.calls["runs"], 1) # Never resubmitted
+        self.assertEqual(refetched, [job.job_id()] * 2)
+        self.assertEqual(self.outcomes("collect"), ["transient", "transient", "success"])
+        self.assertFalse(job.cancelled)
+
+    def test_abandoned_wait_cancels_the_running_job(self):
+        backend = self.service().backend("local_small")
+        job = FlakyJob(backend.run(bell_circuit(), shots=16), failures=0, never_done=True)
+        with self.assertRaises(ConnectionError):
+            submission.collect(counts, job, self.policy, self.timer, self.report, backend.name)
+        self.assertEqual(self.outcomes("collect"), ["transient"] * 3)
+        self.assertTrue(job.cancelled)
+
+    def test_shared_job_is_not_cancelled(self):
+        backend = self.service().backend("local_small")
+        job = FlakyJob(backend.run(bell_circuit(), shots=16), failures=0, never_done=True)
+        with self.assertRaises(ConnectionError):
+            submission.collect(counts, job, self.policy, self.timer, self.report, backend.name, cancel=lambda: False)
+        self.assertFalse(job.cancelled)
+
+    def test_device_fault_fails_over_to_next_backend(self):
+        backend = self.service({"local_large": ["cancel"]}).backend("local_large")
+        result, used, _ = submission.run_with_failover(self.run_fn, bell_circuit(), bell_circuit(), backend,
+                                                       self.policy, self.timer, self.report, self.fail_over)
+        self.assertEqual(sum(result.values()), 16)
+        self.assertEqual(used.name, "local_small") # Least busy of the remaining operational backends
+        self.assertEqual(self.report["failed_backends"], ["local_large"])
+        self.assertEqual(self.report["failovers"], 1)
+        self.assertEqual(self.outcomes("submit"), ["device", "success"])
+
+    def test_outage_takes_backend_out_of_selection(self):
+        backend = self.service({"local_small": ["outage"]}).backend("local_small")
+        _, used, _ = submission.run_with_failover(self.run_fn, bell_circuit(), bell_circuit(), backend, self.policy,
+                                                  self.timer, self.report, self.fail_over)
+        self.assertFalse(self.svc.devices["local_small"][2])
+        self.assertEqual(used.name, "local_large")
+
+    def test_permanent_fault_is_not_retried(self):
+        backend = self.service({"local_small": ["invalid"]}).backend("local_small")
+        with self.assertRaises(ValueError):
+            submission.run_with_failover(self.run_fn, bell_circuit(), bell_circuit(), backend, self.policy,
+                                         self.timer, self.report, self.fail_over)
+        self.assertEqual(self.outcomes(), ["permanent"])
+        self.assertEqual(self.report["failovers"], 0)
+
+    def test_exhausted_candidates_stop_failover_at_once(self):
+        backend = self.service({"only": ["cancel"]}, devices=(("only", 5, 0, True),)).backend("only")
+        with self.assertRaises(backend_registry.NoCandidateBackends):
+            submission.run_with_failover(self.run_fn, bell_circuit(), bell_circuit(), backend, self.policy,
+                                         self.timer, self.report, self.fail_over)
+        self.assertEqual(self.outcomes("failover"), ["permanent"])
+
+
+if __name__ == '__main__':
+    unittest.main()